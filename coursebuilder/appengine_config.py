@@ -16,11 +16,13 @@
 
 __author__ = 'psimakov@google.com (Pavel Simakov)'
 
+import collections
 import datetime
 import importlib
 import logging
 import os
 import sys
+import time
 
 from common import manifests
 
@@ -62,6 +64,17 @@ MODULE_REGISTRATION_IN_PROGRESS = False
 # the immutable core functionality.
 CORE_MODULE_NAME = 'core'
 
+# Seconds spent importing, registering and enabling each module at instance
+# startup, keyed by main module name.  Import time covers whatever the module
+# imports that was not already loaded, so the first module to pull in a heavy
+# dependency is charged for it.
+ModuleStartupCost = collections.namedtuple(
+    'ModuleStartupCost', ['name', 'import_sec', 'register_sec', 'enable_sec'])
+MODULE_STARTUP_COSTS = collections.OrderedDict()
+
+# Number of slowest modules named in the startup log line.
+MODULE_STARTUP_LOG_TOP_N = 5
+
 
 class _Library(object):
     """DDO that represents a Python library contained in a .zip file."""
@@ -178,18 +191,36 @@ def _import_and_enable_modules(env_var, reraise=False):
 
 
 def _import_module_by_name(module_name, enabled, reraise=False):
+    # Modules are imported and registered eagerly, even when disabled.
+    # register_module() adds hooks, config properties, permissions and routes
+    # that other modules and main.py read at startup, so a module cannot be
+    # registered on first request without changing what the rest of the app
+    # sees.  Use MODULE_STARTUP_COSTS to find and defer expensive imports
+    # inside a module instead.
+    timings = {'importing': 0.0, 'registering': 0.0, 'enabling': 0.0}
+    started = time.time()
     try:
         operation = 'importing'
         module = importlib.import_module(module_name)
+        timings[operation] = time.time() - started
+        started = time.time()
         operation = 'registering'
         custom_module = module.register_module()
+        timings[operation] = time.time() - started
         if enabled:
+            started = time.time()
             operation = 'enabling'
             custom_module.enable()
+            timings[operation] = time.time() - started
     except Exception, ex:  # pylint: disable=broad-except
+        timings[operation] = time.time() - started
         logging.exception('Problem %s module "%s"', operation, module_name)
         if reraise:
             raise ex
+    finally:
+        MODULE_STARTUP_COSTS[module_name] = ModuleStartupCost(
+            module_name, timings['importing'], timings['registering'],
+            timings['enabling'])
 
 
 def _import_and_enable_modules_by_manifest():
@@ -209,6 +240,27 @@ def import_and_enable_modules():
     _import_and_enable_modules('GCB_THIRD_PARTY_MODULES')
     _import_and_enable_modules_by_manifest()
     MODULE_REGISTRATION_IN_PROGRESS = False
+    _log_module_startup_costs()
+
+
+def get_module_startup_costs():
+    """Returns ModuleStartupCost for each module, most expensive first."""
+    return sorted(
+        MODULE_STARTUP_COSTS.values(),
+        key=lambda cost: cost.import_sec + cost.register_sec + cost.enable_sec,
+        reverse=True)
+
+
+def _log_module_startup_costs():
+    costs = get_module_startup_costs()
+    total = sum(
+        cost.import_sec + cost.register_sec + cost.enable_sec
+        for cost in costs)
+    logging.info(
+        'Started %d modules in %.3fs; slowest: %s', len(costs), total,
+        ', '.join('%s %.3fs' % (
+            cost.name, cost.import_sec + cost.register_sec + cost.enable_sec)
+                  for cost in costs[:MODULE_STARTUP_LOG_TOP_N]))
 
 
 def time_delta_to_millis(delta):
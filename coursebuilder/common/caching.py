@@ -17,16 +17,45 @@
 __author__ = 'Pavel Simakov (psimakov@google.com)'
 
 
+import cPickle
 import collections
 import datetime
+import itertools
 import logging
 import sys
 import threading
+import types
 import unittest
+import weakref
 
 import appengine_config
+from models import entities
+from models import transforms
+from models.counters import LatencyHistogram
 from models.counters import PerfCounter
 
+from google.appengine.ext import db
+
+# Tombstones older than this are purged; any cache entry they could evict has
+# expired on its own by then.
+TOMBSTONE_TTL_SEC = 24 * 60 * 60
+
+# The high-water mark of a cache that has not seen any change yet.
+_EPOCH = datetime.datetime.fromtimestamp(0)
+
+# Newest change seen, by cache and then by namespace key prefix.  Kept beside
+# the caches, so they are dropped along with them.
+_high_water_marks = weakref.WeakKeyDictionary()
+
+# Containers with more items than this are sized from a sample of their items.
+DEFAULT_SIZER_SAMPLE_SIZE = 100
+
+# Objects nested deeper than this are not visited when sizing.
+DEFAULT_SIZER_MAX_DEPTH = 32
+
+# Memory statistics of named LRU caches, by cache name.
+_lru_cache_counters = {}
+
 
 def iter_all(query, batch_size=100):
     """Yields query results iterator. Proven method for large datasets."""
@@ -125,12 +154,154 @@ class RequestScopedSingleton(AbstractScopedSingleton):
     CONTAINER = _request_scoped_singleton.__dict__
 
 
+class AbstractSizer(object):
+    """Estimates how many bytes of memory a cache entry holds."""
+
+    def get_entry_size(self, key, value):
+        raise NotImplementedError()
+
+
+class ShallowSizer(AbstractSizer):
+    """Counts the key and value objects only, not anything they refer to.
+
+    This is cheap and exact for strings and numbers, but badly underestimates
+    containers and objects: a dict holding megabytes of data counts as a few
+    hundred bytes.
+    """
+
+    def get_entry_size(self, key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+class RecursiveSizer(AbstractSizer):
+    """Counts every object reachable from the key and value, each only once.
+
+    Containers and instance attributes are followed down to max_depth levels.
+    Objects already counted are skipped, which protects against cycles and
+    avoids double-counting shared objects.  Classes, modules and functions
+    belong to the program rather than to the entry and are not counted.
+    Containers with more than sample_size items are sized from their first
+    sample_size items, scaled up to the full length.
+    """
+
+    _ATOMIC_TYPES = (
+        basestring, int, long, float, bool, complex, types.NoneType,
+        datetime.date, datetime.time, datetime.timedelta)
+    _SHARED_TYPES = (
+        type, types.ClassType, types.ModuleType, types.FunctionType,
+        types.BuiltinFunctionType, types.MethodType)
+
+    def __init__(self, sample_size=DEFAULT_SIZER_SAMPLE_SIZE,
+                 max_depth=DEFAULT_SIZER_MAX_DEPTH):
+        self.sample_size = sample_size
+        self.max_depth = max_depth
+
+    def get_entry_size(self, key, value):
+        seen = set()
+        return self.sizeof(key, seen) + self.sizeof(value, seen)
+
+    def sizeof(self, obj, seen, depth=0):
+        if id(obj) in seen or isinstance(obj, self._SHARED_TYPES):
+            return 0
+        seen.add(id(obj))
+        size = sys.getsizeof(obj)
+        if isinstance(obj, self._ATOMIC_TYPES) or depth >= self.max_depth:
+            return size
+
+        if isinstance(obj, dict):
+            # Size keys and values separately; the (key, value) tuples made by
+            # iteritems() are temporary, and their ids are reused.
+            size += self._sizeof_items(
+                obj.iteritems(), len(obj), seen, depth,
+                sizeof_item=self._sizeof_dict_item)
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            size += self._sizeof_items(iter(obj), len(obj), seen, depth)
+        if hasattr(obj, '__dict__'):
+            size += self.sizeof(obj.__dict__, seen, depth + 1)
+        for name in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, name):
+                size += self.sizeof(getattr(obj, name), seen, depth + 1)
+        return size
+
+    def _sizeof_dict_item(self, item, seen, depth):
+        key, value = item
+        return self.sizeof(key, seen, depth) + self.sizeof(value, seen, depth)
+
+    def _sizeof_items(self, items, count, seen, depth, sizeof_item=None):
+        sizeof_item = sizeof_item or self.sizeof
+        sample = itertools.islice(items, self.sample_size)
+        total = 0
+        sampled = 0
+        for item in sample:
+            total += sizeof_item(item, seen, depth + 1)
+            sampled += 1
+        if sampled and count > sampled:
+            total = total * count // sampled
+        return total
+
+
+class SerializedSizer(AbstractSizer):
+    """Counts the length of the value once serialized.
+
+    Use this for values which are, or closely track, a serialized form; e.g.
+    values also stored in memcache, whose limits apply to the pickled bytes.
+    Serializing is costly for large values, so prefer RecursiveSizer for
+    caches with frequent puts.
+    """
+
+    def serialize(self, value):
+        raise NotImplementedError()
+
+    def get_entry_size(self, key, value):
+        return sys.getsizeof(key) + len(self.serialize(value))
+
+
+class PickledSizer(SerializedSizer):
+
+    def serialize(self, value):
+        return cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+
+
+class JsonSizer(SerializedSizer):
+
+    def serialize(self, value):
+        return transforms.dumps(value)
+
+
+def _get_lru_cache_counters(name):
+    """Gets counters for a named cache; shared by its successive instances."""
+    counters = _lru_cache_counters.get(name)
+    if not counters:
+        counters = (
+            PerfCounter(
+                'gcb-caching-LRUCache-%s-len' % name,
+                'A total number of items in the %s cache.' % name),
+            PerfCounter(
+                'gcb-caching-LRUCache-%s-bytes' % name,
+                'A total size of items in the %s cache in bytes, as '
+                'estimated by its sizer.' % name),
+            PerfCounter(
+                'gcb-caching-LRUCache-%s-evict' % name,
+                'A number of items evicted from the %s cache.' % name))
+        _lru_cache_counters[name] = counters
+    return counters
+
+
 class LRUCache(object):
-    """A dict that supports capped size and LRU eviction of items."""
+    """A dict that supports capped size and LRU eviction of items.
+
+    Entries are sized by the sizer passed in, or else by the class's SIZER;
+    subclasses holding nested values should declare a more accurate one.
+    When a name is given, the cache's item count, size and evictions are
+    reported by PerfCounters named after it.
+    """
+
+    SIZER = ShallowSizer()
 
     def __init__(
         self, max_item_count=None,
-        max_size_bytes=None, max_item_size_bytes=None):
+        max_size_bytes=None, max_item_size_bytes=None, sizer=None,
+        name=None):
         assert max_item_count or max_size_bytes
         if max_item_count:
             assert max_item_count > 0
@@ -140,21 +311,41 @@ class LRUCache(object):
         self.max_item_count = max_item_count
         self.max_size_bytes = max_size_bytes
         self.max_item_size_bytes = max_item_size_bytes
+        self.sizer = sizer or self.SIZER
         self.items = collections.OrderedDict([])
+        self.sizes = {}
+
+        self._evict_counter = None
+        if name:
+            len_counter, size_counter, self._evict_counter = (
+                _get_lru_cache_counters(name))
+            cache_ref = weakref.ref(self)
+            len_counter.poll_value = (
+                lambda: len(cache_ref().items) if cache_ref() else 0)
+            size_counter.poll_value = (
+                lambda: cache_ref().total_size if cache_ref() else 0)
 
     def get_entry_size(self, key, value):
-        """Computes item size. Override and compute properly for your items."""
-        return sys.getsizeof(key) + sys.getsizeof(value)
+        """Computes item size using this cache's sizer."""
+        return self.sizer.get_entry_size(key, value)
 
     def _compute_current_size(self):
         total = 0
         for key, item in self.items.iteritems():
-            total += sys.getsizeof(key) + self.get_item_size(item)
+            total += self.get_entry_size(key, item)
         return total
 
+    def _remove(self, key):
+        del self.items[key]
+        if self.max_size_bytes:
+            self.total_size -= self.sizes.pop(key)
+            assert self.total_size >= 0
+
     def _allocate_space(self, key, value):
         """Remove items in FIFO order until size constraints are met."""
-        entry_size = self.get_entry_size(key, value)
+        entry_size = 0
+        if self.max_size_bytes or self.max_item_size_bytes:
+            entry_size = self.get_entry_size(key, value)
         if self.max_item_size_bytes and entry_size > self.max_item_size_bytes:
             return False
         while True:
@@ -167,13 +358,13 @@ class LRUCache(object):
             if not (over_count or over_size):
                 if self.max_size_bytes:
                     self.total_size += entry_size
+                    self.sizes[key] = entry_size
                     assert self.total_size < self.max_size_bytes
                 return True
             if self.items:
-                _key, _value = self.items.popitem(last=False)
-                if self.max_size_bytes:
-                    self.total_size -= self.get_entry_size(_key, _value)
-                    assert self.total_size >= 0
+                self._remove(next(iter(self.items)))
+                if self._evict_counter:
+                    self._evict_counter.inc()
             else:
                 break
         return False
@@ -190,6 +381,8 @@ class LRUCache(object):
 
     def put(self, key, value):
         assert key
+        if key in self.items:
+            self._remove(key)
         if self._allocate_space(key, value):
             self.items[key] = value
             return True
@@ -206,7 +399,7 @@ class LRUCache(object):
     def delete(self, key):
         assert key
         if key in self.items:
-            del self.items[key]
+            self._remove(key)
             return True
         return False
 
@@ -227,7 +420,8 @@ class NoopCacheConnection(object):
 class AbstractCacheEntry(object):
     """Object representation while in cache."""
 
-    # we don't track deletions; deleted item will hang around this long
+    # deletions that leave no tombstone are missed; such deleted item will
+    # hang around this long
     CACHE_ENTRY_TTL_SEC = 5 * 60
 
     @classmethod
@@ -297,6 +491,15 @@ class AbstractCacheConnection(object):
             'gcb-models-%s-cache-expire' % name,
             'A number of times an object has expired from cache because it was '
             'too old.')
+        cls.CACHE_UPDATE_QUERY = PerfCounter(
+            'gcb-models-%s-cache-update-query' % name,
+            'A number of times the datastore was queried for updates.')
+        cls.CACHE_TOMBSTONE_COUNT = PerfCounter(
+            'gcb-models-%s-cache-tombstone-count' % name,
+            'A number of deletion tombstones received.')
+        cls.CACHE_UPDATE_LATENCY = LatencyHistogram(
+            'gcb-models-%s-cache-update-latency' % name,
+            'Latency in milliseconds of querying the datastore for updates.')
 
     @classmethod
     def make_key_prefix(cls, ns):
@@ -347,50 +550,95 @@ class AbstractCacheConnection(object):
                 self.cache.delete(_key)
                 continue
 
+    @classmethod
+    def record_deletion(cls, key):
+        """Leaves a tombstone so that all instances evict a deleted entity.
+
+        Call this in the namespace of the deleted entity.
+
+        Args:
+          key: the key name of the deleted PERSISTENT_ENTITY.
+        """
+        now = datetime.datetime.utcnow()
+        kind = cls.PERSISTENT_ENTITY.kind()
+        entities.CacheTombstoneEntity(
+            key_name='%s:%s' % (kind, key), kind_name=kind,
+            entity_key_name=key, updated_on=now).put()
+        if db.is_in_transaction():
+            return
+        expired = entities.CacheTombstoneEntity.all(keys_only=True).filter(
+            'updated_on <', now - datetime.timedelta(seconds=TOMBSTONE_TTL_SEC)
+        ).fetch(100)
+        if expired:
+            entities.delete(expired)
+
     def _get_most_recent_updated_on(self):
-        """Get the most recent item cached. Datastore deletions are missed..."""
-        has_items = False
-        max_updated_on = datetime.datetime.fromtimestamp(0)
+        """Get the high-water mark: the newest change this cache has seen."""
+        marks = _high_water_marks.get(self.cache, {})
+        updated_on = marks.get(self.make_key_prefix(self.namespace))
+        return updated_on is not None, updated_on or _EPOCH
+
+    def _set_most_recent_updated_on(self, updated_on):
+        marks = _high_water_marks.setdefault(self.cache, {})
         prefix = self.make_key_prefix(self.namespace)
-        for key, entry in self.cache.items.iteritems():
-            if not key.startswith(prefix):
-                continue
-            has_items = True
-            if not entry:
-                continue
-            updated_on = entry.updated_on()
-            if not updated_on:  # old entities may be missing this field
-                updated_on = datetime.datetime.fromtimestamp(0)
-            if updated_on > max_updated_on:
-                max_updated_on = updated_on
-        return has_items, max_updated_on
+        if updated_on > marks.get(prefix, _EPOCH):
+            marks[prefix] = updated_on
+        else:
+            marks.setdefault(prefix, _EPOCH)
+
+    def _get_newest_persistent_updated_on(self):
+        newest = self.PERSISTENT_ENTITY.all().order('-updated_on').get()
+        if newest and newest.updated_on:
+            return newest.updated_on
+        return _EPOCH
 
     def get_updates_when_empty(self):
         """Override this method to pre-load cache when it's completely empty."""
         return {}
 
     def _get_incremental_updates(self):
-        """Gets a list of global changes older than the most recent item cached.
+        """Gets a list of global changes newer than the high-water mark.
 
-        WARNING!!! We fetch the updates since the timestamp of the oldest item
-        we have cached so far. This will bring all objects that have changed or
-        were created since that time.
-
-        This will NOT bring the notifications about object deletions. Thus cache
-        will continue to serve deleted objects until they expire.
+        Changed and new entities are found by their updated_on; deleted ones
+        by the tombstones record_deletion() leaves behind.  The high-water
+        mark then moves up to the newest change found, so that each change is
+        only fetched once.  A cache that is new to this namespace starts from
+        the newest entity in the datastore, as anything it goes on to cache
+        is read after that.
 
         Returns:
-          an dict of {key: update} objects that represent recent updates
+          an dict of {key: update} objects that represent recent updates;
+          the update is None for deleted entities
         """
         has_items, updated_on = self._get_most_recent_updated_on()
         if not has_items:
+            self._set_most_recent_updated_on(
+                self._get_newest_persistent_updated_on())
             return self.get_updates_when_empty()
-        q = self.PERSISTENT_ENTITY.all()
-        if updated_on:
-            q.filter('updated_on > ', updated_on)
-        result = {
-            entity.key().name(): entity for entity in iter_all(q)}
+
+        self.CACHE_UPDATE_QUERY.inc()
+        with self.CACHE_UPDATE_LATENCY.timer():
+            result = {}
+            newest = updated_on
+            kind = self.PERSISTENT_ENTITY.kind()
+            q = entities.CacheTombstoneEntity.all().filter(
+                'updated_on > ', updated_on)
+            for tombstone in iter_all(q):
+                if tombstone.kind_name != kind:
+                    continue
+                self.CACHE_TOMBSTONE_COUNT.inc()
+                result[tombstone.entity_key_name] = None
+                newest = max(newest, tombstone.updated_on)
+
+            # Entities go second, so that one deleted and then re-created
+            # is seen as it is now.
+            q = self.PERSISTENT_ENTITY.all().filter('updated_on > ', updated_on)
+            for entity in iter_all(q):
+                result[entity.key().name()] = entity
+                if entity.updated_on:
+                    newest = max(newest, entity.updated_on)
         self.CACHE_UPDATE_COUNT.inc(len(result.keys()))
+        self._set_most_recent_updated_on(newest)
         return result
 
     def put(self, key, *args):
@@ -488,6 +736,94 @@ class LRUCacheTests(unittest.TestCase):
         found, _ = cache.get('a')
         self.assertTrue(found)
 
+    def test_replace_and_delete_release_size(self):
+        cache = LRUCache(max_size_bytes=5000)
+        self.assertTrue(cache.put('a', bytearray(1000)))
+        self.assertTrue(cache.put('a', bytearray(2000)))
+        self.assertEquals(cache.get_entry_size('a', bytearray(2000)),
+                          cache.total_size)
+        self.assertTrue(cache.delete('a'))
+        self.assertEquals(0, cache.total_size)
+
+    def test_sizer_declared_by_subclass(self):
+
+        class NestedLRUCache(LRUCache):
+            SIZER = RecursiveSizer()
+
+        value = {'data': ['x' * 1000 for _ in xrange(10)]}
+        shallow = LRUCache(max_size_bytes=100000)
+        nested = NestedLRUCache(max_size_bytes=100000)
+        self.assertTrue(shallow.put('a', value))
+        self.assertTrue(nested.put('a', value))
+        self.assertLess(shallow.total_size, 10000)
+        self.assertGreater(nested.total_size, 10000)
+
+    def test_named_cache_reports_counters(self):
+        cache = LRUCache(max_item_count=1, name='test')
+        len_counter, size_counter, evict_counter = _lru_cache_counters['test']
+        cache.put('a', '1')
+        cache.put('b', '2')
+        self.assertEquals(1, len_counter.value)
+        self.assertEquals(0, size_counter.value)
+        self.assertEquals(1, evict_counter.value)
+
+
+class SizerTests(unittest.TestCase):
+
+    def test_recursive_sizer_counts_nested_values(self):
+        sizer = RecursiveSizer()
+        inner = 'x' * 1000
+        self.assertGreater(
+            sizer.get_entry_size('k', {'a': [inner]}),
+            sys.getsizeof({'a': [inner]}) + sys.getsizeof(inner))
+
+    def test_recursive_sizer_counts_every_dict_entry(self):
+        sizer = RecursiveSizer()
+        value = dict(
+            ('key%d' % i, 'x' * 10240 + str(i)) for i in xrange(50))
+        exact = (sys.getsizeof('k') + sys.getsizeof(value) + sum(
+            sys.getsizeof(key) + sys.getsizeof(item)
+            for key, item in value.iteritems()))
+        self.assertGreater(exact, 500 * 1024)
+        self.assertEquals(exact, sizer.get_entry_size('k', value))
+
+    def test_recursive_sizer_counts_shared_and_cyclic_objects_once(self):
+        sizer = RecursiveSizer()
+        inner = 'x' * 1000
+        cycle = [inner, inner]
+        cycle.append(cycle)
+        self.assertEquals(
+            sys.getsizeof('k') + sys.getsizeof(cycle) + sys.getsizeof(inner),
+            sizer.get_entry_size('k', cycle))
+
+    def test_recursive_sizer_counts_object_attributes(self):
+
+        class Holder(object):
+
+            def __init__(self):
+                self.payload = 'x' * 1000
+
+        sizer = RecursiveSizer()
+        self.assertGreater(sizer.get_entry_size('k', Holder()), 1000)
+
+    def test_recursive_sizer_samples_large_containers(self):
+        sizer = RecursiveSizer(sample_size=10)
+        value = ['x' * 100 + str(i) for i in xrange(1000)]
+        size = sizer.get_entry_size('k', value)
+        exact = (sys.getsizeof('k') + sys.getsizeof(value) +
+                 sum(sys.getsizeof(item) for item in value))
+        self.assertAlmostEqual(exact, size, delta=exact * 0.05)
+
+    def test_serialized_sizers(self):
+        value = {'a': ['x' * 1000]}
+        self.assertEquals(
+            sys.getsizeof('k') + len(
+                cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)),
+            PickledSizer().get_entry_size('k', value))
+        self.assertEquals(
+            sys.getsizeof('k') + len(transforms.dumps(value)),
+            JsonSizer().get_entry_size('k', value))
+
 
 class SingletonTests(unittest.TestCase):
 
@@ -546,7 +882,7 @@ class SingletonTests(unittest.TestCase):
 def run_all_unit_tests():
     """Runs all unit tests in this module."""
     suites_list = []
-    for test_class in [LRUCacheTests, SingletonTests]:
+    for test_class in [LRUCacheTests, SizerTests, SingletonTests]:
         suite = unittest.TestLoader().loadTestsFromTestCase(test_class)
         suites_list.append(suite)
     unittest.TextTestRunner().run(unittest.TestSuite(suites_list))
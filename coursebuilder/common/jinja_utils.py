@@ -16,9 +16,13 @@
 
 __author__ = 'John Orr (jorr@google.com)'
 
+import hashlib
+import os
 import sys
+import threading
 import traceback
 import jinja2
+from jinja2 import loaders
 import safe_dom
 import tags
 
@@ -31,12 +35,22 @@ from common import messages
 from models import config
 from models import models
 from models import transforms
+from models.counters import LatencyHistogram
 from models.counters import PerfCounter
 
 
 # max size for in-process jinja template cache
 MAX_GLOBAL_CACHE_SIZE_BYTES = 8 * 1024 * 1024
 
+# max number of configured environments kept in-process
+MAX_GLOBAL_ENVIRONMENT_COUNT = 64
+
+# max number of compiled templates kept in-process
+MAX_GLOBAL_COMPILED_TEMPLATE_COUNT = 1000
+
+# name of the template global holding the handler used by the gcb_tags filter
+_HANDLER_GLOBAL_NAME = '_gcb_tags_handler'
+
 # this cache used to be memcache based; now it's in-process
 CAN_USE_JINJA2_TEMPLATE_CACHE = config.ConfigProperty(
     'gcb_can_use_jinja2_template_cache', bool,
@@ -89,19 +103,34 @@ def _to_json_jinja(data):
     return jinja2.utils.Markup(_escape_js(transforms.dumps(data)))
 
 
+def _apply_gcb_tags(data, handler):
+    """Apply GCB custom tags, if enabled. Otherwise pass as if by 'safe'."""
+    data = unicode(data)
+    if tags.CAN_USE_DYNAMIC_TAGS.value:
+        return jinja2.utils.Markup(tags.html_to_safe_dom(data, handler))
+    else:
+        return jinja2.utils.Markup(data)
+
+
 def get_gcb_tags_filter(handler):
 
     @appengine_config.timeandlog('get_gcb_tags_filter')
     def gcb_tags(data):
-        """Apply GCB custom tags, if enabled. Otherwise pass as if by 'safe'."""
-        data = unicode(data)
-        if tags.CAN_USE_DYNAMIC_TAGS.value:
-            return jinja2.utils.Markup(tags.html_to_safe_dom(data, handler))
-        else:
-            return jinja2.utils.Markup(data)
+        return _apply_gcb_tags(data, handler)
     return gcb_tags
 
 
+@jinja2.contextfilter
+@appengine_config.timeandlog('get_gcb_tags_filter')
+def _gcb_tags_from_context(context, data):
+    """Like get_gcb_tags_filter(), but finds the handler in the context.
+
+    Used in shared environments, where a filter cannot close over the handler
+    of any one request.
+    """
+    return _apply_gcb_tags(data, context.get(_HANDLER_GLOBAL_NAME))
+
+
 class ProcessScopedJinjaCache(caching.ProcessScopedSingleton):
     """This class holds in-process cache of Jinja compiled templates."""
 
@@ -151,6 +180,62 @@ JINJA_CACHE_LEN.poll_value = ProcessScopedJinjaCache.get_cache_len
 JINJA_CACHE_SIZE_BYTES.poll_value = ProcessScopedJinjaCache.get_cache_size
 
 
+class ProcessScopedJinjaTemplateCache(caching.ProcessScopedSingleton):
+    """This class holds in-process Jinja environments and compiled templates.
+
+    Environments are shared by all requests asking for the same template
+    directories, locale and autoescaping.  Compiled template code is keyed by
+    the template's absolute path and autoescaping, and is reused for as long
+    as the file's mtime is unchanged.
+    """
+
+    @classmethod
+    def get_environment_count(cls):
+        return len(cls.instance().environments.items)
+
+    @classmethod
+    def get_compiled_template_count(cls):
+        return len(cls.instance().compiled.items)
+
+    def __init__(self):
+        self.environments = caching.LRUCache(
+            max_item_count=MAX_GLOBAL_ENVIRONMENT_COUNT)
+        self.compiled = caching.LRUCache(
+            max_item_count=MAX_GLOBAL_COMPILED_TEMPLATE_COUNT)
+        self.lock = threading.RLock()
+
+
+JINJA_ENVIRONMENT_COUNT = PerfCounter(
+    'gcb-models-JinjaTemplateCache-environments',
+    'A total number of shared Jinja environments.')
+JINJA_COMPILED_TEMPLATE_COUNT = PerfCounter(
+    'gcb-models-JinjaTemplateCache-templates',
+    'A total number of compiled Jinja templates held in-process.')
+JINJA_COMPILED_TEMPLATE_HIT = PerfCounter(
+    'gcb-models-JinjaTemplateCache-hit',
+    'A number of times a compiled Jinja template was reused.')
+JINJA_COMPILED_TEMPLATE_MISS = PerfCounter(
+    'gcb-models-JinjaTemplateCache-miss',
+    'A number of times a Jinja template had to be compiled.')
+
+JINJA_RENDER_LATENCY = LatencyHistogram(
+    'gcb-models-jinja-render-latency',
+    'Latency in milliseconds of template rendering, labeled by template.')
+
+JINJA_ENVIRONMENT_COUNT.poll_value = (
+    ProcessScopedJinjaTemplateCache.get_environment_count)
+JINJA_COMPILED_TEMPLATE_COUNT.poll_value = (
+    ProcessScopedJinjaTemplateCache.get_compiled_template_count)
+
+
+class _TimedTemplate(jinja2.Template):
+    """A template that records how long it takes to render."""
+
+    def render(self, *args, **kwargs):
+        with JINJA_RENDER_LATENCY.timer(self.name or '<string>'):
+            return super(_TimedTemplate, self).render(*args, **kwargs)
+
+
 def create_jinja_environment(loader, locale=None, autoescape=True):
     """Create proper jinja environment."""
 
@@ -162,6 +247,7 @@ def create_jinja_environment(loader, locale=None, autoescape=True):
     jinja_environment = jinja2.Environment(
         autoescape=autoescape, finalize=finalize,
         extensions=['jinja2.ext.i18n'], bytecode_cache=cache, loader=loader)
+    jinja_environment.template_class = _TimedTemplate
 
     jinja_environment.filters['js_string'] = js_string
     jinja_environment.filters['to_json'] = _to_json_jinja
@@ -183,9 +269,7 @@ def create_jinja_environment(loader, locale=None, autoescape=True):
     return jinja_environment
 
 
-def create_and_configure_jinja_environment(
-    dirs, autoescape=True, handler=None, default_locale='en_US'):
-    """Sets up an environment and gets jinja template."""
+def _get_current_locale(default_locale):
 
     # Defer to avoid circular import.
     from controllers import sites
@@ -198,19 +282,156 @@ def create_and_configure_jinja_environment(
             locale = app_context.default_locale
     if not locale:
         locale = default_locale
+    return locale
+
+
+def create_and_configure_jinja_environment(
+    dirs, autoescape=True, handler=None, default_locale='en_US'):
+    """Sets up an environment and gets jinja template."""
 
     jinja_environment = create_jinja_environment(
-        jinja2.FileSystemLoader(dirs), locale=locale, autoescape=autoescape)
+        jinja2.FileSystemLoader(dirs),
+        locale=_get_current_locale(default_locale), autoescape=autoescape)
 
     jinja_environment.filters['gcb_tags'] = get_gcb_tags_filter(handler)
 
     return jinja_environment
 
 
+def _get_shared_environment(dirs, locale, autoescape):
+    """Gets the process-wide environment for these dirs, locale, escaping.
+
+    The returned environment must not be modified; per-request state such as
+    the handler is passed to templates as globals instead.
+    """
+    key = (tuple(dirs), locale, autoescape)
+    cache = ProcessScopedJinjaTemplateCache.instance()
+    with cache.lock:
+        found, jinja_environment = cache.environments.get(key)
+        if not found:
+            jinja_environment = create_jinja_environment(
+                jinja2.FileSystemLoader(dirs), locale=locale,
+                autoescape=autoescape)
+            jinja_environment.filters['gcb_tags'] = _gcb_tags_from_context
+            cache.environments.put(key, jinja_environment)
+
+    # The environment delegates gettext to the i18n object of the current
+    # request; point that at the locale wanted here, as is done when a new
+    # environment is created.
+    i18n.get_i18n().set_locale(locale)
+    return jinja_environment
+
+
+def _find_template_file(template_name, dirs):
+    pieces = loaders.split_template_path(template_name)
+    for search_path in dirs:
+        filename = os.path.join(search_path, *pieces)
+        if os.path.isfile(filename):
+            return filename
+    raise jinja2.TemplateNotFound(template_name)
+
+
+def _get_compiled_code(jinja_environment, template_name, filename):
+    """Gets compiled code for a template file, compiling only if changed."""
+    key = (filename, jinja_environment.autoescape)
+    mtime = os.path.getmtime(filename)
+    cache = ProcessScopedJinjaTemplateCache.instance()
+    with cache.lock:
+        found, entry = cache.compiled.get(key)
+    if found and entry[0] == mtime:
+        JINJA_COMPILED_TEMPLATE_HIT.inc()
+        return entry[1], mtime
+
+    JINJA_COMPILED_TEMPLATE_MISS.inc()
+    with open(filename, 'rb') as stream:
+        source = stream.read().decode(jinja_environment.loader.encoding)
+    code = jinja_environment.compile(source, template_name, filename)
+    with cache.lock:
+        cache.compiled.put(key, (mtime, code))
+    return code, mtime
+
+
+def _get_compiled_code_for_string(jinja_environment, source):
+    key = ('<string>', hashlib.sha1(source.encode('utf-8')).hexdigest(),
+           jinja_environment.autoescape)
+    cache = ProcessScopedJinjaTemplateCache.instance()
+    with cache.lock:
+        found, code = cache.compiled.get(key)
+    if found:
+        JINJA_COMPILED_TEMPLATE_HIT.inc()
+        return code
+
+    JINJA_COMPILED_TEMPLATE_MISS.inc()
+    code = jinja_environment.compile(source)
+    with cache.lock:
+        cache.compiled.put(key, code)
+    return code
+
+
+def _template_from_code(jinja_environment, code, handler, uptodate=None):
+    return jinja_environment.template_class.from_code(
+        jinja_environment, code,
+        jinja_environment.make_globals({_HANDLER_GLOBAL_NAME: handler}),
+        uptodate)
+
+
 def get_template(
     template_name, dirs, autoescape=True, handler=None, default_locale='en_US'):
-    return create_and_configure_jinja_environment(
-        dirs, autoescape, handler, default_locale).get_template(template_name)
+    if not CAN_USE_JINJA2_TEMPLATE_CACHE.value:
+        return create_and_configure_jinja_environment(
+            dirs, autoescape, handler, default_locale).get_template(
+                template_name)
+
+    jinja_environment = _get_shared_environment(
+        dirs, _get_current_locale(default_locale), autoescape)
+    filename = _find_template_file(template_name, dirs)
+    code, mtime = _get_compiled_code(jinja_environment, template_name, filename)
+
+    def uptodate():
+        try:
+            return os.path.getmtime(filename) == mtime
+        except OSError:
+            return False
+
+    return _template_from_code(jinja_environment, code, handler, uptodate)
+
+
+def get_template_from_string(
+    source, dirs, autoescape=True, handler=None, default_locale='en_US'):
+    """Like get_template(), but for template text rather than a file name."""
+    if not CAN_USE_JINJA2_TEMPLATE_CACHE.value:
+        return create_and_configure_jinja_environment(
+            dirs, autoescape, handler, default_locale).from_string(source)
+
+    jinja_environment = _get_shared_environment(
+        dirs, _get_current_locale(default_locale), autoescape)
+    code = _get_compiled_code_for_string(jinja_environment, unicode(source))
+    return _template_from_code(jinja_environment, code, handler)
+
+
+def precompile_templates(dirs, autoescape=True, extensions=('.html',)):
+    """Compiles all templates found under dirs into the in-process cache.
+
+    Called when an instance starts so that the first requests served do not
+    pay for compiling the templates they use.
+
+    Returns:
+        The number of templates compiled.
+    """
+    jinja_environment = create_jinja_environment(
+        jinja2.FileSystemLoader(dirs), autoescape=autoescape)
+    count = 0
+    for template_name in jinja_environment.list_templates(
+        extensions=[extension.lstrip('.') for extension in extensions]):
+        try:
+            filename = _find_template_file(template_name, dirs)
+            _get_compiled_code(jinja_environment, template_name, filename)
+            count += 1
+        except jinja2.TemplateError:
+            # Not every file with a template extension is a valid template
+            # on its own; such files are compiled when first used instead.
+            pass
+    return count
 
 
 def render_partial_template(name, dirs, values, **kwargs):
@@ -17,13 +17,13 @@
 __author__ = 'John Orr (jorr@google.com)'
 
 
+import collections
 import logging
 import mimetypes
 import os
 import re
 from xml.etree import cElementTree
 
-import html5lib
 import safe_dom
 import webapp2
 
@@ -104,6 +104,18 @@ class BaseTag(object):
         """
         return cElementTree.XML('<div>[Unimplemented custom tag]</div>')
 
+    def prefetch(self, nodes, handler):  # pylint: disable=W0613
+        """Receive every node for this tag in a page before any is rendered.
+
+        Override this to load the data the nodes refer to in bulk, rather than
+        once per node in render().
+
+        Args:
+            nodes: list of cElementTree.Element. The DOM nodes for the tag.
+            handler: controllers.utils.BaseHandler. The server runtime.
+        """
+        pass
+
     def get_icon_url(self):
         """Return the URL for the icon to be displayed in the rich text editor.
 
@@ -352,10 +364,16 @@ def get_tag_bindings():
     return dict(Registry.get_all_tags().items())
 
 
-def html_string_to_element_tree(html_string, is_fragment=True):
-    parser = html5lib.HTMLParser(
+def _make_html5lib_parser():
+    # Deferred so that html5lib is only loaded by requests that parse HTML.
+    import html5lib
+    return html5lib.HTMLParser(
         tree=html5lib.treebuilders.getTreeBuilder('etree', cElementTree),
         namespaceHTMLElements=False)
+
+
+def html_string_to_element_tree(html_string, is_fragment=True):
+    parser = _make_html5lib_parser()
     if is_fragment:
         # This returns the <div> element we wrap around the content.
         return parser.parseFragment('<div>%s</div>' % html_string)[0]
@@ -455,6 +473,8 @@ def html_to_safe_dom(html_string, handler, render_custom_tags=True):
                 original_elt, '%s: %s' % (INVALID_HTML_TAG_MESSAGE, e))
 
     root = html_string_to_element_tree(html_string)
+    if render_custom_tags:
+        _prefetch_tags(root, tag_bindings, handler)
     if root.text:
         node_list.append(safe_dom.Text(root.text))
 
@@ -471,6 +491,20 @@ def html_to_safe_dom(html_string, handler, render_custom_tags=True):
     return node_list
 
 
+def _prefetch_tags(root, tag_bindings, handler):
+    """Passes each custom tag type all of its nodes under root."""
+    tag_nodes = collections.defaultdict(list)
+    for elt in root.iter():
+        if elt.tag in tag_bindings:
+            tag_nodes[elt.tag].append(elt)
+    for tag_name, nodes in tag_nodes.iteritems():
+        try:
+            tag_bindings[tag_name]().prefetch(nodes, handler)
+        except Exception:  # pylint: disable=broad-except
+            # Rendering loads whatever the prefetch did not.
+            logging.exception('Error prefetching for tag: %s', tag_name)
+
+
 def get_components_from_html(html, use_lxml=_LXML_AVAILABLE):
     """Returns a list of dicts representing the components in a lesson.
 
@@ -493,9 +527,7 @@ def get_components_from_html(html, use_lxml=_LXML_AVAILABLE):
 def get_components_using_html5lib(html):
     """Find lesson components using the pure python html5lib library."""
 
-    parser = html5lib.HTMLParser(
-        tree=html5lib.treebuilders.getTreeBuilder('etree', cElementTree),
-        namespaceHTMLElements=False)
+    parser = _make_html5lib_parser()
     content = parser.parseFragment('<div>%s</div>' % html)[0]
     components = []
     for component in content.findall('.//*[@instanceid]'):
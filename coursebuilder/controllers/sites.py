@@ -104,11 +104,15 @@ not hosting multiple courses, your course will run in a default namespace
 Good luck!
 """
 
+import gzip
+import hashlib
 import logging
 import mimetypes
 import os
 import posixpath
 import re
+import StringIO
+import sys
 import threading
 import traceback
 import urllib
@@ -130,6 +134,7 @@ from common import utils as common_utils
 from models import courses
 from models import messages
 from models import models
+from models import counters
 from models import custom_modules
 from models import transforms
 from models.config import ConfigProperty
@@ -175,6 +180,9 @@ SITE_TYPE_COURSE = 'course'
 DEFAULT_CACHE_CONTROL_MAX_AGE = 600
 DEFAULT_CACHE_CONTROL_PUBLIC = 'public'
 
+# maximum total size of CSS/JS combo bundles held in-process
+MAX_COMBO_BUNDLE_CACHE_SIZE_BYTES = 8 * 1024 * 1024
+
 # default HTTP headers for dynamic responses
 DEFAULT_EXPIRY_DATE = 'Mon, 01 Jan 1990 00:00:00 GMT'
 DEFAULT_PRAGMA = 'no-cache'
@@ -192,9 +200,21 @@ DYNAMIC_HANDLER_COUNT = PerfCounter(
 ZIP_HANDLER_COUNT = PerfCounter(
     'gcb-sites-handler-zip',
     'A number of times request was served via zip handler.')
+COMBO_BUNDLE_HIT = PerfCounter(
+    'gcb-sites-combo-bundle-hit',
+    'A number of times a combo bundle was served from the in-process cache.')
+COMBO_BUNDLE_MISS = PerfCounter(
+    'gcb-sites-combo-bundle-miss',
+    'A number of times a combo bundle had to be assembled from a zip file.')
+COMBO_BUNDLE_NOT_MODIFIED = PerfCounter(
+    'gcb-sites-combo-bundle-not-modified',
+    'A number of times a combo bundle request was answered with 304.')
 NO_HANDLER_COUNT = PerfCounter(
     'gcb-sites-handler-none',
     'A number of times request was not matched to any handler.')
+HANDLER_LATENCY = counters.LatencyHistogram(
+    'gcb-sites-handler-latency',
+    'Latency in milliseconds of course handlers, labeled by verb and handler.')
 
 HTTP_BYTES_IN = PerfCounter(
     'gcb-sites-bytes-in',
@@ -406,6 +426,48 @@ def make_zip_handler(zipfilename):
     return CustomZipHandler
 
 
+class ComboBundle(object):
+    """An assembled combo response, plain and gzipped, with its ETag."""
+
+    def __init__(self, content_type, body):
+        self.content_type = content_type
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        # Strong ETags must differ between content encodings.
+        self.gzip_etag = self.etag + '-gzip'
+        buf = StringIO.StringIO()
+        # Zero mtime so the compressed bytes are the same on every instance.
+        gzip_file = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+        gzip_file.write(body)
+        gzip_file.close()
+        self.gzipped_body = buf.getvalue()
+
+
+class _ComboBundleLRUCache(caching.LRUCache):
+
+    def get_entry_size(self, key, value):
+        return sys.getsizeof(key) + len(value.body) + len(
+            value.gzipped_body)
+
+
+class ProcessScopedComboBundleCache(caching.ProcessScopedSingleton):
+    """Holds assembled combo bundles keyed by zip file and member list.
+
+    Zip files are part of the deployed application and never change while
+    the process is alive, so bundles need no invalidation; the cache is only
+    bounded in size.
+    """
+
+    @classmethod
+    def get_bundle_count(cls):
+        return len(cls.instance().bundles.items)
+
+    def __init__(self):
+        self.bundles = _ComboBundleLRUCache(
+            max_size_bytes=MAX_COMBO_BUNDLE_CACHE_SIZE_BYTES)
+        self.lock = threading.Lock()
+
+
 class CssComboZipHandler(BaseZipHandler):
     """A handler which combines a files served from a zip file.
 
@@ -415,6 +477,10 @@ class CssComboZipHandler(BaseZipHandler):
 
     zipfile_cache = {}
 
+    # Lists of member names known to be requested together by our pages;
+    # see preassemble_combo_bundles().
+    COMMON_COMBOS = []
+
     def get(self):
         raise NotImplementedError()
 
@@ -422,9 +488,9 @@ class CssComboZipHandler(BaseZipHandler):
         """Properly controls caching."""
         set_static_resource_cache_control(self)
 
-    def serve_from_zip_file(self, zipfilename, static_file_handler):
-        """Assemble the download by reading file from zip file."""
-        zipfile_object = self.zipfile_cache.get(zipfilename)
+    @classmethod
+    def _get_zipfile(cls, zipfilename):
+        zipfile_object = cls.zipfile_cache.get(zipfilename)
         if zipfile_object is None:
             try:
                 zipfile_object = zipfile.ZipFile(zipfilename)
@@ -433,31 +499,89 @@ class CssComboZipHandler(BaseZipHandler):
                 # configuration error in the app, so it's logged as an error.
                 logging.error('Can\'t open zipfile %s: %s', zipfilename, err)
                 zipfile_object = ''  # Special value to cache negative results.
-            self.zipfile_cache[zipfilename] = zipfile_object
-        if not zipfile_object:
-            self.error(404)
-            return
+            cls.zipfile_cache[zipfilename] = zipfile_object
+        return zipfile_object
 
+    @classmethod
+    def _assemble_bundle(cls, zipfile_object, zipfilename, names,
+                         static_file_handler):
         all_content_types = set()
-        for name in self.request.GET:
+        for name in names:
             all_content_types.add(mimetypes.guess_type(name))
         if len(all_content_types) == 1:
             content_type = all_content_types.pop()[0]
         else:
             content_type = 'text/plain'
-        self.response.headers['Content-Type'] = content_type
-
-        self.SetCachingHeaders()
 
-        for name in self.request.GET:
+        parts = []
+        for name in names:
             try:
                 content = zipfile_object.read(name)
                 if content_type == 'text/css':
-                    content = self.fix_css_paths(
-                        name, content, static_file_handler)
-                self.response.out.write(content)
+                    content = cls.fix_css_paths(
+                        name, content, static_file_handler).encode('utf-8')
+                parts.append(content)
             except (KeyError, RuntimeError), err:
                 logging.error('Not found %s in %s', name, zipfilename)
+        return ComboBundle(content_type, ''.join(parts))
+
+    @classmethod
+    def get_bundle(cls, zipfilename, names, static_file_handler):
+        """Returns ComboBundle for names; None if zip file can't be opened."""
+        zipfile_object = cls._get_zipfile(zipfilename)
+        if not zipfile_object:
+            return None
+
+        cache = ProcessScopedComboBundleCache.instance()
+        key = (zipfilename, static_file_handler, tuple(names))
+        with cache.lock:
+            found, bundle = cache.bundles.get(key)
+        if found:
+            COMBO_BUNDLE_HIT.inc()
+            return bundle
+
+        COMBO_BUNDLE_MISS.inc()
+        bundle = cls._assemble_bundle(
+            zipfile_object, zipfilename, names, static_file_handler)
+        with cache.lock:
+            cache.bundles.put(key, bundle)
+        return bundle
+
+    @classmethod
+    def preassemble(cls, zipfilename, static_file_handler):
+        """Assembles COMMON_COMBOS so that no request has to wait for it."""
+        count = 0
+        for names in cls.COMMON_COMBOS:
+            if cls.get_bundle(zipfilename, names, static_file_handler):
+                count += 1
+        return count
+
+    def serve_from_zip_file(self, zipfilename, static_file_handler):
+        """Serve the download assembled from files in zip file."""
+        bundle = self.get_bundle(
+            zipfilename, list(self.request.GET), static_file_handler)
+        if bundle is None:
+            self.error(404)
+            return
+
+        use_gzip = 'gzip' in self.request.headers.get('Accept-Encoding', '')
+        etag = bundle.gzip_etag if use_gzip else bundle.etag
+
+        self.response.headers['Content-Type'] = bundle.content_type
+        self.response.headers['Vary'] = 'Accept-Encoding'
+        self.response.etag = etag
+        self.SetCachingHeaders()
+
+        if etag in self.request.if_none_match:
+            COMBO_BUNDLE_NOT_MODIFIED.inc()
+            self.response.set_status(304)
+            return
+
+        if use_gzip:
+            self.response.headers['Content-Encoding'] = 'gzip'
+            self.response.out.write(bundle.gzipped_body)
+        else:
+            self.response.out.write(bundle.body)
 
     @classmethod
     def fix_css_paths(cls, path, css, static_file_handler):
@@ -491,16 +615,43 @@ class CssComboZipHandler(BaseZipHandler):
         return css
 
 
-def make_css_combo_zip_handler(zipfilename, static_file_handler):
+# Combo handlers created so far, keyed by (zipfilename, static_file_handler).
+_COMBO_HANDLERS = {}
+
+
+def make_css_combo_zip_handler(
+    zipfilename, static_file_handler, common_combos=None):
+    """Creates a handler that serves combined files from a zip file.
+
+    Args:
+        zipfilename: the path to the zip file
+        static_file_handler: the base handler to serve files referenced by CSS
+        common_combos: optional list of lists of member names pages are known
+            to request; preassemble_combo_bundles() assembles these ahead of
+            the first request.
+    """
 
     class CustomCssComboZipHandler(CssComboZipHandler):
 
+        COMMON_COMBOS = common_combos or []
+
         def get(self):
             self.serve_from_zip_file(zipfilename, static_file_handler)
 
+    _COMBO_HANDLERS[(zipfilename, static_file_handler)] = (
+        CustomCssComboZipHandler)
     return CustomCssComboZipHandler
 
 
+def preassemble_combo_bundles():
+    """Assembles the common combos of all combo handlers; returns count."""
+    count = 0
+    for (zipfilename, static_file_handler), handler_class in (
+        _COMBO_HANDLERS.items()):
+        count += handler_class.preassemble(zipfilename, static_file_handler)
+    return count
+
+
 class AssetHandler(utils.BaseHandler):
     """Handles serving of static resources located on the file system."""
 
@@ -1421,6 +1572,12 @@ class ApplicationRequestHandler(webapp2.RequestHandler):
         finally:
             count_stats(self)
             unset_path_info()
+            try:
+                counters.Registry.flush_histograms()
+            except Exception:  # On purpose. pylint: disable=broad-except
+                # Latency statistics must never replace the response, nor
+                # the handler's own exception.
+                logging.exception('Failed to flush latency histograms.')
 
     @classmethod
     def get_status_code_from_dispatch_exception(cls, verb, path, e):
@@ -1446,7 +1603,9 @@ class ApplicationRequestHandler(webapp2.RequestHandler):
         try:
             status_code = None
             try:
-                handler.dispatch()
+                with HANDLER_LATENCY.timer('%s %s' % (
+                    verb.upper(), handler.__class__.__name__)):
+                    handler.dispatch()
                 status_code = handler.response.status_code
             except exc.HTTPRedirection as e:
                 raise e
@@ -1020,7 +1020,7 @@ class BaseHandler(CourseHandler):
         if user:
             student = Student.get_enrolled_student_by_user(user)
             if student:
-                student.update_last_seen_on()
+                models.StudentActivityBuffer.record_last_seen_on(student)
 
             email = user.email()
             self.template_value['email_no_domain_name'] = (
@@ -1099,15 +1099,17 @@ class BaseHandler(CourseHandler):
 
         # If the page displayed successfully, save the location for registered
         # students so future visits to the course's base URL sends the student
-        # to the most-recently-visited page.
+        # to the most-recently-visited page.  The write is buffered, and is
+        # skipped altogether when the student reloads the same page.
         # TODO(psimakov): method called render() must not have mutations
-        if save_location and self.request.method == 'GET':
+        if (save_location and self.request.method == 'GET' and prefs and
+                prefs.last_location != self.request.path_qs):
             user = self.get_user()
             if user:
                 student = models.Student.get_enrolled_student_by_user(user)
                 if student:
-                    prefs.last_location = self.request.path_qs
-                    models.StudentPreferencesDAO.save(prefs)
+                    models.StudentActivityBuffer.record_last_location(
+                        prefs, self.request.path_qs)
 
     def get_redirect_location(self, student):
         if (not student.is_transient and
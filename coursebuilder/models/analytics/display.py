@@ -182,6 +182,9 @@ def get_generator_status_message(generator_class, job):
             'Job for %s statistics started at %s and is running now.' % (
                generator_description,
                job.updated_on.strftime(utils.HUMAN_READABLE_DATETIME_FORMAT))))
+        if job.percent_complete is not None:
+            message.append(safe_dom.Text(
+                ' It is about %d%% done.' % job.percent_complete))
     return message
 
 
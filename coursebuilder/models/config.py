@@ -23,6 +23,7 @@ of this with performance in mind.
 
 __author__ = 'Pavel Simakov (psimakov@google.com)'
 
+import datetime
 import logging
 import os
 import threading
@@ -33,7 +34,9 @@ import messages
 import transforms
 
 import appengine_config
+from common import utils as common_utils
 
+from google.appengine.api import memcache
 from google.appengine.api import namespace_manager
 from google.appengine.ext import db
 
@@ -44,6 +47,10 @@ DEFAULT_UPDATE_INTERVAL_SEC = 60
 # The longest update interval supported.
 MAX_UPDATE_INTERVAL_SEC = 60 * 5
 
+# How far back before the newest change already seen to look for changed
+# properties; covers clock skew between instances and query staleness.
+DELTA_OVERLAP_SEC = 60
+
 
 # Allowed property types.
 TYPE_INT = int
@@ -308,6 +315,13 @@ class Registry(object):
     REENTRY_ATTR_NAME = 'busy'
     UNREGISTERED_PROPERTY_LOGGING_LEVEL = logging.WARNING
 
+    # Memcache key of a stamp that changes on every write to the properties.
+    VERSION_KEY = 'config-properties-version'
+    db_loaded = False
+    db_version = None
+    pending_version = None
+    db_updated_on = None
+
     @classmethod
     def get_overrides(cls, force_update=False):
         """Returns current property overrides, maybe cached."""
@@ -333,7 +347,7 @@ class Registry(object):
                 try:
                     namespace_manager.set_namespace(
                         appengine_config.DEFAULT_NAMESPACE_NAME)
-                    cls._load_from_db()
+                    cls._refresh_from_db(force_update)
                 finally:
                     namespace_manager.set_namespace(old_namespace)
             except Exception as e:  # pylint: disable=broad-except
@@ -348,18 +362,105 @@ class Registry(object):
 
         return cls.db_overrides
 
+    @classmethod
+    def _get_version(cls):
+        version = memcache.get(
+            cls.VERSION_KEY, namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+        if version is None:
+            memcache.add(
+                cls.VERSION_KEY, long(time.time()),
+                namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+        return version
+
+    @classmethod
+    def _bump_version(cls):
+        # Seeded with the time so that a stamp evicted from memcache does not
+        # come back with a value an instance has already seen.
+        memcache.incr(
+            cls.VERSION_KEY, initial_value=long(time.time()),
+            namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+
+    @classmethod
+    def _refresh_from_db(cls, force_update):
+        """Loads all properties, or only changed ones if the stamp moved."""
+        version = cls._get_version()
+        if force_update or not cls.db_loaded:
+            cls._load_from_db()
+            cls.db_loaded = True
+            cls.db_version = None
+            cls.pending_version = None
+        elif version is None or version != cls.db_version:
+            cls._load_changes_from_db()
+        else:
+            return
+
+        # Queries may briefly miss very recent writes, so only stop looking
+        # once the stamp has held still for a whole refresh interval.
+        if version == cls.pending_version:
+            cls.db_version = version
+        cls.pending_version = version
+
     @classmethod
     def _load_from_db(cls):
         """Loads dynamic properties from db."""
         items = {}
         overrides = {}
         drafts = set()
-        for item in ConfigPropertyEntity.all().fetch(1000):
+        for item in common_utils.iter_all(ConfigPropertyEntity.all()):
             items[item.key().name()] = item
             cls._set_value(item, overrides, drafts)
         cls.db_items = items
         cls.db_overrides = overrides
         cls.names_with_draft = drafts
+        cls.db_updated_on = cls._get_newest_update(items.values())
+
+    @classmethod
+    def _load_changes_from_db(cls):
+        """Loads properties added, changed or deleted since the last load."""
+        items = dict(cls.db_items)
+        overrides = dict(cls.db_overrides)
+        drafts = set(cls.names_with_draft)
+
+        since = datetime.datetime.utcfromtimestamp(0)
+        if cls.db_updated_on:
+            since = cls.db_updated_on - datetime.timedelta(
+                seconds=DELTA_OVERLAP_SEC)
+        changed = list(common_utils.iter_all(
+            ConfigPropertyEntity.all().filter('updated_on >', since)))
+
+        # Deletions and entities written before updated_on was recorded do
+        # not show up in the query above; find them from the keys alone.
+        names = set(key.name() for key in common_utils.iter_all(
+            ConfigPropertyEntity.all(keys_only=True)))
+        for name in set(items) - names:
+            del items[name]
+            overrides.pop(name, None)
+            drafts.discard(name)
+        unknown = names - set(items) - set(item.key().name()
+                                           for item in changed)
+        if unknown:
+            changed += [item for item in ConfigPropertyEntity.get_by_key_name(
+                list(unknown)) if item]
+
+        for item in changed:
+            name = item.key().name()
+            items[name] = item
+            overrides.pop(name, None)
+            drafts.discard(name)
+            cls._set_value(item, overrides, drafts)
+
+        cls.db_items = items
+        cls.db_overrides = overrides
+        cls.names_with_draft = drafts
+        cls.db_updated_on = cls._get_newest_update(
+            changed, cls.db_updated_on)
+
+    @classmethod
+    def _get_newest_update(cls, items, newest=None):
+        for item in items:
+            if item.updated_on and (not newest or item.updated_on > newest):
+                newest = item.updated_on
+        return newest
 
     @classmethod
     def _config_property_entity_changed(cls, item):
@@ -418,11 +519,17 @@ class ConfigPropertyEntity(entities.BaseEntity):
     """A class that represents a named configuration property."""
     value = db.TextProperty(indexed=False)
     is_draft = db.BooleanProperty(indexed=False)
+    updated_on = db.DateTimeProperty(indexed=True)
 
     def put(self):
         # Persist to DB.
+        self.updated_on = datetime.datetime.utcnow()
         super(ConfigPropertyEntity, self).put()
 
+        # Let other instances know there is something new to load.
+        # pylint: disable=protected-access
+        Registry._bump_version()
+
         # And tell local registry.  Do this by direct call and synchronously
         # so that this setting will be internally consistent within the
         # remainder of this server's path of execution.  (Note that the
@@ -430,9 +537,13 @@ class ConfigPropertyEntity(entities.BaseEntity):
         # instances; they will pick it up in due course after
         # UPDATE_INTERVAL_SEC has elapsed.
 
-        # pylint: disable=protected-access
         Registry._config_property_entity_changed(self)
 
+    def delete(self, **kwargs):
+        super(ConfigPropertyEntity, self).delete(**kwargs)
+        # pylint: disable=protected-access
+        Registry._bump_version()
+
 
 def run_all_unit_tests():
     """Runs all unit tests for this modules."""
@@ -16,6 +16,19 @@
 
 __author__ = 'Pavel Simakov (psimakov@google.com)'
 
+import bisect
+import contextlib
+import threading
+import time
+
+# Upper bounds, in milliseconds, of the latency histogram buckets; these double
+# from 1ms to ~33s.  Anything slower than the last bound lands in an extra
+# overflow bucket.
+HISTOGRAM_BUCKET_BOUNDS_MS = [2 ** i for i in xrange(16)]
+
+# How often, at most, an instance pushes its histogram deltas for aggregation.
+HISTOGRAM_FLUSH_INTERVAL_SEC = 60
+
 
 def incr_counter_global_value(unused_name, unused_delta):
     """Hook method for global aggregation."""
@@ -27,6 +40,21 @@ def get_counter_global_value(unused_name):
     return None
 
 
+def incr_histogram_global_values(unused_name, unused_deltas):
+    """Hook method for global aggregation of histograms.
+
+    Args:
+      unused_name: name of the histogram.
+      unused_deltas: dict of label to a list of bucket count increments.
+    """
+    pass
+
+
+def get_histogram_global_values(unused_name, unused_labels):
+    """Hook method for global aggregation; returns dict of label to buckets."""
+    return None
+
+
 class PerfCounter(object):
     """A generic, in-process integer counter."""
 
@@ -73,12 +101,132 @@ class PerfCounter(object):
         return get_counter_global_value(self.name)
 
 
+class LatencyHistogram(PerfCounter):
+    """An in-process histogram of latencies, kept separately for each label.
+
+    Samples are counted in fixed log-scale buckets, so recording one is a
+    bisect and an increment, and percentiles are estimated to within a factor
+    of two.  Labels name what was timed; e.g. the handler serving a route.
+    """
+
+    def __init__(self, name, doc_string):
+        super(LatencyHistogram, self).__init__(name, doc_string)
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._pending = {}
+        self._last_flush = time.time()
+        Registry.add_histogram(self)
+
+    def _clear(self):
+        super(LatencyHistogram, self)._clear()
+        with self._lock:
+            self._buckets = {}
+            self._pending = {}
+
+    @classmethod
+    def _new_buckets(cls):
+        return [0] * (len(HISTOGRAM_BUCKET_BOUNDS_MS) + 1)
+
+    def record(self, millis, label=''):
+        """Counts one sample of the given latency under the given label."""
+        index = bisect.bisect_left(HISTOGRAM_BUCKET_BOUNDS_MS, millis)
+        with self._lock:
+            self._value += 1
+            buckets = self._buckets.get(label)
+            if buckets is None:
+                buckets = self._buckets[label] = self._new_buckets()
+            buckets[index] += 1
+            pending = self._pending.get(label)
+            if pending is None:
+                pending = self._pending[label] = self._new_buckets()
+            pending[index] += 1
+
+    @contextlib.contextmanager
+    def timer(self, label=''):
+        """Records how long the body of a 'with' statement takes."""
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.record((time.time() - started) * 1000, label=label)
+
+    @property
+    def labels(self):
+        return sorted(self._buckets.keys())
+
+    def get_buckets(self, label=''):
+        """Counts for this process, one per HISTOGRAM_BUCKET_BOUNDS_MS + 1."""
+        return list(self._buckets.get(label) or self._new_buckets())
+
+    def get_global_buckets(self):
+        """Returns dict of label to bucket counts aggregated globally."""
+        return get_histogram_global_values(self.name, self.labels)
+
+    @classmethod
+    def get_percentile(cls, buckets, percentile):
+        """Estimates a percentile as the upper bound of its bucket, in ms.
+
+        Returns None if there are no samples; samples in the overflow bucket
+        are reported as twice the last bound.
+        """
+        total = sum(buckets)
+        if not total:
+            return None
+        rank = total * percentile / 100.0
+        seen = 0
+        for index, count in enumerate(buckets):
+            seen += count
+            if count and seen >= rank:
+                break
+        if index < len(HISTOGRAM_BUCKET_BOUNDS_MS):
+            return HISTOGRAM_BUCKET_BOUNDS_MS[index]
+        return HISTOGRAM_BUCKET_BOUNDS_MS[-1] * 2
+
+    def flush(self, force=False):
+        """Pushes samples recorded since the last flush for aggregation."""
+        now = time.time()
+        if not force and now - self._last_flush < HISTOGRAM_FLUSH_INTERVAL_SEC:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = now
+        if pending:
+            incr_histogram_global_values(self.name, pending)
+
+
 class Registry(object):
     """Holds all registered counters."""
     registered = {}
 
+    # LatencyHistograms, sorted by name when registered; flushed after every
+    # request, so kept apart rather than picked out of all counters each time.
+    histograms = []
+
     @classmethod
     def _clear_all(cls):
         """Clears all counters for tests."""
         for counter in cls.registered.values():
             counter._clear()  # pylint: disable=protected-access
+
+    @classmethod
+    def add_histogram(cls, histogram):
+        histograms = [
+            other for other in cls.histograms if other.name != histogram.name]
+        histograms.append(histogram)
+        histograms.sort(key=lambda counter: counter.name)
+        cls.histograms = histograms
+
+    @classmethod
+    def remove_histogram(cls, histogram):
+        del cls.registered[histogram.name]
+        cls.histograms = [
+            other for other in cls.histograms if other is not histogram]
+
+    @classmethod
+    def get_histograms(cls):
+        return list(cls.histograms)
+
+    @classmethod
+    def flush_histograms(cls, force=False):
+        for histogram in cls.histograms:
+            histogram.flush(force=force)
@@ -19,6 +19,7 @@ __author__ = 'Pavel Simakov (psimakov@google.com)'
 import collections
 import copy
 from datetime import datetime
+import hashlib
 import logging
 import os
 import pickle
@@ -857,6 +858,41 @@ class CourseModel12(object):
         return self.is_unit_available(unit) and lesson.now_available
 
 
+def get_manifest_components(element, html, use_lxml=True):
+    """Returns the components in a unit's or lesson's HTML.
+
+    Units and lessons keep a manifest of the components in their HTML, so that
+    lesson views and progress events need not parse the HTML to find them.
+    The manifest is built when the course is saved or loaded from the
+    datastore.  It records a digest of the HTML it came from and which parser
+    was asked for, and is rebuilt here if either differs, e.g. when the HTML
+    has been translated.
+
+    Args:
+        element: the unit or lesson; its components_manifest is updated.
+        html: the unit's or lesson's HTML.
+        use_lxml: whether to parse with lxml rather than html5lib.
+
+    Returns:
+        A list of component dicts, as common.tags.get_components_from_html().
+    """
+    html = html or ''
+    digest = hashlib.md5(
+        html.encode('utf-8') if isinstance(html, unicode) else html
+    ).hexdigest()
+    use_lxml = bool(use_lxml)
+    manifest = getattr(element, 'components_manifest', None)
+    if (not manifest or manifest.get('digest') != digest or
+        manifest.get('use_lxml') != use_lxml):
+        components = []
+        if html:
+            components = common.tags.get_components_from_html(html, use_lxml)
+        manifest = {
+            'digest': digest, 'use_lxml': use_lxml, 'components': components}
+        element.components_manifest = manifest
+    return [dict(component) for component in manifest['components']]
+
+
 class Unit13(object):
     """An object to represent a Unit, Assessment or Link (version 1.3)."""
 
@@ -877,6 +913,7 @@ class Unit13(object):
         'custom_unit_type': None,
         'availability': AVAILABILITY_COURSE,
         'shown_when_unavailable': None,
+        'components_manifest': None,
         }
 
     def __init__(self):
@@ -902,6 +939,8 @@ class Unit13(object):
 
         # Only valid for the unit.type == verify.UNIT_TYPE_ASSESSMENT.
         self.html_content = None
+        # The components found in html_content; see get_manifest_components().
+        self.components_manifest = None
         self.html_check_answers = False
         self.html_review_form = None
 
@@ -1035,6 +1074,7 @@ class Lesson13(object):
         'manual_progress': False,
         'availability': AVAILABILITY_COURSE,
         'shown_when_unavailable': None,
+        'components_manifest': None,
     }
 
     def __init__(self):
@@ -1052,6 +1092,9 @@ class Lesson13(object):
         self.activity_title = ''
         self.activity_listed = True
 
+        # The components found in objectives; see get_manifest_components().
+        self.components_manifest = None
+
         # custom properties
         self.properties = {}
 
@@ -1247,6 +1290,9 @@ class CourseModel13(object):
         if not course:
             course = PersistentCourse13.load(app_context)
             if course:
+                # Fills in manifests for content saved before they existed,
+                # so that only the cached copy needs to be parsed.
+                course.update_components_manifests()
                 CachedCourse13.save(app_context, course)
         return course
 
@@ -1475,9 +1521,17 @@ class CourseModel13(object):
         self._deleted_lessons = []
 
         self._index()
+        self.update_components_manifests()
         PersistentCourse13.save(self._app_context, self)
         CachedCourse13.delete(self._app_context)
 
+    def update_components_manifests(self):
+        for unit in self._units:
+            if unit.type == verify.UNIT_TYPE_ASSESSMENT:
+                get_manifest_components(unit, unit.html_content)
+        for lesson in self._lessons:
+            get_manifest_components(lesson, lesson.objectives)
+
     def get_units(self):
         return self._units[:]
 
@@ -3372,8 +3426,7 @@ class Course(object):
         if not lesson.objectives:
             return []
 
-        return common.tags.get_components_from_html(
-            lesson.objectives, use_lxml)
+        return get_manifest_components(lesson, lesson.objectives, use_lxml)
 
     def get_content_as_dict_safe(self, unit, errors, kind='assessment'):
         """Validate the assessment or review script and return as a dict."""
@@ -3409,7 +3462,7 @@ class Course(object):
         if not getattr(unit, 'html_content', None):
             return []
 
-        return common.tags.get_components_from_html(unit.html_content)
+        return get_manifest_components(unit, unit.html_content)
 
     def get_components_with_name(self, unit_id, lesson_id, component_name):
         """Returns a list of dicts representing this component in a lesson."""
@@ -18,15 +18,18 @@ __author__ = 'Mike Gainer (mgainer@google.com)'
 
 import copy
 import functools
+import hashlib
 import re
 
 from common import crypto
 from common.utils import Namespace
 from models import entity_transforms
+from models import models
 from models import transforms
 from models.data_sources import base_types
 from models.data_sources import utils as data_sources_utils
 
+from google.appengine.api import datastore_errors
 from google.appengine.ext import db
 
 
@@ -46,10 +49,44 @@ class _AbstractDbTableRestDataSource(base_types._AbstractRestDataSource):
             'Do not use this class directly; call paginated_table_source() '
             'to build a curried version.')
 
+    # How long a page serialized ahead of time is kept for the next request.
+    PREFETCH_TTL_SEC = 60
+
     @classmethod
     def get_context_class(cls):
         return _DbTableContext
 
+    @classmethod
+    def use_keyset_pagination(cls):
+        """Whether to page by entity key rather than by saved cursors.
+
+        Keyset pagination orders by __key__ and remembers the first key of
+        each page, so any page can be reached with one keys-only skip
+        rather than walking cursors page by page, and the following page is
+        prefetched while the current one is serialized.  It is only used
+        when no orderings or inequality filters are requested, since those
+        would change the sort order; otherwise cursors are used as before.
+
+        Returns:
+          True if this source opts in to keyset pagination.
+        """
+        return False
+
+    @classmethod
+    def get_projectable_fields(cls):
+        """Names of indexed fields that are exported without transformation.
+
+        When a keyset-paginated request names only fields in this set (via
+        the 'fields' parameter), rows are fetched with a projection query
+        and returned as-is, skipping entity loading and for_export().
+        Fields which are PII, or which are transformed on export, must not
+        be listed here.
+
+        Returns:
+          A set of field names; empty by default.
+        """
+        return set()
+
     @classmethod
     def get_schema(cls, app_context, log, source_context):
         clazz = cls.get_entity_class()
@@ -63,6 +100,11 @@ class _AbstractDbTableRestDataSource(base_types._AbstractRestDataSource):
     def fetch_values(cls, app_context, source_context, schema, log,
                      sought_page_number, *unused_jobs):
         with Namespace(app_context.get_namespace_name()):
+            if cls._can_use_keyset_pagination(source_context):
+                return cls._fetch_values_by_key(
+                    app_context, source_context, schema, log,
+                    sought_page_number)
+
             stopped_early = False
             while len(source_context.cursors) < sought_page_number:
                 page_number = len(source_context.cursors)
@@ -190,6 +232,192 @@ class _AbstractDbTableRestDataSource(base_types._AbstractRestDataSource):
                 log.info('fetch_page %d had no end cursor' % page_number)
         return results
 
+    @classmethod
+    def _can_use_keyset_pagination(cls, source_context):
+        if not cls.use_keyset_pagination() or source_context.orderings:
+            return False
+        for filter_spec in source_context.filters:
+            parts = cls.FILTER_RE.match(filter_spec)
+            if not parts or parts.group(2) != '=':
+                return False
+        return True
+
+    @classmethod
+    def _get_projected_fields(cls, source_context):
+        fields = source_context.fields
+        if not fields or not set(fields) <= cls.get_projectable_fields():
+            return None
+
+        # Datastore does not permit projecting a property which is also
+        # constrained by an equality filter.
+        for filter_spec in source_context.filters:
+            parts = cls.FILTER_RE.match(filter_spec)
+            if parts and parts.group(1) in fields:
+                return None
+        return fields
+
+    @classmethod
+    def _build_keyed_query(cls, source_context, schema, start_key,
+                           keys_only=False, projection=None):
+        query = cls.get_entity_class().all(
+            keys_only=keys_only, projection=projection)
+        cls._add_query_filters(source_context, schema, None, query)
+        if start_key:
+            query.filter('__key__ >=', start_key)
+        query.order('__key__')
+        return query
+
+    @classmethod
+    def _find_page_start_key(cls, source_context, schema, page_number, log):
+        """Find the first key on a page; returns (found, key).
+
+        The key for page 0 is None, meaning the start of the table.  Pages
+        whose start keys are not yet known are reached by skipping forward
+        from the nearest earlier page with a single keys-only query.
+        """
+        page_keys = source_context.page_keys
+        if page_number == 0:
+            return True, None
+        if str(page_number) in page_keys:
+            log.info('fetch page %d start key present' % page_number)
+            return True, db.Key(page_keys[str(page_number)])
+
+        known_pages = [int(p) for p in page_keys if int(p) < page_number]
+        base_page = max(known_pages) if known_pages else 0
+        base_key = (
+            db.Key(page_keys[str(base_page)]) if base_page else None)
+        skip = (page_number - base_page) * source_context.chunk_size
+        log.info('fetch page %d start key missing; skipping %d keys '
+                 'from page %d' % (page_number, skip, base_page))
+        query = cls._build_keyed_query(
+            source_context, schema, base_key, keys_only=True)
+        keys = query.fetch(
+            1, offset=skip, read_policy=db.EVENTUAL_CONSISTENCY)
+        if not keys:
+            return False, None
+        page_keys[str(page_number)] = str(keys[0])
+        return True, keys[0]
+
+    @classmethod
+    def _get_prefetch_cache_key(cls, source_context, start_key):
+        digest = hashlib.sha1(repr((
+            source_context.chunk_size,
+            source_context.filters,
+            source_context.fields,
+            source_context.pii_secret,
+            str(start_key)))).hexdigest()
+        return 'paginated_table:%s:%s' % (cls.get_name(), digest)
+
+    @classmethod
+    def _fetch_values_by_key(cls, app_context, source_context, schema, log,
+                             sought_page_number):
+        if not source_context.chunk_size:
+            source_context.chunk_size = (
+                base_types._AbstractRestDataSource.RECOMMENDED_MAX_DATA_ITEMS)
+        chunk_size = source_context.chunk_size
+
+        page_number = sought_page_number
+        found, start_key = cls._find_page_start_key(
+            source_context, schema, page_number, log)
+        if not found:
+            query = cls._build_keyed_query(
+                source_context, schema, None, keys_only=True)
+            num_rows = query.count(limit=None)
+            page_number = max(0, (num_rows - 1) // chunk_size)
+            log.warning('Fewer pages available than requested.  '
+                        'Stopping at last page %d' % page_number)
+            _, start_key = cls._find_page_start_key(
+                source_context, schema, page_number, log)
+
+        cacheable = not source_context.send_uncensored_pii_data
+        if cacheable:
+            prefetched = models.MemcacheManager.get(
+                cls._get_prefetch_cache_key(source_context, start_key))
+            if prefetched is not None:
+                log.info('fetch page %d served from prefetch' % page_number)
+                ret, next_key = prefetched
+                if next_key:
+                    source_context.page_keys[str(page_number + 1)] = next_key
+                return ret, page_number
+
+        projection = cls._get_projected_fields(source_context)
+        log.info('fetch page %d using keyset limit %d' % (
+            page_number, chunk_size))
+        try:
+            rows, next_key = cls._finish_page_by_key(
+                source_context, cls._start_page_by_key(
+                    source_context, schema, start_key, projection))
+        except datastore_errors.NeedIndexError:
+            # Multi-property projections need a composite index; without
+            # one, load full entities instead.
+            log.warning('fetch page %d has no index for projection on %s; '
+                        'loading full entities' % (
+                            page_number, ', '.join(projection)))
+            projection = None
+            rows, next_key = cls._finish_page_by_key(
+                source_context, cls._start_page_by_key(
+                    source_context, schema, start_key, projection))
+        if next_key:
+            source_context.page_keys[str(page_number + 1)] = next_key
+            log.info('fetch page %d saving next page key' % page_number)
+        else:
+            log.info('fetch page %d is last; no next page key' % page_number)
+
+        # Start the query for the following page before serializing this
+        # one; the datastore works on it while we convert rows to JSON.
+        next_page = None
+        if cacheable and next_key:
+            log.info('fetch page %d prefetching page %d' % (
+                page_number, page_number + 1))
+            next_page = cls._start_page_by_key(
+                source_context, schema, db.Key(next_key), projection)
+
+        ret = cls._serialize_rows(app_context, source_context, schema, log,
+                                  page_number, rows, projection)
+
+        if next_page:
+            next_rows, following_key = cls._finish_page_by_key(
+                source_context, next_page)
+            models.MemcacheManager.set(
+                cls._get_prefetch_cache_key(source_context, next_key),
+                (cls._serialize_rows(app_context, source_context, schema,
+                                     log, page_number + 1, next_rows,
+                                     projection),
+                 following_key),
+                ttl=cls.PREFETCH_TTL_SEC)
+        return ret, page_number
+
+    @classmethod
+    def _start_page_by_key(cls, source_context, schema, start_key,
+                           projection):
+        """Issue the query for one page plus the next page's first row."""
+        query = cls._build_keyed_query(
+            source_context, schema, start_key, projection=projection)
+        limit = source_context.chunk_size + 1
+        return query.run(limit=limit, batch_size=limit,
+                         read_policy=db.EVENTUAL_CONSISTENCY)
+
+    @classmethod
+    def _finish_page_by_key(cls, source_context, results):
+        """Collect a page's rows; returns (rows, next page start key)."""
+        rows = list(results)
+        next_key = None
+        if len(rows) > source_context.chunk_size:
+            next_key = str(rows[source_context.chunk_size].key())
+            rows = rows[:source_context.chunk_size]
+        return rows, next_key
+
+    @classmethod
+    def _serialize_rows(cls, app_context, source_context, schema, log,
+                        page_number, rows, projection):
+        if projection:
+            return [
+                transforms.dict_to_json(
+                    {name: getattr(row, name) for name in projection})
+                for row in rows]
+        return cls._postprocess_rows(
+            app_context, source_context, schema, log, page_number, rows)
+
     @classmethod
     def _build_transform_fn(cls, context):
         if not context.pii_secret:
@@ -221,6 +449,9 @@ class _DbTableContext(base_types._AbstractContextManager):
           the name of a field.  Note that if a less-than or greater-than
           filter is applied, these fields must also be ordered by before
           you specify any other order-by fields.
+      fields=<name>:  May be specified zero or more times.  Names the
+          fields the caller will display.  Sources which support it may
+          use this to fetch only those fields via a projection query.
     """
 
     # Classes defining various versions of source_context used for
@@ -228,7 +459,8 @@ class _DbTableContext(base_types._AbstractContextManager):
     class _TableContext1(object):
 
         def __init__(self, version, chunk_size, filters, orderings, cursors,
-                     pii_secret, send_uncensored_pii_data=False):
+                     pii_secret, send_uncensored_pii_data=False, fields=None,
+                     page_keys=None):
             """Set up a context.
 
             Note: This plain-old-data class is being used in preference over a
@@ -253,6 +485,10 @@ class _DbTableContext(base_types._AbstractContextManager):
                 PII data (if any) when pumping this object.  Unless you have
                 a separate, concrete, intentional UI gesture or command-line
                 flag from the user, this should never be set.
+              fields: List of field names wanted by the caller, or None
+                for all fields.
+              page_keys: Dict of page number to string form of the first
+                entity key on that page; used for keyset pagination.
             """
             self.version = version
             self.chunk_size = chunk_size
@@ -266,18 +502,22 @@ class _DbTableContext(base_types._AbstractContextManager):
             # a checkbox, un-blacklisted data is available.  Note that setting
             # this flag will also almost certainly change the reported schema.
             self.send_uncensored_pii_data = send_uncensored_pii_data
+            self.fields = fields
+            self.page_keys = page_keys or {}
 
     @classmethod
     def build_from_web_request(cls, params, default_chunk_size):
         chunk_size = params.get('chunk_size')
         filters = params.get_all('filters')
         orderings = params.get_all('ordering')
-        if not chunk_size and not filters and not orderings:
+        fields = params.get_all('fields')
+        if not chunk_size and not filters and not orderings and not fields:
             return None
 
         chunk_size = int(chunk_size or default_chunk_size)
         secret = cls._build_secret(params)
-        return cls._TableContext1(1, chunk_size, filters, orderings, {}, secret)
+        return cls._TableContext1(1, chunk_size, filters, orderings, {}, secret,
+                                  fields=fields or None)
 
     @classmethod
     def build_from_dict(cls, context_dict):
@@ -311,6 +551,7 @@ class _DbTableContext(base_types._AbstractContextManager):
         del ret['cursors']
         del ret['pii_secret']
         del ret['send_uncensored_pii_data']
+        ret.pop('page_keys', None)
         return ret
 
     @classmethod
@@ -319,7 +560,8 @@ class _DbTableContext(base_types._AbstractContextManager):
             new_context.version == old_context.version and
             new_context.chunk_size == old_context.chunk_size and
             new_context.filters == old_context.filters and
-            new_context.orderings == old_context.orderings)
+            new_context.orderings == old_context.orderings and
+            new_context.fields == old_context.fields)
 
     @classmethod
     def _build_secret(cls, params):
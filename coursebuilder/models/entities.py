@@ -306,3 +306,16 @@ class BaseEntity(db.Model):
                     cls._remove_named_component(tail, container[name])
             else:
                 del container[name]
+
+
+class CacheTombstoneEntity(BaseEntity):
+    """Records the deletion of an entity that in-process caches may hold.
+
+    Caches learn about changes by querying for entities updated since the
+    newest change they have seen.  A deleted entity can't be found that way,
+    so the delete path leaves one of these behind in its place.  The key name
+    is '<kind>:<key name>' of the deleted entity.
+    """
+    kind_name = db.StringProperty(indexed=False)
+    entity_key_name = db.StringProperty(indexed=False)
+    updated_on = db.DateTimeProperty(indexed=True)
@@ -20,12 +20,14 @@ import ast
 import datetime
 import inspect
 import logging
+import operator
 import time
 import traceback
 import urllib
 
 from common import utils as common_utils
 import entities
+import models
 from mapreduce import base_handler
 from mapreduce import input_readers
 from mapreduce import mapreduce_pipeline
@@ -190,6 +192,124 @@ class DurableJob(DurableJobBase):
         return sequence_num
 
 
+class ResumableJob(DurableJob):
+    """A durable job that checkpoints its work and resumes in new tasks.
+
+    DurableJob.main() runs the whole of run() inside a single deferred task,
+    so a long computation dies at the task deadline and starts over from
+    nothing on the next submit. Subclasses of this class instead split their
+    work into steps: resume() is a generator that advances the computation
+    from a checkpoint and yields a new checkpoint after every step. The
+    checkpoint is a JSON-serializable value, typically a query cursor plus
+    partial accumulators.
+
+    Shortly before the task deadline the latest checkpoint is stored on the
+    DurableJobEntity and a follow-up task is deferred in the same
+    transaction; the follow-up picks up from the stored checkpoint. The
+    checkpoint is also saved every CHECKPOINT_EVERY_SEC so the dashboard can
+    report how far along the job is.
+    """
+
+    # Deferred tasks are killed after 10 minutes; leave room to save state.
+    TASK_TIME_LIMIT_SEC = 8 * 60
+
+    # How often to record progress of a running task.
+    CHECKPOINT_EVERY_SEC = 60
+
+    def start(self):
+        """Returns the checkpoint to resume from when the job begins."""
+        return {}
+
+    def resume(self, checkpoint):
+        """Override to advance the computation from the given checkpoint.
+
+        Args:
+            checkpoint: The value returned by start() or most recently
+                yielded by a previous task of this run.
+        Yields:
+            (checkpoint, percent_complete) tuples; checkpoint must be
+            serializable with transforms.dumps() and percent_complete is an
+            int in [0, 100] or None if progress cannot be estimated.
+        """
+        raise NotImplementedError()
+
+    def finish(self, checkpoint):
+        """Override to build the job result from the final checkpoint."""
+        raise NotImplementedError()
+
+    def run(self):
+        """Runs all steps in the current request; useful in tests."""
+        checkpoint = self.start()
+        for checkpoint, _ in self.resume(checkpoint):
+            pass
+        return self.finish(checkpoint)
+
+    def _defer_continuation(self, sequence_num, checkpoint, percent_complete):
+        if not DurableJobEntity._checkpoint_job(
+            self._job_name, sequence_num, checkpoint, percent_complete):
+            return False
+        deferred.defer(self.main, sequence_num, _transactional=True)
+        return True
+
+    def main(self, sequence_num):
+        """Main method of the deferred task; runs until done or deadline."""
+
+        with Namespace(self._namespace):
+            logging.info('Job resumed: %s w/ sequence number %d',
+                         self._job_name, sequence_num)
+
+            try:
+                if self._already_finished(sequence_num):
+                    logging.info(
+                        'Job %s sequence %d already canceled or subsequent '
+                        'run completed; not running this version.',
+                        self._job_name, sequence_num)
+                    return
+                db.run_in_transaction(DurableJobEntity._start_job,
+                                      self._job_name, sequence_num)
+                job = self.load()
+                if job.checkpoint:
+                    checkpoint = transforms.loads(job.checkpoint)
+                else:
+                    checkpoint = self.start()
+
+                started = last_saved = time.time()
+                for checkpoint, percent_complete in self.resume(checkpoint):
+                    now = time.time()
+                    if now - started >= self.TASK_TIME_LIMIT_SEC:
+                        if db.run_in_transaction(
+                            self._defer_continuation, sequence_num,
+                            transforms.dumps(checkpoint), percent_complete):
+                            logging.info(
+                                'Job %s checkpointed at %s%% done; '
+                                'continuing in a new task.',
+                                self._job_name, percent_complete)
+                        return
+                    if now - last_saved >= self.CHECKPOINT_EVERY_SEC:
+                        if not db.run_in_transaction(
+                            DurableJobEntity._checkpoint_job, self._job_name,
+                            sequence_num, transforms.dumps(checkpoint),
+                            percent_complete):
+                            logging.info(
+                                'Job %s sequence %d was canceled; stopping.',
+                                self._job_name, sequence_num)
+                            return
+                        last_saved = now
+
+                result = self.finish(checkpoint)
+                db.run_in_transaction(DurableJobEntity._complete_job,
+                                      self._job_name, sequence_num,
+                                      transforms.dumps(result))
+                logging.info('Job completed: %s', self._job_name)
+            except (Exception, runtime.DeadlineExceededError) as e:
+                logging.error(traceback.format_exc())
+                logging.error('Job failed: %s\n%s', self._job_name, e)
+                db.run_in_transaction(DurableJobEntity._fail_job,
+                                      self._job_name, sequence_num,
+                                      traceback.format_exc())
+                raise deferred.PermanentTaskFailure(e)
+
+
 class MapReduceJobRunner(base_handler.PipelineBase):
 
     def run(self, job_name, sequence_num, namespace, complete_fn,
@@ -326,6 +446,126 @@ class GoogleCloudStorageConsistentOutputReprWriter(
         super(GoogleCloudStorageConsistentOutputReprWriter, self).write(data)
 
 
+class EventInputReader(input_readers.InputReader):
+    """Reads events from EventEntity rows and from compacted segments.
+
+    Map/reduce jobs over EventEntity use this reader in place of the
+    DatastoreInputReader, so that their map() sees the events moved into
+    EventSegmentEntity by compaction as EventEntity instances, just as it
+    sees the remaining rows.  Each shard wraps a DatastoreInputReader over
+    one of the two kinds.  Filters on recorded_on, source and user_id are
+    translated to the segments' day, sources and user_ids, and then applied
+    exactly to each unpacked event.  A slice may end part-way through a
+    segment; the segment and the number of its events read are saved so
+    the next slice carries on from there.
+    """
+
+    _OPERATORS = {
+        '=': operator.eq, '<': operator.lt, '<=': operator.le,
+        '>': operator.gt, '>=': operator.ge}
+
+    def __init__(self, reader, filters, segment_key=None, offset=0):
+        self._reader = reader
+        self._filters = filters or []
+        self._segment_key = segment_key
+        self._offset = offset
+
+    @classmethod
+    def _make_spec(cls, mapper_spec, entity_class, filters):
+        params = dict(mapper_spec.params)
+        params['entity_kind'] = '%s.%s' % (
+            entity_class.__module__, entity_class.__name__)
+        if filters:
+            params['filters'] = filters
+        else:
+            params.pop('filters', None)
+        return mapreduce_models.MapperSpec(
+            mapper_spec.handler_spec,
+            'mapreduce.input_readers.DatastoreInputReader', params,
+            mapper_spec.shard_count)
+
+    @classmethod
+    def _get_segment_filters(cls, filters):
+        segment_filters = []
+        for name, op, value in filters:
+            if name == 'recorded_on' and op in ('>', '>='):
+                segment_filters.append(
+                    ('day', '>=', models.EventSegmentEntity.get_day(value)))
+            elif name == 'recorded_on' and op in ('<', '<='):
+                segment_filters.append(('day', op, value))
+            elif name == 'source' and op == '=':
+                segment_filters.append(('sources', '=', value))
+            elif name == 'user_id' and op == '=':
+                segment_filters.append(('user_ids', '=', value))
+        return segment_filters
+
+    @classmethod
+    def split_input(cls, mapper_spec):
+        filters = mapper_spec.params.get('filters') or []
+        readers = []
+        for entity_class, reader_filters in (
+            (models.EventEntity, filters),
+            (models.EventSegmentEntity, cls._get_segment_filters(filters))):
+            readers += [
+                cls(reader, filters) for reader in
+                input_readers.DatastoreInputReader.split_input(
+                    cls._make_spec(mapper_spec, entity_class, reader_filters))
+                or []]
+        return readers
+
+    @classmethod
+    def validate(cls, mapper_spec):
+        input_readers.DatastoreInputReader.validate(cls._make_spec(
+            mapper_spec, models.EventEntity,
+            mapper_spec.params.get('filters')))
+
+    @classmethod
+    def from_json(cls, json):
+        return cls(
+            input_readers.DatastoreInputReader.from_json(json['reader']),
+            json['filters'], json['segment_key'], json['offset'])
+
+    def to_json(self):
+        return {
+            'reader': self._reader.to_json(),
+            'filters': self._filters,
+            'segment_key': self._segment_key,
+            'offset': self._offset}
+
+    def _matches(self, event):
+        for name, op, value in self._filters:
+            if not self._OPERATORS[op](getattr(event, name), value):
+                return False
+        return True
+
+    def _iter_segment(self, segment):
+        self._segment_key = str(segment.key())
+        for index, event in enumerate(segment.get_events()):
+            if index < self._offset:
+                continue
+            self._offset = index + 1
+            if self._matches(event):
+                yield event
+        self._segment_key = None
+        self._offset = 0
+
+    def __iter__(self):
+        if self._segment_key:
+            segment = models.EventSegmentEntity.get(self._segment_key)
+            if segment:
+                for event in self._iter_segment(segment):
+                    yield event
+        for item in self._reader:
+            if isinstance(item, models.EventSegmentEntity):
+                for event in self._iter_segment(item):
+                    yield event
+            else:
+                yield item
+
+    def __str__(self):
+        return 'EventInputReader(%s)' % self._reader
+
+
 class MapReduceJob(DurableJobBase):
 
     # The 'output' field in the DurableJobEntity representing a MapReduceJob
@@ -349,6 +589,10 @@ class MapReduceJob(DurableJobBase):
     _OUTPUT_KEY_RESULTS = 'results'
     _OUTPUT_KEY_ERROR = 'error'
 
+    # Whether a job over EventEntity also sees the events compacted into
+    # EventSegmentEntity; see EventInputReader.
+    READ_COMPACTED_EVENTS = True
+
     @staticmethod
     def build_output(root_pipeline_id, results_list, error=None):
         return transforms.dumps({
@@ -631,6 +875,12 @@ class MapReduceJob(DurableJobBase):
         entity_class_type = self.entity_class()
         entity_class_name = '%s.%s' % (entity_class_type.__module__,
                                        entity_class_type.__name__)
+        if (entity_class_type is models.EventEntity and
+            self.READ_COMPACTED_EVENTS):
+            # Also visit events compacted into segments.
+            input_reader_spec = 'models.jobs.EventInputReader'
+        else:
+            input_reader_spec = 'mapreduce.input_readers.DatastoreInputReader'
 
         # Build config parameters to make available to map framework
         # and individual mapper jobs.  Overwrite important parameters
@@ -659,8 +909,7 @@ class MapReduceJob(DurableJobBase):
                 self.__class__.__module__, self.__class__.__name__),
             'reducer_spec': '%s.%s.reduce' % (
                 self.__class__.__module__, self.__class__.__name__),
-            'input_reader_spec':
-                'mapreduce.input_readers.DatastoreInputReader',
+            'input_reader_spec': input_reader_spec,
             'output_writer_spec':
                 'models.jobs.GoogleCloudStorageConsistentOutputReprWriter',
             'mapper_params': self.mapper_params,
@@ -776,6 +1025,9 @@ class DurableJobEntity(entities.BaseEntity):
     status_code = db.IntegerProperty(indexed=False)
     output = db.TextProperty(indexed=False)
     sequence_num = db.IntegerProperty(indexed=False)
+    # Set only by ResumableJob while a run is in progress.
+    checkpoint = db.TextProperty(indexed=False)
+    percent_complete = db.IntegerProperty(indexed=False)
 
     @classmethod
     def _get_by_name(cls, name):
@@ -806,7 +1058,10 @@ class DurableJobEntity(entities.BaseEntity):
         job.status_code = status_code
         if output:
             job.output = output
+        if job.has_finished:
+            job.checkpoint = None
         job.put()
+        return True
 
     @classmethod
     def _create_job(cls, name):
@@ -820,6 +1075,8 @@ class DurableJobEntity(entities.BaseEntity):
         job.execution_time_sec = 0
         job.status_code = STATUS_CODE_QUEUED
         job.output = None
+        job.checkpoint = None
+        job.percent_complete = None
         if not job.sequence_num:
             job.sequence_num = 1
         else:
@@ -839,6 +1096,25 @@ class DurableJobEntity(entities.BaseEntity):
     def _fail_job(cls, name, sequence_num, output):
         return cls._update(name, sequence_num, STATUS_CODE_FAILED, output)
 
+    @classmethod
+    def _checkpoint_job(cls, name, sequence_num, checkpoint, percent_complete):
+        """Records progress of a running job; False if it is no longer ours."""
+        assert db.is_in_transaction()
+
+        job = DurableJobEntity._get_by_name(name)
+        if not job or job.sequence_num != sequence_num or job.has_finished:
+            logging.warning(
+                'Not saving checkpoint of job %s sequence number %d; job was '
+                'deleted, canceled or restarted.', name, sequence_num)
+            return False
+        now = datetime.datetime.utcnow()
+        job.execution_time_sec += long((now - job.updated_on).total_seconds())
+        job.updated_on = now
+        job.checkpoint = checkpoint
+        job.percent_complete = percent_complete
+        job.put()
+        return True
+
     @property
     def has_finished(self):
         return self.status_code in [STATUS_CODE_COMPLETED, STATUS_CODE_FAILED]
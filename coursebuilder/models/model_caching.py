@@ -89,13 +89,10 @@ class CacheFactory(object):
                 return cls.instance()._cache.total_size
 
             def __init__(self):
-                self._cache = caching.LRUCache(max_size_bytes=max_size_bytes)
-                self._cache.get_entry_size = self._get_entry_size
-
-            def _get_entry_size(self, key, value):
-                if not value:
-                    return 0
-                return sys.getsizeof(key) + sys.getsizeof(value)
+                # Entries wrap whole entities; count what they refer to.
+                self._cache = caching.LRUCache(
+                    max_size_bytes=max_size_bytes,
+                    sizer=caching.RecursiveSizer(), name=name)
 
             @property
             def cache(self):
@@ -24,6 +24,7 @@ import os
 import sys
 import time
 import webapp2
+import zlib
 
 import jinja2
 
@@ -38,6 +39,7 @@ import data_removal
 import messages
 import services
 import transforms
+import utils as models_utils
 
 import appengine_config
 from common import caching
@@ -63,9 +65,21 @@ DEFAULT_CACHE_TTL_SECS = 60 * 5
 MEMCACHE_MAX = (1000 * 1000 - 96 - 250)
 MEMCACHE_MULTI_MAX = 32 * 1000 * 1000
 
+# Events of one day are packed into this many EventSegmentEntity shards,
+# chosen by user, so removing a user's events rewrites few segments.
+EVENT_SEGMENT_SHARDS = 16
+
+# Compressed size above which a segment is split into further parts; well
+# under the 1MB limit on an entity.
+MAX_EVENT_SEGMENT_BYTES = 900 * 1000
+
 # Update frequency for Student.last_seen_on.
 STUDENT_LAST_SEEN_ON_UPDATE_SEC = 24 * 60 * 60  # 1 day.
 
+# How long page views may hold a student's last location and last-seen time in
+# memcache before they are written to the datastore.
+STUDENT_ACTIVITY_FLUSH_SEC = 15 * 60
+
 # Global memcache controls.
 CAN_USE_MEMCACHE = config.ConfigProperty(
     'gcb_can_use_memcache', bool, messages.SITE_SETTINGS_MEMCACHE,
@@ -99,6 +113,11 @@ CACHE_MISS_LOCAL = PerfCounter(
     'gcb-models-cache-miss-local',
     'A number of times an object was not found in local memcache.')
 
+# latency of calls to the memcache service, labeled by operation
+CACHE_LATENCY = counters.LatencyHistogram(
+    'gcb-models-cache-latency',
+    'Latency in milliseconds of memcache service calls.')
+
 # Intent for sending welcome notifications.
 WELCOME_NOTIFICATION_INTENT = 'welcome'
 
@@ -251,7 +270,8 @@ class MemcacheManager(object):
         if is_cached:
             return copy.deepcopy(value)
 
-        value = memcache.get(key, namespace=_namespace)
+        with CACHE_LATENCY.timer('get'):
+            value = memcache.get(key, namespace=_namespace)
 
         # We store some objects in memcache that don't evaluate to True, but are
         # real objects, '{}' for example. Count a cache miss only in a case when
@@ -276,7 +296,8 @@ class MemcacheManager(object):
         if is_cached:
             return values
 
-        values = memcache.get_multi(keys, namespace=_namespace)
+        with CACHE_LATENCY.timer('get_multi'):
+            values = memcache.get_multi(keys, namespace=_namespace)
         for key, value in values.items():
             if value is not None:
                 CACHE_HIT.inc()
@@ -301,7 +322,8 @@ class MemcacheManager(object):
                 else:
                     CACHE_PUT.inc()
                     _namespace = cls._get_namespace(namespace)
-                    memcache.set(key, value, ttl, namespace=_namespace)
+                    with CACHE_LATENCY.timer('set'):
+                        memcache.set(key, value, ttl, namespace=_namespace)
                     cls._local_cache_put(key, _namespace, value)
         except:  # pylint: disable=bare-except
             logging.exception(
@@ -323,7 +345,9 @@ class MemcacheManager(object):
                 else:
                     CACHE_PUT.inc()
                     _namespace = cls._get_namespace(namespace)
-                    memcache.set_multi(mapping, time=ttl, namespace=_namespace)
+                    with CACHE_LATENCY.timer('set_multi'):
+                        memcache.set_multi(
+                            mapping, time=ttl, namespace=_namespace)
                     cls._local_cache_put_multi(mapping, _namespace)
         except:  # pylint: disable=bare-except
             logging.exception(
@@ -352,9 +376,10 @@ class MemcacheManager(object):
     def incr(cls, key, delta, namespace=None):
         """Incr an item in memcache if memcache is enabled."""
         if CAN_USE_MEMCACHE.value:
-            memcache.incr(
+            return memcache.incr(
                 key, delta,
                 namespace=cls._get_namespace(namespace), initial_value=0)
+        return None
 
 
 CAN_AGGREGATE_COUNTERS = config.ConfigProperty(
@@ -378,8 +403,40 @@ def get_counter_global_value(name):
     else:
         return None
 
+def _histogram_bucket_key(name, label, index):
+    return 'histogram:%s:%s:%s' % (name, label, index)
+
+
+def incr_histogram_global_values(name, deltas):
+    if not CAN_AGGREGATE_COUNTERS.value or not CAN_USE_MEMCACHE.value:
+        return
+    mapping = {}
+    for label, buckets in deltas.iteritems():
+        for index, delta in enumerate(buckets):
+            if delta:
+                mapping[_histogram_bucket_key(name, label, index)] = delta
+    memcache.offset_multi(
+        mapping, namespace=appengine_config.DEFAULT_NAMESPACE_NAME,
+        initial_value=0)
+
+
+def get_histogram_global_values(name, labels):
+    if not CAN_AGGREGATE_COUNTERS.value or not CAN_USE_MEMCACHE.value:
+        return None
+    num_buckets = len(counters.HISTOGRAM_BUCKET_BOUNDS_MS) + 1
+    keys = [_histogram_bucket_key(name, label, index)
+            for label in labels for index in xrange(num_buckets)]
+    values = memcache.get_multi(
+        keys, namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+    return dict(
+        (label, [values.get(_histogram_bucket_key(name, label, index), 0)
+                 for index in xrange(num_buckets)])
+        for label in labels)
+
 counters.get_counter_global_value = get_counter_global_value
 counters.incr_counter_global_value = incr_counter_global_value
+counters.get_histogram_global_values = get_histogram_global_values
+counters.incr_histogram_global_values = incr_histogram_global_values
 
 DEPRECATED_CAN_SHARE_STUDENT_PROFILE = config.ConfigProperty(
     'gcb_can_share_student_profile', bool, '', default_value=False,
@@ -1433,6 +1490,11 @@ class Student(BaseEntity):
     # Group ID of group in which student is a member; can be None.
     group_id = db.IntegerProperty(indexed=True)
 
+    # Callbacks run with (student, assessment_type, old_score, new_score)
+    # after the transaction changing a student's stored score commits.
+    # old_score is None if the student had no score for the assessment.
+    POST_UPDATE_SCORE_HOOKS = []
+
     # In CB 1.8 and below an email was used as a key_name. This is no longer
     # true and a user_id is the key_name. We transparently support legacy
     # Student entity instances that still have email as key_name, but we no
@@ -1668,13 +1730,22 @@ class EventEntity(BaseEntity):
     the event. The event 'data' is a JSON object, the format of which is defined
     elsewhere and depends on the type of the event.
 
+    Events older than a few weeks may have been moved into EventSegmentEntity
+    by compaction; use iter_events() rather than querying this table to see
+    all of them.  Map/reduce jobs over this class see both automatically.
+
     When extending this class, be sure to register your new class with
     models.data_removal.Registry so that instances can be cleaned up on user
     un-registration.
     """
     recorded_on = db.DateTimeProperty(auto_now_add=True, indexed=True)
     source = db.StringProperty(indexed=False)
-    user_id = db.StringProperty(indexed=False)
+    user_id = db.StringProperty(indexed=True)
+
+    # The source and the day it was recorded, as made by make_source_day(),
+    # so that the events of one kind over a range of days can be found
+    # without a scan of the whole table.
+    source_day = db.StringProperty(indexed=True)
 
     # Each of the following is a string representation of a JSON dict.
     data = db.TextProperty(indexed=False)
@@ -1695,6 +1766,10 @@ class EventEntity(BaseEntity):
                     'Event record hook failed: %s, %s, %s',
                     source, user.user_id(), data_dict)
 
+    @classmethod
+    def make_source_day(cls, source, recorded_on):
+        return '%s:%s' % (source, recorded_on.strftime('%Y-%m-%d'))
+
     @classmethod
     def record(cls, source, user, data, user_id=None):
         """Records new event into a datastore."""
@@ -1703,11 +1778,35 @@ class EventEntity(BaseEntity):
         data = transforms.dumps(data_dict)
 
         event = cls()
+        event.recorded_on = datetime.datetime.utcnow()
         event.source = source
+        event.source_day = cls.make_source_day(source, event.recorded_on)
         event.user_id = user_id if user_id else user.user_id()
         event.data = data
         event.put()
 
+    @classmethod
+    def iter_events(cls, since=None, until=None):
+        """Yields events recorded in [since, until), compacted or not."""
+        query = EventSegmentEntity.all()
+        if since:
+            query.filter('day >=', EventSegmentEntity.get_day(since))
+        if until:
+            query.filter('day <', until)
+        for segment in caching.iter_all(query):
+            for event in segment.get_events():
+                if ((not since or event.recorded_on >= since) and
+                    (not until or event.recorded_on < until)):
+                    yield event
+
+        query = cls.all()
+        if since:
+            query.filter('recorded_on >=', since)
+        if until:
+            query.filter('recorded_on <', until)
+        for event in caching.iter_all(query):
+            yield event
+
     def for_export(self, transform_fn):
         model = super(EventEntity, self).for_export(transform_fn)
         model.user_id = transform_fn(self.user_id)
@@ -1718,17 +1817,277 @@ class EventEntity(BaseEntity):
         return [self.user_id]
 
 
+_UNIX_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _datetime_to_usec(when):
+    delta = when - _UNIX_EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _usec_to_datetime(usec):
+    return _UNIX_EPOCH + datetime.timedelta(microseconds=usec)
+
+
+class EventSegmentEntity(BaseEntity):
+    """Events of one day and shard, packed together and compressed.
+
+    Compaction moves events older than a few weeks out of EventEntity, where
+    each event is a row with its own index entries, into these rows.  Each
+    is keyed by day, shard and part, as made by make_key_name().  The events
+    are held in 'data' as a zlib-compressed JSON list of [id_or_name,
+    recorded_on, source, user_id, data] lists, with recorded_on in
+    microseconds since the epoch.
+
+    The sources and users of the packed events are indexed, so the segments
+    holding one kind of event on a given day, or a given user's events, can
+    be found without unpacking anything.
+    """
+
+    # Midnight UTC at the start of the day of the events.
+    day = db.DateTimeProperty(indexed=True)
+    sources = db.StringListProperty(indexed=True)
+    user_ids = db.StringListProperty(indexed=True)
+    event_count = db.IntegerProperty(indexed=False)
+    data = db.BlobProperty(indexed=False)
+
+    # User IDs are packed in data, so it must never be exported.
+    _PROPERTY_EXPORT_BLACKLIST = [data]
+
+    @classmethod
+    def get_day(cls, when):
+        return datetime.datetime.combine(when.date(), datetime.time())
+
+    @classmethod
+    def get_shard(cls, user_id):
+        return (zlib.crc32(user_id or '') & 0xffffffff) % EVENT_SEGMENT_SHARDS
+
+    @classmethod
+    def make_key_name(cls, day, shard, part):
+        return '%s:%02d:%d' % (day.strftime('%Y-%m-%d'), shard, part)
+
+    @classmethod
+    def get_parts(cls, day, shard):
+        """Gets all existing parts of one shard of one day, in order."""
+        parts = []
+        while True:
+            segment = cls.get_by_key_name(
+                cls.make_key_name(day, shard, len(parts)))
+            if not segment:
+                return parts
+            parts.append(segment)
+
+    @classmethod
+    def _event_to_row(cls, event):
+        return [
+            event.key().id_or_name(),
+            _datetime_to_usec(event.recorded_on),
+            event.source, event.user_id, event.data]
+
+    def get_rows(self):
+        if not self.data:
+            return []
+        return transforms.loads(zlib.decompress(self.data))
+
+    def set_rows(self, rows):
+        self.data = zlib.compress(transforms.dumps(rows))
+        self.event_count = len(rows)
+        self.sources = sorted(set(row[2] for row in rows if row[2]))
+        self.user_ids = sorted(set(row[3] for row in rows if row[3]))
+
+    def get_events(self):
+        """Unpacks the events as (unsaved) EventEntity instances."""
+        for id_or_name, recorded_on, source, user_id, data in self.get_rows():
+            recorded_on = _usec_to_datetime(recorded_on)
+            yield EventEntity(
+                key=db.Key.from_path(EventEntity.kind(), id_or_name),
+                recorded_on=recorded_on, source=source, user_id=user_id,
+                source_day=EventEntity.make_source_day(source, recorded_on),
+                data=data)
+
+    @classmethod
+    def add_events(cls, events):
+        """Packs events into segments and saves them; returns those written.
+
+        Events already present in a segment, as seen by their keys, are not
+        added again, so a compaction that failed between writing segments
+        and deleting the original events can simply be re-run.
+        """
+        by_shard = collections.defaultdict(list)
+        for event in events:
+            day = cls.get_day(event.recorded_on)
+            by_shard[(day, cls.get_shard(event.user_id))].append(event)
+
+        written = []
+        for (day, shard), shard_events in by_shard.iteritems():
+            parts = cls.get_parts(day, shard)
+            # The last part is checked again when it is rewritten.
+            present = set()
+            for part in parts[:-1]:
+                present.update(row[0] for row in part.get_rows())
+            rows = [
+                cls._event_to_row(event) for event in shard_events
+                if event.key().id_or_name() not in present]
+            if rows:
+                written += cls._append_rows(
+                    day, shard, max(len(parts) - 1, 0), rows)
+        return written
+
+    @classmethod
+    def _append_rows(cls, day, shard, last_part, rows):
+        """Adds rows to the last part of a shard, and to new parts after it.
+
+        The last part is read, extended and written in a transaction, so that
+        this cannot undo a remove_user_ids() made in the meantime.  Parts
+        that overflow it are new, and are written afterwards; if that fails,
+        their events are still in EventEntity and are added on the next run.
+        """
+        def append_in_txn():
+            last = cls.get_by_key_name(
+                cls.make_key_name(day, shard, last_part))
+            old_rows = last.get_rows() if last else []
+            present = set(row[0] for row in old_rows)
+            new_rows = [row for row in rows if row[0] not in present]
+            if not new_rows:
+                return []
+            segments = cls._pack(day, shard, last_part, old_rows + new_rows)
+            segments[0].put()
+            return segments
+
+        segments = db.run_in_transaction(append_in_txn)
+        put(segments[1:])
+        return segments
+
+    @classmethod
+    def _pack(cls, day, shard, first_part, rows):
+        """Packs rows into as many parts as needed to fit size limits."""
+        segment = cls(key_name=cls.make_key_name(day, shard, first_part),
+                      day=day)
+        segment.set_rows(rows)
+        if len(segment.data) <= MAX_EVENT_SEGMENT_BYTES or len(rows) < 2:
+            return [segment]
+        half = len(rows) // 2
+        head = cls._pack(day, shard, first_part, rows[:half])
+        return head + cls._pack(
+            day, shard, first_part + len(head), rows[half:])
+
+    @classmethod
+    def delete_by_user_id(cls, user_id):
+        """Removes a user's events from every segment that holds any."""
+        for segment in cls.all().filter('user_ids =', user_id).run():
+            segment.remove_user_ids([user_id])
+
+    def remove_user_ids(self, user_ids):
+        """Removes the events of the given users from this segment.
+
+        Used in place of deleting the segment, which also holds other
+        users' events.  The segment is re-read and
+        rewritten in a transaction, so that events appended by a compaction
+        in the meantime are kept.
+        """
+        user_ids = set(user_ids)
+
+        def remove_in_txn():
+            segment = db.get(self.key())
+            if not segment:
+                return
+            rows = segment.get_rows()
+            kept = [row for row in rows if row[3] not in user_ids]
+            if len(kept) != len(rows):
+                # An emptied part is kept rather than deleted, so that
+                # get_parts() still finds any later parts of its shard.
+                segment.set_rows(kept)
+                segment.put()
+
+        db.run_in_transaction(remove_in_txn)
+
+    def for_export(self, transform_fn):
+        model = super(EventSegmentEntity, self).for_export(transform_fn)
+        model.user_ids = [transform_fn(user_id) for user_id in self.user_ids]
+        return model
+
+    def get_user_ids(self):
+        return self.user_ids
+
+
 class StudentAnswersEntity(BaseEntity):
-    """Student answers to the assessments."""
+    """Student answers to the assessments.
+
+    Each entity holds one student's answers to one assessment and is keyed by
+    the string STUDENT_ID-ASSESSMENT_NAME.  Older entities are keyed by the
+    student ID alone and hold the answers to every assessment; set_answers()
+    splits them up the first time the student submits again.  In both forms
+    data maps assessment names to answers.
+    """
 
     updated_on = db.DateTimeProperty(indexed=True)
 
     # Each of the following is a string representation of a JSON dict.
     data = db.TextProperty(indexed=False)
 
+    @classmethod
+    def create_key(cls, student_id, assessment_name):
+        return '%s-%s' % (student_id, assessment_name)
+
     @classmethod
     def safe_key(cls, db_key, transform_fn):
-        return db.Key.from_path(cls.kind(), transform_fn(db_key.id_or_name()))
+        user_id, separator, assessment_name = db_key.name().partition('-')
+        return db.Key.from_path(
+            cls.kind(), transform_fn(user_id) + separator + assessment_name)
+
+    @classmethod
+    def _create(cls, student_id, assessment_name, answers, updated_on):
+        entity = cls(key_name=cls.create_key(student_id, assessment_name))
+        entity.updated_on = updated_on
+        models_utils.set_answer(entity, assessment_name, answers)
+        return entity
+
+    @classmethod
+    def _create_if_missing(
+        cls, student_id, assessment_name, answers, updated_on):
+        def create_in_txn():
+            if not cls.get_by_key_name(
+                    cls.create_key(student_id, assessment_name)):
+                cls._create(
+                    student_id, assessment_name, answers, updated_on).put()
+        db.run_in_transaction(create_in_txn)
+
+    @classmethod
+    def set_answers(cls, student_id, assessment_name, answers):
+        """Stores a student's answers to an assessment, replacing earlier ones.
+
+        Only the entity for this assessment is written, unless the student
+        still has a combined entity from before answers were stored per
+        assessment; that is then split up and deleted.  Each part of the split
+        is created in its own transaction, and only if the student has no
+        entity for that assessment yet, so answers submitted since are never
+        replaced by older ones, even if two splits overlap or one is retried
+        after failing part way.
+        """
+        put([cls._create(
+            student_id, assessment_name, answers, datetime.datetime.now())])
+        combined = cls.get_by_key_name(student_id)
+        if not combined:
+            return
+        if combined.data:
+            for name, old_answers in transforms.loads(combined.data).items():
+                if name != assessment_name:
+                    cls._create_if_missing(
+                        student_id, name, old_answers, combined.updated_on)
+        combined.delete()
+
+    @classmethod
+    def get_answers(cls, student_id, assessment_name):
+        """Returns a student's stored answers to an assessment, or None."""
+        for entity in get([
+                db.Key.from_path(
+                    cls.kind(), cls.create_key(student_id, assessment_name)),
+                db.Key.from_path(cls.kind(), student_id)]):
+            if entity and entity.data:
+                answers = transforms.loads(entity.data)
+                if assessment_name in answers:
+                    return answers[assessment_name]
+        return None
 
 
 class StudentPropertyEntity(BaseEntity):
@@ -1972,7 +2331,9 @@ class BaseJsonDao(object):
                 if NO_OBJECT == entity:
                     ret.append(None)
                 else:
-                    ret.append(cls.DTO(obj_id, transforms.loads(entity.data)))
+                    dto = cls.DTO(obj_id, transforms.loads(entity.data))
+                    ret.append(dto)
+                    dtos_for_post_hooks.append(dto)
 
         # run hooks
         cls._maybe_apply_post_load_hooks(dtos_for_post_hooks)
@@ -2707,7 +3068,13 @@ class StudentPreferencesDAO(BaseJsonDao):
         user = users.get_current_user()
         if not user:
             return None
-        user_id = user.user_id()
+        prefs = cls.load_or_default_by_user_id(user.user_id())
+        StudentActivityBuffer.merge_preferences(prefs)
+        return prefs
+
+    @classmethod
+    def load_or_default_by_user_id(cls, user_id):
+        """Loads stored preferences, without any buffered changes."""
         prefs = cls.load(user_id)
         if not prefs:
             prefs = StudentPreferencesDTO(
@@ -2719,6 +3086,140 @@ class StudentPreferencesDAO(BaseJsonDao):
         return prefs
 
 
+class StudentActivityBuffer(object):
+    """Buffers the soft-state writes that ordinary page views make.
+
+    Every page view moves a student's last location, and the first view of a
+    day moves their last-seen time.  Neither has to reach the datastore right
+    away, so both are kept in memcache, in one entry per student, and written
+    out by a cron job.  An entry older than STUDENT_ACTIVITY_FLUSH_SEC is
+    written out by the student's next page view instead, in case the cron job
+    has fallen behind.  StudentPreferencesDAO.load_or_default() merges the
+    buffered location in.
+
+    So that the cron job can find them, new entries are listed under numbers
+    handed out by a memcache counter; the job remembers how far down the list
+    it has got.  Memcache may drop any of this, which costs at most a few
+    minutes of soft state: the next page view records it again.
+
+    When memcache is turned off, values are written through as they change.
+    """
+
+    ENTRY_KEY = 'student-activity:%s'
+    PENDING_KEY = 'student-activity-pending:%s'
+    PENDING_COUNT_KEY = 'student-activity-pending-count'
+    FLUSHED_COUNT_KEY = 'student-activity-flushed-count'
+    ENTRY_TTL_SEC = 4 * STUDENT_ACTIVITY_FLUSH_SEC
+    FLUSH_BATCH_SIZE = 500
+
+    @classmethod
+    def is_enabled(cls):
+        return CAN_USE_MEMCACHE.value
+
+    @classmethod
+    def _get_entry(cls, user_id):
+        return MemcacheManager.get(cls.ENTRY_KEY % user_id)
+
+    @classmethod
+    def _record(cls, user_id, entry, name, value):
+        now = datetime.datetime.utcnow()
+        if entry is None:
+            entry = {'buffered_on': now}
+            number = MemcacheManager.incr(cls.PENDING_COUNT_KEY, 1)
+            if number:
+                MemcacheManager.set(
+                    cls.PENDING_KEY % number, user_id, ttl=cls.ENTRY_TTL_SEC)
+        entry[name] = value
+        age = now - entry['buffered_on']
+        if age.total_seconds() > STUDENT_ACTIVITY_FLUSH_SEC:
+            cls._write(user_id, entry)
+            MemcacheManager.delete(cls.ENTRY_KEY % user_id)
+        else:
+            MemcacheManager.set(
+                cls.ENTRY_KEY % user_id, entry, ttl=cls.ENTRY_TTL_SEC)
+
+    @classmethod
+    def _write(cls, user_id, entry):
+        location = entry.get('last_location')
+        if location:
+            prefs = StudentPreferencesDAO.load_or_default_by_user_id(user_id)
+            if prefs.last_location != location:
+                prefs.last_location = location
+                StudentPreferencesDAO.save(prefs)
+        last_seen_on = entry.get('last_seen_on')
+        if last_seen_on:
+            student = Student.get_by_user_id(user_id)
+            if student:
+                student.update_last_seen_on(value=last_seen_on)
+
+    @classmethod
+    def record_last_location(cls, prefs, location):
+        """Sets prefs.last_location, buffering the write when it changes."""
+        if prefs.last_location == location:
+            return
+        prefs.last_location = location
+        if not cls.is_enabled():
+            StudentPreferencesDAO.save(prefs)
+            return
+        cls._record(
+            prefs.id, cls._get_entry(prefs.id), 'last_location', location)
+
+    @classmethod
+    def record_last_seen_on(cls, student):
+        """Notes that the student was seen now, buffering any write."""
+        if not cls.is_enabled():
+            student.update_last_seen_on()
+            return
+        now = datetime.datetime.utcnow()
+        entry = cls._get_entry(student.user_id)
+        last_seen_on = (entry or {}).get('last_seen_on') or student.last_seen_on
+        if last_seen_on and (
+                (now - last_seen_on).total_seconds() <=
+                STUDENT_LAST_SEEN_ON_UPDATE_SEC):
+            return
+        cls._record(student.user_id, entry, 'last_seen_on', now)
+
+    @classmethod
+    def merge_preferences(cls, prefs):
+        if not prefs or not cls.is_enabled():
+            return
+        entry = cls._get_entry(prefs.id)
+        if entry and entry.get('last_location'):
+            prefs.last_location = entry['last_location']
+
+    @classmethod
+    def flush(cls):
+        """Writes out all entries buffered in the current namespace.
+
+        Returns:
+          The number of students whose entries were written out.
+        """
+        if not cls.is_enabled():
+            return 0
+        count = MemcacheManager.get(cls.PENDING_COUNT_KEY) or 0
+        flushed = MemcacheManager.get(cls.FLUSHED_COUNT_KEY) or 0
+        if flushed > count:
+            # The counter was evicted and has started again from zero.
+            flushed = 0
+
+        num_written = 0
+        for start in xrange(flushed + 1, count + 1, cls.FLUSH_BATCH_SIZE):
+            end = min(start + cls.FLUSH_BATCH_SIZE, count + 1)
+            user_ids = MemcacheManager.get_multi(
+                [cls.PENDING_KEY % number for number in xrange(start, end)])
+            entry_keys = dict(
+                (cls.ENTRY_KEY % user_id, user_id)
+                for user_id in user_ids.values() if user_id)
+            entries = MemcacheManager.get_multi(entry_keys.keys())
+            for key, entry in entries.iteritems():
+                if entry:
+                    cls._write(entry_keys[key], entry)
+                    num_written += 1
+            MemcacheManager.delete_multi(entries.keys())
+            MemcacheManager.set(cls.FLUSHED_COUNT_KEY, end - 1, ttl=0)
+        return num_written
+
+
 class RoleEntity(BaseEntity):
     data = db.TextProperty(indexed=False)
 
@@ -2763,9 +3264,10 @@ def register_for_data_removal():
         StudentProfileDAO.delete_profile_by_user_id)
     removers = [
         Student.delete_by_user_id,
-        StudentAnswersEntity.delete_by_key,
+        StudentAnswersEntity.delete_by_user_id_prefix,
         StudentPropertyEntity.delete_by_user_id_prefix,
         StudentPreferencesEntity.delete_by_key,
+        EventSegmentEntity.delete_by_user_id,
     ]
     for remover in removers:
         data_removal.Registry.register_indexed_by_user_id_remover(remover)
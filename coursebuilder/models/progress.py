@@ -99,9 +99,16 @@ class UnitLessonCompletionTracker(object):
         EVENT_CODE_MAPPING['html'],
         EVENT_CODE_MAPPING['custom_unit']
     ]
+    # Leaf events that are counted, but whose counts are only ever checked
+    # for being non-zero; assessment counts, by contrast, record attempts.
+    COMPLETION_ONLY_EVENTS = frozenset(['block', 'component'])
 
     POST_UPDATE_PROGRESS_HOOK = []
 
+    # Callbacks run with (course, student, old_value, new_value) after a
+    # changed progress entity is saved; the values are its JSON strings.
+    POST_SAVE_PROGRESS_HOOK = []
+
     def __init__(self, course):
         self._course = course
         self._progress_by_user_id = {}
@@ -655,9 +662,12 @@ class UnitLessonCompletionTracker(object):
         current_state = self._get_entity_value(progress, event_key)
         if current_state == state or current_state == self.COMPLETED_STATE:
             return
+        old_value = progress.value
         self._set_entity_value(progress, event_key, state)
         progress.updated_on = datetime.datetime.now()
         progress.put()
+        utils.run_hooks(self.POST_SAVE_PROGRESS_HOOK, self._get_course(),
+                        student, old_value, progress.value)
 
     UPDATER_MAPPING = {
         'activity': _update_activity,
@@ -815,12 +825,18 @@ class UnitLessonCompletionTracker(object):
             return
 
         progress = self.get_or_create_progress(student)
+        old_value = progress.value
 
         self._update_event(
             student, progress, event_entity, event_key, direct_update=True)
 
+        # Revisits of completed content are most events, and change nothing.
+        if progress.value == old_value:
+            return
         progress.updated_on = datetime.datetime.now()
         progress.put()
+        utils.run_hooks(self.POST_SAVE_PROGRESS_HOOK, self._get_course(),
+                        student, old_value, progress.value)
 
     def _update_event(self, student, progress, event_entity, event_key,
                       direct_update=False):
@@ -834,18 +850,27 @@ class UnitLessonCompletionTracker(object):
           direct_update: True if this event is being updated explicitly; False
               if it is being auto-updated.
         """
+        old_state = self._get_entity_value(progress, event_key)
         if direct_update or event_entity not in self.UPDATER_MAPPING:
             if event_entity in self.UPDATER_MAPPING:
                 # This is a derived event, so directly mark it as completed.
                 self._set_entity_value(
                     progress, event_key, self.COMPLETED_STATE)
+            elif event_entity in self.COMPLETION_ONLY_EVENTS and old_state:
+                # Only ever read as done or not done, so completing it again
+                # changes nothing.
+                pass
             else:
                 # This is not a derived event, so increment its counter by one.
                 self._inc(progress, event_key)
         else:
             self.UPDATER_MAPPING[event_entity](self, progress, event_key)
 
-        if event_entity in self.DERIVED_EVENTS:
+        if self._get_entity_value(progress, event_key) == old_state:
+            # The state of containers is derived from the state of what they
+            # contain, so if this did not change, neither can they.
+            pass
+        elif event_entity in self.DERIVED_EVENTS:
             for derived_event in self.DERIVED_EVENTS[event_entity]:
                 parent_event_key = derived_event['generate_parent_id'](
                     event_key)
@@ -1058,6 +1083,8 @@ class UnitLessonCompletionTracker(object):
         except (AttributeError, TypeError):
             progress_dict = {}
 
+        if key in progress_dict and progress_dict[key] == value:
+            return
         progress_dict[key] = value
         student_property.value = transforms.dumps(progress_dict)
 
@@ -122,6 +122,29 @@ class Notifications(Service):
         """
         raise NotImplementedError()
 
+    def send_many(self, messages, sender, intent, retention_policy=None):
+        """Asynchronously sends a notification via email to many recipients.
+
+        Args:
+          messages: list of dict. One per recipient, with 'to', 'body' and
+              'subject' entries, and optionally 'html' and 'audit_trail', each
+              as described for send_async(). Recipients must be unique.
+          sender: string. As for send_async(); used for every message.
+          intent: string. As for send_async(); used for every message.
+          retention_policy: RetentionPolicy. As for send_async(); used for
+              every message.
+
+        Returns:
+          List of (notification_key, payload_key) 2-tuples, in the order of
+          messages.
+
+        Raises:
+          Exception: if values delegated to model initializers are invalid.
+          ValueError: if sender or any recipient is malformed according to App
+              Engine, or if a recipient is repeated.
+        """
+        raise NotImplementedError()
+
 
 class Unsubscribe(Service):
 
@@ -20,8 +20,12 @@ __author__ = [
 ]
 
 import logging
+import time
+
 import transforms
 
+from google.appengine.ext import db
+
 _LOG = logging.getLogger('models.utils')
 logging.basicConfig()
 
@@ -39,6 +43,10 @@ class QueryMapper(object):
 
     QueryMapper works with result sets larger than 1000.
 
+    By default the next batch is requested from the datastore before the
+    current batch is handed to the map function, so datastore latency overlaps
+    with the work done in the map function.
+
     Usage:
 
         def map_fn(model, named_arg, keyword_arg=None):
@@ -51,19 +59,31 @@ class QueryMapper(object):
         mapper.run(map_fn, 'foo', keyword_arg='bar')
     """
 
-    def __init__(self, query, batch_size=20, counter=None, report_every=None):
+    def __init__(self, query, batch_size=20, counter=None, report_every=None,
+                 prefetch=True, target_batch_secs=None, max_batch_size=None):
         """Constructs a new QueryMapper.
 
         Args:
             query: db.Query. The query to run. Cannot be reused after the
                 query mapper's run() method is invoked.
-            batch_size: int. Number of results to fetch per batch.
+            batch_size: int. Number of results to fetch per batch. When
+                target_batch_secs is given, this is the size of the first
+                batch only.
             counter: entities.PerfCounter or None. If given, the counter to
                 increment once for every entity retrieved by query.
             report_every: int or None. If specified, every report_every results
                 we will log the number of results processed at level info. By
                 default we will do this every 10 batches. Set to 0 to disable
                 logging.
+            prefetch: boolean. If True, the datastore RPC for the next batch is
+                issued before the current batch is mapped. Set to False when
+                the map function changes entities that a later batch of the
+                same query would return and must see those changes.
+            target_batch_secs: float or None. If given, the batch size adapts
+                to the observed per-result cost of the map function so that
+                mapping one batch takes roughly this many seconds.
+            max_batch_size: int or None. Upper bound for the adaptive batch
+                size; defaults to _MAX_ADAPTIVE_BATCH_SIZE.
         """
         if report_every is None:
             report_every = 10 * batch_size
@@ -72,6 +92,9 @@ class QueryMapper(object):
         self._counter = counter
         self._query = query
         self._report_every = report_every
+        self._prefetch = prefetch
+        self._target_batch_secs = target_batch_secs
+        self._max_batch_size = max_batch_size or _MAX_ADAPTIVE_BATCH_SIZE
 
     def run(self, fn, *fn_args, **fn_kwargs):
         """Runs the query in batches, applying a function to each result.
@@ -88,47 +111,237 @@ class QueryMapper(object):
             Integer. Total number of results processed.
         """
         total_count = 0
-        cursor = None
+        reported_count = 0
+        batches = _BatchIterator(
+            self._query, self._batch_size, prefetch=self._prefetch)
 
-        while True:
-            batch_count, cursor = self._handle_batch(
-                cursor, fn, *fn_args, **fn_kwargs)
+        for batch in batches:
+            if self._counter:
+                self._counter.inc(increment=len(batch))
 
+            start = time.time()
+            batch_count, stopped = _map_batch(batch, fn, fn_args, fn_kwargs)
             total_count += batch_count
-
-            if not (batch_count and cursor):
+            if stopped:
                 return total_count
-
-            if self._report_every != 0 and not total_count % self._report_every:
+            if self._target_batch_secs:
+                batches.batch_size = _adapt_batch_size(
+                    batches.batch_size, batch_count, time.time() - start,
+                    self._target_batch_secs, self._max_batch_size)
+
+            if (self._report_every and
+                total_count // self._report_every >
+                reported_count // self._report_every):
+                reported_count = total_count
                 _LOG.info(
                     'Models processed by %s.%s so far: %s',
                     fn.__module__, fn.func_name, total_count)
 
-    def _handle_batch(self, cursor, fn, *fn_args, **fn_kwargs):
-        if cursor:
-            self._query.with_cursor(start_cursor=cursor)
+        return total_count
+
+
+class ShardedQueryMapper(object):
+    """Maps a function over a kind split into key ranges mapped concurrently.
+
+    The key space of the query's kind is split into at most num_shards ranges
+    using the datastore's __scatter__ sampling, the same technique the
+    mapreduce library uses to pick its input splits. One query per range is
+    kept in flight at all times, so up to num_shards datastore RPCs overlap
+    with each other and with the map function. The map function itself runs
+    on the calling thread, one result at a time, so it needs no locking.
+
+    Because each shard adds a filter on __key__, the query produced by
+    query_factory must not carry sort orders or inequality filters on other
+    properties.
+
+    Usage:
+
+        mapper = ShardedQueryMapper(MyModel.all, num_shards=8, deadline_secs=60)
+        mapper.run(map_fn, 'foo', keyword_arg='bar')
+        if not mapper.complete:
+            [...]  # The deadline was hit; schedule a follow-up.
+    """
+
+    def __init__(self, query_factory, num_shards=4, batch_size=20,
+                 counter=None, deadline_secs=None, oversampling_factor=32):
+        """Constructs a new ShardedQueryMapper.
+
+        Args:
+            query_factory: callable. Takes no arguments and returns a new
+                db.Query over a single kind each time it is called.
+            num_shards: int. Maximum number of key ranges mapped concurrently.
+            batch_size: int. Number of results to fetch per batch and shard.
+            counter: entities.PerfCounter or None. If given, the counter to
+                increment once for every entity retrieved.
+            deadline_secs: float or None. If given, stop starting new batches
+                once this many seconds have elapsed since run() was called;
+                complete is then False.
+            oversampling_factor: int. Number of __scatter__ samples taken per
+                shard when picking split points.
+        """
+        self._query_factory = query_factory
+        self._num_shards = max(1, num_shards)
+        self._batch_size = batch_size
+        self._counter = counter
+        self._deadline_secs = deadline_secs
+        self._oversampling_factor = oversampling_factor
+        self.complete = False
+
+    def get_split_keys(self):
+        """Returns sorted list of db.Key bounding the shards' key ranges."""
+        if self._num_shards == 1:
+            return []
+        # pylint: disable=protected-access
+        query = db.Query(self._query_factory()._model_class, keys_only=True)
+        query.order('__scatter__')
+        samples = sorted(query.fetch(
+            self._num_shards * self._oversampling_factor))
+        if not samples:
+            return []
+        stride = len(samples) / float(self._num_shards)
+        split_keys = []
+        for index in xrange(1, self._num_shards):
+            key = samples[int(index * stride)]
+            if not split_keys or split_keys[-1] != key:
+                split_keys.append(key)
+        return split_keys
+
+    def _make_shard_queries(self):
+        bounds = [None] + self.get_split_keys() + [None]
+        queries = []
+        for start_key, end_key in zip(bounds, bounds[1:]):
+            query = self._query_factory()
+            if start_key is not None:
+                query.filter('__key__ >=', start_key)
+            if end_key is not None:
+                query.filter('__key__ <', end_key)
+            queries.append(query)
+        return queries
+
+    def run(self, fn, *fn_args, **fn_kwargs):
+        """Runs all shards, applying a function to each result.
+
+        Args:
+            fn: function. Takes a single query result as its first arg, then
+                any number of positional and keyword arguments.
+            *fn_args: positional args delegated to fn.
+            **fn_kwargs: keyword args delegated to fn.
+
+        Returns:
+            Integer. Total number of results processed.
+        """
+        start = time.time()
+        self.complete = False
+        total_count = 0
+        active = [
+            _BatchIterator(query, self._batch_size)
+            for query in self._make_shard_queries()]
+        for batches in active:
+            batches.start()
+
+        while active:
+            if (self._deadline_secs is not None and
+                time.time() - start > self._deadline_secs):
+                _LOG.info(
+                    'Deadline reached with %s shards pending; models '
+                    'processed by %s.%s: %s', len(active), fn.__module__,
+                    fn.func_name, total_count)
+                return total_count
 
-        count = 0
-        empty = True
+            for batches in list(active):
+                try:
+                    batch = batches.next()
+                except StopIteration:
+                    active.remove(batches)
+                    continue
+                if self._counter:
+                    self._counter.inc(increment=len(batch))
+                batch_count, stopped = _map_batch(
+                    batch, fn, fn_args, fn_kwargs)
+                total_count += batch_count
+                if stopped:
+                    self.complete = True
+                    return total_count
 
-        batch = self._query.fetch(limit=self._batch_size)
-        if self._counter:
-            self._counter.inc(increment=len(batch))
+        self.complete = True
+        return total_count
 
-        for result in batch:
-            try:
-                fn(result, *fn_args, **fn_kwargs)
-            except StopMapping:
-                return count, None
 
-            count += 1
-            empty = False
+_MAX_ADAPTIVE_BATCH_SIZE = 1000
 
-        cursor = None
-        if not empty:
-            cursor = self._query.cursor()
 
-        return count, cursor
+class _BatchIterator(object):
+    """Yields lists of query results, optionally one batch ahead."""
+
+    def __init__(self, query, batch_size, prefetch=True):
+        self.batch_size = batch_size
+        self._query = query
+        self._prefetch = prefetch
+        self._cursor = None
+        self._pending = None
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def start(self):
+        """Issues the RPC for the first batch without waiting for it."""
+        if self._pending is None and not self._done:
+            if self._cursor:
+                # run() only takes Cursor objects; with_cursor() converts
+                # the websafe string that cursor() returned.
+                self._query.with_cursor(start_cursor=self._cursor)
+            self._pending = self._query.run(
+                limit=self.batch_size, batch_size=self.batch_size)
+
+    def next(self):
+        if self._done:
+            raise StopIteration()
+
+        if self._prefetch:
+            self.start()
+            batch = list(self._pending)
+        else:
+            if self._cursor:
+                self._query.with_cursor(start_cursor=self._cursor)
+            batch = self._query.fetch(limit=self.batch_size)
+        self._pending = None
+
+        if len(batch) < self.batch_size:
+            self._done = True
+        else:
+            self._cursor = self._query.cursor()
+            if self._prefetch:
+                self.start()
+
+        if not batch:
+            raise StopIteration()
+        return batch
+
+
+def _map_batch(batch, fn, fn_args, fn_kwargs):
+    """Applies fn to batch; returns (count mapped, whether StopMapping)."""
+    count = 0
+    for result in batch:
+        try:
+            fn(result, *fn_args, **fn_kwargs)
+        except StopMapping:
+            return count, True
+        count += 1
+    return count, False
+
+
+def _adapt_batch_size(batch_size, count, elapsed_secs, target_secs,
+                      max_batch_size):
+    """Returns the batch size that would have taken about target_secs."""
+    if not count:
+        return batch_size
+    if elapsed_secs <= 0:
+        return min(batch_size * 2, max_batch_size)
+    ideal = int(target_secs * count / elapsed_secs)
+    # Move at most by a factor of two per batch to damp noisy timings.
+    ideal = max(batch_size // 2, min(batch_size * 2, ideal))
+    return max(1, min(max_batch_size, ideal))
 
 
 def set_answer(answers, assessment_name, answer):
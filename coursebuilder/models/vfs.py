@@ -24,6 +24,7 @@ import threading
 import unittest
 
 from config import ConfigProperty
+from counters import LatencyHistogram
 from counters import PerfCounter
 from entities import BaseEntity
 from entities import put as entities_put
@@ -101,7 +102,8 @@ class AbstractFileSystem(object):
 
     def open(self, filename):
         """Returns a stream with the file content, similar to open(...)."""
-        return self._impl.get(filename)
+        with VFS_READ_LATENCY.timer(self._impl.__class__.__name__):
+            return self._impl.get(filename)
 
     def get(self, filename):
         """Returns bytes with the file content, but no metadata."""
@@ -333,6 +335,9 @@ VFS_CACHE_LEN = PerfCounter(
 VFS_CACHE_SIZE_BYTES = PerfCounter(
     'gcb-models-VfsCacheConnection-cache-bytes',
     'A total size of items in vfs cache in bytes.')
+VFS_READ_LATENCY = LatencyHistogram(
+    'gcb-models-vfs-read-latency',
+    'Latency in milliseconds of file reads, labeled by file system.')
 
 VFS_CACHE_LEN.poll_value = ProcessScopedVfsCache.get_vfs_cache_len
 VFS_CACHE_SIZE_BYTES.poll_value = ProcessScopedVfsCache.get_vfs_cache_size
@@ -730,16 +735,21 @@ class DatastoreBackedFileSystem(object):
 
         return wait_and_finalize
 
-    @db.transactional(xg=True)
     def delete(self, filename):
         filename = self._logical_to_physical(filename)
+        if self._transactional_delete(filename):
+            VfsCacheConnection.record_deletion(filename)
+        self.cache.delete(filename)
+
+    @db.transactional(xg=True)
+    def _transactional_delete(self, filename):
         metadata = FileMetadataEntity.get_by_key_name(filename)
         if metadata:
             metadata.delete()
         data = FileDataEntity(key_name=filename)
         if data:
             data.delete()
-        self.cache.delete(filename)
+        return metadata is not None
 
     def isfile(self, afilename):
         """Checks file existence by looking up the datastore row."""
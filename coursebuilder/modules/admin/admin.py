@@ -372,6 +372,9 @@ class BaseAdminHandler(ConfigPropertyEditor):
         cls.add_menu_item(
             'analytics', 'console', 'Console', action='console',
             contents=cls.get_console, sub_group_name='advanced')
+        cls.add_menu_item(
+            'analytics', 'latency', 'Latency', action='latency',
+            contents=cls.get_latency, sub_group_name='advanced')
 
         def can_view_appstats(app_context):
             return appengine_config.gcb_appstats_enabled()
@@ -435,6 +438,60 @@ class BaseAdminHandler(ConfigPropertyEditor):
         return self.render_dict(
             perf_counters, 'In-process Performance Counters (local/global)')
 
+    LATENCY_PERCENTILES = [50, 90, 99]
+
+    def _render_latency_histogram(self, histogram):
+        content = safe_dom.NodeList()
+        content.append(safe_dom.Element('h3').add_text(histogram.name))
+        content.append(safe_dom.Element('p').add_text(histogram.doc_string))
+
+        global_buckets = histogram.get_global_buckets() or {}
+        table = safe_dom.Element('table', className='gcb-latency-histogram')
+        content.append(table)
+        tr = safe_dom.Element('tr')
+        table.add_child(tr)
+        titles = ['Label', 'Samples (local/global)'] + [
+            'p%s ms (local/global)' % percentile
+            for percentile in self.LATENCY_PERCENTILES]
+        for title in titles:
+            tr.add_child(safe_dom.Element('th').add_text(title))
+
+        def format_pair(local_value, global_value):
+            if local_value is None:
+                local_value = 'NA'
+            if global_value is None:
+                global_value = 'NA'
+            return '%s / %s' % (local_value, global_value)
+
+        for label in histogram.labels:
+            local = histogram.get_buckets(label)
+            remote = global_buckets.get(label)
+            row = [label or '-', format_pair(
+                sum(local), sum(remote) if remote else None)]
+            for percentile in self.LATENCY_PERCENTILES:
+                row.append(format_pair(
+                    counters.LatencyHistogram.get_percentile(
+                        local, percentile),
+                    counters.LatencyHistogram.get_percentile(
+                        remote, percentile) if remote else None))
+            tr = safe_dom.Element('tr')
+            table.add_child(tr)
+            for cell in row:
+                tr.add_child(safe_dom.Element('td').add_text(cell))
+        return content
+
+    def get_latency(self):
+        """Shows latency distributions recorded by histogram counters."""
+        template_values = {}
+        template_values['page_title'] = self.format_title('Latency')
+        template_values['main_content'] = content = safe_dom.NodeList()
+        content.append(safe_dom.Element('p').add_text(
+            'Percentiles are upper bounds of log-scale buckets, so each is '
+            'accurate to within a factor of two.'))
+        for histogram in counters.Registry.get_histograms():
+            content.append(self._render_latency_histogram(histogram))
+        self.render_page(template_values)
+
     def _make_routes_dom(self, parent_element, routes, caption):
         """Renders routes as DOM."""
         if routes:
@@ -476,6 +533,19 @@ class BaseAdminHandler(ConfigPropertyEditor):
                 li, amodule.namespaced_routes, 'Namespaced Routes')
         return module_content
 
+    def _render_module_startup_costs(self):
+        content = safe_dom.NodeList()
+        content.append(
+            safe_dom.Element('h3').add_text('Module Startup Costs'))
+        ol = safe_dom.Element('ol')
+        content.append(ol)
+        for cost in appengine_config.get_module_startup_costs():
+            ol.add_child(safe_dom.Element('li').add_text(
+                '%s: import %.1fms, register %.1fms, enable %.1fms' % (
+                    cost.name, cost.import_sec * 1000,
+                    cost.register_sec * 1000, cost.enable_sec * 1000)))
+        return content
+
     def _render_custom_tags(self):
         tag_content = safe_dom.NodeList()
         tag_content.append(
@@ -554,6 +624,8 @@ class BaseAdminHandler(ConfigPropertyEditor):
         if roles.Roles.is_super_admin():
             content.append(
                 self._render_modules()
+            ).append(
+                self._render_module_startup_costs()
             ).append(
                 self._render_db_entity_types()
             ).append(
@@ -170,3 +170,10 @@ class AdminDashboardTabTests(actions.TestBase):
             app_context = sites.get_app_context_for_namespace(self.NAMESPACE)
             courses.Course.get(app_context).set_course_availability(policy)
             self.assertEqual(settings['title'], get_availability_text())
+
+    def test_latency_page_shows_handler_percentiles(self):
+        actions.login(self.ADMIN_EMAIL, is_admin=True)
+        self.get('/%s/course' % self.COURSE_NAME)
+        response = self.get('admin?action=latency')
+        self.assertIn(sites.HANDLER_LATENCY.name, response.body)
+        self.assertIn('GET CourseHandler', response.body)
@@ -24,10 +24,12 @@ from models import custom_modules
 from models import data_sources
 from models import data_removal
 from models import models
+from models import progress
 from models import services
 from modules.analytics import answers_aggregator
 from modules.analytics import click_link_aggregator
 from modules.analytics import clustering
+from modules.analytics import event_compaction
 from modules.analytics import gradebook
 from modules.analytics import location_aggregator
 from modules.analytics import page_event_aggregator
@@ -40,6 +42,7 @@ from modules.analytics import youtube_event_aggregator
 from modules.dashboard import dashboard
 
 ANALYTICS = 'analytics'
+RUNNING_TOTALS = 'analytics_running_totals'
 
 # Name for a course level setting: whether to record events for student
 # interaction with course: page views, widget interactions, question answers.
@@ -158,6 +161,17 @@ def add_actions():
         'edit_cluster', cluster_prepare_template)
 
 
+def get_global_handlers():
+    return [
+        (student_aggregate.StartIncrementalStudentAggregate.URL,
+         student_aggregate.StartIncrementalStudentAggregate),
+        (event_compaction.StartEventCompaction.URL,
+         event_compaction.StartEventCompaction),
+        (synchronous_providers.FlushRunningTotals.URL,
+         synchronous_providers.FlushRunningTotals),
+        ]
+
+
 def get_namespaced_handlers():
     return [
         (clustering.ClusterRESTHandler.URI, clustering.ClusterRESTHandler),
@@ -242,12 +256,33 @@ def register_module():
             models.StudentLifecycleObserver.EVENT_ADD][ANALYTICS] = (
                 rest_providers.AdditionalFieldNamesDAO.user_added_callback)
 
+        # Keep the totals shown by synchronous analytics current between
+        # recounts.
+        lifecycle_callbacks = models.StudentLifecycleObserver.EVENT_CALLBACKS
+        lifecycle_callbacks[models.StudentLifecycleObserver.EVENT_ADD][
+            RUNNING_TOTALS] = synchronous_providers.count_student_added
+        lifecycle_callbacks[models.StudentLifecycleObserver.EVENT_UNENROLL][
+            RUNNING_TOTALS] = synchronous_providers.count_student_unenrolled
+        lifecycle_callbacks[
+            models.StudentLifecycleObserver.EVENT_UNENROLL_COMMANDED][
+                RUNNING_TOTALS] = synchronous_providers.count_student_unenrolled
+        lifecycle_callbacks[models.StudentLifecycleObserver.EVENT_REENROLL][
+            RUNNING_TOTALS] = synchronous_providers.count_student_reenrolled
+        models.Student.POST_UPDATE_SCORE_HOOKS.append(
+            synchronous_providers.StudentEnrollmentAndScoresGenerator
+            .count_score_change)
+        progress.UnitLessonCompletionTracker.POST_SAVE_PROGRESS_HOOK.append(
+            synchronous_providers.StudentProgressStatsGenerator
+            .count_progress_change)
+        models.EventEntity.EVENT_LISTENERS.append(
+            synchronous_providers.QuestionStatsGenerator.count_event)
+
         register_tabs()
         add_actions()
 
     global custom_module  # pylint: disable=global-statement
     custom_module = custom_modules.Module(
         'Analytics', 'Data sources and dashboard analytics pages',
-        [], get_namespaced_handlers(),
+        get_global_handlers(), get_namespaced_handlers(),
         notify_module_enabled=on_module_enabled)
     return custom_module
@@ -39,6 +39,7 @@ from models import models
 from models import transforms
 from models.data_sources import paginated_table
 from modules.analytics import clustering
+from modules.analytics import event_compaction
 from modules.analytics import filters
 from modules.analytics import gradebook
 from modules.analytics import student_aggregate
@@ -156,6 +157,12 @@ class AbstractModulesAnalyticsTest(actions.TestBase):
         job.submit()
         self.execute_all_deferred_tasks()
 
+    def run_incremental_aggregator_job(self):
+        job = student_aggregate.IncrementalStudentAggregateGenerator(
+            self.app_context)
+        job.submit()
+        self.execute_all_deferred_tasks()
+
 
 class NotReallyTest(AbstractModulesAnalyticsTest):
 
@@ -319,6 +326,161 @@ class StudentAggregateTest(AbstractModulesAnalyticsTest):
             self.load_expected_data(data_set_name, 'expected.json'))
 
 
+class IncrementalStudentAggregateTest(AbstractModulesAnalyticsTest):
+
+    def _get_median_event_time(self):
+        with common_utils.Namespace('ns_' + self.COURSE_NAME):
+            times = sorted(
+                event.recorded_on for event in models.EventEntity.all())
+        return times[len(times) / 2]
+
+    def _clear_aggregates(self):
+        with common_utils.Namespace('ns_' + self.COURSE_NAME):
+            db.delete(student_aggregate.StudentAggregateEntity.all(
+                keys_only=True))
+            db.delete(student_aggregate.StudentAggregateHighWaterMarkEntity
+                      .all(keys_only=True))
+
+    def _assert_incremental_matches_full(self, sort_keys):
+        self.run_aggregator_job()
+        expected = self.get_aggregated_data_by_email('foo@bar.com')
+        self._clear_aggregates()
+
+        # Aggregate the first half of the events, then fold in the rest.
+        cutoff = self._get_median_event_time()
+        self.swap(student_aggregate.StudentAggregateGenerator,
+                  '_get_window_end', classmethod(lambda cls: cutoff))
+        self.run_aggregator_job()
+        partial = self.get_aggregated_data_by_email('foo@bar.com')
+        self.swap(student_aggregate.StudentAggregateGenerator,
+                  '_get_window_end', classmethod(
+                      lambda cls: datetime.datetime.utcnow()))
+        self.run_incremental_aggregator_job()
+        actual = self.get_aggregated_data_by_email('foo@bar.com')
+
+        self.assertNotEqual(expected, partial)
+        for name, sort_key in sort_keys.iteritems():
+            expected[name].sort(key=sort_key)
+            actual[name].sort(key=sort_key)
+        self.assertEqual(expected, actual)
+
+    def test_incremental_page_views(self):
+        self.load_course('simple_questions')
+        self.load_datastore('page_views')
+        self._assert_incremental_matches_full({
+            'page_views': lambda x: (x['name'], x.get('id'), x.get('start')),
+            })
+
+    def test_incremental_frequencies(self):
+        self.load_course('simple_questions')
+        self.load_datastore('location_locale')
+        self._assert_incremental_matches_full({
+            'location_frequencies': lambda x: (x['country'], x['frequency']),
+            'locale_frequencies': lambda x: (x['locale'], x['frequency']),
+            'user_agent_frequencies': lambda x: (
+                x['user_agent'], x['frequency']),
+            })
+
+    def test_incremental_assessments(self):
+        self.load_course('simple_questions')
+        self.load_datastore('multiple')
+        self._assert_incremental_matches_full({
+            'assessments': lambda x: (x['unit_id'], x['lesson_id']),
+            })
+
+    def test_incremental_without_previous_run_computes_everything(self):
+        self.load_course('simple_questions')
+        self.load_datastore('multiple')
+        self.run_incremental_aggregator_job()
+        actual = self.get_aggregated_data_by_email('foo@bar.com')
+
+        expected = self.load_expected_data('multiple', 'assessments.json')
+        expected.sort(key=lambda x: (x['unit_id'], x['lesson_id']))
+        actual['assessments'].sort(key=lambda x: (x['unit_id'], x['lesson_id']))
+        self.assertEqual(expected, actual['assessments'])
+
+    def test_failed_run_does_not_advance_high_water_mark(self):
+        self.load_course('simple_questions')
+        self.load_datastore('multiple')
+        self.run_aggregator_job()
+        with common_utils.Namespace('ns_' + self.COURSE_NAME):
+            mark = student_aggregate.StudentAggregateHighWaterMarkEntity
+            job = student_aggregate.IncrementalStudentAggregateGenerator(
+                self.app_context)
+            until = datetime.datetime.utcnow()
+            first = mark.get_or_create().begin_window(job.name, until)
+            self.assertIsNotNone(first)
+
+            # The incremental job never ran, so the window does not move.
+            second = mark.get_or_create().begin_window(job.name, until)
+            self.assertEqual(first, second)
+
+
+class EventCompactionTests(AbstractModulesAnalyticsTest):
+
+    def setUp(self):
+        super(EventCompactionTests, self).setUp()
+        self.load_course('simple_questions')
+        self.load_datastore('multiple')
+
+        # Treat every loaded event as old enough to compact.
+        self.swap(event_compaction, 'EVENT_COMPACTION_AGE_DAYS', -1)
+
+    def _get_event_ids(self):
+        with common_utils.Namespace('ns_' + self.COURSE_NAME):
+            return sorted(
+                event.key().id_or_name()
+                for event in models.EventEntity.iter_events())
+
+    def _compact(self):
+        with common_utils.Namespace('ns_' + self.COURSE_NAME):
+            return event_compaction.CompactEventsJob(self.app_context).run()
+
+    def test_compaction_moves_events_into_segments(self):
+        expected = self._get_event_ids()
+        result = self._compact()
+
+        self.assertEqual(len(expected), result['compacted'])
+        with common_utils.Namespace('ns_' + self.COURSE_NAME):
+            self.assertEqual(0, models.EventEntity.all().count())
+            self.assertTrue(models.EventSegmentEntity.all().count())
+        self.assertEqual(expected, self._get_event_ids())
+
+    def test_compaction_is_idempotent(self):
+        expected = self._get_event_ids()
+        self._compact()
+        result = self._compact()
+
+        self.assertEqual(0, result['compacted'])
+        self.assertEqual(expected, self._get_event_ids())
+
+    def test_aggregate_is_unchanged_by_compaction(self):
+        self.run_aggregator_job()
+        expected = self.get_aggregated_data_by_email('foo@bar.com')
+        self._compact()
+        self.run_aggregator_job()
+        actual = self.get_aggregated_data_by_email('foo@bar.com')
+
+        # Segments hand events to the mappers in a different order.
+        for name in expected:
+            if isinstance(expected[name], list):
+                expected[name].sort(key=transforms.dumps)
+                actual[name].sort(key=transforms.dumps)
+        self.assertEqual(expected, actual)
+
+    def test_delete_by_user_id_removes_only_their_compacted_events(self):
+        self._compact()
+        with common_utils.Namespace('ns_' + self.COURSE_NAME):
+            user_ids = set(
+                event.user_id for event in models.EventEntity.iter_events())
+            user_id = user_ids.pop()
+            models.EventSegmentEntity.delete_by_user_id(user_id)
+            remaining = set(
+                event.user_id for event in models.EventEntity.iter_events())
+        self.assertNotIn(user_id, remaining)
+        self.assertEqual(user_ids, remaining)
+
+
 class StudentAggregateSchemaRegistryTests(actions.TestBase):
 
     def setUp(self):
@@ -359,6 +521,18 @@ class StudentAggregateSchemaRegistryTests(actions.TestBase):
 
         super(StudentAggregateSchemaRegistryTests, self).tearDown()
 
+    def test_supports_incremental_requires_merge_aggregate(self):
+        reg = student_aggregate.StudentAggregateComponentRegistry
+        schema = schema_fields.SchemaField(
+            'an_int', 'An Integer', 'integer', description='integer desc')
+        aggregator = self._build_aggregator('no_merge', schema)
+        reg.register_component(aggregator)
+        self.assertFalse(reg.supports_incremental())
+
+        aggregator.merge_aggregate = classmethod(
+            lambda cls, *unused_args: None)
+        self.assertTrue(reg.supports_incremental())
+
     def _build_aggregator(self, name, schema):
 
         # Build class under a closure where name, schema are configurable.
@@ -2234,8 +2408,7 @@ class FilteredAssessmentScoresBaseGenerator(object):
         if not student.scores:
             return
         for assessment_id, score in transforms.loads(student.scores).items():
-            for key in cls._generate_keys(student, assessment_id):
-                yield key, score
+            yield cls._make_cell(student, assessment_id, score)
 
 
 class FilteredAssessmentScoresAverageGenerator(
@@ -2680,6 +2853,27 @@ class FilteredDataSourceTests(actions.TestBase):
             _filters=['student_track=%d' % track_id,
                       'student_group=%d' % group_id]))
 
+    def test_map_emits_one_cell_per_element(self):
+        group_id = self._add_group('Section One', '8AM Mondays.  Whee!')
+        track_id = self._add_track('Herpetology', 'Lizards and stuff.')
+        students = self._register_students(num_students=1)
+        self._set_group_for_student(group_id, students[0])
+        self._set_track_for_student(track_id, students[0])
+
+        generator_class = FilteredAssessmentScoresAverageGenerator
+        with common_utils.Namespace(self.NAMESPACE):
+            cells = sorted(generator_class.map(students[0]))
+        self.assertEquals(
+            [(('1',), (((group_id,), (track_id,)), (0, 1))),
+             (('2',), (((group_id,), (track_id,)), (100, 1)))],
+            cells)
+
+        # Cells for the same filter keys are merged by the combiner.
+        combined = list(generator_class.combine(
+            "('1',)", [str(cells[0][1]), str(cells[0][1])],
+            [cells[0][1]]))
+        self.assertEquals([(((group_id,), (track_id,)), (0, 3))], combined)
+
     def test_averaging_generator(self):
         FilteredAssessmentScoresDataSource.GENERATOR = (
             FilteredAssessmentScoresAverageGenerator)
@@ -181,6 +181,24 @@ class AnswersAggregator(student_aggregate.AbstractStudentAggregationComponent):
                     assessment['min_score'] = min_score
         return {'assessments': assessments}
 
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params, previous,
+                        num_previous_items, event_items):
+        if previous:
+            # Each previous assessment looks like a process_event() item
+            # with many submissions; drop the derived scores, which
+            # produce_aggregate() recomputes over old and new submissions.
+            old_items = []
+            for assessment in previous['assessments']:
+                old_items.append({
+                    'unit_id': assessment['unit_id'],
+                    'lesson_id': assessment['lesson_id'],
+                    'submissions': assessment['submissions'],
+                    })
+            event_items = old_items + event_items
+        return cls.produce_aggregate(
+            course, student, static_params, event_items)
+
     @classmethod
     def get_schema(cls):
         answer = schema_fields.FieldRegistry('answer')
@@ -49,6 +49,14 @@ class ClickLinkAggregator(
         return {'click_link':
             list(sorted(event_items, key=lambda event: event["timestamp"]))}
 
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params, previous,
+                        num_previous_items, event_items):
+        if previous:
+            event_items = previous['click_link'] + event_items
+        return cls.produce_aggregate(
+            course, student, static_params, event_items)
+
     @classmethod
     def get_schema(cls):
         event = schema_fields.FieldRegistry('event')
@@ -0,0 +1,112 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Moves old events from EventEntity into compressed EventSegmentEntity."""
+
+import datetime
+import logging
+
+from controllers import utils
+from models import config
+from models import entities
+from models import jobs
+from models import models
+from modules.analytics import messages
+
+# Events recorded at least this many days ago are compacted.
+EVENT_COMPACTION_AGE_DAYS = 30
+
+_DAY_FORMAT = '%Y-%m-%d'
+
+COMPACT_OLD_EVENTS = config.ConfigProperty(
+    'gcb_compact_old_events', bool,
+    messages.SITE_SETTINGS_COMPACT_OLD_EVENTS, default_value=False,
+    label='Compact Old Events')
+
+
+class CompactEventsJob(jobs.ResumableJob):
+    """Packs events older than EVENT_COMPACTION_AGE_DAYS into segments.
+
+    Each step packs a batch of events into their segments and then deletes
+    them from EventEntity.  Segments ignore events they already hold, so a
+    step interrupted between the two is safely repeated.
+    """
+
+    BATCH_SIZE = 500
+
+    @staticmethod
+    def get_description():
+        return 'compact old events'
+
+    def _get_query(self, until):
+        return models.EventEntity.all().filter(
+            'recorded_on <', until).order('recorded_on')
+
+    def start(self):
+        until = models.EventSegmentEntity.get_day(
+            datetime.datetime.utcnow() -
+            datetime.timedelta(days=EVENT_COMPACTION_AGE_DAYS))
+        return {
+            'until': until.strftime(_DAY_FORMAT),
+            'cursor': None,
+            'compacted': 0}
+
+    def resume(self, checkpoint):
+        until = datetime.datetime.strptime(checkpoint['until'], _DAY_FORMAT)
+        cursor = checkpoint['cursor']
+        compacted = checkpoint['compacted']
+        while True:
+            query = self._get_query(until)
+            if cursor:
+                query.with_cursor(cursor)
+            batch = query.fetch(self.BATCH_SIZE)
+            if not batch:
+                return
+            models.EventSegmentEntity.add_events(batch)
+            entities.delete([event.key() for event in batch])
+
+            cursor = query.cursor()
+            compacted += len(batch)
+            checkpoint = {
+                'until': checkpoint['until'],
+                'cursor': cursor,
+                'compacted': compacted}
+            yield checkpoint, None
+            if len(batch) < self.BATCH_SIZE:
+                return
+
+    def finish(self, checkpoint):
+        return {'compacted': checkpoint['compacted']}
+
+
+class StartEventCompaction(utils.AbstractAllCoursesCronHandler):
+    """Daily compaction of old events in every course."""
+
+    URL = '/cron/analytics/compact_events'
+
+    @classmethod
+    def is_globally_enabled(cls):
+        return COMPACT_OLD_EVENTS.value
+
+    @classmethod
+    def is_enabled_for_course(cls, app_context):
+        return True
+
+    def cron_action(self, app_context, global_state):
+        job = CompactEventsJob(app_context)
+        if job.is_active():
+            logging.info('Event compaction for %s still running; not '
+                         'starting another.', app_context.get_slug())
+            return
+        job.submit()
@@ -119,6 +119,22 @@ class AbstractFilteredMapReduceJob(jobs.MapReduceJob):
 
     """Base functionality for map/reduce jobs generating filterable results.
 
+    Results are written for every combination of filter values, with None
+    standing for "not filtered on this axis", so that the admin UI can fetch
+    an aggregate for any selection of filters with a single query.  Rather
+    than emit one map output per element for each such combination, map()
+    emits exactly one value per element: the finest-grained cell, naming all
+    of the element's keys for every filter, holding a partial aggregate.
+    Cells with equal filter keys are merged by the combiner and again in
+    reduce(), which then rolls the merged cells up into all of the coarser
+    combinations and writes the results in batched puts.  Adding a filter
+    dimension thus no longer multiplies the volume of map output.
+
+    Since the same partial may be merged any number of times at any stage,
+    concrete classes describe their aggregation with make_partial(),
+    merge_partials() and finalize_partial() rather than by overriding
+    combine() or reduce().
+
     See analytics_tests.FilteredAssessmentScores{Entity,Generator,DataSource}
     for an example implementation of an entity, generator job, and data source
     class that collaborate to filter on student group and student course
@@ -128,6 +144,9 @@ class AbstractFilteredMapReduceJob(jobs.MapReduceJob):
     # Override default pipeline in base class; we need to clean old results.
     MAP_REDUCE_PIPELINE_CLASS = PreCleanMapReduceJobPipeline
 
+    # Maximum number of result entities saved in one datastore RPC.
+    PUT_BATCH_SIZE = 100
+
     @classmethod
     def result_class(cls):
         """Identify the dervied AbstractFilteredEntity type saved by this job.
@@ -155,10 +174,10 @@ class AbstractFilteredMapReduceJob(jobs.MapReduceJob):
             # primary_id: Holds the ID on which aggregation should be
             #     performed.  E.g., if aggregating by Student, the user_id.
             #     If by course element, the unit_id, or similar.
-            # result: One result which will be passed in to the reducer
-            #     in a list of all results having the same key.  May be
-            #     a simple scalar or complex, as long as it's serializable
-            #     via str() and recoverable via ast.literal_eval().
+            # result: One result which will be passed to make_partial().
+            #     May be a simple scalar or complex, as long as it's
+            #     serializable via str() and recoverable via
+            #     ast.literal_eval().
             #
 
             # Example----------------(This will vary depending on your use case)
@@ -177,12 +196,12 @@ class AbstractFilteredMapReduceJob(jobs.MapReduceJob):
 
             # Boilerplate----------------------------(always write exactly this)
             #
-            # generate_keys() generates all combinations of keys and None
+            # _make_cell() tags the result with the keys of all filters
             # we want to be able to filter by for processor use cost.
-            # reduce() will aggregate and store these for each combination.
+            # reduce() will aggregate and store results for every
+            # combination of these keys and None.
             #
-            for key in cls._generate_keys(element, primary_id):
-                yield key, result
+            yield cls._make_cell(an_entity, primary_id, result)
 
         Args:
           entity: One instance of whatever type this class returns from the
@@ -191,55 +210,74 @@ class AbstractFilteredMapReduceJob(jobs.MapReduceJob):
         raise NotImplementedError()
 
     @classmethod
-    def reduce(cls, keys, values):
-        """Standard reduce function in map/reduce paradigm.
+    def make_partial(cls, result):
+        """Converts one result from map() into a partial aggregate.
 
-        You should perform whatever aggregation is required (if any), and
-        then call _write_entity, as in the example code below.  You may
-        also use 'yield' to generate output that will be stored in the
-        DurableJobEntity result row for this job run, but this is neither
-        required nor is it expected to be a common use case.
+        Override this when the aggregate needs more than the result itself;
+        e.g., an average is merged from (sum, count) pairs.  Partials travel
+        through the map/reduce shuffle, so they must be serializable via
+        str() and recoverable via ast.literal_eval().
+        """
+        return result
 
-        @classmethod
-        def reduce(cls, keys, values):
-            # code to perform aggregation or any other required processing
-            # on the list of values.  Here, we assume that a variable named
-            # 'result' has been filled in with some simple or complex
-            # structure.
+    @classmethod
+    def merge_partials(cls, partials):
+        """Merges a list of partial aggregates into a single partial.
+
+        This must be associative: the framework merges partials within each
+        mapper, again in the reducer, and once more for every combination of
+        filter values a cell contributes to.
 
+        @classmethod
+        def merge_partials(cls, partials):
             # Example----------------(This will vary depending on your use case)
             #
-            # Unpack values; collect all currency codes and get conversion
-            # rates to USD.  For all results, aggregate amounts in USD.
-            # These will be stored by write_entity() for this particular
-            # set of keys.
+            # Amounts are kept per currency; conversion to USD waits for
+            # finalize_partial() so that it is done once per result row.
             #
-            values = [ast.literal_eval(v) for v in values]
-            currency_codes = set([v['currency_code'] for v in values])
-            conversion = modules.payment.payment.conversions_to_usd(
-                currency_codes)
-            result = sum([v['amount'] * conversions[v['currency_code']]
-                for v in values])
+            totals = {}
+            for partial in partials:
+                for currency_code, amount in partial.iteritems():
+                    totals[currency_code] = (
+                        totals.get(currency_code, 0) + amount)
+            return totals
 
-            # Boilerplate----------------------------(always write exactly this)
-            #
-            # Stores one row with the supplied keys and our aggregated result.
-            cls._write_entity(keys, result)
+        Args:
+            partials: A non-empty list of values from make_partial() or from
+                earlier calls to merge_partials().
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def finalize_partial(cls, partial):
+        """Converts a fully-merged partial into the data of a result entity.
+
+        Returns a string, or a value that will be stored as JSON.
+        """
+        return partial
+
+    @classmethod
+    def combine(cls, unused_key, values, previously_combined_values=None):
+        for cell in cls._merge_cells(
+            itertools.chain(values, previously_combined_values or [])):
+            yield cell
+
+    @classmethod
+    def reduce(cls, keys, values):
+        """Merges, rolls up and stores all cells for one primary_id.
 
         Args:
             keys: A tuple of key fields packed as a string.  The first
                 item in the tuple will be the value of 'primary_id' as passed
-                to generate_keys.  The other items are generated by the
-                filters for this class, and should be treated as opaque data.
-            values: A tuple of values; these will be _all_ the values, and
-                _only_ the values yielded by map() for this specific list
-                of keys.
+                to _make_cell().
+            values: All the cells yielded by map() or combine() for this
+                primary_id.
         """
-        raise NotImplementedError()
+        cls._write_entities(keys, values)
 
     @classmethod
-    def _generate_keys(cls, element, primary_id):
-        """Generates lists of combinations of keys for writing FilteredEntities
+    def _make_cell(cls, element, primary_id, result):
+        """Builds the map() output for one element.
 
         Derived classes should not implement this function, but they will
         call it from their map() implementations.
@@ -252,46 +290,72 @@ class AbstractFilteredMapReduceJob(jobs.MapReduceJob):
               for the relevant Student.  Similarly, if mapping over
               EventEntity assessment answers, and aggregating by question
               instance, this would be the ID of the instance of a question.
+          result: The value to aggregate, as passed to make_partial().
+        Returns:
+          A key/value 2-tuple.  The key holds only the primary_id; the value
+          holds the sorted keys of the element for each filter (in the order
+          of _get_sorted_filters()) along with the partial aggregate.
         """
 
-        filter_key_lists = []
-        filter_key_lists.append([primary_id])  # Always at index 0
+        filter_keys = []
         for _filter in cls._get_sorted_filters():
-            key_list = _filter.get_keys_for_element(element)
-            if key_list is None:
-                key_list = []
-            else:
-                key_list = list(key_list)  # Convert set/tuple/generator to list
-
-            # Note that we always add 'None' to the list of keys before we
-            # generate the explosion of all possible key combinations.  We
-            # do this to support the admin UI wanting to see results that are
-            # not filtered on some axis.  Note that this consideration applies
-            # for *all* filters, even for filters that will always have a
-            # well-defined value for every item (e.g., display language for
-            # page views)
-            if None not in key_list:
-                key_list.append(None)
-
-            key_list.sort()
-            filter_key_lists.append(key_list)
-        for item in itertools.product(*filter_key_lists):
-            yield item
+            keys = _filter.get_keys_for_element(element) or []
+            filter_keys.append(
+                tuple(sorted(set(key for key in keys if key is not None))))
+        return (primary_id,), (tuple(filter_keys), cls.make_partial(result))
 
     @classmethod
-    def _write_entity(cls, keys, data):
-        """Save a result entity initialized w/ primary_id and filter values."""
-
-        if not isinstance(data, basestring):
-            data = transforms.dumps(data)
-        keys = ast.literal_eval(keys)
-        constructor_args = {}
-        constructor_args['primary_id'] = keys[0]  # Always at index 0
-        constructor_args['data'] = data
-        for key, _filter in zip(keys[1:], cls._get_sorted_filters()):
-            if key is not None:
-                constructor_args[_filter.get_name()] = key
-        cls.result_class()(**constructor_args).put()
+    def _merge_cells(cls, cells):
+        """Returns list of (filter_keys, partial), one per distinct keys."""
+
+        partials = {}
+        for cell in cells:
+            # Values arrive as strings from the shuffle, but as objects when
+            # fed back from an earlier combine() on the same mapper.
+            if isinstance(cell, basestring):
+                cell = ast.literal_eval(cell)
+            filter_keys, partial = cell
+            filter_keys = tuple(tuple(keys) for keys in filter_keys)
+            partials.setdefault(filter_keys, []).append(partial)
+        return [(filter_keys, cls.merge_partials(cell_partials))
+                for filter_keys, cell_partials in partials.iteritems()]
+
+    @classmethod
+    def _write_entities(cls, keys, cells):
+        """Save result entities for all roll-ups of the given cells."""
+
+        primary_id = ast.literal_eval(keys)[0]  # Always at index 0
+
+        # Every cell contributes to each combination of its own keys and None
+        # on every filter axis; None means "not filtered on this axis".
+        # Note that this consideration applies for *all* filters, even for
+        # filters that will always have a well-defined value for every item
+        # (e.g., display language for page views)
+        rollups = {}
+        for filter_keys, partial in cls._merge_cells(cells):
+            for combination in itertools.product(
+                *[axis_keys + (None,) for axis_keys in filter_keys]):
+                rollups.setdefault(combination, []).append(partial)
+
+        filters = cls._get_sorted_filters()
+        result_class = cls.result_class()
+        to_put = []
+        for combination, partials in sorted(rollups.iteritems()):
+            data = cls.finalize_partial(cls.merge_partials(partials))
+            if not isinstance(data, basestring):
+                data = transforms.dumps(data)
+            constructor_args = {}
+            constructor_args['primary_id'] = primary_id
+            constructor_args['data'] = data
+            for key, _filter in zip(combination, filters):
+                if key is not None:
+                    constructor_args[_filter.get_name()] = key
+            to_put.append(result_class(**constructor_args))
+            if len(to_put) >= cls.PUT_BATCH_SIZE:
+                entities.put(to_put)
+                to_put = []
+        if to_put:
+            entities.put(to_put)
 
     @classmethod
     def _get_sorted_filters(cls):
@@ -327,9 +391,16 @@ class AbstractFilteredSummingMapReduceJob(AbstractFilteredMapReduceJob):
     RESULT_KEY = 'sum'
 
     @classmethod
-    def reduce(cls, keys, values):
-        _sum = sum(int(value) for value in values)
-        cls._write_entity(keys, {cls.RESULT_KEY: _sum})
+    def make_partial(cls, result):
+        return int(result)
+
+    @classmethod
+    def merge_partials(cls, partials):
+        return sum(partials)
+
+    @classmethod
+    def finalize_partial(cls, partial):
+        return {cls.RESULT_KEY: partial}
 
 
 class AbstractFilteredAveragingMapReduceJob(AbstractFilteredMapReduceJob):
@@ -338,9 +409,18 @@ class AbstractFilteredAveragingMapReduceJob(AbstractFilteredMapReduceJob):
     RESULT_KEY = 'average'
 
     @classmethod
-    def reduce(cls, keys, values):
-        average = sum(int(value) for value in values) / len(values)
-        cls._write_entity(keys, {cls.RESULT_KEY: average})
+    def make_partial(cls, result):
+        return (int(result), 1)
+
+    @classmethod
+    def merge_partials(cls, partials):
+        return (sum(total for total, _ in partials),
+                sum(count for _, count in partials))
+
+    @classmethod
+    def finalize_partial(cls, partial):
+        total, count = partial
+        return {cls.RESULT_KEY: total / count}
 
 
 class StudentTrackFilter(data_sources.AbstractEnumFilter):
@@ -16,7 +16,6 @@
 
 __author__ = 'Mike Gainer (mgainer@google.com)'
 
-import ast
 import collections
 import csv
 import datetime
@@ -152,8 +151,22 @@ class RawAnswersGenerator(filters.AbstractFilteredMapReduceJob):
         # Each answer is a namedtuple; convert to a list for pack/unpack
         # journey through the map/reduce shuffle stage.
         result = [list(answer) for answer in answers]
-        for key in cls._generate_keys(event, event.user_id):
-            yield (key, result)
+        yield cls._make_cell(event, event.user_id, result)
+
+    @classmethod
+    def merge_partials(cls, answers_lists):
+        return list(itertools.chain(*answers_lists))
+
+    @classmethod
+    def combine(cls, key, values, previously_combined_values=None):
+        if key == RawAnswersGenerator.TOTAL_STUDENTS:
+            for user_id in set(values).union(previously_combined_values or []):
+                yield user_id
+            return
+
+        for cell in super(RawAnswersGenerator, cls).combine(
+            key, values, previously_combined_values):
+            yield cell
 
     @classmethod
     def reduce(cls, keys, answers_lists):
@@ -164,9 +177,7 @@ class RawAnswersGenerator(filters.AbstractFilteredMapReduceJob):
             yield (keys, len(student_ids))
             return
 
-        answers = itertools.chain(*[ast.literal_eval(l) for l in answers_lists])
-        data = transforms.dumps(list(answers))
-        cls._write_entity(keys, data)
+        cls._write_entities(keys, answers_lists)
 
 
 StudentPlaceholder = collections.namedtuple(
@@ -225,6 +236,10 @@ class RawAnswersDataSource(data_sources.SynchronousQuery,
         # we at least see rows for them in the UI, even if there are no scores.
         return 25
 
+    @classmethod
+    def use_keyset_pagination(cls):
+        return True
+
     @classmethod
     def get_filters(cls):
         return QuestionAnswersEntity.get_filters()
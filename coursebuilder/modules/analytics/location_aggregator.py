@@ -66,6 +66,17 @@ class LocationAggregator(student_aggregate.AbstractStudentAggregationComponent):
             ret.append(item)
         return {'location_frequencies': ret}
 
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params, previous,
+                        num_previous_items, event_items):
+        if previous:
+            event_items = cls._unpack_frequencies(
+                previous['location_frequencies'], num_previous_items,
+                lambda item: [item.get('country'), item.get('region'),
+                              item.get('city')]) + event_items
+        return cls.produce_aggregate(
+            course, student, static_params, event_items)
+
     @classmethod
     def get_schema(cls):
         location_frequency = schema_fields.FieldRegistry('location_frequency')
@@ -137,6 +148,16 @@ class LocaleAggregator(student_aggregate.AbstractStudentAggregationComponent):
                 })
         return {'locale_frequencies': ret}
 
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params, previous,
+                        num_previous_items, event_items):
+        if previous:
+            event_items = cls._unpack_frequencies(
+                previous['locale_frequencies'], num_previous_items,
+                lambda item: item['locale']) + event_items
+        return cls.produce_aggregate(
+            course, student, static_params, event_items)
+
     @classmethod
     def get_schema(cls):
         """Provide schema; override default schema generated from DB type."""
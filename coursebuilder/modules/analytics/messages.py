@@ -22,3 +22,10 @@ If checked, student events (e.g., page views and assessment answers) will be
 recorded. This enables analytics, but may increase App Engine quota usage.
 Analytics requires the use of the Google Cloud Storage default bucket.
 """
+
+SITE_SETTINGS_COMPACT_OLD_EVENTS = """
+If checked, a daily job packs student events more than a few weeks old into
+compressed segments, reducing datastore storage and index costs. Analytics
+see compacted events as before, but raw exports of the EventEntity table
+will no longer include them.
+"""
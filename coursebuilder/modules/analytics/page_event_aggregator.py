@@ -261,6 +261,22 @@ class PageEventAggregator(
         page_views.sort(key=lambda v: v['start'])
         return {'page_views': page_views}
 
+    @classmethod
+    def merge_aggregate(cls, course, student, static_value, previous,
+                        num_previous_items, event_items):
+        if previous:
+            # Views are re-clustered from scratch, so a view whose exit-page
+            # event arrives in a later run is still closed off correctly.
+            old_items = []
+            for view in previous['page_views']:
+                old_items.append([
+                    [view['name'], view.get('item_id'), activity['timestamp'],
+                     activity['action']]
+                    for activity in view['activities']])
+            event_items = old_items + event_items
+        return cls.produce_aggregate(
+            course, student, static_value, event_items)
+
     @classmethod
     def get_schema(cls):
         activity = schema_fields.FieldRegistry('activity')
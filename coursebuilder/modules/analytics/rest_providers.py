@@ -457,6 +457,16 @@ class StudentsDataSource(data_sources.AbstractDbTableRestDataSource):
     def get_default_chunk_size(cls):
         return 100
 
+    @classmethod
+    def use_keyset_pagination(cls):
+        return True
+
+    @classmethod
+    def get_projectable_fields(cls):
+        # Indexed, and exported as stored.  (user_id is indexed, but is
+        # transformed on export.)
+        return set(['enrolled_on', 'last_seen_on', 'group_id'])
+
     @classmethod
     def get_schema(cls, app_context, log, source_context):
         """Override default entity-based schema to reflect our upgrades.
@@ -0,0 +1,236 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Analytics totals kept current between full recounts.
+
+A set of running totals is a JSON structure of nested dicts and lists whose
+leaves are numbers, e.g. the output of one of the synchronous analytics
+generators.  It is stored as one 'base' entity holding the result of the most
+recent full recount, plus NUM_SHARDS entities accumulating the changes made
+since then.  Each change is a structure of the same shape holding signed
+deltas.  Changes are buffered in memcache, listed under numbers handed out by
+a memcache counter, and a cron job adds them up and applies them in batches,
+each in a single transaction on a randomly chosen shard.  Reading the totals
+adds the shards onto the base, so changes show once they have been flushed.
+When memcache is turned off, each change is applied as it is made.
+"""
+
+import logging
+import random
+
+from models import entities
+from models import models
+from models import transforms
+
+from google.appengine.ext import db
+
+# Number of entities over which the changes to one set of totals are spread.
+NUM_SHARDS = 16
+
+# Most buffered changes added up and applied in one transaction.
+FLUSH_BATCH_SIZE = 500
+
+# How long a buffered change is kept in memcache waiting to be flushed.
+BUFFER_TTL_SEC = 60 * 60
+
+
+class RunningTotalsEntity(entities.BaseEntity):
+    """One part of a named set of running totals in a course.
+
+    The key name is '<name>:base' for the recounted totals, or '<name>:<n>'
+    for the n'th shard of changes made since.
+    """
+
+    # JSON-encoded totals, or deltas to them.
+    data = db.TextProperty(indexed=False)
+
+
+def _add(total, delta, add_new_keys):
+    """Adds delta into total, matching dicts by key and lists by position.
+
+    Args:
+        total: Totals to update; dicts and lists are modified in place.
+            None stands for no totals yet.
+        delta: Deltas of the same shape; any part may be missing.
+        add_new_keys: Whether entries present only in delta are added to
+            total, or ignored.
+    Returns:
+        The updated total.
+    """
+    if total is None:
+        return delta
+    if isinstance(delta, dict):
+        for key, value in delta.iteritems():
+            if key in total:
+                total[key] = _add(total[key], value, add_new_keys)
+            elif add_new_keys:
+                total[key] = value
+        return total
+    if isinstance(delta, list):
+        for index, value in enumerate(delta):
+            if index < len(total):
+                total[index] = _add(total[index], value, add_new_keys)
+            elif add_new_keys:
+                total.append(value)
+        return total
+    return total + delta
+
+
+class RunningTotals(object):
+    """Access to one named set of running totals in the current course."""
+
+    BASE = 'base'
+
+    def __init__(self, name, add_new_keys=True):
+        """Creates an accessor.
+
+        Args:
+            name: Name of the totals, unique within the course.
+            add_new_keys: Whether deltas for entries that the last recount
+                did not produce add those entries.  If False, such deltas are
+                ignored when the totals are read; use this when the recount
+                lays out every entry that can exist.
+        """
+        self._name = name
+        self._add_new_keys = add_new_keys
+
+    def _key_name(self, part):
+        return '%s:%s' % (self._name, part)
+
+    def _memcache_key(self):
+        return 'running_totals:%s:exists' % self._name
+
+    def _pending_key(self, number):
+        return 'running_totals:%s:pending:%d' % (self._name, number)
+
+    def _pending_count_key(self):
+        return 'running_totals:%s:pending-count' % self._name
+
+    def _flushed_count_key(self):
+        return 'running_totals:%s:flushed-count' % self._name
+
+    def reset(self, totals):
+        """Replaces the totals with a full recount and clears the shards.
+
+        Changes still buffered are dropped, as the recount has seen them.
+        """
+        models.MemcacheManager.set(
+            self._flushed_count_key(),
+            models.MemcacheManager.get(self._pending_count_key()) or 0, ttl=0)
+        entities.put(
+            [RunningTotalsEntity(
+                key_name=self._key_name(self.BASE),
+                data=transforms.dumps(totals))] +
+            [RunningTotalsEntity(
+                key_name=self._key_name(shard), data=transforms.dumps(None))
+             for shard in xrange(NUM_SHARDS)])
+        models.MemcacheManager.set(self._memcache_key(), True)
+
+    def exists(self):
+        """Whether a recount has established the totals, cached in memcache.
+
+        Lets callers skip working out deltas that add() would only drop.
+        """
+        exists = models.MemcacheManager.get(self._memcache_key())
+        if exists is None:
+            exists = bool(RunningTotalsEntity.get_by_key_name(
+                self._key_name(self.BASE)))
+            models.MemcacheManager.set(self._memcache_key(), exists)
+        return exists
+
+    def add(self, deltas):
+        """Records signed deltas to the totals, if the totals exist at all.
+
+        Totals are only established by a full recount; until one has run in
+        the course there is nothing meaningful to adjust, and the deltas are
+        dropped.  Otherwise the deltas are buffered for flush() to apply.
+        Deltas that cannot be written are logged and dropped, rather than
+        failing the student's request; the next recount puts the totals
+        right.
+
+        Returns:
+            True if the deltas were recorded.
+        """
+        if not deltas or not self.exists():
+            return False
+        number = models.MemcacheManager.incr(self._pending_count_key(), 1)
+        if number:
+            models.MemcacheManager.set(
+                self._pending_key(number), deltas, ttl=BUFFER_TTL_SEC)
+            return True
+        return self._apply(deltas)
+
+    def _apply(self, deltas):
+        try:
+            return db.run_in_transaction(
+                self._add_in_txn,
+                self._key_name(random.randrange(NUM_SHARDS)), deltas)
+        except db.Error:
+            logging.exception('Failed to update %s totals', self._name)
+            return False
+
+    def flush(self):
+        """Applies the changes buffered in the current namespace.
+
+        Each batch of changes is added up and applied in one transaction.  If
+        that fails, the batch is left for the next flush.
+
+        Returns:
+            The number of changes applied.
+        """
+        count = models.MemcacheManager.get(self._pending_count_key()) or 0
+        flushed = models.MemcacheManager.get(self._flushed_count_key()) or 0
+        if flushed > count:
+            # The counter was evicted and has started again from zero.
+            flushed = 0
+
+        num_applied = 0
+        for start in xrange(flushed + 1, count + 1, FLUSH_BATCH_SIZE):
+            end = min(start + FLUSH_BATCH_SIZE, count + 1)
+            pending = models.MemcacheManager.get_multi(
+                [self._pending_key(number) for number in xrange(start, end)])
+            total = None
+            for deltas in pending.itervalues():
+                if deltas:
+                    total = _add(total, deltas, True)
+                    num_applied += 1
+            if total is not None and not self._apply(total):
+                break
+            models.MemcacheManager.delete_multi(pending.keys())
+            models.MemcacheManager.set(
+                self._flushed_count_key(), end - 1, ttl=0)
+        return num_applied
+
+    def _add_in_txn(self, key_name, deltas):
+        entity = RunningTotalsEntity.get_by_key_name(key_name)
+        if not entity:
+            return False
+        entity.data = transforms.dumps(
+            _add(transforms.loads(entity.data), deltas, True))
+        entity.put()
+        return True
+
+    def load(self):
+        """Returns the current totals, or None if never recounted."""
+        parts = RunningTotalsEntity.get_by_key_name(
+            [self._key_name(self.BASE)] +
+            [self._key_name(shard) for shard in xrange(NUM_SHARDS)])
+        if not parts[0]:
+            return None
+        totals = transforms.loads(parts[0].data)
+        for part in parts[1:]:
+            deltas = transforms.loads(part.data) if part else None
+            if deltas is not None:
+                totals = _add(totals, deltas, self._add_new_keys)
+        return totals
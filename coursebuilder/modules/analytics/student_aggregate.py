@@ -26,6 +26,7 @@ from mapreduce import context
 from common import schema_fields
 from common import utils as common_utils
 from controllers import sites
+from controllers import utils
 from models import courses
 from models import data_sources
 from models import entities
@@ -136,6 +137,36 @@ class AbstractStudentAggregationComponent(object):
         """
         raise NotImplementedError()
 
+    # pylint: disable=unused-argument
+    def merge_aggregate(self, course, student, static_params, previous,
+                        num_previous_items, event_items):
+        """Fold new event-item outputs into a previously produced aggregate.
+
+        Called instead of produce_aggregate() from the reduce phase of an
+        incremental job, which only maps over events recorded since the last
+        successful run.  Components must override this to take part in
+        incremental aggregation; if any registered component does not, the
+        incremental job falls back to recomputing everything.
+
+        Implementations typically rebuild the process_event() items that
+        previous must have come from, append event_items, and hand the lot to
+        produce_aggregate().
+
+        Args:
+          course: The Course in which the student and the events are found.
+          student: the Student for which the events occurred.
+          static_params: the value from build_static_params(), if any.
+          previous: the dict this component produced on the previous run, or
+              None if it produced nothing for this Student.
+          num_previous_items: the number of event items that were folded into
+              previous.  Useful for re-weighting frequencies.
+          event_items: a list of the items produced by process_event() for
+              the given Student from events recorded since the previous run.
+        Returns:
+          A dict corresponding to the declared schema.
+        """
+        raise NotImplementedError()
+
     def get_schema(self):
         """Provide the partial schema for results produced.
 
@@ -149,6 +180,15 @@ class AbstractStudentAggregationComponent(object):
     def _fix_timestamp(cls, timestamp):
         return int((timestamp - UNIX_EPOCH).total_seconds())
 
+    @classmethod
+    def _unpack_frequencies(cls, frequencies, num_items, item_fn):
+        """Rebuild event items from a list of {..., 'frequency': f} dicts."""
+        ret = []
+        for frequency in frequencies:
+            count = int(round(frequency['frequency'] * num_items))
+            ret.extend([item_fn(frequency)] * count)
+        return ret
+
 
 class StudentAggregateEntity(entities.BaseEntity):
     """Holds data aggregated from Event entites for a single Student.
@@ -163,11 +203,58 @@ class StudentAggregateEntity(entities.BaseEntity):
 
     data = db.BlobProperty()
 
+    # Exclusive upper bound on recorded_on of the events folded into data.
+    merged_through = db.DateTimeProperty(indexed=False)
+
+    # JSON dict of component name to number of event items folded into data.
+    item_counts = db.TextProperty()
+
     @classmethod
     def safe_key(cls, db_key, transform_fn):
         return db.Key.from_path(cls.kind(), transform_fn(db_key.id_or_name()))
 
 
+class StudentAggregateHighWaterMarkEntity(entities.BaseEntity):
+    """Tracks how far student aggregation has progressed in a course.
+
+    There is one of these per course namespace.  merged_through is the
+    recorded_on time up to which every StudentAggregateEntity in the course is
+    known to be current.  pending_through is the bound being worked towards by
+    the most recently submitted job; it becomes the new merged_through once
+    that job is seen to have completed successfully.
+    """
+
+    KEY_NAME = 'high_water_mark'
+
+    merged_through = db.DateTimeProperty(indexed=False)
+    pending_through = db.DateTimeProperty(indexed=False)
+    pending_job_name = db.StringProperty(indexed=False)
+
+    @classmethod
+    def get_or_create(cls):
+        return cls.get_by_key_name(cls.KEY_NAME) or cls(key_name=cls.KEY_NAME)
+
+    def begin_window(self, job_name, until):
+        """Commit the previous window if its job finished; start a new one.
+
+        Args:
+          job_name: name of the DurableJob about to be submitted.
+          until: datetime.  Exclusive upper bound for the new window.
+        Returns:
+          The datetime from which the new window starts, or None if no
+          complete aggregation has been recorded yet.
+        """
+        if self.pending_through and self.pending_job_name:
+            # pylint: disable=protected-access
+            job = jobs.DurableJobEntity._get_by_name(self.pending_job_name)
+            if job and job.status_code == jobs.STATUS_CODE_COMPLETED:
+                self.merged_through = self.pending_through
+        self.pending_through = until
+        self.pending_job_name = job_name
+        self.put()
+        return self.merged_through
+
+
 class StudentAggregateGenerator(jobs.MapReduceJob):
     """M/R job to aggregate data by student using registered plug-ins.
 
@@ -179,6 +266,13 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
 
     """
 
+    # Events may be recorded with a timestamp a little before they become
+    # visible to queries; leave them for the next run rather than miss them.
+    WINDOW_END_SKEW = datetime.timedelta(minutes=5)
+
+    # Whether this job only folds in events recorded since the previous run.
+    INCREMENTAL = False
+
     @staticmethod
     def get_description():
         return 'student_aggregate'
@@ -187,14 +281,32 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
     def entity_class():
         return models.EventEntity
 
+    @classmethod
+    def _get_window_end(cls):
+        return datetime.datetime.utcnow() - cls.WINDOW_END_SKEW
+
     def build_additional_mapper_params(self, app_context):
         schemas = {}
         schema_names = {}
+        until = self._get_window_end()
+        since = StudentAggregateHighWaterMarkEntity.get_or_create(
+            ).begin_window(self._job_name, until)
+        incremental = self.INCREMENTAL and since is not None
+        if (incremental and
+            not StudentAggregateComponentRegistry.supports_incremental()):
+            logging.warning(
+                'Not all student aggregation components implement '
+                'merge_aggregate(); recomputing all aggregates.')
+            incremental = False
         ret = {
             'course_namespace': app_context.get_namespace_name(),
             'schemas': schemas,
             'schema_names': schema_names,
+            'incremental': incremental,
+            'until': _datetime_to_usec(until),
             }
+        if incremental:
+            ret['filters'] = [('recorded_on', '>=', since)]
         for component in StudentAggregateComponentRegistry.get_components():
             component_name = component.get_name()
             static_value = component.build_static_params(app_context)
@@ -211,10 +323,13 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
 
     @staticmethod
     def map(event):
+        params = context.get().mapreduce_spec.mapper.params
+        recorded_on = _datetime_to_usec(event.recorded_on)
+        if recorded_on >= params['until']:
+            return
         for component in (StudentAggregateComponentRegistry.
                           get_components_for_event_source(event.source)):
             component_name = component.get_name()
-            params = context.get().mapreduce_spec.mapper.params
             static_data = params.get(component_name)
             value = None
             try:
@@ -226,7 +341,8 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
                                  'component handler %s failed: %s',
                                  component_name, str(ex))
             if value:
-                value_str = '%s:%s' % (component_name, transforms.dumps(value))
+                value_str = '%s:%d:%s' % (
+                    component_name, recorded_on, transforms.dumps(value))
                 yield event.user_id, value_str
 
     @staticmethod
@@ -245,29 +361,61 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
                 'was not loaded.  Ignoring records for this student.', user_id)
             return
 
-        params = context.get().mapreduce_spec.mapper.params
-        ns = params['course_namespace']
-        app_context = sites.get_course_index().get_app_context_for_namespace(ns)
-        course = courses.Course(None, app_context=app_context)
-
-        # Bundle items together into lists by collection name
+        mapreduce_spec = context.get().mapreduce_spec
+        params = mapreduce_spec.mapper.params
+        course = _get_reducer_course(
+            mapreduce_spec.mapreduce_id, params['course_namespace'])
+
+        previous = None
+        previous_aggregate = {}
+        previous_counts = {}
+        merged_through = 0
+        if params.get('incremental'):
+            previous = StudentAggregateEntity.get_by_key_name(user_id)
+        if previous:
+            previous_aggregate = transforms.loads(
+                zlib.decompress(previous.data))
+            previous_counts = transforms.loads(previous.item_counts or '{}')
+            if previous.merged_through:
+                merged_through = _datetime_to_usec(previous.merged_through)
+
+        # Bundle items together into lists by collection name.  When merging,
+        # skip events already folded in by an earlier run that got this far
+        # before failing.
         event_items = collections.defaultdict(list)
         for value in values:
-            component_name, payload = value.split(':', 1)
-            event_items[component_name].append(transforms.loads(payload))
+            component_name, recorded_on, payload = value.split(':', 2)
+            if int(recorded_on) >= merged_through:
+                event_items[component_name].append(transforms.loads(payload))
+        if previous and not event_items:
+            return
 
         # Build up per-Student aggregate by calling each component.  Note that
         # we call each component whether or not its mapper produced any
         # output.
         aggregate = {}
+        item_counts = {}
         for component in StudentAggregateComponentRegistry.get_components():
             component_name = component.get_name()
+            schema_name = params['schema_names'][component_name]
             static_value = params.get(component_name)
+            items = event_items.get(component_name, [])
             value = {}
             try:
-                value = component.produce_aggregate(
-                    course, student, static_value,
-                    event_items.get(component_name, []))
+                if previous:
+                    num_previous = previous_counts.get(component_name, 0)
+                    previous_value = None
+                    if schema_name in previous_aggregate:
+                        previous_value = {
+                            schema_name: previous_aggregate[schema_name]}
+                    item_counts[component_name] = num_previous + len(items)
+                    value = component.merge_aggregate(
+                        course, student, static_value, previous_value,
+                        num_previous, items)
+                else:
+                    item_counts[component_name] = len(items)
+                    value = component.produce_aggregate(
+                        course, student, static_value, items)
                 if not value:
                     continue
             # pylint: disable=broad-except
@@ -278,7 +426,6 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
                                  component_name, str(ex))
                 continue
 
-            schema_name = params['schema_names'][component_name]
             if schema_name not in value:
                 logging.critical(
                     'Student aggregation reduce handler %s produced '
@@ -314,7 +461,78 @@ class StudentAggregateGenerator(jobs.MapReduceJob):
                 'Aggregated compressed student data is over %d bytes; '
                 'cannot store this in one field; ignoring this record!')
         else:
-            StudentAggregateEntity(key_name=user_id, data=data).put()
+            StudentAggregateEntity(
+                key_name=user_id, data=data,
+                merged_through=_usec_to_datetime(params['until']),
+                item_counts=transforms.dumps(item_counts)).put()
+
+
+class IncrementalStudentAggregateGenerator(StudentAggregateGenerator):
+    """Folds events recorded since the last run into existing aggregates.
+
+    Only EventEntity rows recorded after the course's high-water mark are
+    mapped, and the reduce step merges them into each Student's existing
+    StudentAggregateEntity via the components' merge_aggregate() hooks.
+    Until a StudentAggregateGenerator or an earlier run of this job has
+    completed, or if some component cannot merge, this recomputes everything
+    just as StudentAggregateGenerator does.
+    """
+
+    INCREMENTAL = True
+
+    @staticmethod
+    def get_description():
+        return 'student_aggregate_incremental'
+
+
+class StartIncrementalStudentAggregate(utils.AbstractAllCoursesCronHandler):
+    """Daily refresh of student aggregates in courses that have them."""
+
+    URL = '/cron/analytics/student_aggregate'
+
+    @classmethod
+    def is_globally_enabled(cls):
+        return True
+
+    @classmethod
+    def is_enabled_for_course(cls, app_context):
+        with common_utils.Namespace(app_context.get_namespace_name()):
+            mark = StudentAggregateHighWaterMarkEntity.get_by_key_name(
+                StudentAggregateHighWaterMarkEntity.KEY_NAME)
+        return bool(mark and mark.pending_through)
+
+    def cron_action(self, app_context, global_state):
+        full_job = StudentAggregateGenerator(app_context)
+        job = IncrementalStudentAggregateGenerator(app_context)
+        if full_job.is_active() or job.is_active():
+            logging.info('Student aggregation for %s still running; not '
+                         'starting another.', app_context.get_slug())
+            return
+        job.submit()
+
+
+_reducer_course = (None, None)
+
+
+def _get_reducer_course(mapreduce_id, namespace):
+    """Get a Course shared by all reduce calls for one job in this instance."""
+    global _reducer_course  # pylint: disable=global-statement
+    cache_key, course = _reducer_course
+    if cache_key != (mapreduce_id, namespace):
+        app_context = sites.get_course_index().get_app_context_for_namespace(
+            namespace)
+        course = courses.Course(None, app_context=app_context)
+        _reducer_course = ((mapreduce_id, namespace), course)
+    return course
+
+
+def _datetime_to_usec(when):
+    delta = when - UNIX_EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _usec_to_datetime(usec):
+    return UNIX_EPOCH + datetime.timedelta(microseconds=usec)
 
 
 class StudentAggregateComponentRegistry(
@@ -421,3 +639,10 @@ class StudentAggregateComponentRegistry(
     @classmethod
     def get_components(cls):
         return cls._components
+
+    @classmethod
+    def supports_incremental(cls):
+        base_merge = AbstractStudentAggregationComponent.merge_aggregate
+        return all(
+            component.merge_aggregate.im_func is not base_merge.im_func
+            for component in cls._components)
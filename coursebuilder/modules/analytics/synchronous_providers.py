@@ -20,20 +20,134 @@ import logging
 import urlparse
 
 from common import safe_dom
+from controllers import sites
+from controllers import utils
 from models import courses
 from models import data_sources
 from models import jobs
+from models import models
 from models import progress
 from models import transforms
-from models import utils as models_utils
 from models.models import EventEntity
+from models.models import EventSegmentEntity
 from models.models import Student
 from models.models import StudentPropertyEntity
-
-
-class StudentEnrollmentAndScoresGenerator(jobs.DurableJob):
+from modules.analytics import running_totals
+
+
+class _QueryScanJob(jobs.ResumableJob):
+    """Visits all entities of one or more queries in batches, checkpointing.
+
+    The checkpoint holds which query is being read and its cursor, the
+    number of entities visited so far, and the state of every aggregator.
+    Progress is estimated after each batch from a count of the entities left
+    to visit, capped at PROGRESS_COUNT_LIMIT per query, so no run counts a
+    whole query. Aggregators implement visit(entity), get_state() returning
+    a JSON-serializable value, and set_state(state).
+
+    If RUNNING_TOTALS is set, the result of each completed scan replaces
+    those totals, which hooks then keep current until the next scan.
+    """
+
+    BATCH_SIZE = 500
+
+    # Most entities counted ahead of the cursor in each query when estimating
+    # progress; while more remain, the estimate stays low.
+    PROGRESS_COUNT_LIMIT = 1000
+
+    # running_totals.RunningTotals re-established by each scan, if any.
+    RUNNING_TOTALS = None
+
+    def _get_query(self):
+        """Override to return a new db.Query over the entities to visit."""
+        raise NotImplementedError()
+
+    def _get_queries(self):
+        """Override to visit the results of several queries in turn."""
+        return [self._get_query()]
+
+    def _expand(self, entity):
+        """Override to visit items derived from an entity instead of it."""
+        return [entity]
+
+    def _create_aggregators(self):
+        """Override to return a dict of name to new aggregator."""
+        raise NotImplementedError()
+
+    def _get_result(self, aggregators):
+        """Override to build the job output from the final aggregators."""
+        raise NotImplementedError()
+
+    def _restore_aggregators(self, checkpoint):
+        aggregators = self._create_aggregators()
+        for name, state in checkpoint['state'].iteritems():
+            aggregators[name].set_state(state)
+        return aggregators
+
+    def start(self):
+        return {
+            'query': 0,
+            'cursor': None,
+            'done': 0,
+            'state': {}}
+
+    def resume(self, checkpoint):
+        aggregators = self._restore_aggregators(checkpoint)
+        index = checkpoint.get('query', 0)
+        cursor = checkpoint['cursor']
+        while True:
+            queries = self._get_queries()
+            if index >= len(queries):
+                return
+            query = queries[index]
+            if cursor:
+                query.with_cursor(cursor)
+            batch = query.fetch(self.BATCH_SIZE)
+            if not batch:
+                index, cursor = index + 1, None
+                continue
+            for entity in batch:
+                for item in self._expand(entity):
+                    for aggregator in aggregators.itervalues():
+                        aggregator.visit(item)
+
+            if len(batch) < self.BATCH_SIZE:
+                index, cursor = index + 1, None
+            else:
+                cursor = query.cursor()
+            done = checkpoint['done'] + len(batch)
+            checkpoint = {
+                'query': index,
+                'cursor': cursor,
+                'done': done,
+                'state': dict(
+                    (name, aggregator.get_state())
+                    for name, aggregator in aggregators.iteritems())}
+            remaining = self._estimate_remaining(index, cursor)
+            yield checkpoint, min(99, done * 100 // (done + remaining))
+
+    def _estimate_remaining(self, index, cursor):
+        remaining = 0
+        for query in self._get_queries()[index:]:
+            if cursor:
+                query.with_cursor(cursor)
+                cursor = None
+            remaining += query.count(limit=self.PROGRESS_COUNT_LIMIT)
+        return remaining
+
+    def finish(self, checkpoint):
+        result = self._get_result(self._restore_aggregators(checkpoint))
+        if self.RUNNING_TOTALS:
+            self.RUNNING_TOTALS.reset(result)
+        return result
+
+
+class StudentEnrollmentAndScoresGenerator(_QueryScanJob):
     """A job that computes student statistics."""
 
+    RUNNING_TOTALS = running_totals.RunningTotals(
+        'student_enrollment_and_scores')
+
     @staticmethod
     def get_description():
         return 'student enrollment and scores'
@@ -47,6 +161,12 @@ class StudentEnrollmentAndScoresGenerator(jobs.DurableJob):
             #     (student_count, sum(score))
             self.name_to_tuple = {}
 
+        def get_state(self):
+            return self.name_to_tuple
+
+        def set_state(self, state):
+            self.name_to_tuple = state
+
         def visit(self, student):
             if student.scores:
                 scores = transforms.loads(student.scores)
@@ -67,33 +187,69 @@ class StudentEnrollmentAndScoresGenerator(jobs.DurableJob):
             self.enrolled = 0
             self.unenrolled = 0
 
+        def get_state(self):
+            return {'enrolled': self.enrolled, 'unenrolled': self.unenrolled}
+
+        def set_state(self, state):
+            self.enrolled = state['enrolled']
+            self.unenrolled = state['unenrolled']
+
         def visit(self, student):
             if student.is_enrolled:
                 self.enrolled += 1
             else:
                 self.unenrolled += 1
 
-    def run(self):
-        """Computes student statistics."""
-        enrollment = self.EnrollmentAggregator()
-        scores = self.ScoresAggregator()
-        mapper = models_utils.QueryMapper(
-            Student.all(), batch_size=500, report_every=1000)
-
-        def map_fn(student):
-            enrollment.visit(student)
-            scores.visit(student)
+    def _get_query(self):
+        return Student.all()
 
-        mapper.run(map_fn)
+    def _create_aggregators(self):
+        return {
+            'enrollment': self.EnrollmentAggregator(),
+            'scores': self.ScoresAggregator()}
 
+    def _get_result(self, aggregators):
+        """Computes student statistics."""
+        enrollment = aggregators['enrollment']
         data = {
             'enrollment': {
                 'enrolled': enrollment.enrolled,
                 'unenrolled': enrollment.unenrolled},
-            'scores': scores.name_to_tuple}
+            'scores': aggregators['scores'].name_to_tuple}
 
         return data
 
+    @classmethod
+    def count_enrollment_change(cls, enrolled, unenrolled):
+        cls.RUNNING_TOTALS.add({
+            'enrollment': {'enrolled': enrolled, 'unenrolled': unenrolled}})
+
+    @classmethod
+    def count_score_change(cls, unused_student, assessment_type, old_score,
+                           new_score):
+        """Hook for Student.POST_UPDATE_SCORE_HOOKS."""
+        if old_score is None:
+            delta = [1, float(new_score)]
+        else:
+            delta = [0, float(new_score) - float(old_score)]
+        cls.RUNNING_TOTALS.add({'scores': {assessment_type: delta}})
+
+
+# StudentLifecycleObserver callbacks keeping enrollment totals current.  A
+# student who registers again after unenrolling is reported as an add, so
+# stays counted as unenrolled too until the next recount.
+
+def count_student_added(unused_user_id, unused_utc_date_time):
+    StudentEnrollmentAndScoresGenerator.count_enrollment_change(1, 0)
+
+
+def count_student_unenrolled(unused_user_id, unused_utc_date_time):
+    StudentEnrollmentAndScoresGenerator.count_enrollment_change(-1, 1)
+
+
+def count_student_reenrolled(unused_user_id, unused_utc_date_time):
+    StudentEnrollmentAndScoresGenerator.count_enrollment_change(1, -1)
+
 
 class StudentEnrollmentAndScoresSource(data_sources.SynchronousQuery):
     """Shows student enrollment analytics on the dashboard."""
@@ -104,7 +260,9 @@ class StudentEnrollmentAndScoresSource(data_sources.SynchronousQuery):
 
     @staticmethod
     def fill_values(app_context, template_values, job):
-        stats = transforms.loads(job.output)
+        stats = StudentEnrollmentAndScoresGenerator.RUNNING_TOTALS.load()
+        if stats is None:
+            stats = transforms.loads(job.output)
 
         course = courses.Course(None, app_context)
 
@@ -129,9 +287,11 @@ class StudentEnrollmentAndScoresSource(data_sources.SynchronousQuery):
         template_values['total_records'] = total_records
 
 
-class StudentProgressStatsGenerator(jobs.DurableJob):
+class StudentProgressStatsGenerator(_QueryScanJob):
     """A job that computes student progress statistics."""
 
+    RUNNING_TOTALS = running_totals.RunningTotals('student_progress')
+
     @staticmethod
     def get_description():
         return 'student progress'
@@ -143,37 +303,79 @@ class StudentProgressStatsGenerator(jobs.DurableJob):
             self.progress_data = {}
             self._tracker = progress.UnitLessonCompletionTracker(course)
 
+        def get_state(self):
+            return self.progress_data
+
+        def set_state(self, state):
+            self.progress_data = state
+
+        def get_counts(self, value):
+            """Returns what one student's progress adds to each entity."""
+            counts = {}
+            if not value:
+                return counts
+            entity_scores = transforms.loads(value)
+            for entity in entity_scores:
+                entity_score = {'progress': 0, 'completed': 0}
+                if self._tracker.determine_if_composite_entity(entity):
+                    if (entity_scores[entity] ==
+                        self._tracker.IN_PROGRESS_STATE):
+                        entity_score['progress'] += 1
+                    elif (entity_scores[entity] ==
+                          self._tracker.COMPLETED_STATE):
+                        entity_score['completed'] += 1
+                else:
+                    if entity_scores[entity] != 0:
+                        entity_score['completed'] += 1
+                counts[entity] = entity_score
+            return counts
+
         def visit(self, student_property):
-            if (student_property.value and
-                student_property.name ==
+            if (student_property.name ==
                 progress.UnitLessonCompletionTracker.PROPERTY_KEY):
-                entity_scores = transforms.loads(student_property.value)
-                for entity in entity_scores:
+                counts = self.get_counts(student_property.value)
+                for entity, entity_counts in counts.iteritems():
                     entity_score = self.progress_data.get(
                         entity, {'progress': 0, 'completed': 0})
-                    if self._tracker.determine_if_composite_entity(entity):
-                        if (entity_scores[entity] ==
-                            self._tracker.IN_PROGRESS_STATE):
-                            entity_score['progress'] += 1
-                        elif (entity_scores[entity] ==
-                              self._tracker.COMPLETED_STATE):
-                            entity_score['completed'] += 1
-                    else:
-                        if entity_scores[entity] != 0:
-                            entity_score['completed'] += 1
+                    entity_score['progress'] += entity_counts['progress']
+                    entity_score['completed'] += entity_counts['completed']
                     self.progress_data[entity] = entity_score
 
     def __init__(self, app_context):
         super(StudentProgressStatsGenerator, self).__init__(app_context)
         self._course = courses.Course(None, app_context)
 
-    def run(self):
+    def _get_query(self):
+        return StudentPropertyEntity.all()
+
+    def _create_aggregators(self):
+        return {'progress': self.ProgressAggregator(self._course)}
+
+    def _get_result(self, aggregators):
         """Computes student progress statistics."""
-        student_progress = self.ProgressAggregator(self._course)
-        mapper = models_utils.QueryMapper(
-            StudentPropertyEntity.all(), batch_size=500, report_every=1000)
-        mapper.run(student_progress.visit)
-        return student_progress.progress_data
+        return aggregators['progress'].progress_data
+
+    @classmethod
+    def count_progress_change(cls, course, unused_student, old_value,
+                              new_value):
+        """Hook for UnitLessonCompletionTracker.POST_SAVE_PROGRESS_HOOK."""
+        if not cls.RUNNING_TOTALS.exists():
+            return
+        aggregator = cls.ProgressAggregator(course)
+        old_counts = aggregator.get_counts(old_value)
+        new_counts = aggregator.get_counts(new_value)
+        no_counts = {'progress': 0, 'completed': 0}
+        deltas = {}
+        for entity in set(old_counts) | set(new_counts):
+            old = old_counts.get(entity, no_counts)
+            new = new_counts.get(entity, no_counts)
+            # An entity seen for the first time is listed even if it counts
+            # for nothing yet, as a recount would list it.
+            if old != new or entity not in old_counts:
+                deltas[entity] = {
+                    'progress': new['progress'] - old['progress'],
+                    'completed': new['completed'] - old['completed']}
+        cls.RUNNING_TOTALS.add(deltas)
 
 
 class StudentProgressStatsSource(data_sources.SynchronousQuery):
@@ -188,7 +390,9 @@ class StudentProgressStatsSource(data_sources.SynchronousQuery):
         course = courses.Course(None, app_context=app_context)
         template_values['entity_codes'] = transforms.dumps(
             progress.UnitLessonCompletionTracker.EVENT_CODE_MAPPING.values())
-        value = transforms.loads(job.output)
+        value = StudentProgressStatsGenerator.RUNNING_TOTALS.load()
+        if value is None:
+            value = transforms.loads(job.output)
         if value:
             value = transforms.dumps(value)
         else:
@@ -204,15 +408,20 @@ class StudentProgressStatsSource(data_sources.SynchronousQuery):
                 'This feature is supported by CB 1.3 and up.')
 
 
-class QuestionStatsGenerator(jobs.DurableJob):
+class QuestionStatsGenerator(_QueryScanJob):
     """A job that computes stats for student submissions to questions."""
 
+    # The recount lays out every question in the course, so answers to
+    # questions it does not know about are left out, as a recount would.
+    RUNNING_TOTALS = running_totals.RunningTotals(
+        'question_stats', add_new_keys=False)
+
     @staticmethod
     def get_description():
         return 'question analysis'
 
-    class MultipleChoiceQuestionAggregator(object):
-        """Class that aggregates submissions for multiple-choice questions."""
+    class QuestionEventSummarizer(object):
+        """Extracts the multiple-choice answers submitted in events."""
 
         ATTEMPT_ACTIVITY = 'attempt-activity'
         TAG_ASSESSMENT = 'tag-assessment'
@@ -226,37 +435,26 @@ class QuestionStatsGenerator(jobs.DurableJob):
 
         def __init__(self, course):
             self._course = course
-            self.id_to_questions_dict = progress.UnitLessonCompletionTracker(
-                course).get_id_to_questions_dict()
-            self.id_to_assessments_dict = progress.UnitLessonCompletionTracker(
-                course).get_id_to_assessments_dict()
 
         def _get_course(self):
             return self._course
 
-        def _append_data(self, summarized_question, dict_to_update):
-            # Validate the structure and content of summarized_question dict.
+        def _is_valid_summary(self, summarized_question):
+            """Validates the structure and content of a summarized question."""
             if set(summarized_question.keys()) != {'id', 'score', 'answers'}:
-                return
+                return False
             if not isinstance(summarized_question['score'], (int, float)):
-                return
+                return False
             if not isinstance(summarized_question['answers'], list):
-                return
+                return False
             if any(not isinstance(answer, int) for answer in (
                     summarized_question['answers'])):
-                return
-            if summarized_question['id'] not in dict_to_update:
-                return
-            if max(summarized_question['answers']) >= len(
-                    dict_to_update[summarized_question['id']]['answer_counts']):
-                return
+                return False
+            return True
 
-            # Add the summarized_question to the aggregating dict.
-            q_dict = dict_to_update[summarized_question['id']]
-            q_dict['score'] += summarized_question['score']
-            q_dict['num_attempts'] += 1
-            for choice_index in summarized_question['answers']:
-                q_dict['answer_counts'][choice_index] += 1
+        def _is_assessment_event(self, source):
+            return (source == self.SUBMIT_ASSESSMENT or
+                    source == self.ATTEMPT_ASSESSMENT)
 
         def _get_unit_and_lesson_id_from_url(self, url):
             url_components = urlparse.urlparse(url)
@@ -462,6 +660,78 @@ class QuestionStatsGenerator(jobs.DurableJob):
 
             return question_list
 
+        def get_deltas(self, source, data):
+            """Returns what one event adds to the generator's output.
+
+            The result has the shape of the [questions, assessments] dicts
+            built by MultipleChoiceQuestionAggregator, but holds only the
+            questions answered in the event.  Question ids and choices are
+            not checked against the course here; running totals ignore any
+            that the last recount did not lay out.
+            """
+            id_to_questions_dict = {}
+            id_to_assessments_dict = {}
+            if self._is_assessment_event(source):
+                dict_to_update = id_to_assessments_dict
+            else:
+                dict_to_update = id_to_questions_dict
+
+            for summarized_question in self._process_event(source, data):
+                if (not self._is_valid_summary(summarized_question) or
+                    any(answer < 0 for answer in (
+                        summarized_question['answers']))):
+                    continue
+                q_dict = dict_to_update.setdefault(
+                    summarized_question['id'],
+                    {'score': 0, 'num_attempts': 0, 'answer_counts': []})
+                q_dict['score'] += summarized_question['score']
+                q_dict['num_attempts'] += 1
+                answer_counts = q_dict['answer_counts']
+                for choice_index in summarized_question['answers']:
+                    answer_counts.extend(
+                        [0] * (choice_index + 1 - len(answer_counts)))
+                    answer_counts[choice_index] += 1
+
+            if not id_to_questions_dict and not id_to_assessments_dict:
+                return None
+            return [id_to_questions_dict, id_to_assessments_dict]
+
+    class MultipleChoiceQuestionAggregator(QuestionEventSummarizer):
+        """Class that aggregates submissions for multiple-choice questions."""
+
+        def __init__(self, course):
+            super(QuestionStatsGenerator.MultipleChoiceQuestionAggregator,
+                  self).__init__(course)
+            self.id_to_questions_dict = progress.UnitLessonCompletionTracker(
+                course).get_id_to_questions_dict()
+            self.id_to_assessments_dict = progress.UnitLessonCompletionTracker(
+                course).get_id_to_assessments_dict()
+
+        def get_state(self):
+            return {
+                'questions': self.id_to_questions_dict,
+                'assessments': self.id_to_assessments_dict}
+
+        def set_state(self, state):
+            self.id_to_questions_dict = state['questions']
+            self.id_to_assessments_dict = state['assessments']
+
+        def _append_data(self, summarized_question, dict_to_update):
+            if not self._is_valid_summary(summarized_question):
+                return
+            if summarized_question['id'] not in dict_to_update:
+                return
+            if max(summarized_question['answers']) >= len(
+                    dict_to_update[summarized_question['id']]['answer_counts']):
+                return
+
+            # Add the summarized_question to the aggregating dict.
+            q_dict = dict_to_update[summarized_question['id']]
+            q_dict['score'] += summarized_question['score']
+            q_dict['num_attempts'] += 1
+            for choice_index in summarized_question['answers']:
+                q_dict['answer_counts'][choice_index] += 1
+
         def visit(self, event_entity):
             """Records question data from given event_entity."""
             if not event_entity or not event_entity.source:
@@ -478,8 +748,7 @@ class QuestionStatsGenerator(jobs.DurableJob):
             question_list = self._process_event(event_entity.source, data)
 
             # Update the correct dict according to the event source.
-            if (event_entity.source == self.SUBMIT_ASSESSMENT or
-                event_entity.source == self.ATTEMPT_ASSESSMENT):
+            if self._is_assessment_event(event_entity.source):
                 dict_to_update = self.id_to_assessments_dict
             else:
                 dict_to_update = self.id_to_questions_dict
@@ -491,15 +760,41 @@ class QuestionStatsGenerator(jobs.DurableJob):
         super(QuestionStatsGenerator, self).__init__(app_context)
         self._course = courses.Course(None, app_context)
 
-    def run(self):
+    def _get_queries(self):
+        return [EventEntity.all(), EventSegmentEntity.all()]
+
+    def _expand(self, entity):
+        if isinstance(entity, EventSegmentEntity):
+            return entity.get_events()
+        return [entity]
+
+    def _create_aggregators(self):
+        return {
+            'questions': self.MultipleChoiceQuestionAggregator(self._course)}
+
+    def _get_result(self, aggregators):
         """Computes submitted question answers statistics."""
-        question_stats = self.MultipleChoiceQuestionAggregator(self._course)
-        mapper = models_utils.QueryMapper(
-            EventEntity.all(), batch_size=500, report_every=1000)
-        mapper.run(question_stats.visit)
+        question_stats = aggregators['questions']
         return (question_stats.id_to_questions_dict,
                 question_stats.id_to_assessments_dict)
 
+    @classmethod
+    def count_event(cls, source, unused_user, data):
+        """Hook for EventEntity.EVENT_LISTENERS."""
+        if source not in (
+            cls.QuestionEventSummarizer.ATTEMPT_ACTIVITY,
+            cls.QuestionEventSummarizer.TAG_ASSESSMENT,
+            cls.QuestionEventSummarizer.ATTEMPT_LESSON,
+            cls.QuestionEventSummarizer.SUBMIT_ASSESSMENT,
+            cls.QuestionEventSummarizer.ATTEMPT_ASSESSMENT):
+            return
+        app_context = sites.get_course_for_current_request()
+        if not app_context or not cls.RUNNING_TOTALS.exists():
+            return
+        summarizer = cls.QuestionEventSummarizer(
+            courses.Course.get(app_context))
+        cls.RUNNING_TOTALS.add(summarizer.get_deltas(source, data))
+
 
 class QuestionStatsSource(data_sources.SynchronousQuery):
     """Shows statistics on the dashboard for students' answers to questions."""
@@ -510,11 +805,33 @@ class QuestionStatsSource(data_sources.SynchronousQuery):
 
     @staticmethod
     def fill_values(app_context, template_values, job):
+        stats = QuestionStatsGenerator.RUNNING_TOTALS.load()
+        if stats is None:
+            stats = transforms.loads(job.output)
         # pylint: disable=unpacking-non-sequence
-        accumulated_question_answers, accumulated_assessment_answers = (
-            transforms.loads(job.output))
+        accumulated_question_answers, accumulated_assessment_answers = stats
 
         template_values['accumulated_question_answers'] = transforms.dumps(
             accumulated_question_answers)
         template_values['accumulated_assessment_answers'] = transforms.dumps(
             accumulated_assessment_answers)
+
+
+class FlushRunningTotals(utils.AbstractAllCoursesCronHandler):
+    """Applies the changes to running totals buffered in each course."""
+
+    URL = '/cron/analytics/flush_running_totals'  # Must match cron.yaml
+
+    @classmethod
+    def is_globally_enabled(cls):
+        return models.CAN_USE_MEMCACHE.value
+
+    @classmethod
+    def is_enabled_for_course(cls, app_context):
+        return True
+
+    def cron_action(self, app_context, global_state):
+        for generator in (StudentEnrollmentAndScoresGenerator,
+                          StudentProgressStatsGenerator,
+                          QuestionStatsGenerator):
+            generator.RUNNING_TOTALS.flush()
@@ -57,6 +57,16 @@ class UserAgentAggregator(
                 })
         return {'user_agent_frequencies': ret}
 
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params, previous,
+                        num_previous_items, event_items):
+        if previous:
+            event_items = cls._unpack_frequencies(
+                previous['user_agent_frequencies'], num_previous_items,
+                lambda item: item['user_agent']) + event_items
+        return cls.produce_aggregate(
+            course, student, static_params, event_items)
+
     @classmethod
     def get_schema(cls):
         user_agent_frequency = schema_fields.FieldRegistry(
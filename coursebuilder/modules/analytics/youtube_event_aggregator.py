@@ -29,6 +29,8 @@ ACTION_ID_TO_NAME = {
     3: 'buffering',
     5: 'video cued'
 }
+ACTION_NAME_TO_ID = dict(
+    (name, action_id) for action_id, name in ACTION_ID_TO_NAME.iteritems())
 
 
 class YouTubeEventAggregator(
@@ -92,6 +94,28 @@ class YouTubeEventAggregator(
 
         return {'youtube': youtube_interactions}
 
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params, previous,
+                        num_previous_items, event_items):
+        if previous:
+            old_items = []
+            for interaction in previous['youtube']:
+                for event in interaction['events']:
+                    action = event['action']
+                    if action in ACTION_NAME_TO_ID:
+                        action = ACTION_NAME_TO_ID[action]
+                    else:
+                        try:
+                            action = int(action)
+                        except ValueError:
+                            pass
+                    old_items.append([
+                        interaction['video_id'], event['position'], action,
+                        event['timestamp']])
+            event_items = old_items + event_items
+        return cls.produce_aggregate(
+            course, student, static_params, event_items)
+
     @classmethod
     def get_schema(cls):
         youtube_event = schema_fields.FieldRegistry('event')
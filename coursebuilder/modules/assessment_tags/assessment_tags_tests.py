@@ -129,3 +129,32 @@ class MultipleChoiceTagTests(actions.TestBase):
         self.assertIsNotNone(match)
         decoded_dict = transforms.loads(base64.b64decode(match.group(1)))
         self.assertIn('qg1.0.%s' % self.mc_1_id, decoded_dict)
+
+    def test_questions_are_loaded_in_bulk(self):
+        calls = []
+
+        def spy(dao, name):
+            original = getattr(dao, name)
+
+            def wrapper(unused_cls, arg):
+                calls.append((dao, name, arg))
+                return original(arg)
+            self.swap(dao, name, classmethod(wrapper))
+
+        spy(models.QuestionDAO, 'load')
+        spy(models.QuestionDAO, 'bulk_load')
+        spy(models.QuestionGroupDAO, 'load')
+        spy(models.QuestionGroupDAO, 'bulk_load')
+
+        response = self.get('assessment?name=%s' % self.assessment.unit_id)
+        self.assertIn('questionData[\'q1\']', response.body)
+        self.assertIn('questionData[\'qg1\']', response.body)
+
+        # One load for the groups, then one for all questions, including
+        # those in the groups; nothing loaded one at a time.
+        self.assertEquals(2, len(calls))
+        self.assertEquals(
+            (models.QuestionGroupDAO, 'bulk_load', [self.qg_1_id]), calls[0])
+        dao, name, quids = calls[1]
+        self.assertEquals((models.QuestionDAO, 'bulk_load'), (dao, name))
+        self.assertEquals(sorted([self.mc_1_id, self.mc_2_id]), sorted(quids))
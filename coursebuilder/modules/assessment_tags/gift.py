@@ -18,6 +18,7 @@ __author__ = 'borislavr@google.com (Boris Roussev)'
 
 
 import logging
+import re
 
 from pyparsing import alphanums
 from pyparsing import Combine
@@ -182,6 +183,46 @@ def set_questions(toks):
     return ('questions', toks)
 
 
+def split_questions(lines):
+    """Splits GIFT text into the source text of its individual questions.
+
+    Questions are separated by blank lines; a question is also considered
+    complete when a line closes its last open answer block.  Lines holding
+    only a '//' comment are dropped.  Working a line at a time lets callers
+    stream large question banks through the parser without the grammar ever
+    seeing more than one question.
+
+    Args:
+      lines: an iterable of lines, e.g. a file object or text.splitlines().
+    Yields:
+      (line_number, text) tuples; line_number is the 1-based number of the
+      first line of the question.
+    """
+    block = []
+    start = None
+    depth = 0
+    closed = False
+    for line_number, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if not stripped and not depth:
+            if block:
+                yield start, '\n'.join(block)
+            block, start, closed = [], None, False
+            continue
+        if stripped.startswith('//'):
+            continue
+        if start is None:
+            start = line_number
+        block.append(line.rstrip('\r\n'))
+        depth += line.count('{') - line.count('}')
+        closed = closed or '}' in line
+        if closed and depth <= 0:
+            yield start, '\n'.join(block)
+            block, start, depth, closed = [], None, 0, False
+    if block:
+        yield start, '\n'.join(block)
+
+
 class GiftParser(object):
     """Parser for GIFT format questions."""
 
@@ -494,11 +535,159 @@ class GiftParser(object):
             logging.exception('Invalid GIFT syntax: %s', text)
             raise ParseError(e.msg)
 
+    @classmethod
+    def parse_question(cls, text):
+        """Parses the text of exactly one GIFT question."""
+        result = GiftScanner.scan(text)
+        if result:
+            return result
+        try:
+            return cls.question.parseString(text)[0]
+        except ParseException as e:
+            raise ParseError(e.msg)
+
+    @classmethod
+    def iter_questions(cls, lines):
+        """Parses and converts GIFT questions one at a time.
+
+        A malformed question does not stop the parse; its error is reported
+        in its place and parsing resumes with the next question.
+
+        Args:
+          lines: an iterable of lines of GIFT text.
+        Yields:
+          (line_number, question, error) tuples, where exactly one of
+          question (a CB question dict) and error (a message) is set.
+        """
+        adapter = GiftAdapter()
+        for line_number, text in split_questions(lines):
+            try:
+                question = adapter.convert_to_question(
+                    cls.parse_question(text))
+            except (ParseError, ValueError) as e:
+                logging.warning(
+                    'Invalid GIFT question at line %s: %s', line_number, e)
+                yield line_number, None, 'Line %s: %s' % (line_number, e)
+            else:
+                yield line_number, question, None
+
     @classmethod
     def parse_questions(cls, text):
         """Parses a list new-line separated GIFT questions to."""
-        tree = cls.parse(text)
-        return [GiftAdapter().convert_to_question(node) for node in tree]
+        if not text:
+            raise ValueError('Questions field can\'t be blank.')
+        questions = []
+        errors = []
+        for _, question, error in cls.iter_questions(text.splitlines()):
+            if error:
+                errors.append(error)
+            else:
+                questions.append(question)
+        if errors:
+            raise ParseError('\n'.join(errors))
+        return questions
+
+
+class GiftScanner(object):
+    """Hand-written scanner for the most common shapes of GIFT question.
+
+    Essay, true-false and '='/'~' answer questions make up nearly all of a
+    typical question bank, and the grammar in GiftParser spends most of its
+    time trying and backtracking out of the other alternatives.  This scanner
+    recognizes those shapes directly and builds the same parse tree as the
+    grammar.  Anything it is not certain about (comments, numeric, match and
+    missing word questions, text after the answers) is left to the grammar.
+    """
+
+    TRUE_FALSE_RE = re.compile(r'^(TRUE|T|FALSE|F)\s*(?:#(.*))?$', re.DOTALL)
+
+    WEIGHT_RE = re.compile(r'\s*%([+-]?\d+)%')
+
+    ANSWER_TEXT_END_RE = re.compile(r'[#=~]')
+
+    FEEDBACK_END_RE = re.compile(r'[=~]')
+
+    @classmethod
+    def scan(cls, text):
+        """Returns the grammar's parse tree for text, or None if unsure."""
+        if '//' in text or '->' in text:
+            return None
+        text = text.strip()
+        title = ''
+        if text.startswith('::'):
+            end = text.find('::', 2)
+            if end < 0:
+                return None
+            title = text[2:end].strip()
+            text = text[end + 2:]
+        start = text.find('{')
+        end = text.find('}', start)
+        if start < 0 or end < 0 or text[end + 1:].strip():
+            return None
+        task = text[:start].strip()
+        body = text[start + 1:end]
+        if '{' in body:
+            return None
+
+        if not body.strip():
+            return ('question', (
+                ('type', 'essay'),
+                ('title', title),
+                ('task', task)))
+
+        match = cls.TRUE_FALSE_RE.match(body.strip())
+        if match:
+            return ('question', (
+                ('type', 'true_false'),
+                ('title', title),
+                ('task', task),
+                ('choices', [(
+                    ('text', match.group(1) in ('TRUE', 'T')),
+                    ('feedback', (match.group(2) or '').strip()))])))
+
+        choices = cls._scan_choices(body)
+        if not choices:
+            return None
+        return ('question', (
+            ('type', 'multi_choice'),
+            ('title', title),
+            ('task', task),
+            ('choices', choices)))
+
+    @classmethod
+    def _scan_choices(cls, body):
+        choices = []
+        pos = len(body) - len(body.lstrip())
+        while pos < len(body):
+            sign = body[pos]
+            if sign not in '=~':
+                return None
+            pos += 1
+            weight = 100
+            if sign == '~':
+                weight = 0
+                match = cls.WEIGHT_RE.match(body, pos)
+                if match:
+                    weight = int(match.group(1))
+                    pos = match.end()
+            match = cls.ANSWER_TEXT_END_RE.search(body, pos)
+            end = match.start() if match else len(body)
+            answer = body[pos:end].strip()
+            if not answer:
+                return None
+            pos = end
+            feedback = ''
+            if body.startswith('#', pos):
+                match = cls.FEEDBACK_END_RE.search(body, pos)
+                end = match.start() if match else len(body)
+                feedback = body[pos + 1:end].strip()
+                pos = end
+            choices.append((
+                ('sign', sign),
+                ('score', weight),
+                ('text', answer),
+                ('feedback', feedback)))
+        return choices
 
 
 class GiftAdapter(object):
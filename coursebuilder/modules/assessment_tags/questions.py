@@ -23,6 +23,7 @@ import os
 import jinja2
 
 import appengine_config
+from common import caching
 from common import jinja_utils
 from common import schema_fields
 from common import tags
@@ -34,6 +35,102 @@ from models import transforms
 RESOURCES_PATH = '/modules/assessment_tags/resources'
 
 
+class QuestionLookup(caching.RequestScopedSingleton):
+    """Request-scoped store of the questions and groups a page refers to.
+
+    The question tags register the ids in a page before it is rendered (see
+    their prefetch() methods).  The first lookup afterwards resolves all of
+    them together: one bulk load of the groups, then one bulk load of the
+    questions, including those the groups contain.  Ids that were not
+    registered are loaded one at a time when asked for.
+    """
+
+    def __init__(self):
+        self._questions = {}
+        self._question_groups = {}
+        self._pending_quids = set()
+        self._pending_qgids = set()
+        self._templates = {}
+
+    @classmethod
+    def _key(cls, obj_id):
+        """Make key specific to the id and current namespace."""
+        return (m_models.MemcacheManager.get_namespace(), unicode(obj_id))
+
+    def _prefetch(self, quids, qgids):
+        self._pending_quids.update(
+            self._key(quid) for quid in quids if quid is not None)
+        self._pending_qgids.update(
+            self._key(qgid) for qgid in qgids if qgid is not None)
+
+    def _bulk_load(self, dao, pending, loaded):
+        """Loads the pending ids of the current namespace into loaded."""
+        namespace = m_models.MemcacheManager.get_namespace()
+        keys = []
+        for key in list(pending):
+            if key[0] != namespace:
+                continue
+            pending.discard(key)
+            if key in loaded:
+                continue
+            try:
+                keys.append((key, int(key[1])))
+            except ValueError:
+                pass  # Left for load(), which reports the error.
+        if not keys:
+            return []
+        dtos = dao.bulk_load([obj_id for _, obj_id in keys])
+        for (key, _), dto in zip(keys, dtos):
+            loaded[key] = dto
+        return [dto for dto in dtos if dto]
+
+    def _resolve(self):
+        for question_group_dto in self._bulk_load(
+                m_models.QuestionGroupDAO, self._pending_qgids,
+                self._question_groups):
+            self._prefetch(
+                [item['question']
+                 for item in question_group_dto.dict.get('items', [])], [])
+        self._bulk_load(
+            m_models.QuestionDAO, self._pending_quids, self._questions)
+
+    def _get(self, dao, loaded, obj_id):
+        self._resolve()
+        key = self._key(obj_id)
+        if key not in loaded:
+            loaded[key] = dao.load(obj_id)
+        return loaded[key]
+
+    def _get_template(self, template_file):
+        if template_file not in self._templates:
+            self._templates[template_file] = jinja_utils.get_template(
+                template_file, [os.path.dirname(__file__)])
+        return self._templates[template_file]
+
+    @classmethod
+    def prefetch(cls, quids=(), qgids=()):
+        # pylint: disable=protected-access
+        cls.instance()._prefetch(quids, qgids)
+
+    @classmethod
+    def get_question(cls, quid):
+        # pylint: disable=protected-access
+        instance = cls.instance()
+        return instance._get(m_models.QuestionDAO, instance._questions, quid)
+
+    @classmethod
+    def get_question_group(cls, qgid):
+        # pylint: disable=protected-access
+        instance = cls.instance()
+        return instance._get(
+            m_models.QuestionGroupDAO, instance._question_groups, qgid)
+
+    @classmethod
+    def get_template(cls, template_file):
+        # pylint: disable=protected-access
+        return cls.instance()._get_template(template_file)
+
+
 @appengine_config.timeandlog('render_question', duration_only=True)
 def render_question(
     quid, instanceid, embedded=False, weight=None, progress=None):
@@ -57,7 +154,7 @@ def render_question(
       a Jinja markup string that represents the HTML for the question.
     """
     try:
-        question_dto = m_models.QuestionDAO.load(quid)
+        question_dto = QuestionLookup.get_question(quid)
     except Exception:  # pylint: disable=broad-except
         logging.exception('Invalid question: %s', quid)
         return '[Invalid question]'
@@ -73,7 +170,8 @@ def render_question(
         except ValueError:
             weight = 1.0
 
-    template_values = question_dto.dict
+    # The DTO may be shared with other renders in this request; don't modify it.
+    template_values = dict(question_dto.dict)
     template_values['embedded'] = embedded
     template_values['instanceid'] = instanceid
     template_values['resources_path'] = RESOURCES_PATH
@@ -131,8 +229,7 @@ def render_question(
         js_data['weight'] = float(weight)
     template_values['js_data'] = base64.b64encode(transforms.dumps(js_data))
 
-    template = jinja_utils.get_template(
-        template_file, [os.path.dirname(__file__)])
+    template = QuestionLookup.get_template(template_file)
     return jinja2.utils.Markup(template.render(template_values))
 
 
@@ -152,6 +249,10 @@ class QuestionTag(tags.BaseTag):
     def vendor(cls):
         return 'gcb'
 
+    def prefetch(self, nodes, handler):
+        QuestionLookup.prefetch(
+            quids=[node.attrib.get('quid') for node in nodes])
+
     def render(self, node, handler):
         """Renders a question."""
 
@@ -278,16 +379,20 @@ class QuestionGroupTag(tags.BaseTag):
     def vendor(cls):
         return 'gcb'
 
+    def prefetch(self, nodes, handler):
+        QuestionLookup.prefetch(
+            qgids=[node.attrib.get('qgid') for node in nodes])
+
     def render(self, node, handler):
         """Renders a question."""
 
         qgid = node.attrib.get('qgid')
         group_instanceid = node.attrib.get('instanceid')
-        question_group_dto = m_models.QuestionGroupDAO.load(qgid)
+        question_group_dto = QuestionLookup.get_question_group(qgid)
         if not question_group_dto:
             return tags.html_string_to_element_tree('[Deleted question group]')
 
-        template_values = question_group_dto.dict
+        template_values = dict(question_group_dto.dict)
         template_values['embedded'] = False
         template_values['instanceid'] = group_instanceid
         template_values['resources_path'] = RESOURCES_PATH
@@ -312,9 +417,7 @@ class QuestionGroupTag(tags.BaseTag):
             js_data[question_instanceid] = item
         template_values['js_data'] = base64.b64encode(transforms.dumps(js_data))
 
-        template_file = 'templates/question_group.html'
-        template = jinja_utils.get_template(
-            template_file, [os.path.dirname(__file__)])
+        template = QuestionLookup.get_template('templates/question_group.html')
 
         html_string = template.render(template_values)
         return tags.html_string_to_element_tree(html_string)
@@ -22,6 +22,7 @@ import os
 import urllib
 
 import appengine_config
+from common import utils as common_utils
 from controllers import utils
 from models import courses
 from models import custom_modules
@@ -300,7 +301,7 @@ def store_score(course, student, assessment_type, score):
         score: the student's score on this assessment.
 
     Returns:
-        the result of the assessment, if appropriate.
+        True if the stored score changed and the student must be put().
     """
     # FIXME: Course creators can edit this code to implement custom
     # assessment scoring and storage behavior
@@ -311,25 +312,29 @@ def store_score(course, student, assessment_type, score):
     # remember to cast to int for comparison
     if (existing_score is None) or (score > int(existing_score)):
         models_utils.set_score(student, assessment_type, score)
+        return True
+    return False
 
 
 class AnswerHandler(AssignmentsModuleMixin, utils.BaseHandler):
     """Handler for saving assessment answers."""
 
-    # Find student entity and save answers
-    @db.transactional(xg=True)
-    def update_assessment_transaction(
-        self, key_name, assessment_type, new_answers, score):
-        """Stores answer and updates user scores.
+    # Find student entity and update scores
+    @db.transactional
+    def update_score_transaction(self, key_name, assessment_type, score):
+        """Updates user scores.
+
+        The student is only written if the score stored for the assessment
+        changes.
 
         Args:
-            email: the student's email address.
+            key_name: the key name of the student entity.
             assessment_type: the title of the assessment.
-            new_answers: the latest set of answers supplied by the student.
             score: the numerical assessment score.
 
         Returns:
-            the student instance.
+            the student instance, the score previously stored for the
+            assessment (or None), and whether the stored score changed.
         """
         student = models.Student.get_by_key_name(key_name)
         if not student or not student.is_enrolled:
@@ -339,20 +344,43 @@ class AnswerHandler(AssignmentsModuleMixin, utils.BaseHandler):
         course = self.get_course()
 
         # It may be that old Student entities don't have user_id set; fix it.
+        changed = False
         if not student.user_id:
             student.user_id = self.get_user().user_id()
+            changed = True
 
-        answers = models.StudentAnswersEntity.get_by_key_name(student.user_id)
-        if not answers:
-            answers = models.StudentAnswersEntity(key_name=student.user_id)
-        answers.updated_on = datetime.datetime.now()
+        old_score = course.get_score(student, assessment_type)
+        score_changed = store_score(course, student, assessment_type, score)
+        if score_changed:
+            changed = True
 
-        models_utils.set_answer(answers, assessment_type, new_answers)
+        if changed:
+            student.put()
+        return student, old_score, score_changed
 
-        store_score(course, student, assessment_type, score)
+    def update_assessment(self, key_name, assessment_type, new_answers, score):
+        """Stores answer and updates user scores.
 
-        student.put()
-        answers.put()
+        Args:
+            key_name: the key name of the student entity.
+            assessment_type: the title of the assessment.
+            new_answers: the latest set of answers supplied by the student.
+            score: the numerical assessment score.
+
+        Returns:
+            the student instance.
+        """
+        student, old_score, score_changed = self.update_score_transaction(
+            key_name, assessment_type, score)
+        if score_changed:
+            common_utils.run_hooks(
+                models.Student.POST_UPDATE_SCORE_HOOKS, student,
+                assessment_type, old_score, score)
+
+        # Answers are kept per student and assessment, so they are written
+        # outside the transaction without touching other assessments.
+        models.StudentAnswersEntity.set_answers(
+            student.user_id, assessment_type, new_answers)
 
         # Also record the event, which is useful for tracking multiple
         # submissions and history.
@@ -418,7 +446,7 @@ class AnswerHandler(AssignmentsModuleMixin, utils.BaseHandler):
             score = int(round(float(self.request.get('score'))))
 
         # Record assessment transaction.
-        student = self.update_assessment_transaction(
+        student = self.update_assessment(
             student.key().name(), assessment_type, answers, score)
 
         if grader == courses.HUMAN_GRADER:
@@ -35,6 +35,7 @@ __author__ = [
     'John Orr (jorr@google.com)']
 
 
+import hashlib
 import os
 import StringIO
 
@@ -48,22 +49,28 @@ from common import resource
 from common import safe_dom
 from common import schema_fields
 from common import tags
+from common import utils as common_utils
 from controllers import sites
 from controllers import utils
 from models import analytics
 from models import courses
 from models import custom_modules
 from models import data_sources
+from models import entities
 from models import jobs
 from models import models
 from models import progress
 from models import services
+from models import transforms
 from modules.analytics import student_aggregate
 from modules.certificate import custom_criteria
 from modules.certificate import messages
 from modules.courses import settings
 from modules.dashboard import dashboard
 from modules.news import news
+from modules.review import review as review_module
+
+from google.appengine.ext import db
 
 MODULE_NAME = 'certificates'
 MODULE_TITLE = 'Certificates'
@@ -80,6 +87,9 @@ RESOURCES_PATH = '/modules/certificate/resources'
 RESOURCE_TYPE = 'certificate'
 RESOURCE_KEY = RESOURCE_TYPE + resource.Key.SEPARATOR + '1'
 
+# Name of the StudentPropertyEntity holding each student's stored eligibility.
+ELIGIBILITY_PROPERTY_NAME = 'certificate-eligibility'
+
 
 class ShowCertificateHandler(utils.BaseHandler):
     """Handler for student to print course certificate."""
@@ -90,7 +100,7 @@ class ShowCertificateHandler(utils.BaseHandler):
         if not student:
             return
 
-        if not student_is_qualified(student, self.get_course()):
+        if not student_has_certificate(student, self.get_course()):
             self.redirect('/')
             return
 
@@ -167,7 +177,7 @@ class ShowCertificatePdfHandler(utils.BaseHandler):
         if not student:
             return
 
-        if not student_is_qualified(student, self.get_course()):
+        if not student_has_certificate(student, self.get_course()):
             self.redirect('/')
             return
 
@@ -276,12 +286,118 @@ def student_is_qualified(student, course, explanations=None):
     return True
 
 
+def _get_criteria_fingerprint(course):
+    criteria = course.app_context.get_environ().get('certificate_criteria')
+    return hashlib.sha1(transforms.dumps(criteria, sort_keys=True)).hexdigest()
+
+
+def _has_custom_criteria(course):
+    criteria = course.app_context.get_environ().get('certificate_criteria')
+    return any(criterion.get('custom_criteria') for criterion in criteria or [])
+
+
+def _load_eligibility(student):
+    prop = models.StudentPropertyEntity.get(student, ELIGIBILITY_PROPERTY_NAME)
+    if prop and prop.value:
+        return transforms.loads(prop.value)
+    return None
+
+
+def _get_count_deltas(previous, current):
+    previous = previous or {}
+    return {
+        TOTAL_STUDENTS: 0 if previous else 1,
+        TOTAL_ACTIVE_STUDENTS: (
+            int(current['active']) - int(previous.get('active', False))),
+        TOTAL_CERTIFICATES: (
+            int(current['earned']) - int(previous.get('earned', False))),
+    }
+
+
+def update_eligibility(student, course, explanations=None, update_counts=True):
+    """Evaluates the certificate criteria for a student and stores the result.
+
+    This is called back whenever something a criterion may depend on changes,
+    so that page views can read the stored result rather than re-scoring the
+    student.  When the result differs from what was stored, the course's
+    running certificates-earned totals are adjusted to match.
+
+    Args:
+        student: models.models.Student. The student entity to evaluate.
+        course: models.courses.Course. The course the student is enrolled in.
+        explanations: list. Holder for explanatory strings from custom criteria.
+        update_counts: bool. Whether to adjust CertificatesEarnedCountsDAO.
+            CertificatesEarnedGenerator passes False since it overwrites the
+            totals when it completes.
+
+    Returns:
+        A dict with boolean 'earned' and 'active' entries, and the fingerprint
+        of the 'criteria' they were evaluated against.
+    """
+    current = {
+        'earned': student_is_qualified(
+            student, course, explanations=explanations),
+        'active': bool(student.scores),
+        'criteria': _get_criteria_fingerprint(course),
+    }
+    if not student.user_id:
+        return current  # Legacy entity; nowhere to store the result.
+    previous = _load_eligibility(student)
+    if previous == current:
+        return current
+
+    prop = models.StudentPropertyEntity.create(
+        student, ELIGIBILITY_PROPERTY_NAME)
+    prop.value = transforms.dumps(current)
+    prop.put()
+
+    if update_counts:
+        deltas = _get_count_deltas(previous, current)
+        if any(deltas.itervalues()):
+            CertificatesEarnedCountsDAO.inc(deltas)
+    return current
+
+
+def get_eligibility(student, course):
+    """Returns stored eligibility, re-evaluating only if criteria changed."""
+    eligibility = _load_eligibility(student)
+    if (eligibility is None or
+        eligibility['criteria'] != _get_criteria_fingerprint(course)):
+        eligibility = update_eligibility(student, course)
+    return eligibility
+
+
+def student_has_certificate(student, course, explanations=None):
+    """Determines whether the student has earned a certificate.
+
+    Unlike student_is_qualified(), this reads the eligibility stored by
+    update_eligibility().  Criteria are only evaluated again when they have
+    changed since the stored result, or when the student has not qualified
+    and explanations are wanted from custom criteria.
+
+    Args:
+        student: models.models.Student. The student entity to test.
+        course: models.courses.Course. The course which the student is
+            enrolled in.
+        explanations: list. Holder for a list of explanatory strings.
+
+    Returns:
+        True if the student has earned a certificate, False otherwise.
+    """
+    eligibility = get_eligibility(student, course)
+    if (not eligibility['earned'] and explanations is not None and
+        _has_custom_criteria(course)):
+        eligibility = update_eligibility(
+            student, course, explanations=explanations)
+    return eligibility['earned']
+
+
 def get_certificate_table_entry(handler, student, course):
     # I18N: Title of section on page showing certificates for course completion.
     title = handler.gettext('Certificate')
 
     explanations = []
-    if student_is_qualified(student, course, explanations=explanations):
+    if student_has_certificate(student, course, explanations=explanations):
         nl = safe_dom.NodeList()
         nl.append(
             safe_dom.A(
@@ -375,7 +491,67 @@ TOTAL_ACTIVE_STUDENTS = 'total_active_students'
 TOTAL_STUDENTS = 'total_students'
 
 
+class CertificatesEarnedCountsEntity(entities.BaseEntity):
+    """Running totals shown on the Certificates analytics page.
+
+    One entity per course namespace, stored under KEY_NAME.  The totals are
+    adjusted by update_eligibility() as students' eligibility changes, and
+    overwritten whenever CertificatesEarnedGenerator completes.
+    """
+
+    KEY_NAME = 'certificates_earned'
+
+    # JSON-encoded dict of TOTAL_* names to counts.
+    data = db.TextProperty(indexed=False)
+
+
+class CertificatesEarnedCountsDAO(object):
+    """Access to the current course's certificates-earned totals."""
+
+    @classmethod
+    def load(cls):
+        """Returns a dict of totals, or None if they were never computed."""
+        entity = CertificatesEarnedCountsEntity.get_by_key_name(
+            CertificatesEarnedCountsEntity.KEY_NAME)
+        if not entity:
+            return None
+        return transforms.loads(entity.data)
+
+    @classmethod
+    def set(cls, counts):
+        CertificatesEarnedCountsEntity(
+            key_name=CertificatesEarnedCountsEntity.KEY_NAME,
+            data=transforms.dumps(counts)).put()
+
+    @classmethod
+    @db.transactional
+    def inc(cls, deltas):
+        """Adjusts totals by signed deltas, if the totals exist at all.
+
+        Totals are only established by CertificatesEarnedGenerator; until it
+        has run once for a course, there is nothing meaningful to adjust.
+
+        Args:
+            deltas: dict of TOTAL_* names to signed offsets.
+        Returns:
+            The adjusted dict of totals, or None if there were none.
+        """
+        counts = cls.load()
+        if counts is None:
+            return None
+        for name, delta in deltas.iteritems():
+            counts[name] = counts.get(name, 0) + delta
+        cls.set(counts)
+        return counts
+
+
 class CertificatesEarnedGenerator(jobs.AbstractCountingMapReduceJob):
+    """Recounts certificates earned from scratch.
+
+    Only needed to establish the running totals for a course, or to repair
+    them, e.g. after the certificate criteria have been edited.  Each
+    student's stored eligibility is refreshed along the way.
+    """
 
     @staticmethod
     def get_description():
@@ -394,12 +570,25 @@ class CertificatesEarnedGenerator(jobs.AbstractCountingMapReduceJob):
         ns = params['course_namespace']
         app_context = sites.get_course_index().get_app_context_for_namespace(ns)
         course = courses.Course(None, app_context=app_context)
-        if student_is_qualified(student, course):
+        eligibility = update_eligibility(student, course, update_counts=False)
+        if eligibility['earned']:
             yield(TOTAL_CERTIFICATES, 1)
-        if student.scores:
+        if eligibility['active']:
             yield(TOTAL_ACTIVE_STUDENTS, 1)
         yield(TOTAL_STUDENTS, 1)
 
+    @classmethod
+    def complete(cls, kwargs, results):
+        counts = {
+            TOTAL_CERTIFICATES: 0,
+            TOTAL_ACTIVE_STUDENTS: 0,
+            TOTAL_STUDENTS: 0,
+            }
+        counts.update(dict(results))
+        ns = kwargs['mapper_params']['course_namespace']
+        with common_utils.Namespace(ns):
+            CertificatesEarnedCountsDAO.set(counts)
+
 
 class CertificatesEarnedDataSource(data_sources.SynchronousQuery):
 
@@ -445,9 +634,12 @@ class CertificatesEarnedDataSource(data_sources.SynchronousQuery):
             TOTAL_ACTIVE_STUDENTS: 0,
             TOTAL_STUDENTS: 0,
             })
-        # Override with actual values from m/r job, if present.
-        template_values.update(
-            jobs.MapReduceJob.get_results(certificates_earned_job))
+        # Prefer the running totals; the m/r job's results are only as
+        # fresh as its last run.
+        counts = CertificatesEarnedCountsDAO.load()
+        if counts is None:
+            counts = jobs.MapReduceJob.get_results(certificates_earned_job)
+        template_values.update(counts)
 
 
 def register_analytic():
@@ -484,7 +676,13 @@ class CertificateAggregator(
     @classmethod
     def produce_aggregate(cls, course, student, unused_static_params,
                           unused_event_items):
-        return {'earned_certificate': student_is_qualified(student, course)}
+        return {'earned_certificate': student_has_certificate(student, course)}
+
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params,
+                        unused_previous, unused_num_previous_items,
+                        unused_event_items):
+        return cls.produce_aggregate(course, student, static_params, [])
 
     @classmethod
     def get_schema(cls):
@@ -498,11 +696,29 @@ class CertificateAggregator(
 def _post_update_progress(course, student, progress_, event_entity, event_key):
     """Called back when student has progress event recorded."""
 
-    if student_is_qualified(student, course):
+    if update_eligibility(student, course)['earned']:
         item = news.NewsItem(RESOURCE_KEY, CERTIFICATE_HANDLER_PATH)
         news.StudentNewsDao.add_news_item(item, overwrite_existing=False)
 
 
+def _post_write_review(review_step_key):
+    """Called back when a review is written; reviews can complete criteria."""
+    step = db.get(review_step_key)
+    student = db.get(step.reviewer_key) if step else None
+    app_context = sites.get_app_context_for_current_request()
+    if student and app_context:
+        update_eligibility(
+            student, courses.Course(None, app_context=app_context))
+
+
+def _student_added(user_id, unused_timestamp):
+    """Called back from student lifecycle queue when a student registers."""
+    student = models.Student.get_by_user_id(user_id)
+    app_context = sites.get_app_context_for_current_request()
+    if student and app_context:
+        get_eligibility(student, courses.Course(None, app_context=app_context))
+
+
 def _get_i18n_news_title(_unused_key):
     app_context = sites.get_app_context_for_current_request()
     # I18N: Shown in list of news item titles (short descriptions)
@@ -535,6 +751,11 @@ def register_module():
             CertificateAggregator)
         progress.UnitLessonCompletionTracker.POST_UPDATE_PROGRESS_HOOK.append(
             _post_update_progress)
+        review_module.Manager.POST_WRITE_REVIEW_HOOKS.append(
+            _post_write_review)
+        models.StudentLifecycleObserver.EVENT_CALLBACKS[
+            models.StudentLifecycleObserver.EVENT_ADD][
+                MODULE_NAME] = _student_added
         news.I18nTitleRegistry.register(RESOURCE_TYPE, _get_i18n_news_title)
 
     global_routes = [
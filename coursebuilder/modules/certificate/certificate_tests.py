@@ -46,15 +46,17 @@ class CertificateHandlerTestCase(actions.TestBase):
     def setUp(self):
         super(CertificateHandlerTestCase, self).setUp()
 
-        # Mock the module's student_is_qualified method
+        # Mock the module's student_has_certificate method
         self.is_qualified = True
-        def student_is_qualified(student, course, explanations=None):
+        def student_has_certificate(student, course, explanations=None):
             return self.is_qualified
-        self.original_student_is_qualified = certificate.student_is_qualified
-        certificate.student_is_qualified = student_is_qualified
+        self.original_student_has_certificate = (
+            certificate.student_has_certificate)
+        certificate.student_has_certificate = student_has_certificate
 
     def tearDown(self):
-        certificate.student_is_qualified = self.original_student_is_qualified
+        certificate.student_has_certificate = (
+            self.original_student_has_certificate)
         super(CertificateHandlerTestCase, self).tearDown()
 
     def test_student_must_be_enrolled(self):
@@ -203,7 +205,12 @@ class CertificateCriteriaTestCase(actions.TestBase):
         self.submit(response.forms['gcb-run-visualization-certificates_earned'],
                     response)
         self.execute_all_deferred_tasks()
+        self._expect_analytic(
+            expected_students, expected_active_students, expected_certificates)
 
+    def _expect_analytic(self, expected_students, expected_active_students,
+                         expected_certificates):
+        actions.login(self.ADMIN_EMAIL)
         dom = self.parse_html_string(self.get(self.ANALYTICS_URL).body)
         total_students = int(
             dom.find('.//span[@id="total_students"]').text)
@@ -260,6 +267,62 @@ class CertificateCriteriaTestCase(actions.TestBase):
         self.assertEquals(200, response.status_code)
         self._run_analytic_and_expect(1, 1, 1)  # 1 student, 1 active, 1 cert
 
+    def test_counts_updated_without_rerunning_analytic(self):
+        assessment = self.course.add_assessment()
+        assessment.title = 'Assessment'
+        assessment.html_content = 'assessment content'
+        assessment.availability = courses.AVAILABILITY_AVAILABLE
+        self.course.save()
+        self.certificate_criteria.append(
+            {'assessment_id': assessment.unit_id, 'pass_percent': 70.0})
+        self._run_analytic_and_expect(1, 0, 0)
+
+        actions.submit_assessment(
+            self, assessment.unit_id,
+            {'answers': '', 'score': 50, 'assessment_type': assessment.unit_id},
+            presubmit_checks=False)
+        self._expect_analytic(1, 1, 0)
+
+        actions.submit_assessment(
+            self, assessment.unit_id,
+            {'answers': '', 'score': 70, 'assessment_type': assessment.unit_id},
+            presubmit_checks=False)
+        self._expect_analytic(1, 1, 1)
+
+        actions.login('bar@foo.com')
+        actions.register(self, 'Bar')
+        self.execute_all_deferred_tasks()
+        self._expect_analytic(2, 1, 1)
+
+    def test_views_use_stored_eligibility(self):
+        assessment = self.course.add_assessment()
+        assessment.title = 'Assessment'
+        assessment.html_content = 'assessment content'
+        assessment.availability = courses.AVAILABILITY_AVAILABLE
+        self.course.save()
+        self.certificate_criteria.append(
+            {'assessment_id': assessment.unit_id, 'pass_percent': 70.0})
+        actions.submit_assessment(
+            self, assessment.unit_id,
+            {'answers': '', 'score': 70, 'assessment_type': assessment.unit_id},
+            presubmit_checks=False)
+
+        calls = []
+        original_student_is_qualified = certificate.student_is_qualified
+        def student_is_qualified(*args, **kwargs):
+            calls.append(args)
+            return original_student_is_qualified(*args, **kwargs)
+        self.swap(certificate, 'student_is_qualified', student_is_qualified)
+
+        self.assertEquals(200, self.get('certificate').status_code)
+        self.get('student/home')
+        self.assertEquals([], calls)
+
+        # Editing the criteria makes the stored result stale.
+        self.certificate_criteria[0]['pass_percent'] = 80.0
+        self._assert_redirect_to_course_landing_page(self.get('certificate'))
+        self.assertEquals(1, len(calls))
+
     @news_tests_lib.force_news_enabled
     def test_news_notification(self):
         assessment = self.course.add_assessment()
@@ -0,0 +1,41 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cron handler writing out student activity buffered by page views."""
+
+import logging
+
+from controllers import utils
+from models import models
+
+
+class FlushStudentActivity(utils.AbstractAllCoursesCronHandler):
+    """Writes buffered last locations and last-seen times to the datastore."""
+
+    URL = '/cron/courses/flush_student_activity'  # Must match cron.yaml
+
+    @classmethod
+    def is_globally_enabled(cls):
+        return models.StudentActivityBuffer.is_enabled()
+
+    @classmethod
+    def is_enabled_for_course(cls, app_context):
+        return True
+
+    def cron_action(self, app_context, global_state):
+        num_written = models.StudentActivityBuffer.flush()
+        if num_written:
+            logging.info(
+                'Wrote buffered activity of %d students in namespace %s',
+                num_written, app_context.get_namespace_name())
@@ -28,6 +28,12 @@ possible if the content no longer exists, so none is taken.
 
 Any triggers that are missing required content are similarly logged and then
 removed from the course settings.
+
+Jobs are only started for courses that have a trigger due, as recorded in the
+triggers.TriggerDueIndex whenever triggers are saved or acted on.  Triggers can
+also reach course settings by other paths (e.g. course import or direct edits
+of course.yaml), so once a day jobs are run for every course, as a backstop
+that also rebuilds the index.
 """
 
 __author__ = 'Todd Larsen (tlarsen@google.com)'
@@ -105,12 +111,18 @@ class UpdateAvailability(jobs.DurableJob):
 
         common_utils.run_hooks(self.RUN_HOOKS.itervalues(), course)
 
+        # Every source of triggers still in the course has now re-indexed
+        # its remaining triggers; anything past due is left from a source
+        # that is gone.
+        triggers.TriggerDueIndex.delete_stale(namespace, now)
+
 
 class StartAvailabilityJobsStatus(db.Model):
 
     SINGLETON_KEY = 'singleton'
 
     last_run = db.DateTimeProperty(indexed=False)
+    last_full_run = db.DateTimeProperty(indexed=False)
 
     @classmethod
     def get_singleton(cls):
@@ -119,6 +131,8 @@ class StartAvailabilityJobsStatus(db.Model):
             if not entity:
                 entity = cls(key_name=cls.SINGLETON_KEY)
                 entity.last_run = datetime.datetime(1970, 1, 1)
+            if not entity.last_full_run:
+                entity.last_full_run = datetime.datetime(1970, 1, 1)
             return entity
 
     @classmethod
@@ -151,6 +165,9 @@ class StartAvailabilityJobs(utils.CronHandler):
 
     URL = '/cron/availability/update'
 
+    # How often jobs are run for all courses, regardless of the due index.
+    FULL_RUN_INTERVAL = datetime.timedelta(days=1)
+
     def get(self):
         eta_timestamp = utc.hour_end(utc.now_as_timestamp()) + 1
         eta = utc.timestamp_to_datetime(eta_timestamp)
@@ -163,22 +180,39 @@ class StartAvailabilityJobs(utils.CronHandler):
         # Current time, rounded to top of hour.
         @db.transactional(xg=True)
         def should_start_jobs():
+            """Returns (whether to start jobs, whether for all courses)."""
             now_timestamp = utc.hour_start(utc.now_as_timestamp())
             status = StartAvailabilityJobsStatus.get_singleton()
             last_run = utc.hour_start(
                 utc.datetime_to_timestamp(status.last_run))
             if now_timestamp > last_run:
-                status.last_run = utc.timestamp_to_datetime(now_timestamp)
+                now = utc.timestamp_to_datetime(now_timestamp)
+                status.last_run = now
+                full_run = now - status.last_full_run >= cls.FULL_RUN_INTERVAL
+                if full_run:
+                    status.last_full_run = now
                 StartAvailabilityJobsStatus.update_singleton(status)
-                return True
-            return False
-
-        if should_start_jobs():
-            logging.info('StartAvailabilityJobs: running jobs')
-            for app_context in sites.get_all_courses():
-                job = UpdateAvailability(app_context)
-                if job.is_active():
-                    job.cancel()
-                job.submit()
-        else:
+                return True, full_run
+            return False, False
+
+        start_jobs, full_run = should_start_jobs()
+        if not start_jobs:
             logging.info('StartAvailabilityJobs: skipping jobs')
+            return
+
+        if full_run:
+            app_contexts = sites.get_all_courses()
+        else:
+            due = triggers.TriggerDueIndex.get_namespaces_due(
+                utc.now_as_datetime())
+            app_contexts = [
+                app_context for app_context in sites.get_all_courses()
+                if app_context.get_namespace_name() in due]
+        logging.info(
+            'StartAvailabilityJobs: running jobs for %d course(s)%s',
+            len(app_contexts), ' (all courses)' if full_run else '')
+        for app_context in app_contexts:
+            job = UpdateAvailability(app_context)
+            if job.is_active():
+                job.cancel()
+            job.submit()
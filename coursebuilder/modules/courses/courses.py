@@ -18,11 +18,11 @@ __author__ = 'Pavel Simakov (psimakov@google.com)'
 
 from common import resource
 from controllers import utils
-from models import content
 from models import resources_display
 from models import custom_modules
 from models import roles
 from models import student_labels
+from modules.courses import activity_cron
 from modules.courses import admin_preferences_editor
 from modules.courses import assets
 from modules.courses import availability
@@ -40,6 +40,13 @@ from tools import verify
 custom_module = None
 
 
+def _parse_content(content, scope, root_name):
+    # Deferred so that pyparsing and the grammars it builds are only loaded
+    # when legacy assessment or activity text is actually parsed.
+    from models import content as content_parser
+    return content_parser.parse_string_in_scope(content, scope, root_name)
+
+
 def register_module():
     """Registers this module in the registry."""
 
@@ -72,11 +79,13 @@ def register_module():
         roles.Roles.register_permissions(custom_module, permissions_callback)
 
     # provide parser to verify
-    verify.parse_content = content.parse_string_in_scope
+    verify.parse_content = _parse_content
 
     global_handlers = [
         (availability_cron.StartAvailabilityJobs.URL,
          availability_cron.StartAvailabilityJobs),
+        (activity_cron.FlushStudentActivity.URL,
+         activity_cron.FlushStudentActivity),
     ]
 
     # setup routes
@@ -66,14 +66,19 @@ import collections
 import datetime
 import logging
 
+import appengine_config
 from common import resource
 from common import utc
 from common import utils
 from models import courses
+from models import entities
 from models import resources_display
 from modules.courses import availability_options
 from modules.courses import constants
 
+from google.appengine.api import namespace_manager
+from google.appengine.ext import db
+
 
 def _fully_qualified_typename(cls):
     """Returns a 'package...module.ClassName' string for the supplied class."""
@@ -88,6 +93,79 @@ def _qualified_typename(cls, num_package_path_parts_to_keep=1):
     return '.'.join(kept_parts)
 
 
+class TriggerDueEntity(entities.BaseEntity):
+    """Earliest pending trigger `when` for one source of triggers in a course.
+
+    A "source" is one trigger class in one "settings" object, e.g. the
+    ContentTrigger list in a course's environ, or the course override
+    triggers of a single student group.  These entities all live in the
+    default namespace, keyed by course namespace and source, so that the
+    hourly cron can find the courses with triggers due without opening any
+    course.
+    """
+
+    namespace = db.StringProperty(indexed=True)
+    due = db.DateTimeProperty(indexed=True)
+    updated = db.DateTimeProperty(indexed=False, auto_now=True)
+
+    @classmethod
+    def make_key_name(cls, namespace, source):
+        return '%s:%s' % (namespace, source)
+
+
+class TriggerDueIndex(object):
+    """Maintains and queries TriggerDueEntity records."""
+
+    @classmethod
+    def set_due(cls, namespace, source, due):
+        """Records due (a UTC datetime), or removes the record if None.
+
+        An unchanged `due` is not written again while it is still in the
+        future.  Once it has passed, the record is rewritten regardless, so
+        that its `updated` time shows delete_stale() the source still exists.
+        """
+        key_name = TriggerDueEntity.make_key_name(namespace, source)
+        with utils.Namespace(appengine_config.DEFAULT_NAMESPACE_NAME):
+            entity = TriggerDueEntity.get_by_key_name(key_name)
+            if due is None:
+                if entity:
+                    entity.delete()
+                return
+            if (entity and entity.due == due and
+                due > utc.now_as_datetime()):
+                return
+            entity = entity or TriggerDueEntity(
+                key_name=key_name, namespace=namespace)
+            entity.due = due
+            entity.put()
+
+    @classmethod
+    def get_namespaces_due(cls, now):
+        """Returns the set of namespaces having a trigger due at or before now.
+        """
+        with utils.Namespace(appengine_config.DEFAULT_NAMESPACE_NAME):
+            query = TriggerDueEntity.all().filter('due <=', now)
+            return set(entity.namespace for entity in query.run())
+
+    @classmethod
+    def delete_stale(cls, namespace, before):
+        """Removes past-due records not refreshed since `before`.
+
+        Called once all triggers for a course have been acted on, so that any
+        record still past due belongs to a source that no longer exists (e.g.
+        a deleted student group).
+        """
+        with utils.Namespace(appengine_config.DEFAULT_NAMESPACE_NAME):
+            # A course has one record per trigger source, so compare `due` here
+            # rather than in the query, which would need a composite index.
+            stale = [
+                entity for entity in TriggerDueEntity.all().filter(
+                    'namespace =', namespace)
+                if entity.due <= before and entity.updated < before]
+            if stale:
+                db.delete(stale)
+
+
 class DateTimeTrigger(object):
     """Trigger some side-effect at a specified date and time.
 
@@ -537,6 +615,41 @@ class DateTimeTrigger(object):
         """
         cls.set_into_settings(cls.from_payload(payload), settings,
                               semantics=semantics, course=course)
+        cls.update_due_index(settings)
+
+    @classmethod
+    def due_index_source(cls, unused_settings):
+        """Names the TriggerDueIndex source for this class in settings."""
+        return cls.typename()
+
+    @classmethod
+    def earliest_due(cls, encoded_triggers):
+        """Returns the earliest `when` of encoded triggers, or None if none.
+
+        A trigger whose `when` is missing or malformed counts as due at once,
+        so that the cron job runs and discards it, as for any invalid trigger.
+        """
+        earliest = None
+        for encoded in encoded_triggers:
+            try:
+                when = utc.text_to_datetime(
+                    encoded[DateTimeTrigger.FIELD_NAME])
+            except (KeyError, ValueError, TypeError):
+                when = datetime.datetime(1970, 1, 1)
+            if earliest is None or when < earliest:
+                earliest = when
+        return earliest
+
+    @classmethod
+    def update_due_index(cls, settings):
+        """Records when triggers of this class in settings next fall due.
+
+        Must be called in the namespace of the course owning the settings.
+        """
+        TriggerDueIndex.set_due(
+            namespace_manager.get_namespace(),
+            cls.due_index_source(settings),
+            cls.earliest_due(cls.copy_from_settings(settings)))
 
     @classmethod
     def sort(cls, triggers):
@@ -803,6 +916,7 @@ class DateTimeTrigger(object):
             # the responsibility of the caller.)
             cls.set_into_settings(future_encoded, settings, course=course)
 
+        cls.update_due_index(settings)
         return cls.SettingsActs(num_consumed, separated, num_changed, acts)
 
     @classmethod
@@ -23,8 +23,11 @@ import re
 import time
 import unittest
 
+import appengine_config
+
 from common import resource
 from common import utc
+from common import utils
 from controllers import sites
 from models import courses
 
@@ -1378,3 +1381,122 @@ class CronHackTests(actions.TestBase):
         # And again, we're deduped.
         tasks = self.taskq.GetTasks('default')
         self.assertEquals(0, len(tasks))
+
+
+class TriggerDueIndexTests(actions.TestBase):
+
+    COURSE_NAME = 'due_index_test'
+    NAMESPACE = 'ns_' + COURSE_NAME
+    ADMIN_EMAIL = 'admin@example.com'
+    PAST = '2016-01-01T00:00:00.000000Z'
+    FUTURE = '2099-01-01T00:00:00.000000Z'
+
+    def setUp(self):
+        super(TriggerDueIndexTests, self).setUp()
+        self.app_context = actions.simple_add_course(
+            self.COURSE_NAME, self.ADMIN_EMAIL, 'Due Index Test')
+        self.submitted = []
+
+        def submit(job):
+            self.submitted.append(job._namespace)
+        self.swap(availability_cron.UpdateAvailability, 'submit', submit)
+
+    def tearDown(self):
+        sites.reset_courses()
+        super(TriggerDueIndexTests, self).tearDown()
+
+    def _settings(self, *whens):
+        return {'publish': {triggers.ContentTrigger.SETTINGS_NAME: [
+            {'when': when, 'content': 'unit:1', 'availability': 'public'}
+            for when in whens]}}
+
+    def _get_due(self):
+        return triggers.TriggerDueIndex.get_namespaces_due(
+            utc.now_as_datetime())
+
+    def _skip_full_run(self):
+        status = availability_cron.StartAvailabilityJobsStatus.get_singleton()
+        status.last_run = datetime.datetime(1970, 1, 1)
+        status.last_full_run = utc.now_as_datetime()
+        availability_cron.StartAvailabilityJobsStatus.update_singleton(status)
+
+    def test_earliest_due(self):
+        tct = triggers.ContentTrigger
+        self.assertIsNone(tct.earliest_due([]))
+        self.assertEquals(
+            utc.text_to_datetime(self.PAST),
+            tct.earliest_due([{'when': self.FUTURE}, {'when': self.PAST}]))
+        self.assertEquals(
+            datetime.datetime(1970, 1, 1), tct.earliest_due([{'when': 'x'}]))
+
+    def test_update_due_index(self):
+        with utils.Namespace(self.NAMESPACE):
+            triggers.ContentTrigger.update_due_index(
+                self._settings(self.FUTURE))
+            self.assertEquals(set(), self._get_due())
+
+            triggers.ContentTrigger.update_due_index(
+                self._settings(self.FUTURE, self.PAST))
+            self.assertEquals(set([self.NAMESPACE]), self._get_due())
+
+            triggers.ContentTrigger.update_due_index(self._settings())
+            self.assertEquals(set(), self._get_due())
+
+    def test_cron_starts_jobs_only_for_due_courses(self):
+        self._skip_full_run()
+        availability_cron.StartAvailabilityJobs.maybe_start_jobs()
+        self.assertEquals([], self.submitted)
+
+        with utils.Namespace(self.NAMESPACE):
+            triggers.ContentTrigger.update_due_index(
+                self._settings(self.PAST))
+        self._skip_full_run()
+        availability_cron.StartAvailabilityJobs.maybe_start_jobs()
+        self.assertEquals([self.NAMESPACE], self.submitted)
+
+    def test_job_run_removes_stale_entries(self):
+        with utils.Namespace(self.NAMESPACE):
+            triggers.TriggerDueIndex.set_due(
+                self.NAMESPACE, 'gone', datetime.datetime(2000, 1, 1))
+        self.assertEquals(set([self.NAMESPACE]), self._get_due())
+
+        with utils.Namespace(self.NAMESPACE):
+            availability_cron.UpdateAvailability(self.app_context).run()
+        self.assertEquals(set(), self._get_due())
+
+    def test_past_due_source_reindexed_unchanged_is_not_stale(self):
+        due = datetime.datetime(2000, 1, 1)
+        triggers.TriggerDueIndex.set_due(self.NAMESPACE, 'kept', due)
+        triggers.TriggerDueIndex.set_due(self.NAMESPACE, 'gone', due)
+        before = utc.now_as_datetime()
+        triggers.TriggerDueIndex.set_due(self.NAMESPACE, 'kept', due)
+
+        triggers.TriggerDueIndex.delete_stale(self.NAMESPACE, before)
+        with utils.Namespace(appengine_config.DEFAULT_NAMESPACE_NAME):
+            remaining = [entity.key().name()
+                         for entity in triggers.TriggerDueEntity.all()]
+        self.assertEquals([self.NAMESPACE + ':kept'], remaining)
+
+    def test_benchmark_many_courses(self):
+        num_courses = 300
+        due_courses = ['ns_synthetic_%d' % i for i in (7, 150, 299)]
+        sites.setup_courses(', '.join(
+            'course:/synthetic_%d::ns_synthetic_%d' % (i, i)
+            for i in xrange(num_courses)))
+        for namespace in due_courses:
+            triggers.TriggerDueIndex.set_due(
+                namespace, 'ContentTrigger', datetime.datetime(2000, 1, 1))
+
+        availability_cron.StartAvailabilityJobs.maybe_start_jobs()
+        full_run_jobs = len(self.submitted)
+
+        del self.submitted[:]
+        self._skip_full_run()
+        availability_cron.StartAvailabilityJobs.maybe_start_jobs()
+        indexed_jobs = len(self.submitted)
+
+        logging.info(
+            'Availability jobs for %d courses: %d without index, %d with.',
+            num_courses, full_run_jobs, indexed_jobs)
+        self.assertEquals(num_courses, full_run_jobs)
+        self.assertItemsEqual(due_courses, self.submitted)
@@ -20,16 +20,18 @@ from common import schema_fields
 from common.crypto import XsrfTokenManager
 from common import tags
 from common import utils as common_utils
+from models import jobs
 from models import roles
 from models import transforms
 from models import models
 from models import resources_display
 from models import services
-from modules.assessment_tags import gift
 from modules.dashboard import dto_editor
 from modules.dashboard import utils as dashboard_utils
 from modules.dashboard import messages
 
+from google.appengine.ext import db
+
 
 class QuestionManagerAndEditor(dto_editor.BaseDatastoreAssetEditor):
     """An editor for editing and managing questions."""
@@ -311,16 +313,11 @@ class GiftQuestionRESTHandler(dto_editor.BaseDatastoreRestHandler):
                 messages.GIFT_QUESTIONS_DESCRIPTION,
                 'dashboard:gift_questions:questions'),
             extra_schema_dict_values={'className': 'gift-questions'}))
+        gift_questions.add_property(schema_fields.SchemaField(
+            'status', 'Last Import', 'text', optional=True, editable=False,
+            extra_schema_dict_values={'className': 'gift-status'}))
         return gift_questions
 
-    def validate_question_descriptions(self, questions, errors):
-        descriptions = [q.description for q in models.QuestionDAO.get_all()]
-        for question in questions:
-            if question['description'] in descriptions:
-                errors.append(
-                    ('The description must be different '
-                     'from existing questions.'))
-
     def validate_group_description(self, group_description, errors):
         descriptions = [gr.description
                         for gr in models.QuestionGroupDAO.get_all()]
@@ -330,32 +327,30 @@ class GiftQuestionRESTHandler(dto_editor.BaseDatastoreRestHandler):
     def get_default_content(self):
         return {
             'questions': '',
-            'description': ''}
-
-    def convert_to_dtos(self, questions):
-        dtos = []
-        for question in questions:
-            question['version'] = models.QuestionDAO.VERSION
-            dto = models.QuestionDTO(None, question)
-            if dto.type == 'multi_choice':
-                dto.type = models.QuestionDTO.MULTIPLE_CHOICE
-            else:
-                dto.type = models.QuestionDTO.SHORT_ANSWER
-            dtos.append(dto)
-        return dtos
-
-    def create_group(self, description, question_ids):
-        group = {
-            'version': models.QuestionDAO.VERSION,
-            'description': description,
-            'introduction': '',
-            'items': [{
-                'question': str(x),
-                'weight': 1.0} for x in question_ids]}
-        return models.QuestionGroupDAO.create_question_group(group)
+            'description': '',
+            'status': self.get_import_status()}
+
+    def get_import_status(self):
+        """Describes the progress or outcome of the latest import."""
+        job = ImportGiftQuestionsJob(self.app_context).load()
+        if not job:
+            return ''
+        if job.status_code == jobs.STATUS_CODE_FAILED:
+            return 'Import failed; see App Engine logs for details.'
+        if not job.output:
+            return 'Import queued.'
+        output = transforms.loads(job.output)
+        if job.status_code == jobs.STATUS_CODE_STARTED:
+            return 'Importing: %s questions saved so far.' % output['imported']
+        status = 'Imported %s questions into group "%s".' % (
+            output['imported'], output['description'])
+        if output['errors']:
+            status += ' Skipped %s questions:\n%s' % (
+                len(output['errors']), '\n'.join(output['errors']))
+        return status
 
     def put(self):
-        """Store a QuestionGroupDTO and QuestionDTO in the datastore."""
+        """Start a job importing questions into a new QuestionGroupDTO."""
         request = transforms.loads(self.request.get('request'))
 
         if not self.assert_xsrf_token_or_fail(
@@ -373,30 +368,113 @@ class GiftQuestionRESTHandler(dto_editor.BaseDatastoreRestHandler):
         try:
             python_dict = transforms.json_to_dict(
                 json_dict, self.get_schema().get_json_schema_dict())
-            questions = gift.GiftParser.parse_questions(
-                python_dict['questions'])
-            self.validate_question_descriptions(questions, errors)
+            if not python_dict['questions']:
+                errors.append('Questions field can\'t be blank.')
             self.validate_group_description(
                 python_dict['description'], errors)
-            if not errors:
-                dtos = self.convert_to_dtos(questions)
-                question_ids = models.QuestionDAO.save_all(dtos)
-                self.create_group(python_dict['description'], question_ids)
         except ValueError as e:
             errors.append(str(e))
-        except gift.ParseError as e:
-            errors.append(str(e))
-        except models.CollisionError as e:
-            errors.append(str(e))
         if errors:
             self.validation_error('\n'.join(errors))
             return
 
-        msg = 'Saved: %s.' % python_dict['description']
+        import_job = ImportGiftQuestionsJob(
+            self.app_context, python_dict['description'],
+            python_dict['questions'])
+        if import_job.is_active():
+            transforms.send_json_response(
+                self, 503, 'Import already in progress.')
+            return
+        import_job.submit()
+
+        msg = 'Importing: %s.' % python_dict['description']
         transforms.send_json_response(self, 200, msg)
         return
 
 
+class ImportGiftQuestionsJob(jobs.DurableJob):
+    """Parses GIFT questions and saves them, and a group, in batches.
+
+    Each question is parsed on its own, so a malformed question or one
+    with a duplicate description is skipped and reported rather than
+    failing the whole import.  Progress is recorded in the job's output
+    after every batch.
+    """
+
+    BATCH_SIZE = 100
+
+    @staticmethod
+    def get_description():
+        return 'GIFT question import'
+
+    def __init__(self, app_context, description=None, questions=None):
+        super(ImportGiftQuestionsJob, self).__init__(app_context)
+        self._description = description
+        self._questions = questions
+
+    def run(self):
+        # Deferred so that pyparsing is only loaded when GIFT is imported.
+        from modules.assessment_tags import gift
+
+        sequence_num = self.load().sequence_num
+        descriptions = set(q.description for q in models.QuestionDAO.get_all())
+        question_ids = []
+        errors = []
+        dtos = []
+        for line_number, question, error in gift.GiftParser.iter_questions(
+                self._questions.splitlines()):
+            if error:
+                errors.append(error)
+                continue
+            if question['description'] in descriptions:
+                errors.append(
+                    'Line %s: The description must be different from '
+                    'existing questions.' % line_number)
+                continue
+            descriptions.add(question['description'])
+            dtos.append(self.convert_to_dto(question))
+            if len(dtos) >= self.BATCH_SIZE:
+                question_ids += models.QuestionDAO.save_all(dtos)
+                dtos = []
+                self._report_progress(sequence_num, question_ids, errors)
+        if dtos:
+            question_ids += models.QuestionDAO.save_all(dtos)
+        if question_ids:
+            self.create_group(question_ids)
+        return self._build_output(question_ids, errors)
+
+    def _build_output(self, question_ids, errors):
+        return {
+            'description': self._description,
+            'imported': len(question_ids),
+            'errors': errors}
+
+    def _report_progress(self, sequence_num, question_ids, errors):
+        # pylint: disable=protected-access
+        db.run_in_transaction(
+            jobs.DurableJobEntity._start_job, self._job_name, sequence_num,
+            transforms.dumps(self._build_output(question_ids, errors)))
+
+    def convert_to_dto(self, question):
+        question['version'] = models.QuestionDAO.VERSION
+        dto = models.QuestionDTO(None, question)
+        if dto.type == 'multi_choice':
+            dto.type = models.QuestionDTO.MULTIPLE_CHOICE
+        else:
+            dto.type = models.QuestionDTO.SHORT_ANSWER
+        return dto
+
+    def create_group(self, question_ids):
+        group = {
+            'version': models.QuestionDAO.VERSION,
+            'description': self._description,
+            'introduction': '',
+            'items': [{
+                'question': str(x),
+                'weight': 1.0} for x in question_ids]}
+        return models.QuestionGroupDAO.create_question_group(group)
+
+
 class GeneralQuestionRESTHandler(BaseQuestionRESTHandler):
     """REST handler for editing questions of any type."""
 
@@ -568,6 +568,10 @@ class DataRemovalCronHandler(utils.AbstractAllCoursesCronHandler):
 class DataRemovalJob(jobs.AbstractCountingMapReduceJob):
     """Map/reduce job against a single un-indexed table to delete user data."""
 
+    # Compacted events are removed per user, by the indexed remover
+    # EventSegmentEntity.delete_by_user_id; only EventEntity rows are swept.
+    READ_COMPACTED_EVENTS = False
+
     def __init__(self, app_context, entity_class, user_ids):
         super(DataRemovalJob, self).__init__(app_context)
         self._entity_class = entity_class
@@ -18,10 +18,12 @@ __author__ = [
     'nretallack@google.com (Nick Retallack)',
 ]
 
+import collections
 import httplib2
 import itertools
 import json
 
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import urlfetch
 from google.appengine.api import urlfetch_errors
 
@@ -46,6 +48,9 @@ KNOWN_MIME_TYPES = {
 
 _URLFETCH_DEADLINE_SECONDS = 20
 
+# How many files fetch_files downloads at the same time.
+FETCHES_IN_FLIGHT = 5
+
 
 class _APIClientWrapper(object):
     """Facade for accessing Google Drive, Docs, and Sheets APIs.
@@ -56,8 +61,9 @@ class _APIClientWrapper(object):
     but it will not perform OAuth until it has to do a web request.
     """
 
-    def __init__(self, drive_client):
+    def __init__(self, drive_client, credentials=None):
         self._drive_client = drive_client
+        self._credentials = credentials
         urlfetch.set_default_fetch_deadline(_URLFETCH_DEADLINE_SECONDS)
 
     @classmethod
@@ -67,7 +73,7 @@ class _APIClientWrapper(object):
             client_id, client_secret, scope, code)
         http_auth = credentials.authorize(httplib2.Http())
         api = discovery.build('drive', 'v2', http=http_auth)
-        return cls(api)
+        return cls(api, credentials=credentials)
 
     @classmethod
     def from_service_account_secrets(cls, email, key, scope=_ALL_SCOPES):
@@ -80,7 +86,7 @@ class _APIClientWrapper(object):
             # pylint: disable=protected-access
             raise errors._WrappedError(error)
             # pylint: enable=protected-access
-        return cls(api)
+        return cls(api, credentials=credentials)
 
     def _http_request(self, url):
         """Perform an arbitrary HTTP request using the Python API client.
@@ -175,7 +181,7 @@ class _APIClientWrapper(object):
         )
 
     def _get_worksheet_data(self, file_id, worksheet_meta):
-        worksheet_id = worksheet_meta['id']['$t'].rsplit('/', 1)[1]
+        worksheet_id = self._get_worksheet_id(worksheet_meta)
 
         return Worksheet(
             cells=self._get_worksheet_rows(file_id, worksheet_id),
@@ -183,7 +189,14 @@ class _APIClientWrapper(object):
             worksheet_id=worksheet_id,
         )
 
+    def _get_worksheet_id(self, worksheet_meta):
+        return worksheet_meta['id']['$t'].rsplit('/', 1)[1]
+
     def _get_worksheet_rows(self, file_id, worksheet_id):
+        return self._format_worksheet_rows(
+            self._get_worksheet_meta(file_id, worksheet_id))
+
+    def _format_worksheet_rows(self, worksheet_meta):
         def row_keyfunc(cell_data):
             return int(cell_data['gs$cell']['row'])
 
@@ -209,7 +222,7 @@ class _APIClientWrapper(object):
             format_row(cells)
             for row_index, cells in itertools.groupby(
                 sorted(
-                    self._get_worksheet_meta(file_id, worksheet_id)['entry'],
+                    worksheet_meta['entry'],
                     key=cell_keyfunc,
                 ),
                 key=row_keyfunc,
@@ -226,6 +239,158 @@ class _APIClientWrapper(object):
         return ('https://spreadsheets.google.com/feeds/{}/private/full?alt=json'
             ).format(path)
 
+    def _make_files_url(self, file_id):
+        return 'https://www.googleapis.com/drive/v2/files/{}'.format(file_id)
+
+    def fetch_files(self, files, max_in_flight=FETCHES_IN_FLIGHT):
+        """Downloads several files, with up to max_in_flight of them at once.
+
+        Each file is fetched by a pipeline of HTTP requests (metadata, then
+        the export or the worksheet feeds).  Requests for different files are
+        issued as asynchronous urlfetch RPCs, so their latencies overlap.
+
+        Args:
+            files: list of (file_id, file_type) pairs.
+            max_in_flight: how many files to download concurrently.
+
+        Returns:
+            A dict mapping each file_id to either a (DriveItem, content) pair,
+            with content as get_doc_as_html or get_sheet_data would return it,
+            or to the errors.Error that stopped that file's download.
+        """
+        results = {}
+        try:
+            headers = self._get_auth_headers()
+        except Exception as error:  # pylint: disable=broad-except
+            # pylint: disable=protected-access
+            error = errors._WrappedError(error)
+            # pylint: enable=protected-access
+            for file_id, _ in files:
+                results[file_id] = error
+            return results
+
+        pending = collections.deque(
+            (file_id, self._fetch_steps(file_id, file_type))
+            for file_id, file_type in files)
+        active = []
+
+        def advance(file_id, steps, value):
+            try:
+                step = steps.send(value)
+            except errors.Error as error:
+                results[file_id] = error
+                return
+            except (KeyError, IndexError, ValueError) as error:
+                # pylint: disable=protected-access
+                results[file_id] = errors._WrappedError(error)
+                # pylint: enable=protected-access
+                return
+            if isinstance(step, tuple):
+                results[file_id] = step
+                steps.close()
+                return
+            many = isinstance(step, list)
+            urls = step if many else [step]
+            rpcs = [self._start_fetch(url, headers) for url in urls]
+            active.append((file_id, steps, many, zip(urls, rpcs)))
+
+        while pending or active:
+            while pending and len(active) < max_in_flight:
+                file_id, steps = pending.popleft()
+                advance(file_id, steps, None)
+            if not active:
+                continue
+
+            finished = self._wait_any(
+                [rpc for _, _, _, fetches in active for _, rpc in fetches])
+            entry = next(
+                entry for entry in active
+                if any(rpc is finished for _, rpc in entry[3]))
+            active.remove(entry)
+            file_id, steps, many, fetches = entry
+            try:
+                contents = [self._finish_fetch(url, rpc)
+                            for url, rpc in fetches]
+            except errors.Error as error:
+                results[file_id] = error
+                steps.close()
+                continue
+            advance(file_id, steps, contents if many else contents[0])
+
+        return results
+
+    def _fetch_steps(self, file_id, file_type):
+        """Generator yielding the URL(s) to fetch at each step of a download.
+
+        The response body (or list of bodies) is sent back in.  The final
+        value yielded is the (DriveItem, content) result.
+        """
+        meta = json.loads((yield self._make_files_url(file_id)))
+        item = DriveItem.from_api_item(meta)
+
+        if file_type == DOC_TYPE:
+            try:
+                export_url = meta['exportLinks']['text/html']
+            except KeyError:
+                raise errors.Error
+            content = yield export_url
+
+        elif file_type == SHEET_TYPE:
+            feed = json.loads((yield self._make_sheets_url(
+                'worksheets/{}'.format(file_id))))['feed']
+            worksheet_ids = [
+                self._get_worksheet_id(worksheet_meta)
+                for worksheet_meta in feed['entry']]
+            cell_feeds = yield [
+                self._make_sheets_url('cells/{}/{}'.format(
+                    file_id, worksheet_id))
+                for worksheet_id in worksheet_ids]
+            content = Sheet(
+                file_id=file_id,
+                title=feed['title']['$t'],
+                worksheets=[
+                    Worksheet(
+                        cells=self._format_worksheet_rows(
+                            json.loads(cell_feed)['feed']),
+                        title=worksheet_meta['title']['$t'],
+                        worksheet_id=worksheet_id,
+                    )
+                    for worksheet_meta, worksheet_id, cell_feed in zip(
+                        feed['entry'], worksheet_ids, cell_feeds)
+                ],
+            )
+
+        else:
+            raise errors.Error
+
+        yield item, content
+
+    def _get_auth_headers(self):
+        # Refreshes the access token if it has expired.
+        token = self._credentials.get_access_token().access_token
+        return {'Authorization': 'Bearer {}'.format(token)}
+
+    def _start_fetch(self, url, headers):
+        rpc = urlfetch.create_rpc(deadline=_URLFETCH_DEADLINE_SECONDS)
+        urlfetch.make_fetch_call(rpc, url, headers=headers)
+        return rpc
+
+    def _wait_any(self, rpcs):
+        return apiproxy_stub_map.UserRPC.wait_any(rpcs)
+
+    def _finish_fetch(self, url, rpc):
+        # pylint: disable=protected-access
+        try:
+            response = rpc.get_result()
+        except urlfetch_errors.DeadlineExceededError as error:
+            raise errors.TimeoutError(error)
+        except urlfetch_errors.Error as error:
+            raise errors._WrappedError(error)
+        if response.status_code != 200:
+            raise errors._HttpError(
+                url, 'HTTP {}'.format(response.status_code), response.content)
+        return response.content
+
 
 class Sheet(object):
     def __init__(self, file_id=None, title=None, worksheets=None):
@@ -95,15 +95,42 @@ class _DriveManager(object):
         try:
             meta = self.client.get_file_meta(dto.id)
             content = fetch_method(dto.id)
-            content_chunk = models.ContentChunkDAO.get_one_by_uid(
-                models.ContentChunkDAO.make_uid(dto.type, dto.id))
-            content_chunk_id = content_chunk.id if content_chunk else None
-            self._save_content(meta, content, content_chunk_id)
+            self._store_content(dto, meta, content)
 
         except errors.Error as error:
             self._save_failure(dto.id, error)
             raise error
 
+    def download_files(self, dtos):
+        """Downloads several files into the datastore at once.
+
+        Unlike download_file, this expects the items to be marked as started
+        already; DriveSyncDAO.claim_due does so when it leases them.  The
+        downloads overlap on the network and each result is then saved in its
+        own transaction, as in download_file.
+
+        Returns a dict mapping the id of each file that failed to its error.
+        """
+        fetched = self.client.fetch_files([(dto.id, dto.type) for dto in dtos])
+        failures = {}
+        for dto in dtos:
+            result = fetched.get(dto.id, errors.Error())
+            try:
+                if isinstance(result, errors.Error):
+                    raise result
+                meta, content = result
+                self._store_content(dto, meta, content)
+            except errors.Error as error:
+                self._save_failure(dto.id, error)
+                failures[dto.id] = error
+        return failures
+
+    def _store_content(self, dto, meta, content):
+        content_chunk = models.ContentChunkDAO.get_one_by_uid(
+            models.ContentChunkDAO.make_uid(dto.type, dto.id))
+        content_chunk_id = content_chunk.id if content_chunk else None
+        self._save_content(meta, content, content_chunk_id)
+
     @db.transactional
     def _start_sync(self, file_id):
         dto = drive_models.DriveSyncDAO.load(file_id)
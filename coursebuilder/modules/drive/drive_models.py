@@ -18,13 +18,15 @@ __author__ = [
     'nretallack@google.com (Nick Retallack)',
 ]
 
-import time
+import calendar
 import datetime
+import time
 
 from google.appengine.ext import db
 
 from models import courses
 from models import models
+from models import transforms
 from common import schema_fields
 from modules.drive import messages
 
@@ -32,6 +34,19 @@ from modules.drive import messages
 class DriveSyncEntity(models.BaseEntity):
     data = db.TextProperty(indexed=False)
 
+    # When the item is next due to be synced; None if it is not scheduled.
+    # Denormalized from data by DriveSyncDAO so the job can query the head
+    # of the sync queue instead of scanning every item.
+    sync_due = db.FloatProperty()
+
+
+class DriveSyncQueueStatus(models.BaseEntity):
+    """Marks a course whose existing items have been put in the sync queue."""
+
+    SINGLETON_KEY = 'singleton'
+
+    backfilled = db.BooleanProperty(indexed=False)
+
 
 SYNC_STATUS_NEVER = None
 SYNC_STATUS_OK = 'ok'
@@ -50,6 +65,8 @@ SYNC_STATUS_MESSAGES = {
 # Assume the fetch was interrupted if it takes this long.
 SYNC_TIMEOUT_SECONDS = 60 * 10
 
+SECONDS_IN_AN_HOUR = 60 * 60
+
 
 class DriveSyncDTO(object):
     def __init__(self, the_id, the_dict):
@@ -126,12 +143,14 @@ class DriveSyncDTO(object):
         self.dict['sync_start_time'] = time.time()
 
     def sync_failed(self, error):
+        self.release_lease()
         self.dict['sync_status'] = SYNC_STATUS_FAILED
         self.dict['sync_fail_time'] = time.time()
         self.dict['manual_sync_requested'] = False
         self.dict['last_error'] = str(error)
 
     def sync_succeeded(self):
+        self.release_lease()
         self.dict['sync_status'] = SYNC_STATUS_OK
         self.dict['last_synced'] = time.time()
         self.dict['manual_sync_requested'] = False
@@ -140,27 +159,30 @@ class DriveSyncDTO(object):
 
     @property
     def needs_sync(self):
-        return (self.manual_sync_requested
-            or (self.sync_interval == SYNC_INTERVAL_HOUR
-                and not self.synced_this_hour)
-            or (self.sync_interval == SYNC_INTERVAL_DAY
-                and not self.synced_today))
-
-    @property
-    def sync_priority(self):
-        return (self.manual_sync_requested, -(self.last_synced or 0))
+        sync_due = self.sync_due
+        return sync_due is not None and sync_due <= time.time()
 
     @property
-    def synced_today(self):
-        return (
-            datetime.datetime.fromtimestamp(self.dict.get('sync_start_time', 0)
-            ).day == datetime.datetime.utcnow().day)
-
-    @property
-    def synced_this_hour(self):
-        SECONDS_IN_AN_HOUR = 60 * 60
-        return (time.time() - self.dict.get('sync_start_time', 0)
-            < SECONDS_IN_AN_HOUR)
+    def sync_due(self):
+        """Time at which this item should next be synced, or None if never.
+
+        Manual requests are due at once.  Scheduled items fall due an hour, or
+        at the start of the next UTC day, after their last sync started.  An
+        item leased by a worker is not due again until its lease runs out.
+        """
+        last_start = self.dict.get('sync_start_time', 0)
+        sync_interval = self.dict.get('sync_interval')
+        if self.manual_sync_requested:
+            sync_due = 0.0
+        elif sync_interval == SYNC_INTERVAL_HOUR:
+            sync_due = float(last_start + SECONDS_IN_AN_HOUR)
+        elif sync_interval == SYNC_INTERVAL_DAY:
+            next_day = (datetime.datetime.utcfromtimestamp(last_start).date()
+                + datetime.timedelta(days=1))
+            sync_due = float(calendar.timegm(next_day.timetuple()))
+        else:
+            return None
+        return max(sync_due, self.dict.get('lease_expiry', 0.0))
 
     @property
     def last_sync_attempt(self):
@@ -168,6 +190,14 @@ class DriveSyncDTO(object):
             self.dict.get('last_synced', 0),
             self.dict.get('sync_fail_time', 0)) or None
 
+    # work leases
+
+    def lease(self, seconds=SYNC_TIMEOUT_SECONDS):
+        self.dict['lease_expiry'] = time.time() + seconds
+
+    def release_lease(self):
+        self.dict.pop('lease_expiry', None)
+
     # priority overrides
 
     def request_manual_sync(self):
@@ -193,6 +223,74 @@ class DriveSyncDAO(models.BaseJsonDao):
             dto = cls.DTO(key, defaults)
         return dto
 
+    @classmethod
+    def before_put(cls, dto, entity):
+        entity.sync_due = dto.sync_due
+
+    @classmethod
+    def claim_due(cls, limit, now=None):
+        """Leases up to limit items that are due for sync, earliest first.
+
+        Only the head of the sync_due index is read.  Each candidate is checked
+        again and leased in its own transaction, so a worker never claims an
+        item that another worker holds a live lease on.  Claimed items are
+        marked as started; an item whose worker dies falls due again when its
+        lease expires.
+        """
+        if now is None:
+            now = time.time()
+        keys = (cls.ENTITY.all(keys_only=True)
+            .filter('sync_due >=', 0.0)
+            .filter('sync_due <=', now)
+            .order('sync_due')
+            .fetch(limit))
+        claimed = []
+        for key in keys:
+            dto = db.run_in_transaction(cls._claim, key, now)
+            if dto is not None:
+                claimed.append(dto)
+        return claimed
+
+    @classmethod
+    def _claim(cls, key, now):
+        entity = db.get(key)
+        if entity is None:
+            return None
+        dto = cls.DTO(key.name(), transforms.loads(entity.data))
+        sync_due = dto.sync_due
+        if sync_due is None or sync_due > now:
+            return None
+        dto.sync_started()
+        dto.lease()
+        cls.save(dto)
+        return dto
+
+    @classmethod
+    def update_sync_queue(cls):
+        """Puts items written before the sync_due index existed in the queue.
+
+        Every item is scanned once per course; a DriveSyncQueueStatus marker
+        then records that the scan is done.  Items saved since are kept in
+        the queue by before_put.
+
+        Returns:
+            The number of items re-indexed.
+        """
+        status = DriveSyncQueueStatus.get_by_key_name(
+            DriveSyncQueueStatus.SINGLETON_KEY)
+        if status and status.backfilled:
+            return 0
+        stale = []
+        for entity in cls.ENTITY.all():
+            dto = cls.DTO(entity.key().name(), transforms.loads(entity.data))
+            if entity.sync_due != dto.sync_due:
+                stale.append(dto)
+        if stale:
+            cls.save_all(stale)
+        DriveSyncQueueStatus(
+            key_name=DriveSyncQueueStatus.SINGLETON_KEY, backfilled=True).put()
+        return len(stale)
+
 
 def get_drive_sync_entity_schema():
     schema = schema_fields.FieldRegistry(
@@ -29,12 +29,13 @@ from modules.drive import errors
 
 class DriveSyncJob(jobs.DurableJobBase):
 
-    def get_a_valid_work_item(self):
-        return sorted(
-            (dto for dto in drive_models.DriveSyncDAO.get_all_iter()
-                if dto.needs_sync),
-            key=lambda dto: dto.sync_priority,
-            reverse=True)[0]
+    # How many due items each task leases and downloads together.
+    BATCH_SIZE = 10
+
+    def _pre_transaction_setup(self):
+        # Once per course, pick up items stored before the sync queue existed.
+        drive_models.DriveSyncDAO.update_sync_queue()
+        return True
 
     def complete(self, sequence_num):
         # Nothing left to do.
@@ -67,22 +68,28 @@ class DriveSyncJob(jobs.DurableJobBase):
             raise deferred.PermanentTaskFailure('Job {} failed: {}'.format(
                 self._job_name, error))
 
-        try:
-            dto = self.get_a_valid_work_item()
-        except IndexError:
+        dtos = drive_models.DriveSyncDAO.claim_due(self.BATCH_SIZE)
+        if not dtos:
             self.complete(sequence_num)
             return
 
+        titles = ', '.join(dto.title for dto in dtos)
         try:
-            logging.info('Starting download of %s', dto.title)
-            drive_manager.download_file(dto)
-            logging.info('Finished download of %s', dto.title)
+            logging.info('Starting download of %s', titles)
+            failures = drive_manager.download_files(dtos)
+            logging.info('Finished download of %s', titles)
         except Exception as error:  #pylint: disable=broad-except
-            # Normally errors.Error covers everything, but this covers the
-            # possibility of an unexpected parse error.
-            logging.info(
-                'Failed to sync %s (%s) from drive: %s', dto.title, dto.key,
-                error)
+            # Normally errors.Error is reported per file, but this covers the
+            # possibility of an unexpected parse error.  The leased items
+            # become due again when their leases expire.
+            logging.info('Failed to sync %s from drive: %s', titles, error)
+            failures = {}
+
+        for dto in dtos:
+            if dto.id in failures:
+                logging.info(
+                    'Failed to sync %s (%s) from drive: %s', dto.title,
+                    dto.key, failures[dto.id])
 
         deferred.defer(self.main, sequence_num)
 
@@ -19,6 +19,7 @@ __author__ = [
 ]
 
 import json
+import time
 
 from common import crypto
 from common import utils
@@ -28,6 +29,7 @@ from modules.drive import drive_api_manager
 from modules.drive import drive_models
 from modules.drive import drive_settings
 from modules.drive import handlers
+from modules.drive import jobs
 from modules.drive.tests import mocks
 from tests.functional import actions
 
@@ -350,6 +352,103 @@ class DriveTests(DriveTestBase):
             response.headers['Content-Type'], 'text/html; charset=utf-8')
         self.assertEqual(response.body, '<p>Some HTML</p>')
 
+    def test_sync_queue_order_and_leases(self):
+        with utils.Namespace(self.app_context.namespace):
+            # Manual-only items are not queued until a sync is requested.
+            self.setup_schedule_for_file('1')
+            dto = drive_models.DriveSyncDAO.load('1')
+            dto.dict['sync_interval'] = drive_models.SYNC_INTERVAL_MANUAL
+            drive_models.DriveSyncDAO.save(dto)
+            self.assertIsNone(
+                drive_models.DriveSyncEntity.get_by_key_name('1').sync_due)
+            dto.request_manual_sync()
+            drive_models.DriveSyncDAO.save(dto)
+
+            # 3 last started three hours ago, 5 ninety minutes ago, and 6 has
+            # just been synced.
+            for file_id, age in (('3', 3 * 60 * 60), ('5', 90 * 60), ('6', 0)):
+                dto = drive_models.DriveSyncDAO.load(file_id)
+                dto.dict['sync_start_time'] = time.time() - age
+                drive_models.DriveSyncDAO.save(dto)
+
+            claimed = drive_models.DriveSyncDAO.claim_due(5)
+            self.assertEqual(['1', '3', '5'], [dto.id for dto in claimed])
+            for dto in claimed:
+                self.assertEqual(
+                    drive_models.SYNC_STATUS_WORKING,
+                    drive_models.DriveSyncDAO.load(dto.id).sync_status)
+
+            # Leased items can't be claimed again...
+            self.assertEqual([], drive_models.DriveSyncDAO.claim_due(5))
+
+            # ...until the lease runs out, when the pending manual request is
+            # due again.  The scheduled items' next sync is an hour away.
+            later = time.time() + drive_models.SYNC_TIMEOUT_SECONDS + 1
+            self.assertEqual(
+                ['1'],
+                [dto.id for dto in drive_models.DriveSyncDAO.claim_due(
+                    5, now=later)])
+
+    def test_cron_job_downloads_in_batches(self):
+        batches = []
+        # pylint: disable=protected-access
+        fetch_files = mocks._APIClientWrapperMock.fetch_files
+
+        def fetch_files_spy(client, files, max_in_flight=None):
+            batches.append(sorted(file_id for file_id, _ in files))
+            return fetch_files(client, files)
+
+        self.swap(
+            mocks._APIClientWrapperMock, 'fetch_files', fetch_files_spy)
+        # pylint: enable=protected-access
+        self.swap(jobs.DriveSyncJob, 'BATCH_SIZE', 2)
+
+        # An item stored before the sync queue existed is picked up too.
+        with utils.Namespace(self.app_context.namespace):
+            entity = drive_models.DriveSyncEntity.get_by_key_name('6')
+            entity.sync_due = None
+            entity.put()
+
+        response = self.get('/cron/drive/sync')
+        self.assertEqual(response.status_code, 200)
+        self.execute_all_deferred_tasks()
+
+        self.assertEqual([2, 1], [len(batch) for batch in batches])
+        self.assertEqual(['3', '5', '6'], sorted(sum(batches, [])))
+        with utils.Namespace(self.app_context.namespace):
+            for file_id in ('3', '5', '6'):
+                dto = drive_models.DriveSyncDAO.load(file_id)
+                self.assertEqual(drive_models.SYNC_STATUS_OK, dto.sync_status)
+                self.assertFalse(dto.needs_sync)
+
+            # The backfill is done once per course, not on every submit.
+            entity = drive_models.DriveSyncEntity.get_by_key_name('6')
+            entity.sync_due = None
+            entity.put()
+            self.assertEqual(0, drive_models.DriveSyncDAO.update_sync_queue())
+
+    def test_cron_job_failures_are_per_file(self):
+        # pylint: disable=protected-access
+        self.swap(
+            mocks._APIClientWrapperMock, 'get_doc_as_html',
+            mocks.raise_error)
+
+        self.get('/cron/drive/sync')
+        self.execute_all_deferred_tasks()
+
+        with utils.Namespace(self.app_context.namespace):
+            self.assertEqual(
+                drive_models.SYNC_STATUS_FAILED,
+                drive_models.DriveSyncDAO.load('5').sync_status)
+            for file_id in ('3', '6'):
+                self.assertEqual(
+                    drive_models.SYNC_STATUS_OK,
+                    drive_models.DriveSyncDAO.load(file_id).sync_status)
+            self.assertEqual([], drive_models.DriveSyncDAO.claim_due(5))
+
+        response = self.get('modules/drive/item/content?key=3')
+        self.assertEqual(response.status_code, 200)
+
     def test_download_missing(self):
         soup = self.get_page('modules/drive')
         token = soup.select(
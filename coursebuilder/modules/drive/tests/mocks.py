@@ -80,6 +80,20 @@ class _APIClientWrapperMock(object):
 
         return '<p>Some HTML</p>'
 
+    def fetch_files(self, files, max_in_flight=None):
+        results = {}
+        for file_id, file_type in files:
+            try:
+                fetch_method = {
+                    drive_api_client.SHEET_TYPE: self.get_sheet_data,
+                    drive_api_client.DOC_TYPE: self.get_doc_as_html,
+                }.get(file_type, raise_error)
+                results[file_id] = (
+                    self.get_file_meta(file_id), fetch_method(file_id))
+            except errors.Error as error:
+                results[file_id] = error
+        return results
+
     def share_file(self, file_id, email):
         if self.SHARABLE_FILE not in self.MOCK_FILES:
             self.MOCK_FILES = self.MOCK_FILES.append(self.SHARABLE_FILE)
@@ -73,6 +73,69 @@ class ApiClientTests(suite.TestBase):
                 '1184RD90Yf9YhzFUWGVzF0_0-u9bm5COKEwRmBsvVFhA').to_json(),
             json.loads(read_fixture('sheet_data.json')))
 
+    def test_fetch_files(self):
+        # pylint: disable=protected-access
+        sheet_id = '1184RD90Yf9YhzFUWGVzF0_0-u9bm5COKEwRmBsvVFhA'
+        export_url = 'https://docs.google.com/export/doc'
+        responses = {
+            self.client._make_files_url(sheet_id): json.dumps({
+                'id': sheet_id,
+                'mimeType': drive_api_client.SHEET_MIME_TYPE,
+                'title': 'Sheet',
+                'version': '3',
+            }),
+            self.client._make_files_url('doc'): json.dumps({
+                'id': 'doc',
+                'mimeType': drive_api_client.DOC_MIME_TYPE,
+                'title': 'Doc',
+                'version': '2',
+                'exportLinks': {'text/html': export_url},
+            }),
+            export_url: '<p>Doc</p>',
+        }
+        waits = []
+
+        def finish_fetch(client, url, rpc):
+            if url in responses:
+                return responses[url]
+            elif url.startswith('https://spreadsheets.google.com/'):
+                return client._http_request(url)
+            raise errors._HttpError(url, 'HTTP 404', '')
+
+        def wait_any(client, rpcs):
+            waits.append(len(rpcs))
+            return rpcs[-1]
+
+        self.swap(
+            drive_api_client._APIClientWrapper, '_get_auth_headers',
+            lambda client: {})
+        self.swap(
+            drive_api_client._APIClientWrapper, '_start_fetch',
+            lambda client, url, headers: url)
+        self.swap(drive_api_client._APIClientWrapper, '_wait_any', wait_any)
+        self.swap(
+            drive_api_client._APIClientWrapper, '_finish_fetch', finish_fetch)
+
+        results = self.client.fetch_files([
+            (sheet_id, drive_api_client.SHEET_TYPE),
+            ('doc', drive_api_client.DOC_TYPE),
+            ('missing', drive_api_client.DOC_TYPE),
+        ], max_in_flight=2)
+
+        meta, sheet = results[sheet_id]
+        self.assertEqual(meta.version, '3')
+        self.assertEqual(
+            sheet.to_json(), json.loads(read_fixture('sheet_data.json')))
+        meta, html = results['doc']
+        self.assertEqual(meta.title, 'Doc')
+        self.assertEqual(html, '<p>Doc</p>')
+        self.assertIsInstance(results['missing'], errors.Error)
+
+        # Requests for different files were outstanding together, but never
+        # for more than two files at once.
+        self.assertIn(2, waits)
+        self.assertTrue(max(waits) <= 3)
+
     def test_bad_secrets(self):
         with self.assertRaises(errors.Misconfigured):
             # empty strings
@@ -52,6 +52,7 @@ from models import courses
 from models import custom_modules
 from models import data_removal
 from models import models
+from models import services
 from models import transforms
 from modules.courses import settings
 from modules.invitation import messages
@@ -134,6 +135,19 @@ class InvitationEmail(object):
             self.subject
         )
 
+    @classmethod
+    def send_many(cls, invitation_emails):
+        """Sends a batch of invitations with a single send_many() call."""
+        if not invitation_emails:
+            return
+        services.notifications.send_many(
+            [{'to': invitation_email.recipient_email,
+              'body': invitation_email.body,
+              'subject': invitation_email.subject}
+             for invitation_email in invitation_emails],
+            invitation_emails[0].sender_email,
+            INVITATION_INTENT)
+
 
 class InvitationStudentProperty(models.StudentPropertyEntity):
     """Entity to hold the list of people already invited."""
@@ -293,6 +307,7 @@ class InvitationRESTHandler(utils.BaseRESTHandler):
             return
 
         email_messages = []
+        invitation_emails = []
         for email in email_set:
             if not is_email_valid(email):
                 # I18N: Error indicating an email addresses is not well-formed.
@@ -310,7 +325,9 @@ class InvitationRESTHandler(utils.BaseRESTHandler):
                 # No message to the user, for privacy reasons
                 logging.info('Declined to send email to registered user')
             else:
-                InvitationEmail(self, email, student.name).send()
+                invitation_emails.append(
+                    InvitationEmail(self, email, student.name))
+        InvitationEmail.send_many(invitation_emails)
 
         invitation_data.append_to_invited_list(email_set)
         invitation_data.put()
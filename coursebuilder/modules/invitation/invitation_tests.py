@@ -22,9 +22,9 @@ import urlparse
 from common import crypto
 from models import courses
 from models import models
+from models import services
 from models import transforms
 from modules.invitation import invitation
-from modules.notifications import notifications
 from modules.unsubscribe import unsubscribe
 from tests.functional import actions
 
@@ -77,18 +77,19 @@ class InvitationHandlerTests(BaseInvitationTests):
     def setUp(self):
         super(InvitationHandlerTests, self).setUp()
 
-        self.old_send_async = notifications.Manager.send_async
-        notifications.Manager.send_async = self._send_async_spy
-        self.send_async_count = 0
-        self.send_async_call_log = []
+        self.swap(services.notifications, 'send_many', self._send_many_spy)
+        self.send_many_call_count = 0
+        self.send_count = 0
+        self.send_call_log = []
 
-    def tearDown(self):
-        notifications.Manager.send_async = self.old_send_async
-        super(InvitationHandlerTests, self).tearDown()
-
-    def _send_async_spy(self, *args, **kwargs):
-        self.send_async_count += 1
-        self.send_async_call_log.append({'args': args, 'kwargs': kwargs})
+    def _send_many_spy(self, messages, sender, intent, **kwargs):
+        self.send_many_call_count += 1
+        for message in messages:
+            self.send_count += 1
+            self.send_call_log.append({
+                'args': (message['to'], sender, intent, message['body'],
+                         message['subject']),
+                'kwargs': kwargs})
 
     def test_invitation_panel_unavailable_when_email_is_not_fully_set_up(self):
         self.register()
@@ -209,7 +210,7 @@ class InvitationHandlerTests(BaseInvitationTests):
             [spammed_email, spammed_email])
         self.assertEquals(200, response['status'])
         self.assertEquals('OK, 1 messages sent', response['message'])
-        self.assertEqual(1, self.send_async_count)
+        self.assertEqual(1, self.send_count)
 
     def test_rest_handler_discretely_does_not_mail_unsubscribed_users(self):
         # For privacy reasons the service should NOT email unsubscribed users,
@@ -220,7 +221,7 @@ class InvitationHandlerTests(BaseInvitationTests):
         response = self._do_valid_email_list_post([unsubscribed_email])
         self.assertEquals(200, response['status'])
         self.assertEquals('OK, 1 messages sent', response['message'])
-        self.assertEqual(0, self.send_async_count)
+        self.assertEqual(0, self.send_count)
 
     def test_rest_handler_discretely_does_not_mail_registered_users(self):
         # To reduce spam the service should NOT email registered users, but for
@@ -232,18 +233,18 @@ class InvitationHandlerTests(BaseInvitationTests):
         response = self._do_valid_email_list_post([registered_student])
         self.assertEquals(200, response['status'])
         self.assertEquals('OK, 1 messages sent', response['message'])
-        self.assertEqual(0, self.send_async_count)
+        self.assertEqual(0, self.send_count)
 
     def test_rest_handler_can_send_invitation(self):
         recipient = 'recipient@foo.com'
 
         response = self._do_valid_email_list_post([recipient])
         self.assertEquals(200, response['status'])
-        self.assertEqual(1, self.send_async_count)
-        self.assertEquals(1, len(self.send_async_call_log))
+        self.assertEqual(1, self.send_count)
+        self.assertEquals(1, len(self.send_call_log))
 
-        args = self.send_async_call_log[0]['args']
-        kwargs = self.send_async_call_log[0]['kwargs']
+        args = self.send_call_log[0]['args']
+        kwargs = self.send_call_log[0]['kwargs']
 
         self.assertEquals(5, len(args))
         self.assertEquals(recipient, args[0])
@@ -260,18 +261,19 @@ class InvitationHandlerTests(BaseInvitationTests):
         response = self._do_valid_email_list_post(email_list)
         self.assertEquals(200, response['status'])
         self.assertEquals('OK, 3 messages sent', response['message'])
-        self.assertEqual(3, self.send_async_count)
+        self.assertEqual(3, self.send_count)
+        self.assertEqual(1, self.send_many_call_count)
         self.assertEquals(
             set(email_list),
-            {log['args'][0] for log in self.send_async_call_log})
+            {log['args'][0] for log in self.send_call_log})
 
     def test_rest_handler_can_send_some_invitations_but_not_others(self):
         spammed_email = 'spammed@foo.com'
         response = self._do_valid_email_list_post([spammed_email])
         self.assertEquals(200, response['status'])
-        self.assertEqual(1, self.send_async_count)
+        self.assertEqual(1, self.send_count)
 
-        self.send_async_count = 0
+        self.send_count = 0
 
         unsubscribed_email = 'unsubscribed@foo.com'
         unsubscribe.set_subscribed(unsubscribed_email, False)
@@ -283,7 +285,7 @@ class InvitationHandlerTests(BaseInvitationTests):
         self.assertIn(
             'You have already sent an invitation email to "spammed@foo.com"',
             response['message'])
-        self.assertEqual(2, self.send_async_count)
+        self.assertEqual(2, self.send_count)
 
     def test_rest_handler_limits_number_of_invitations(self):
         old_max_emails = invitation.MAX_EMAILS
@@ -296,7 +298,7 @@ class InvitationHandlerTests(BaseInvitationTests):
                 'This exceeds your email cap. '
                 'Number of remaining invitations: 2. '
                 'No messages sent.', response['message'])
-            self.assertEqual(0, self.send_async_count)
+            self.assertEqual(0, self.send_count)
         finally:
             invitation.MAX_EMAILS = old_max_emails
 
@@ -38,6 +38,7 @@ __author__ = [
 
 import collections
 import os
+import uuid
 
 import jinja2
 
@@ -77,6 +78,11 @@ NEWSWORTHINESS_SECONDS = 6 * 60 * 60
 # means pulling in news that was seen more than NEWSWORTHINESS_SECONDS ago.
 MIN_NEWS_ITEMS_TO_DISPLAY = 5
 
+# Longest time a rendered News tab is reused.  Saving news invalidates it
+# immediately; this bounds staleness from changes news does not track, such
+# as a renamed unit or a change to track labels.
+NEWS_DIGEST_TTL_SECONDS = 60 * 60
+
 custom_module = None
 
 
@@ -248,6 +254,23 @@ class BaseNewsDto(object):
 
 class BaseNewsDao(models.BaseJsonDao):
 
+    @classmethod
+    def _bump_version(cls, dto):
+        raise NotImplementedError()
+
+    @classmethod
+    def save(cls, dto):
+        ret = super(BaseNewsDao, cls).save(dto)
+        cls._bump_version(dto)
+        return ret
+
+    @classmethod
+    def save_all(cls, dtos):
+        ret = super(BaseNewsDao, cls).save_all(dtos)
+        for dto in dtos:
+            cls._bump_version(dto)
+        return ret
+
     @classmethod
     def add_news_item(cls, news_item, overwrite_existing=True):
         """Convenience method when only one operation is needed on DTO."""
@@ -294,6 +317,10 @@ class CourseNewsDao(BaseNewsDao):
     ENTITY = CourseNewsEntity
     ENTITY_KEY_TYPE = models.BaseJsonDao.EntityKeyTypeName
 
+    @classmethod
+    def _bump_version(cls, unused_dto):
+        NewsDigestCache.bump_course_version()
+
     @classmethod
     def load_or_default(cls):
         dto = cls.load(CourseNewsEntity.SINGLETON_KEY_NAME)
@@ -354,6 +381,10 @@ class StudentNewsDao(BaseNewsDao):
     ENTITY = StudentNewsEntity
     ENTITY_KEY_TYPE = models.BaseJsonDao.EntityKeyTypeName
 
+    @classmethod
+    def _bump_version(cls, dto):
+        NewsDigestCache.bump_student_version(dto.id)
+
     @classmethod
     def load_or_default(cls):
         # Sanity check: Re-verify that we have a Student.  Calling handlers
@@ -384,6 +415,103 @@ class StudentNewsDao(BaseNewsDao):
         return dto.get_seen_items()
 
 
+class NewsDigestCache(object):
+    """Caches each student's rendered News tab, and course news titles.
+
+    Course news and each student's news carry a version token in memcache,
+    replaced whenever they are saved.  A rendered News tab is stored along
+    with the versions and other inputs it was rendered from, and is reused
+    while those all still match; it is fetched together with the current
+    versions in a single memcache call.  Tokens are random rather than
+    counters, so an evicted version can never be mistaken for an older one.
+    """
+
+    COURSE_VERSION_KEY = 'news:version:course'
+    STUDENT_VERSION_KEY = 'news:version:student:%s'
+    DIGEST_KEY = 'news:digest:%s'
+    TITLES_KEY = 'news:titles:%s:%s'
+
+    @classmethod
+    def _new_version(cls):
+        return uuid.uuid4().hex
+
+    @classmethod
+    def bump_course_version(cls):
+        models.MemcacheManager.set(cls.COURSE_VERSION_KEY, cls._new_version())
+
+    @classmethod
+    def bump_student_version(cls, user_id):
+        models.MemcacheManager.set(
+            cls.STUDENT_VERSION_KEY % user_id, cls._new_version())
+
+    @classmethod
+    def get_digest(cls, user_id, inputs):
+        """Looks up a rendered News tab.
+
+        Args:
+          user_id: the student's user ID.
+          inputs: anything other than news versions that the rendering depends
+              on, e.g. labels and locale; compared for equality.
+        Returns:
+          A tuple of (html or None, versions).  Pass versions to put_digest()
+          after rendering on a miss.
+        """
+        course_key = cls.COURSE_VERSION_KEY
+        student_key = cls.STUDENT_VERSION_KEY % user_id
+        digest_key = cls.DIGEST_KEY % user_id
+        found = models.MemcacheManager.get_multi(
+            [course_key, student_key, digest_key])
+
+        versions = []
+        for key in (course_key, student_key):
+            version = found.get(key)
+            if version is None:
+                version = cls._new_version()
+                models.MemcacheManager.set(key, version)
+            versions.append(version)
+        versions = tuple(versions)
+
+        digest = found.get(digest_key)
+        if (digest and digest['versions'] == versions and
+            digest['inputs'] == inputs and
+            utc.now_as_timestamp() < digest['expires']):
+            return digest['html'], versions
+        return None, versions
+
+    @classmethod
+    def put_digest(cls, user_id, versions, inputs, html, expires):
+        models.MemcacheManager.set(
+            cls.DIGEST_KEY % user_id,
+            {'versions': versions, 'inputs': inputs, 'html': html,
+             'expires': expires},
+            ttl=NEWS_DIGEST_TTL_SECONDS)
+
+    @classmethod
+    def get_course_titles(cls, course_version, locale):
+        return models.MemcacheManager.get(
+            cls.TITLES_KEY % (course_version, locale)) or {}
+
+    @classmethod
+    def put_course_titles(cls, course_version, locale, titles):
+        models.MemcacheManager.set(
+            cls.TITLES_KEY % (course_version, locale), titles)
+
+
+def _get_i18n_title(resource_key):
+    try:
+        key = resource.Key.fromstring(resource_key)
+        resource_handler = (
+            i18n_dashboard.TranslatableResourceRegistry.get_by_type(
+                key.type))
+        return resource_handler.get_i18n_title(key)
+    except AssertionError:
+        # Not all news things are backed by AbstractResourceHandler types.
+        # Fall back to news-specific registry for these.
+        resource_handler = I18nTitleRegistry
+        key_type, _ = resource_key.split(resource.Key.SEPARATOR, 1)
+        return resource_handler.get_i18n_title(key_type, resource_key)
+
+
 def course_page_navbar_callback(app_context):
     """Generate HTML for inclusion on tabs bar.
 
@@ -399,10 +527,25 @@ def course_page_navbar_callback(app_context):
     student = models.Student.get_enrolled_student_by_user(user)
     if not student or student.is_transient:
         return []
+
+    locale = app_context.get_current_locale()
+    digest_inputs = (
+        is_enabled(), student.labels, locale, student.enrolled_on)
+    html, versions = NewsDigestCache.get_digest(user.user_id(), digest_inputs)
+    if html is None:
+        html, expires = _render_news(app_context, student, locale, versions[0])
+        NewsDigestCache.put_digest(
+            user.user_id(), versions, digest_inputs, html, expires)
+    return [jinja2.utils.Markup(html)]
+
+
+def _render_news(app_context, student, locale, course_version):
+    """Renders the News tab; returns HTML and timestamp it is valid until."""
     student_dao = StudentNewsDao.load_or_default()
 
     # Combine all news items for consideration.
-    news = student_dao.get_news_items() + CourseNewsDao.get_news_items()
+    course_news = CourseNewsDao.get_news_items()
+    news = student_dao.get_news_items() + course_news
     seen_times = {s.resource_key: s.when
                   for s in student_dao.get_seen_items()}
 
@@ -417,6 +560,9 @@ def course_page_navbar_callback(app_context):
     new_news = []
     old_news = []
     now = utc.now_as_datetime()
+    now_ts = utc.datetime_to_timestamp(now)
+    # The rendering changes when a recently-seen item becomes old news.
+    expires = now_ts + NEWS_DIGEST_TTL_SECONDS
     enrolled_on = student.enrolled_on.replace(microsecond=0)
     for item in news:
         seen_when = seen_times.get(item.resource_key)
@@ -433,6 +579,8 @@ def course_page_navbar_callback(app_context):
             # Items seen recently are always shown, but with CSS dimming.
             item.is_new_news = False
             new_news.append(item)
+            expires = min(expires, utc.datetime_to_timestamp(
+                seen_when) + NEWSWORTHINESS_SECONDS)
         else:
             # Items seen and not recently are put on seprate list for
             # inclusion only if there are few new items.
@@ -446,27 +594,28 @@ def course_page_navbar_callback(app_context):
     news = new_news + old_news[
         0:max(0, MIN_NEWS_ITEMS_TO_DISPLAY - len(new_news))]
 
+    # Titles of course-wide items are shared by all students, so are cached
+    # per course news version and locale.
+    course_keys = set(item.resource_key for item in course_news)
+    course_titles = NewsDigestCache.get_course_titles(course_version, locale)
+    titles_changed = False
     for item in news:
-        try:
-            key = resource.Key.fromstring(item.resource_key)
-            resource_handler = (
-                i18n_dashboard.TranslatableResourceRegistry.get_by_type(
-                    key.type))
-            item.i18n_title = resource_handler.get_i18n_title(key)
-        except AssertionError:
-            # Not all news things are backed by AbstractResourceHandler types.
-            # Fall back to news-specific registry for these.
-            resource_handler = I18nTitleRegistry
-            key_type, _ = item.resource_key.split(resource.Key.SEPARATOR, 1)
-            item.i18n_title = resource_handler.get_i18n_title(
-                key_type, item.resource_key)
+        title = course_titles.get(item.resource_key)
+        if title is None:
+            title = _get_i18n_title(item.resource_key)
+            if item.resource_key in course_keys:
+                course_titles[item.resource_key] = title
+                titles_changed = True
+        item.i18n_title = title
+    if titles_changed:
+        NewsDigestCache.put_course_titles(
+            course_version, locale, course_titles)
 
     # Fill template
     template_environ = app_context.get_template_environ(
-        app_context.get_current_locale(), [TEMPLATES_DIR])
+        locale, [TEMPLATES_DIR])
     template = template_environ.get_template('news.html', [TEMPLATES_DIR])
-    return [
-        jinja2.utils.Markup(template.render({'news': news}, autoescape=True))]
+    return unicode(template.render({'news': news}, autoescape=True)), expires
 
 
 class I18nTitleRegistry(object):
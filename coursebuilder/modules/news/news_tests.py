@@ -23,6 +23,7 @@ import time
 from controllers import sites
 from common import utc
 from common import utils as common_utils
+from models import config
 from models import models
 from modules.news import news
 from modules.news import news_tests_lib
@@ -555,3 +556,82 @@ class NewsHttpTests(NewsTestBase):
              news_tests_lib.NewsItem(
                  'Test Item with_labels', 'url_with_labels', True)],
             news_tests_lib.extract_news_items_from_soup(soup))
+
+
+class NewsDigestCacheTests(NewsTestBase):
+
+    def setUp(self):
+        super(NewsDigestCacheTests, self).setUp()
+        config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
+        self.user = actions.login(self.STUDENT_EMAIL)
+        actions.register(self, 'John Smith')
+        then_ts = utc.now_as_timestamp() - news.NEWSWORTHINESS_SECONDS - 1
+        student = models.Student.get_enrolled_student_by_user(self.user)
+        student.enrolled_on = utc.timestamp_to_datetime(then_ts)
+        student.put()
+        self.then = utc.timestamp_to_datetime(then_ts)
+
+        self.num_renders = 0
+        real_render_news = news._render_news
+        def render_news(*args):
+            self.num_renders += 1
+            return real_render_news(*args)
+        self.swap(news, '_render_news', render_news)
+
+    def tearDown(self):
+        del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
+        super(NewsDigestCacheTests, self).tearDown()
+
+    def _get_news(self):
+        return news.course_page_navbar_callback(self.app_context)
+
+    def test_digest_reused_until_course_news_changes(self):
+        news.CourseNewsDao.add_news_item(
+            news.NewsItem('test:one', 'url_one', self.then))
+        first = self._get_news()
+        self.assertEquals(first, self._get_news())
+        self.assertEquals(1, self.num_renders)
+
+        news.CourseNewsDao.add_news_item(
+            news.NewsItem('test:two', 'url_two', self.then))
+        second = self._get_news()
+        self.assertEquals(2, self.num_renders)
+        self.assertIn('Test Item two', second[0])
+
+    def test_digest_invalidated_when_student_sees_item(self):
+        news.CourseNewsDao.add_news_item(
+            news.NewsItem('test:one', 'url_one', self.then))
+        self._get_news()
+        news.StudentNewsDao.mark_item_seen('test:one')
+        self._get_news()
+        self._get_news()
+        self.assertEquals(2, self.num_renders)
+
+    def test_digest_expires_when_seen_item_becomes_old_news(self):
+        news.CourseNewsDao.add_news_item(
+            news.NewsItem('test:one', 'url_one', self.then))
+        news.StudentNewsDao.mark_item_seen('test:one')
+        self._get_news()
+
+        digest = models.MemcacheManager.get(
+            news.NewsDigestCache.DIGEST_KEY % self.user.user_id())
+        seen_ts = utc.datetime_to_timestamp(
+            news.StudentNewsDao.get_seen_items()[0].when)
+        self.assertEquals(
+            seen_ts + news.NEWSWORTHINESS_SECONDS, digest['expires'])
+
+    def test_course_titles_cached_per_course_version(self):
+        news.CourseNewsDao.add_news_item(
+            news.NewsItem('test:one', 'url_one', self.then))
+        titles = []
+        real_get_i18n_title = news._get_i18n_title
+        def get_i18n_title(resource_key):
+            titles.append(resource_key)
+            return real_get_i18n_title(resource_key)
+        self.swap(news, '_get_i18n_title', get_i18n_title)
+
+        self._get_news()
+        news.StudentNewsDao.mark_item_seen('test:one')
+        self._get_news()
+        self.assertEquals(2, self.num_renders)
+        self.assertEquals(['test:one'], titles)
@@ -14,8 +14,9 @@
 
 """Notification module.
 
-Provides Manager.send_async, which sends notifications; and Manager.query, which
-queries the current status of notifications.
+Provides Manager.send_async, which sends notifications; Manager.send_many, which
+sends the same kind of notification to many recipients at once; and
+Manager.query, which queries the current status of notifications.
 
 Notifications are transported by email. Every message you send consumes email
 quota. A message is a single payload delivered to a single user. We do not
@@ -77,6 +78,8 @@ from models import transforms
 from models import utils
 from modules.dashboard import asset_paths
 
+import webapp2
+
 from google.appengine.api import mail
 from google.appengine.api import mail_errors
 from google.appengine.api import taskqueue
@@ -101,6 +104,13 @@ _MAX_RETRY_DAYS = 3
 # expected cap on the number of retries imposed by taskqueue.
 _RECOVERABLE_FAILURE_CAP = 20
 _SECONDS_PER_HOUR = 60 * 60
+# Number of messages whose entities send_many() writes per db.put() call. Each
+# message is a Notification and a Payload, well under the 500 entity limit.
+_SEND_MANY_PUT_BATCH_SIZE = 100
+# Number of messages send_many() hands to each task.
+_SEND_MANY_MESSAGES_PER_TASK = 10
+# Number of tasks send_many() adds per taskqueue call; the most App Engine allows.
+_SEND_MANY_TASKS_PER_ADD = 100
 _SECONDS_PER_DAY = 24 * _SECONDS_PER_HOUR
 _USECS_PER_SECOND = 10 ** 6
 
@@ -124,6 +134,47 @@ COUNTER_SEND_ASYNC_SUCCESS = counters.PerfCounter(
     'gcb-notifications-send-async-success',
     'number of times send_async succeeded'
 )
+COUNTER_SEND_MANY_FAILED_BAD_ARGUMENTS = counters.PerfCounter(
+    'gcb-notifications-send-many-failed-bad-arguments',
+    'number of times send_many failed because arguments were bad'
+)
+COUNTER_SEND_MANY_FAILED_DATASTORE_ERROR = counters.PerfCounter(
+    'gcb-notifications-send-many-failed-datastore-error',
+    'number of times send_many failed because of datastore error'
+)
+COUNTER_SEND_MANY_MESSAGES = counters.PerfCounter(
+    'gcb-notifications-send-many-messages',
+    'number of messages enqueued by successful send_many calls'
+)
+COUNTER_SEND_MANY_PUT_BATCHES = counters.PerfCounter(
+    'gcb-notifications-send-many-put-batches',
+    'number of batched datastore puts made by send_many'
+)
+COUNTER_SEND_MANY_START = counters.PerfCounter(
+    'gcb-notifications-send-many-called',
+    'number of times send_many has been called'
+)
+COUNTER_SEND_MANY_SUCCESS = counters.PerfCounter(
+    'gcb-notifications-send-many-success',
+    'number of times send_many succeeded'
+)
+COUNTER_SEND_MANY_TASK_BATCHES = counters.PerfCounter(
+    'gcb-notifications-send-many-task-batches',
+    'number of batched task queue adds made by send_many'
+)
+COUNTER_SEND_MAIL_BATCH_TASK_MESSAGES = counters.PerfCounter(
+    'gcb-notifications-send-mail-batch-task-messages',
+    'number of messages processed by send mail batch tasks'
+)
+COUNTER_SEND_MAIL_BATCH_TASK_REENQUEUED = counters.PerfCounter(
+    'gcb-notifications-send-mail-batch-task-reenqueued',
+    ('number of messages a send mail batch task handed to a task of their own '
+     'after a recoverable failure')
+)
+COUNTER_SEND_MAIL_BATCH_TASK_STARTED = counters.PerfCounter(
+    'gcb-notifications-send-mail-batch-task-started',
+    'number of times a send mail batch task was dequeued and started'
+)
 COUNTER_SEND_MAIL_TASK_FAILED = counters.PerfCounter(
     'gcb-notifications-send-mail-task-failed',
     'number of times the send mail task failed, but could be retried'
@@ -175,6 +226,11 @@ def _dt_to_epoch_usec(dt):
         dt - datetime.datetime.utcfromtimestamp(0)).total_seconds())
 
 
+def _batches(items, size):
+    for i in xrange(0, len(items), size):
+        yield items[i:i + size]
+
+
 def _epoch_usec_to_dt(usec):
     """Converts microseconds since epoch int to datetime (UTC, no tzinfo)."""
     return (
@@ -439,6 +495,148 @@ class Manager(object):
 
         return notification_key, payload_key
 
+    @classmethod
+    def send_many(cls, messages, sender, intent, retention_policy=None):
+        """Asynchronously sends a notification via email to many recipients.
+
+        Behaves like one send_async() call per message, but costs far fewer
+        datastore and task queue round trips: all arguments are validated
+        before anything is stored, entities are written by batched db.put()
+        calls instead of one transaction per message, and messages are handed
+        to tasks several at a time, with those tasks added in batches.
+
+        Each message is still sent, retried, and has its retention policy
+        applied independently. Entities are not written transactionally, so
+        if a put fails part way through, the messages already stored are left
+        for the cron to enqueue.
+
+        Args:
+            messages: list of dict. One per recipient, with 'to', 'body' and
+                    'subject' entries, and optionally 'html' and
+                    'audit_trail'. Each entry is as described for the
+                    send_async() argument of the same name. Recipients must be
+                    unique.
+            sender: string. As for send_async(); used for every message.
+            intent: string. As for send_async(); used for every message.
+            retention_policy: RetentionPolicy. As for send_async(); used for
+                    every message.
+
+        Returns:
+            List of (notification_key, payload_key) 2-tuples, in the order of
+            messages.
+
+        Raises:
+            Exception: if values delegated to model initializers are invalid.
+            ValueError: if sender or any recipient is malformed according to
+                    App Engine, or if a recipient is repeated.
+        """
+        COUNTER_SEND_MANY_START.inc()
+        enqueue_date = datetime.datetime.utcnow()
+        retention_policy = (
+            retention_policy if retention_policy else RetainAuditTrail)
+
+        if not mail.is_email_valid(sender):
+            COUNTER_SEND_MANY_FAILED_BAD_ARGUMENTS.inc()
+            raise ValueError('Malformed email address: "%s"' % sender)
+
+        recipients = [message['to'] for message in messages]
+        malformed = [to for to in recipients if not mail.is_email_valid(to)]
+        if malformed:
+            COUNTER_SEND_MANY_FAILED_BAD_ARGUMENTS.inc()
+            raise ValueError('Malformed email addresses: %s' % ', '.join(
+                '"%s"' % to for to in malformed))
+
+        if len(set(recipients)) != len(recipients):
+            # Notifications are keyed by recipient, intent and enqueue date.
+            COUNTER_SEND_MANY_FAILED_BAD_ARGUMENTS.inc()
+            raise ValueError('Recipients must not be repeated')
+
+        if retention_policy.NAME not in _RETENTION_POLICIES:
+            COUNTER_SEND_MANY_FAILED_BAD_ARGUMENTS.inc()
+            raise ValueError('Invalid retention policy: ' +
+                             str(retention_policy))
+
+        try:
+            unsaved_models = [
+                cls._make_unsaved_models(
+                    message.get('audit_trail'), message['body'], enqueue_date,
+                    intent, retention_policy.NAME, sender, message['subject'],
+                    message['to'], html=message.get('html'))
+                for message in messages]
+        except Exception, e:
+            COUNTER_SEND_MANY_FAILED_BAD_ARGUMENTS.inc()
+            raise e
+
+        for notification, _ in unsaved_models:
+            cls._mark_enqueued(notification, enqueue_date)
+
+        keys = []
+        try:
+            for batch in _batches(unsaved_models, _SEND_MANY_PUT_BATCH_SIZE):
+                saved = db.put([model for pair in batch for model in pair])
+                keys.extend(zip(saved[::2], saved[1::2]))
+                COUNTER_SEND_MANY_PUT_BATCHES.inc()
+        except Exception, e:
+            COUNTER_SEND_MANY_FAILED_DATASTORE_ERROR.inc()
+            raise e
+
+        tasks = [
+            cls._make_send_mail_batch_task(batch)
+            for batch in _batches(keys, _SEND_MANY_MESSAGES_PER_TASK)]
+        for batch in _batches(tasks, _SEND_MANY_TASKS_PER_ADD):
+            taskqueue.Queue().add(batch)
+            COUNTER_SEND_MANY_TASK_BATCHES.inc()
+
+        COUNTER_SEND_MANY_MESSAGES.inc(len(messages))
+        COUNTER_SEND_MANY_SUCCESS.inc()
+
+        return keys
+
+    @classmethod
+    def _make_send_mail_batch_task(cls, keys):
+        # A plain task for our own handler, rather than deferred.defer(), so
+        # that tasks can be added to the queue many at a time.
+        return taskqueue.Task(
+            url=SendMailBatchHandler.URL,
+            params={SendMailBatchHandler.KEYS_PARAM: transforms.dumps(
+                [[str(notification_key), str(payload_key)]
+                 for notification_key, payload_key in keys])},
+            retry_options=cls._get_retry_options())
+
+    @classmethod
+    def _send_mail_batch_task(cls, keys):
+        """Sends several messages enqueued together by send_many().
+
+        Each message is sent in its own transaction, exactly as a task from
+        send_async() would send it. A message that fails permanently has that
+        recorded on its notification and does not affect the others. A message
+        that fails recoverably is handed to a task of its own, so that it alone
+        is retried with the usual retry options.
+
+        Args:
+            keys: list of (notification_key, payload_key) 2-tuples.
+        """
+        COUNTER_SEND_MAIL_BATCH_TASK_STARTED.inc()
+
+        for notification_key, payload_key in keys:
+            COUNTER_SEND_MAIL_BATCH_TASK_MESSAGES.inc()
+            try:
+                cls._transactional_send_mail_task(notification_key, payload_key)
+            except deferred.PermanentTaskFailure, e:
+                _LOG.error(
+                    'Permanent failure processing notification %s: %s',
+                    notification_key, e)
+            # Must be vague. pylint: disable=broad-except
+            except Exception, e:
+                _LOG.warning(
+                    'Recoverable error processing notification %s; enqueueing '
+                    'it for retry on its own. Error was: %s',
+                    notification_key, e)
+                deferred.defer(
+                    cls._transactional_send_mail_task, notification_key,
+                    payload_key, _retry_options=cls._get_retry_options())
+                COUNTER_SEND_MAIL_BATCH_TASK_REENQUEUED.inc()
+
     @classmethod
     def _make_unsaved_models(
         cls, audit_trail, body, enqueue_date, intent, retention_policy, sender,
@@ -959,6 +1157,24 @@ class Payload(_Model):
         _IntentProperty().validate(kwargs.get('intent'))
 
 
+class SendMailBatchHandler(webapp2.RequestHandler):
+    """Runs the tasks added by Manager.send_many()."""
+
+    URL = '/modules/notifications/send_mail_batch'
+    KEYS_PARAM = 'keys'
+
+    def post(self):
+        if 'X-AppEngine-QueueName' not in self.request.headers:
+            self.response.set_status(500)
+            return
+        keys = [
+            (db.Key(notification_key), db.Key(payload_key))
+            for notification_key, payload_key in transforms.loads(
+                self.request.get(self.KEYS_PARAM))]
+        # Treating as module-protected. pylint: disable=protected-access
+        Manager._send_mail_batch_task(keys)
+
+
 custom_module = None
 
 
@@ -975,13 +1191,15 @@ def register_module():
     from modules.notifications import stats
 
     stats.register_analytic()
-    cron_handlers = [(
+    global_handlers = [(
             '/cron/process_pending_notifications',
             cron.ProcessPendingNotificationsHandler
+    ), (
+            SendMailBatchHandler.URL, SendMailBatchHandler
     )]
     custom_module = custom_modules.Module(
         'Notifications', 'Student notification management system.',
-        cron_handlers,
+        global_handlers,
         [],
         notify_module_enabled=on_module_enabled
     )
@@ -1001,5 +1219,9 @@ def register_module():
                 to, sender, intent, body, subject, audit_trail=audit_trail,
                 html=html, retention_policy=retention_policy)
 
+        def send_many(self, messages, sender, intent, retention_policy=None):
+            return Manager.send_many(
+                messages, sender, intent, retention_policy=retention_policy)
+
     services.notifications = Service()
     return custom_module
@@ -696,6 +696,98 @@ class ManagerTest(actions.TestBase):
                 invalid_to, self.sender, self.intent, self.body, self.subject,
                 )
 
+    def _make_messages(self, count):
+        return [
+            {'to': 'to%s@example.com' % i, 'body': self.body,
+             'subject': self.subject}
+            for i in xrange(count)]
+
+    def test_send_many_sets_initial_state_in_batches_and_can_run_tasks(self):
+        self.swap(notifications, '_SEND_MANY_PUT_BATCH_SIZE', 10)
+        messages = self._make_messages(25)
+
+        keys = notifications.Manager.send_many(
+            messages, self.sender, self.intent)
+
+        self.assertEqual(25, len(keys))
+        for message, (notification_key, payload_key) in zip(messages, keys):
+            notification, payload = db.get([notification_key, payload_key])
+            self.assertEqual(message['to'], notification.to)
+            self.assertEqual(message['to'], payload.to)
+            self.assertEqual(self.sender, notification.sender)
+            self.assertEqual(self.subject, notification.subject)
+            self.assertEqual(self.body, payload.body)
+            self.assertEqual(notification.enqueue_date,
+                             notification._last_enqueue_date)
+            self.assertEqual(
+                notifications.RetainAuditTrail.NAME,
+                notification._retention_policy)
+
+        # 25 messages at 10 per task.
+        self.assertEqual(3, len(self.taskq.GetTasks('default')))
+        self.assertEqual(3, notifications.COUNTER_SEND_MANY_PUT_BATCHES.value)
+        self.assertEqual(1, notifications.COUNTER_SEND_MANY_TASK_BATCHES.value)
+        self.assertEqual(25, notifications.COUNTER_SEND_MANY_MESSAGES.value)
+
+        self.execute_all_deferred_tasks()
+        sent = self.get_mail_stub().get_sent_messages()
+        self.assertEqual(
+            sorted(message['to'] for message in messages),
+            sorted(message.to for message in sent))
+        self.assertEqual(
+            [None] * 25, [payload.body for payload in db.get(
+                [payload_key for _, payload_key in keys])])
+
+        self.assertEqual(
+            3, notifications.COUNTER_SEND_MAIL_BATCH_TASK_STARTED.value)
+        self.assertEqual(
+            25, notifications.COUNTER_SEND_MAIL_BATCH_TASK_MESSAGES.value)
+        self.assertEqual(25, notifications.COUNTER_SEND_MAIL_TASK_SENT.value)
+        self.assertEqual(25, notifications.COUNTER_RETENTION_POLICY_RUN.value)
+
+    def test_send_many_raises_value_error_and_stores_nothing_if_to_invalid(self):
+        messages = self._make_messages(3)
+        messages[1]['to'] = ''
+
+        with self.assertRaisesRegexp(
+                ValueError, 'Malformed email addresses: ""'):
+            notifications.Manager.send_many(messages, self.sender, self.intent)
+        self.assertEqual(0, notifications.Notification.all().count())
+        self.assertEqual(0, len(self.taskq.GetTasks('default')))
+
+    def test_send_many_raises_value_error_if_to_repeated(self):
+        messages = self._make_messages(2)
+        messages[1]['to'] = messages[0]['to']
+
+        with self.assertRaisesRegexp(ValueError, 'must not be repeated'):
+            notifications.Manager.send_many(messages, self.sender, self.intent)
+
+    def test_send_mail_batch_task_reenqueues_recoverable_failures_alone(self):
+        bad_to = 'bad@example.com'
+        sent = []
+
+        def send_mail(unused_sender, to, unused_subject, unused_body):
+            if to == bad_to:
+                raise ValueError('thrown')
+            sent.append(to)
+
+        self.swap(notifications.mail, 'send_mail', send_mail)
+        keys = [
+            tuple(db.put(notifications.Manager._make_unsaved_models(
+                self.audit_trail, self.body, self.now, self.intent,
+                notifications.RetainAuditTrail.NAME, self.sender, self.subject,
+                to)))
+            for to in (self.to, bad_to)]
+
+        notifications.Manager._send_mail_batch_task(keys)
+
+        self.assertEqual([self.to], sent)
+        self.assertTrue(db.get(keys[0][0])._send_date)
+        self.assertEqual(1, db.get(keys[1][0])._recoverable_failure_count)
+        self.assertEqual(1, len(self.taskq.GetTasks('default')))
+        self.assertEqual(
+            1, notifications.COUNTER_SEND_MAIL_BATCH_TASK_REENQUEUED.value)
+
     def test_send_mail_task_fails_permanent_and_marks_entities_if_cap_hit(self):
         over_cap = notifications._RECOVERABLE_FAILURE_CAP + 1
         notification_key, payload_key = db.put(
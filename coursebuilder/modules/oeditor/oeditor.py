@@ -429,6 +429,12 @@ def create_bool_select_annotation(
 custom_module = None
 
 
+# Skin CSS requested as one combo by every page showing the object editor.
+_INPUTEX_SKIN_CSS = [
+    'src/inputex/assets/skins/sam/inputex.css',
+    'src/inputex-list/assets/skins/sam/inputex-list.css']
+
+
 def register_module():
     """Registers this module in the registry."""
 
@@ -448,7 +454,8 @@ def register_module():
             ('/static/combo/inputex', sites.make_css_combo_zip_handler(
                 os.path.join(
                     appengine_config.BUNDLE_ROOT, 'lib/inputex-3.1.0.zip'),
-                '/static/inputex-3.1.0/')),
+                '/static/inputex-3.1.0/',
+                common_combos=[_INPUTEX_SKIN_CSS])),
             ('/static/combo/yui', sites.make_css_combo_zip_handler(
                 os.path.join(appengine_config.BUNDLE_ROOT, 'lib/yui_3.6.0.zip'),
                 '/yui/')),
@@ -22,6 +22,7 @@ import datetime
 import random
 
 from common import schema_fields
+from common import utils as common_utils
 from models import counters
 from models import custom_modules
 from models import data_removal
@@ -254,6 +255,10 @@ _REVIEW_STEP_QUERY_LIMIT = 2 * domain.MAX_UNREMOVED_REVIEW_STEPS
 class Manager(object):
     """Object that manages the review subsystem."""
 
+    # Callbacks run with the step key after write_review() succeeds.  Writing
+    # a review may complete the reviewer's requirements on an assessment.
+    POST_WRITE_REVIEW_HOOKS = []
+
     @classmethod
     def add_reviewer(cls, unit_id, submission_key, reviewee_key, reviewer_key):
         """Adds a reviewer for a submission.
@@ -980,6 +985,7 @@ class Manager(object):
             raise e
 
         COUNTER_WRITE_REVIEW_SUCCESS.inc()
+        common_utils.run_hooks(cls.POST_WRITE_REVIEW_HOOKS, step_key)
         return step_key
 
     @classmethod
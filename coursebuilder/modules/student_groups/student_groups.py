@@ -173,6 +173,11 @@ class OverrideTriggerMixin(object):
         """Remove all SETTINGS_NAME triggers from the student_group DTO."""
         student_group.clear_triggers(cls.SETTINGS_NAME)
 
+    @classmethod
+    def due_index_source(cls, student_group):
+        """Student groups each have their own due time for these triggers."""
+        return '%s:%s' % (cls.typename(), student_group.id)
+
 
 class ContentOverrideTrigger(OverrideTriggerMixin, triggers.ContentTrigger):
     """Course content availability override applied at specified date/time.
@@ -1587,6 +1592,12 @@ class AddToStudentAggregate(
             }
         }
 
+    @classmethod
+    def merge_aggregate(cls, course, student, static_params,
+                        unused_previous, unused_num_previous_items,
+                        unused_event_items):
+        return cls.produce_aggregate(course, student, static_params, [])
+
     @classmethod
     def get_schema(cls):
         schema = schema_fields.FieldRegistry(cls.SECTION)
@@ -16,11 +16,15 @@
 
 __author__ = 'Mike Gainer (mgainer@google.com)'
 
+import glob
 import logging
+import os
 import urlparse
 import webapp2
 
 import appengine_config
+from common import jinja_utils
+from controllers import sites
 from models import custom_modules
 
 MODULE_NAME = 'warmup'
@@ -31,11 +35,37 @@ logging.basicConfig()
 custom_module = None
 
 
+def _get_template_dirs():
+    return [os.path.join(appengine_config.BUNDLE_ROOT, 'views')] + sorted(
+        glob.glob(os.path.join(
+            appengine_config.BUNDLE_ROOT, 'modules', '*', 'templates')))
+
+
+def precompile_templates():
+    """Compile page templates so first requests to this instance skip it."""
+    if not jinja_utils.CAN_USE_JINJA2_TEMPLATE_CACHE.value:
+        return 0
+    count = 0
+    for template_dir in _get_template_dirs():
+        count += jinja_utils.precompile_templates([template_dir])
+    _LOG.info('Precompiled %d templates.', count)
+    return count
+
+
+def preassemble_combo_bundles():
+    """Assemble common CSS/JS combos so first requests find them cached."""
+    count = sites.preassemble_combo_bundles()
+    _LOG.info('Preassembled %d combo bundles.', count)
+    return count
+
+
 class WarmupHandler(webapp2.RequestHandler):
 
     URL = '/_ah/warmup'
 
     def get(self):
+        precompile_templates()
+        preassemble_combo_bundles()
         if not appengine_config.PRODUCTION_MODE:
             port = urlparse.urlparse(self.request.url).port
             _LOG.info('warmup ---------------------------------------------')
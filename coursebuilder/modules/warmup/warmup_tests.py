@@ -17,6 +17,8 @@
 __author__ = 'Mike Gainer (mgainer@google.com)'
 
 import appengine_config
+from common import jinja_utils
+from controllers import sites
 from modules.warmup import warmup
 from tests.functional import actions
 
@@ -44,3 +46,17 @@ class WarmupTests(actions.TestBase):
             self.assertLogDoesNotContain('or http://0.0.0.0:8081')
         finally:
             appengine_config.PRODUCTION_MODE = False
+
+    def test_warmup_precompiles_templates(self):
+        jinja_utils.ProcessScopedJinjaTemplateCache.clear_instance()
+        self.get('http://localhost:8081' + warmup.WarmupHandler.URL)
+        self.assertLogContains('Precompiled')
+        self.assertTrue(jinja_utils.ProcessScopedJinjaTemplateCache
+                        .get_compiled_template_count() > 0)
+
+    def test_warmup_preassembles_combo_bundles(self):
+        sites.ProcessScopedComboBundleCache.clear_instance()
+        self.get('http://localhost:8081' + warmup.WarmupHandler.URL)
+        self.assertLogContains('Preassembled 1 combo bundles.')
+        self.assertEquals(
+            1, sites.ProcessScopedComboBundleCache.get_bundle_count())
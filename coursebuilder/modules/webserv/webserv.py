@@ -280,8 +280,8 @@ class WebServer(lessons.CourseHandler, utils.StarRouteHandlerMixin):
                 appengine_config.BUNDLE_ROOT, 'views')]
 
         if from_string:
-            template = jinja_utils.create_and_configure_jinja_environment(
-                template_dirs, handler=self).from_string(from_string)
+            template = jinja_utils.get_template_from_string(
+                from_string, template_dirs, handler=self)
         else:
             template = jinja_utils.get_template(
                 relname, template_dirs, handler=self)
@@ -58,6 +58,7 @@ ALL_TEST_CLASSES = {
     'tests.functional.common_crypto.GenCryptoKeyFromHmac': 2,
     'tests.functional.common_crypto.GetExternalUserIdTests': 4,
     'tests.functional.common_manifest.ModuleManifestTests': 7,
+    'tests.functional.common_jinja_utils.JinjaTemplateCacheTests': 5,
     'tests.functional.common_users.AppEnginePassthroughUsersServiceTest': 10,
     'tests.functional.common_users.AuthInterceptorAndRequestHooksTest': 2,
     'tests.functional.common_users.PublicExceptionsAndClassesIdentityTests': 2,
@@ -68,12 +69,14 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_analytics.AnalyticsTabsWithNoJobs': 8,
     'tests.functional.model_analytics.CronCleanupTest': 14,
     'tests.functional.model_analytics.MapReduceSimpleTest': 1,
-    'tests.functional.model_analytics.ProgressAnalyticsTest': 9,
-    'tests.functional.model_analytics.QuestionAnalyticsTest': 3,
+    'tests.functional.model_analytics.ProgressAnalyticsTest': 10,
+    'tests.functional.model_analytics.QuestionAnalyticsTest': 4,
+    'tests.functional.model_analytics.RunningTotalsTest': 5,
     'tests.functional.model_config.ValueLoadingTests': 2,
+    'tests.functional.model_config.DeltaRefreshTests': 2,
     'tests.functional.model_courses.CourseCachingTest': 5,
     'tests.functional.model_courses.PermissionsTest': 4,
-    'tests.functional.model_data_sources.PaginatedTableTest': 17,
+    'tests.functional.model_data_sources.PaginatedTableTest': 20,
     'tests.functional.model_data_sources.PiiExportTest': 4,
     'tests.functional.model_entities.BaseEntityTestCase': 3,
     'tests.functional.model_entities.ExportEntityTestCase': 2,
@@ -86,7 +89,7 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_models.MemcacheManagerTestCase': 4,
     'tests.functional.model_models.PersonalProfileTestCase': 1,
     'tests.functional.model_models.QuestionDAOTestCase': 3,
-    'tests.functional.model_models.StudentAnswersEntityTestCase': 1,
+    'tests.functional.model_models.StudentAnswersEntityTestCase': 5,
     'tests.functional.model_models.StudentLifecycleObserverTestCase': 16,
     'tests.functional.model_models.StudentProfileDAOTestCase': 6,
     'tests.functional.model_models.StudentPropertyEntityTestCase': 1,
@@ -96,19 +99,23 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_student_work.KeyPropertyTest': 4,
     'tests.functional.model_student_work.ReviewTest': 3,
     'tests.functional.model_student_work.SubmissionTest': 4,
-    'tests.functional.model_utils.QueryMapperTest': 4,
+    'tests.functional.model_utils.QueryMapperTest': 8,
+    'tests.functional.model_utils.ShardedQueryMapperTest': 4,
     'tests.functional.model_vfs.VfsLargeFileSupportTest': 6,
+    'tests.functional.model_vfs.VfsCacheUpdatesTest': 2,
     'tests.functional.module_config_test.ManipulateAppYamlFileTest': 8,
     'tests.functional.module_config_test.ModuleIncorporationTest': 12,
     'tests.functional.module_config_test.ModuleManifestTest': 7,
+    'tests.functional.module_startup.ModuleStartupTests': 3,
     'tests.functional.modules_data_source_providers.CourseElementsTest': 11,
     'tests.functional.modules_data_source_providers.StudentScoresTest': 6,
     'tests.functional.modules_data_source_providers.StudentsTest': 5,
-    'tests.functional.progress_percent.ProgressPercent': 4,
+    'tests.functional.progress_percent.ProgressPercent': 5,
     'tests.functional.student_answers.StudentAnswersAnalyticsTest': 1,
     'tests.functional.student_labels.StudentLabelsTest': 32,
     'tests.functional.student_last_location.NonRootCourse': 9,
     'tests.functional.student_last_location.RootCourse': 3,
+    'tests.functional.student_last_location.BufferedLastLocation': 2,
     'tests.functional.student_tracks.StudentTracksTest': 10,
     'tests.functional.roles.RolesTest': 24,
     'tests.functional.test_classes.ActivityTest': 1,
@@ -128,12 +135,12 @@ ALL_TEST_CLASSES = {
     'tests.functional.test_classes.InfrastructureTest': 21,
     'tests.functional.test_classes.I18NTest': 2,
     'tests.functional.test_classes.LegacyEMailAsKeyNameTest': 44,
-    'tests.functional.test_classes.LessonComponentsTest': 3,
+    'tests.functional.test_classes.LessonComponentsTest': 4,
     'tests.functional.test_classes.MemcacheTest': 65,
     'tests.functional.test_classes.MultipleCoursesTest': 1,
     'tests.functional.test_classes.NamespaceTest': 2,
     'tests.functional.test_classes.ProgressTests': 1,
-    'tests.functional.test_classes.StaticHandlerTest': 3,
+    'tests.functional.test_classes.StaticHandlerTest': 4,
     'tests.functional.test_classes.StudentAspectTest': 19,
     'tests.functional.test_classes.StudentKeyNameTest': 8,
     'tests.functional.test_classes.TransformsEntitySchema': 1,
@@ -141,7 +148,7 @@ ALL_TEST_CLASSES = {
     'tests.functional.test_classes.VirtualFileSystemTest': 44,
     'tests.functional.test_classes.ImportActivityTests': 7,
     'tests.functional.test_classes.ImportAssessmentTests': 3,
-    'tests.functional.test_classes.ImportGiftQuestionsTests': 1,
+    'tests.functional.test_classes.ImportGiftQuestionsTests': 2,
     'tests.functional.test_classes.WSGIRoutingTest': 6,
     'tests.functional.unit_assessment.UnitPartialUpdateTests': 5,
     'tests.functional.unit_assessment.UnitPrePostAssessmentTest': 18,
@@ -179,6 +186,7 @@ ALL_TEST_CLASSES = {
     'tests.unit.javascript_tests.AllJavaScriptTests': 2,
     'tests.unit.models_analytics.AnalyticsTests': 6,
     'tests.unit.models_config.ValidateIntegerRangeTests': 3,
+    'tests.unit.models_counters.LatencyHistogramTests': 4,
     'tests.unit.models_courses.WorkflowValidationTests': 13,
     'tests.unit.models_transforms.JsonToDictTests': 13,
     'tests.unit.models_transforms.JsonParsingTests': 3,
@@ -199,6 +207,8 @@ ALL_TEST_CLASSES = {
     'tests.unit.gift_parser_tests.TestHead': 2,
     'tests.unit.gift_parser_tests.TestMultiChoiceQuestion': 5,
     'tests.unit.gift_parser_tests.TestCreateManyGiftQuestion': 1,
+    'tests.unit.gift_parser_tests.TestStreamingParser': 3,
+    'tests.unit.gift_parser_tests.GiftParserBenchmark': 1,
 }
 
 INTERNAL_TEST_CLASSES = {}
@@ -0,0 +1,93 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for shared Jinja environments and compiled template caching."""
+
+import os
+import shutil
+import tempfile
+import time
+
+import actions
+
+from common import jinja_utils
+
+
+class JinjaTemplateCacheTests(actions.TestBase):
+
+    def setUp(self):
+        super(JinjaTemplateCacheTests, self).setUp()
+        jinja_utils.ProcessScopedJinjaTemplateCache.clear_instance()
+        self.template_dir = tempfile.mkdtemp()
+        self._write('page.html', 'Hello, {{ name }}!')
+
+    def tearDown(self):
+        shutil.rmtree(self.template_dir)
+        jinja_utils.ProcessScopedJinjaTemplateCache.clear_instance()
+        super(JinjaTemplateCacheTests, self).tearDown()
+
+    def _write(self, name, content, mtime=None):
+        path = os.path.join(self.template_dir, name)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        if mtime:
+            os.utime(path, (mtime, mtime))
+
+    def _render(self, name, **kwargs):
+        return jinja_utils.get_template(
+            name, [self.template_dir]).render(**kwargs)
+
+    def test_environment_and_code_are_shared(self):
+        self.assertEquals('Hello, A!', self._render('page.html', name='A'))
+        self.assertEquals('Hello, B!', self._render('page.html', name='B'))
+        cache = jinja_utils.ProcessScopedJinjaTemplateCache
+        self.assertEquals(1, cache.get_environment_count())
+        self.assertEquals(1, cache.get_compiled_template_count())
+
+    def test_changed_template_is_recompiled(self):
+        self.assertEquals('Hello, A!', self._render('page.html', name='A'))
+        self._write('page.html', 'Goodbye, {{ name }}!',
+                    mtime=time.time() + 10)
+        self.assertEquals('Goodbye, A!', self._render('page.html', name='A'))
+
+    def test_gcb_tags_filter_uses_handler_of_each_template(self):
+        self._write('tags.html', '{{ text | gcb_tags }}')
+        seen = []
+
+        def fake_apply(data, handler):
+            seen.append(handler)
+            return data
+        self.swap(jinja_utils, '_apply_gcb_tags', fake_apply)
+
+        jinja_utils.get_template(
+            'tags.html', [self.template_dir], handler='one').render(text='x')
+        jinja_utils.get_template(
+            'tags.html', [self.template_dir], handler='two').render(text='x')
+        self.assertEquals(['one', 'two'], seen)
+
+    def test_template_from_string_is_cached(self):
+        for name in ['A', 'B']:
+            template = jinja_utils.get_template_from_string(
+                'Hi, {{ name }}.', [self.template_dir])
+            self.assertEquals('Hi, %s.' % name, template.render(name=name))
+        self.assertEquals(1, jinja_utils.ProcessScopedJinjaTemplateCache
+                          .get_compiled_template_count())
+
+    def test_precompile_templates(self):
+        self._write('other.html', '{{ 1 + 1 }}')
+        self._write('broken.html', '{% if %}')
+        self.assertEquals(
+            2, jinja_utils.precompile_templates([self.template_dir]))
+        self.assertEquals(2, jinja_utils.ProcessScopedJinjaTemplateCache
+                          .get_compiled_template_count())
@@ -43,6 +43,7 @@ from models.progress import ProgressStats
 from models.progress import UnitLessonCompletionTracker
 from modules.analytics import analytics
 from modules.analytics import rest_providers
+from modules.analytics import running_totals
 from modules.analytics import synchronous_providers
 from modules.mapreduce import mapreduce_module
 
@@ -276,6 +277,42 @@ class ProgressAnalyticsTest(actions.TestBase):
         response = self.get(response.request.url)
         assert_contains('Canceled by ' + email, response.body)
 
+    def test_resumable_job_checkpoints_and_resumes_across_tasks(self):
+        for index in range(3):
+            actions.login('student%s@google.com' % index)
+            actions.register(self, 'Student %s' % index)
+            actions.logout()
+
+        generator_class = (
+            synchronous_providers.StudentEnrollmentAndScoresGenerator)
+        self.swap(generator_class, 'BATCH_SIZE', 1)
+        self.swap(generator_class, 'TASK_TIME_LIMIT_SEC', 0)
+        generator = generator_class(sites.get_all_courses()[0])
+        expected = generator.run()
+
+        self.execute_all_deferred_tasks()
+        generator.submit()
+        self.execute_all_deferred_tasks(iteration_limit=2)
+        job = generator.load()
+        self.assertEquals(jobs.STATUS_CODE_STARTED, job.status_code)
+        self.assertEquals(66, job.percent_complete)
+        self.assertEquals(2, transforms.loads(job.checkpoint)['done'])
+
+        actions.login('admin@google.com', is_admin=True)
+        response = self.get('dashboard?action=analytics_students')
+        assert_contains('It is about 66% done.', response.body)
+
+        self.execute_all_deferred_tasks()
+        job = generator.load()
+        self.assertEquals(jobs.STATUS_CODE_COMPLETED, job.status_code)
+        self.assertIsNone(job.checkpoint)
+        self.assertEquals(
+            transforms.loads(transforms.dumps(expected)),
+            transforms.loads(job.output))
+        self.assertEquals(
+            {'enrolled': 3, 'unenrolled': 0},
+            transforms.loads(job.output)['enrollment'])
+
     def test_get_entity_id_wrapper_in_progress_works(self):
         """Tests get_entity_id wrappers in progress.ProgressStats."""
         sites.setup_courses('course:/test::ns_test, course:/:/')
@@ -554,6 +591,101 @@ class ProgressAnalyticsTest(actions.TestBase):
 
 
 
+class RunningTotalsTest(actions.TestBase):
+    """Tests totals kept current by hooks between full recounts."""
+
+    def _recount(self, generator_class):
+        return transforms.loads(transforms.dumps(
+            generator_class(sites.get_all_courses()[0]).run()))
+
+    def test_totals_are_only_adjusted_after_a_recount(self):
+        totals = running_totals.RunningTotals('test')
+        self.assertFalse(totals.add({'a': 1}))
+        self.assertIsNone(totals.load())
+
+        totals.reset({'a': 1, 'b': [1, 2]})
+        self.assertTrue(totals.add({'a': 2, 'b': [0, -1, 5]}))
+        self.assertTrue(totals.add({'a': 3, 'c': {'d': 1}}))
+        self.assertEquals(
+            {'a': 6, 'b': [1, 1, 5], 'c': {'d': 1}}, totals.load())
+
+        totals.reset({'a': 0})
+        self.assertEquals({'a': 0}, totals.load())
+
+    def test_totals_can_ignore_entries_unknown_to_recount(self):
+        running_totals.RunningTotals('test').reset({'a': 1, 'b': [1, 2]})
+        totals = running_totals.RunningTotals('test', add_new_keys=False)
+        totals.add({'a': 1, 'b': [1, 1, 1], 'c': 1})
+        self.assertEquals({'a': 2, 'b': [2, 3]}, totals.load())
+
+    def test_buffered_changes_are_applied_when_flushed(self):
+        config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
+        try:
+            totals = (
+                synchronous_providers.StudentEnrollmentAndScoresGenerator
+                .RUNNING_TOTALS)
+            app_context = sites.get_all_courses()[0]
+            with common_utils.Namespace(app_context.get_namespace_name()):
+                totals.reset({'enrollment': {'enrolled': 1}})
+                self.assertTrue(totals.add({'enrollment': {'enrolled': 2}}))
+                self.assertTrue(totals.add({'enrollment': {'enrolled': 3}}))
+                self.assertEquals(
+                    {'enrollment': {'enrolled': 1}}, totals.load())
+
+                synchronous_providers.FlushRunningTotals._for_testing_only_get()
+                self.assertEquals(
+                    {'enrollment': {'enrolled': 6}}, totals.load())
+                self.assertEquals(0, totals.flush())
+        finally:
+            del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
+
+    def test_enrollment_and_score_totals_follow_students(self):
+        generator_class = (
+            synchronous_providers.StudentEnrollmentAndScoresGenerator)
+        actions.login('student1@google.com')
+        actions.register(self, 'Student 1')
+        actions.submit_assessment(
+            self, 'Pre', {'assessment_type': 'Pre', 'score': '1.00'})
+        self.execute_all_deferred_tasks(
+            models.StudentLifecycleObserver.QUEUE_NAME)
+        self._recount(generator_class)
+
+        actions.submit_assessment(
+            self, 'Pre', {'assessment_type': 'Pre', 'score': '3.00'})
+        actions.unregister(self)
+        actions.login('student2@google.com')
+        actions.register(self, 'Student 2')
+        actions.submit_assessment(
+            self, 'Pre', {'assessment_type': 'Pre', 'score': '2.00'})
+        actions.submit_assessment(
+            self, 'Mid', {'assessment_type': 'Mid', 'score': '4.00'})
+        self.execute_all_deferred_tasks(
+            models.StudentLifecycleObserver.QUEUE_NAME)
+
+        totals = generator_class.RUNNING_TOTALS.load()
+        self.assertEquals(
+            {'enrolled': 1, 'unenrolled': 1}, totals['enrollment'])
+        self.assertEquals({'Pre': [2, 5.0], 'Mid': [1, 4.0]}, totals['scores'])
+        self.assertEquals(self._recount(generator_class), totals)
+
+    def test_progress_totals_follow_students(self):
+        generator_class = synchronous_providers.StudentProgressStatsGenerator
+        with actions.OverriddenEnvironment(
+            {'course': {analytics.CAN_RECORD_STUDENT_EVENTS: 'true'}}):
+            actions.login('student1@google.com')
+            actions.register(self, 'Student 1')
+            self._recount(generator_class)
+
+            actions.view_unit(self)
+            actions.login('student2@google.com')
+            actions.register(self, 'Student 2')
+            actions.view_unit(self)
+
+        totals = generator_class.RUNNING_TOTALS.load()
+        self.assertEquals({'progress': 0, 'completed': 2}, totals['u.1.l.1'])
+        self.assertEquals(self._recount(generator_class), totals)
+
+
 class QuestionAnalyticsTest(actions.TestBase):
     """Tests the question analytics page from Course Author dashboard."""
 
@@ -668,6 +800,39 @@ class QuestionAnalyticsTest(actions.TestBase):
         assert_equals({}, id_to_questions)
         assert_equals({}, id_to_assessments)
 
+    def test_running_totals_follow_answers(self):
+        course = self._get_sample_v15_course()
+        generator_class = synchronous_providers.QuestionStatsGenerator
+        summarizer = generator_class.QuestionEventSummarizer(course)
+        answer = {
+            'type': 'McQuestion', 'instanceid': 'QN', 'answer': [0],
+            'score': 1.0,
+            'location': 'http://localhost/test/unit?unit=1&lesson=2'}
+        unknown_question = dict(answer, instanceid='XX')
+        unknown_choice = dict(answer, answer=[1])
+
+        with common_utils.Namespace('ns_test'):
+            generator = generator_class(sites.get_all_courses()[0])
+            generator.run()
+            for data in (answer, unknown_question, unknown_choice):
+                models.EventEntity(
+                    source='tag-assessment', user_id='1',
+                    data=transforms.dumps(data)).put()
+                generator_class.RUNNING_TOTALS.add(
+                    summarizer.get_deltas('tag-assessment', data))
+
+            id_to_questions, _ = generator_class.RUNNING_TOTALS.load()
+            self.assertNotIn('u.1.l.2.c.XX', id_to_questions)
+            self.assertEquals(
+                [1], id_to_questions['u.1.l.2.c.QN']['answer_counts'])
+
+            # A recount skips the whole of an answer with an unknown choice;
+            # the running totals still count the attempt.
+            expected, _ = transforms.loads(transforms.dumps(generator.run()))
+            expected['u.1.l.2.c.QN']['num_attempts'] += 1
+            expected['u.1.l.2.c.QN']['score'] += 1.0
+            self.assertEquals(expected, id_to_questions)
+
     def test_id_to_question_dict_constructed_correctly(self):
         """Tests id_to_question dicts are constructed correctly."""
         course = self._get_sample_v15_course()
@@ -19,12 +19,15 @@ __author__ = [
 ]
 
 import appengine_config
+import datetime
 import logging
 
 from models import config
 from models import models
 from tests.functional import actions
 
+from google.appengine.ext import db
+
 
 class ValueLoadingTests(actions.TestBase):
 
@@ -47,3 +50,71 @@ class ValueLoadingTests(actions.TestBase):
                 'INFO: Property is not registered (skipped): foo')
         finally:
             appengine_config.MODULE_REGISTRATION_IN_PROGRESS = False
+
+
+class DeltaRefreshTests(actions.TestBase):
+
+    def setUp(self):
+        super(DeltaRefreshTests, self).setUp()
+        self.first = config.ConfigProperty(
+            'gcb_test_delta_first', str, 'doc', default_value='first_default')
+        self.second = config.ConfigProperty(
+            'gcb_test_delta_second', str, 'doc', default_value='second_default')
+
+    def tearDown(self):
+        del config.Registry.registered[self.first.name]
+        del config.Registry.registered[self.second.name]
+        super(DeltaRefreshTests, self).tearDown()
+
+    def _put_from_other_instance(self, name, value, age_hours=0):
+        # db.put() skips ConfigPropertyEntity.put(), so neither the local
+        # registry nor the version stamp hear about this write.
+        db.put(config.ConfigPropertyEntity(
+            key_name=name, value=value, is_draft=False,
+            updated_on=datetime.datetime.utcnow() - datetime.timedelta(
+                hours=age_hours)))
+
+    def _refresh(self):
+        config.Registry.last_update_time = 0
+        return config.Registry.get_overrides()
+
+    def test_reload_skipped_while_version_unchanged(self):
+        config.Registry.get_overrides(force_update=True)
+        self._refresh()
+
+        self._put_from_other_instance(self.first.name, 'first_value')
+        self._refresh()
+        self.assertEquals('first_default', self.first.value)
+
+        config.Registry._bump_version()  # pylint: disable=protected-access
+        self._refresh()
+        self.assertEquals('first_value', self.first.value)
+
+    def test_only_changes_are_loaded(self):
+        self._put_from_other_instance(
+            self.first.name, 'first_value', age_hours=1)
+        self._put_from_other_instance(
+            self.second.name, 'second_value', age_hours=2)
+        config.Registry.get_overrides(force_update=True)
+        self.assertEquals('first_value', self.first.value)
+        self.assertEquals('second_value', self.second.value)
+
+        loaded = []
+        set_value = config.Registry._set_value  # pylint: disable=protected-access
+        def record_set_value(item, overrides, drafts):
+            loaded.append(item.key().name())
+            set_value(item, overrides, drafts)
+        self.swap(config.Registry, '_set_value', staticmethod(record_set_value))
+
+        self._put_from_other_instance(self.first.name, 'first_changed')
+        config.Registry._bump_version()  # pylint: disable=protected-access
+        self._refresh()
+        self.assertEquals('first_changed', self.first.value)
+        self.assertEquals('second_value', self.second.value)
+        self.assertEquals([self.first.name], loaded)
+
+        # Deleted properties revert to their defaults.
+        config.ConfigPropertyEntity.get_by_key_name(self.first.name).delete()
+        self._refresh()
+        self.assertEquals('first_default', self.first.value)
+        self.assertEquals('second_value', self.second.value)
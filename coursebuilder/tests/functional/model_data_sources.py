@@ -25,6 +25,7 @@ from common import crypto
 from common import utils as common_utils
 from models import data_sources
 from models import entities
+from models import models
 from models import transforms
 from models.data_sources import utils as data_sources_utils
 
@@ -64,6 +65,23 @@ class CharacterDataSource(data_sources.AbstractDbTableRestDataSource):
 
 data_sources.Registry.register(CharacterDataSource)
 
+
+class KeyedCharacterDataSource(CharacterDataSource):
+
+    @classmethod
+    def get_name(cls):
+        return 'keyed_character'
+
+    @classmethod
+    def use_keyset_pagination(cls):
+        return True
+
+    @classmethod
+    def get_projectable_fields(cls):
+        return set(['goal', 'rank'])
+
+data_sources.Registry.register(KeyedCharacterDataSource)
+
 from tests.functional import actions
 
 
@@ -616,6 +634,96 @@ class PaginatedTableTest(DataSourceTest):
             'fetch page 0 saving end cursor',
             ])
 
+    def test_keyset_pagination_random_access(self):
+        email = 'admin@google.com'
+        actions.login(email, is_admin=True)
+        by_key = sorted(self.characters, key=lambda c: c.key())
+
+        response = transforms.loads(self.get(
+            '/rest/data/keyed_character/items?chunk_size=3&page_number=2'
+            ).body)
+        source_context = response['source_context']
+        self.assertEquals(2, response['page_number'])
+        self._verify_data(by_key[6:9], response['data'])
+        self._assert_have_only_logs(response, [
+            'Creating new context for given parameters',
+            'fetch page 2 start key missing; skipping 6 keys from page 0',
+            'fetch page 2 using keyset limit 3',
+            'fetch page 2 saving next page key',
+            ])
+
+        # Start keys for pages seen so far are remembered; later pages
+        # skip forward from the nearest one.
+        response = transforms.loads(self.get(
+            '/rest/data/keyed_character/items?chunk_size=3&page_number=3'
+            '&source_context=%s' % source_context).body)
+        source_context = response['source_context']
+        self._verify_data(by_key[9:], response['data'])
+        self._assert_have_only_logs(response, [
+            'Existing context matches parameters; using existing context',
+            'fetch page 3 start key present',
+            'fetch page 3 using keyset limit 3',
+            'fetch page 3 is last; no next page key',
+            ])
+
+        response = transforms.loads(self.get(
+            '/rest/data/keyed_character/items?chunk_size=3&page_number=7'
+            '&source_context=%s' % source_context).body)
+        self.assertEquals(3, response['page_number'])
+        self._verify_data(by_key[9:], response['data'])
+        self._assert_have_only_logs(response, [
+            'Existing context matches parameters; using existing context',
+            'fetch page 7 start key missing; skipping 12 keys from page 3',
+            'Fewer pages available than requested.  Stopping at last page 3',
+            'fetch page 3 start key present',
+            'fetch page 3 using keyset limit 3',
+            'fetch page 3 is last; no next page key',
+            ])
+
+    def test_keyset_pagination_falls_back_to_cursors_when_ordered(self):
+        email = 'admin@google.com'
+        actions.login(email, is_admin=True)
+
+        response = transforms.loads(self.get(
+            '/rest/data/keyed_character/items?ordering=rank'
+            '&chunk_size=3&page_number=0').body)
+        self._assert_have_only_logs(response, [
+            'Creating new context for given parameters',
+            'fetch page 0 start cursor missing; end cursor missing',
+            'fetch page 0 using limit 3',
+            'fetch page 0 saving end cursor',
+            ])
+
+    def test_keyset_pagination_projects_and_prefetches(self):
+        email = 'admin@google.com'
+        actions.login(email, is_admin=True)
+        by_key = [c for c in sorted(self.characters, key=lambda c: c.key())
+                  if c.goal == 'R']
+        with actions.OverriddenConfig(models.CAN_USE_MEMCACHE.name, True):
+            response = transforms.loads(self.get(
+                '/rest/data/keyed_character/items?chunk_size=2'
+                '&filters=goal=R&fields=rank').body)
+            source_context = response['source_context']
+            self.assertEquals(
+                [{'rank': c.rank} for c in by_key[:2]], response['data'])
+            self._assert_have_only_logs(response, [
+                'Creating new context for given parameters',
+                'fetch page 0 using keyset limit 2',
+                'fetch page 0 saving next page key',
+                'fetch page 0 prefetching page 1',
+                ])
+
+            response = transforms.loads(self.get(
+                '/rest/data/keyed_character/items?page_number=1'
+                '&source_context=%s' % source_context).body)
+            self.assertEquals(
+                [{'rank': c.rank} for c in by_key[2:]], response['data'])
+            self._assert_have_only_logs(response, [
+                'Continuing use of existing context',
+                'fetch page 1 start key present',
+                'fetch page 1 served from prefetch',
+                ])
+
     def _assert_have_only_logs(self, response, messages):
         for message in messages:
             found_index = -1
@@ -797,6 +797,66 @@ class StudentAnswersEntityTestCase(actions.ExportTestBase):
             models.StudentAnswersEntity.safe_key(
                 answers_key, self.transform).name())
 
+    def test_safe_key_transforms_user_id_component(self):
+        answers_key = models.StudentAnswersEntity(
+            key_name=models.StudentAnswersEntity.create_key(
+                'user_id', 'Pre-Test')).put()
+        self.assertEqual(
+            'transformed_user_id-Pre-Test',
+            models.StudentAnswersEntity.safe_key(
+                answers_key, self.transform).name())
+
+    def test_set_answers_writes_one_entity_per_assessment(self):
+        models.StudentAnswersEntity.set_answers('user_id', 'Pre', [1])
+        models.StudentAnswersEntity.set_answers('user_id', 'Mid', [2])
+        models.StudentAnswersEntity.set_answers('user_id', 'Pre', [3])
+
+        self.assertEqual(
+            ['user_id-Mid', 'user_id-Pre'],
+            sorted(key.name() for key in models.StudentAnswersEntity.all(
+                keys_only=True)))
+        self.assertEqual(
+            [3], models.StudentAnswersEntity.get_answers('user_id', 'Pre'))
+        self.assertEqual(
+            [2], models.StudentAnswersEntity.get_answers('user_id', 'Mid'))
+        self.assertIsNone(
+            models.StudentAnswersEntity.get_answers('user_id', 'Fin'))
+
+    def test_combined_answers_are_read_and_then_split(self):
+        models.StudentAnswersEntity(
+            key_name='user_id',
+            data=transforms.dumps({'Pre': [1], 'Mid': [2]})).put()
+        self.assertEqual(
+            [1], models.StudentAnswersEntity.get_answers('user_id', 'Pre'))
+
+        models.StudentAnswersEntity.set_answers('user_id', 'Mid', [3])
+
+        self.assertIsNone(models.StudentAnswersEntity.get_by_key_name(
+            'user_id'))
+        self.assertEqual(
+            [1], models.StudentAnswersEntity.get_answers('user_id', 'Pre'))
+        self.assertEqual(
+            [3], models.StudentAnswersEntity.get_answers('user_id', 'Mid'))
+
+    def test_split_does_not_replace_newer_answers(self):
+        # As left by a split that failed before deleting the combined entity.
+        models.StudentAnswersEntity(
+            key_name='user_id',
+            data=transforms.dumps({'Pre': [1], 'Mid': [2]})).put()
+        models.StudentAnswersEntity.set_answers('user_id', 'Pre', [3])
+        models.StudentAnswersEntity(
+            key_name='user_id',
+            data=transforms.dumps({'Pre': [1], 'Mid': [2]})).put()
+
+        models.StudentAnswersEntity.set_answers('user_id', 'Mid', [4])
+
+        self.assertIsNone(models.StudentAnswersEntity.get_by_key_name(
+            'user_id'))
+        self.assertEqual(
+            [3], models.StudentAnswersEntity.get_answers('user_id', 'Pre'))
+        self.assertEqual(
+            [4], models.StudentAnswersEntity.get_answers('user_id', 'Mid'))
+
 
 class StudentPropertyEntityTestCase(actions.ExportTestBase):
 
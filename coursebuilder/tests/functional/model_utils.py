@@ -82,3 +82,85 @@ class QueryMapperTest(actions.TestBase):
         self.assertEqual(1001, num_processed)
         self.assertEqual(1, last_written.number)
         self.assertEqual('foo', last_written.string)
+
+    def test_run_with_prefetch_processes_more_than_one_batch(self):
+        db.put([Model() for _ in xrange(45)])
+        num_processed = utils.QueryMapper(
+            Model.all(), batch_size=10, prefetch=True, report_every=0
+        ).run(process, 1, string='foo')
+
+        self.assertEqual(45, num_processed)
+        self.assertEqual(45, Model.all().filter('number =', 1).count())
+
+    def test_run_without_prefetch_processes_all_entities(self):
+        db.put([Model() for _ in xrange(45)])
+        num_processed = utils.QueryMapper(
+            Model.all(), batch_size=10, prefetch=False, report_every=0
+        ).run(process, 1, string='foo')
+
+        self.assertEqual(45, num_processed)
+        self.assertEqual(45, Model.all().filter('number =', 1).count())
+
+    def test_run_with_adaptive_batch_size_processes_all_entities(self):
+        db.put([Model() for _ in xrange(120)])
+        num_processed = utils.QueryMapper(
+            Model.all(), batch_size=5, report_every=0, target_batch_secs=10,
+            max_batch_size=40
+        ).run(process, 1, string='foo')
+
+        self.assertEqual(120, num_processed)
+        self.assertEqual(120, Model.all().filter('number =', 1).count())
+
+    def test_adapt_batch_size(self):
+        # pylint: disable=protected-access
+        # Fast map function: grows, but at most doubles and caps at max.
+        self.assertEqual(40, utils._adapt_batch_size(20, 20, 0.001, 1, 1000))
+        self.assertEqual(30, utils._adapt_batch_size(20, 20, 0.001, 1, 30))
+        # Slow map function: shrinks, but at most halves and stays positive.
+        self.assertEqual(10, utils._adapt_batch_size(20, 20, 100, 1, 1000))
+        self.assertEqual(1, utils._adapt_batch_size(1, 1, 100, 1, 1000))
+        # Nothing mapped: nothing learned.
+        self.assertEqual(20, utils._adapt_batch_size(20, 0, 1, 1, 1000))
+
+
+class ShardedQueryMapperTest(actions.TestBase):
+    """Tests for utils.ShardedQueryMapper."""
+
+    def test_run_processes_every_entity_exactly_once(self):
+        db.put([Model(number=x) for x in xrange(250)])
+        seen = []
+        mapper = utils.ShardedQueryMapper(
+            Model.all, num_shards=4, batch_size=15)
+        num_processed = mapper.run(lambda model: seen.append(model.number))
+
+        self.assertEqual(250, num_processed)
+        self.assertEqual(range(250), sorted(seen))
+        self.assertTrue(mapper.complete)
+
+    def test_shard_queries_cover_key_space_without_overlap(self):
+        db.put([Model(number=x) for x in xrange(100)])
+        mapper = utils.ShardedQueryMapper(Model.all, num_shards=3)
+        # pylint: disable=protected-access
+        queries = mapper._make_shard_queries()
+        split_keys = mapper.get_split_keys()
+
+        self.assertEqual(len(split_keys) + 1, len(queries))
+        self.assertEqual(sorted(split_keys), split_keys)
+        numbers = []
+        for query in queries:
+            numbers.extend(model.number for model in query.run())
+        self.assertEqual(range(100), sorted(numbers))
+
+    def test_run_stops_at_deadline(self):
+        db.put([Model() for _ in xrange(10)])
+        mapper = utils.ShardedQueryMapper(
+            Model.all, num_shards=2, deadline_secs=-1)
+
+        self.assertEqual(0, mapper.run(process, 1))
+        self.assertFalse(mapper.complete)
+
+    def test_raising_stop_mapping_stops_execution(self):
+        db.put([Model(number=5) for _ in xrange(3)])
+        mapper = utils.ShardedQueryMapper(Model.all, num_shards=2)
+
+        self.assertEqual(0, mapper.run(stop_mapping_at_5))
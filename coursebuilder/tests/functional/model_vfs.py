@@ -18,6 +18,7 @@ __author__ = [
     'mgainer@google.com (Mike Gainer)',
 ]
 
+import datetime
 import os
 import random
 import StringIO
@@ -199,3 +200,61 @@ class VfsLargeFileSupportTest(actions.TestBase):
         # from AppEngine about cross-group transaction having too many
         # entities involved.
         self.course.save()
+
+
+class VfsCacheUpdatesTest(actions.TestBase):
+    """Tests how changes made elsewhere reach the in-process VFS cache."""
+
+    NAMESPACE = 'ns_vfs_cache_updates'
+
+    def setUp(self):
+        super(VfsCacheUpdatesTest, self).setUp()
+        self.fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+        self.fs.put('/file.txt', StringIO.StringIO('contents'))
+
+    def _new_request_fs(self):
+        # Each new file system makes a new cache connection, which is what
+        # happens at the start of every request.
+        return vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+
+    def test_file_deleted_elsewhere_is_evicted(self):
+        self.assertEquals(
+            'contents', self._new_request_fs().get('/file.txt').read())
+
+        # Delete the file the way another instance would: this process's
+        # cache is not told about it directly.
+        with common_utils.Namespace(self.NAMESPACE):
+            vfs.FileMetadataEntity.get_by_key_name('/file.txt').delete()
+        self.assertEquals(
+            'contents', self._new_request_fs().get('/file.txt').read())
+
+        with common_utils.Namespace(self.NAMESPACE):
+            vfs.VfsCacheConnection.record_deletion('/file.txt')
+        tombstones = vfs.VfsCacheConnection.CACHE_TOMBSTONE_COUNT.value
+        self.assertIsNone(self._new_request_fs().get('/file.txt'))
+        self.assertEquals(
+            tombstones + 1,
+            vfs.VfsCacheConnection.CACHE_TOMBSTONE_COUNT.value)
+
+    def test_each_update_is_fetched_once(self):
+        self._new_request_fs().get('/file.txt')
+        with common_utils.Namespace(self.NAMESPACE):
+            metadata = vfs.FileMetadataEntity.get_by_key_name('/file.txt')
+            metadata.updated_on = datetime.datetime.utcnow()
+            metadata.put()
+
+        updates = vfs.VfsCacheConnection.CACHE_UPDATE_COUNT.value
+        self._new_request_fs().get('/file.txt')
+        self.assertEquals(
+            updates + 1, vfs.VfsCacheConnection.CACHE_UPDATE_COUNT.value)
+        self._new_request_fs().get('/file.txt')
+        self.assertEquals(
+            updates + 1, vfs.VfsCacheConnection.CACHE_UPDATE_COUNT.value)
+
+        with common_utils.Namespace(self.NAMESPACE):
+            connection = vfs.VfsCacheConnection.new_connection(
+                self.NAMESPACE)
+            # pylint: disable=protected-access
+            unused_found, updated_on = (
+                connection._get_most_recent_updated_on())
+        self.assertEquals(metadata.updated_on, updated_on)
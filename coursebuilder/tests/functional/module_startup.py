@@ -0,0 +1,79 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Startup cost reporting and a cold-start benchmark."""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import actions
+
+import appengine_config
+from common import manifests
+
+# Libraries which must not be loaded just to start an instance; each is
+# imported by the code that needs it on first use.
+DEFERRED_LIBRARIES = ['html5lib', 'pyparsing']
+
+# Imports main in a fresh interpreter, as a new instance would, and reports
+# elapsed time, per-module costs and which deferred libraries got loaded.
+_BENCHMARK_SCRIPT = '''
+import json
+import sys
+import time
+started = time.time()
+import main
+import appengine_config
+print json.dumps({
+    'elapsed_sec': time.time() - started,
+    'costs': [list(cost) for cost in
+              appengine_config.get_module_startup_costs()],
+    'loaded': [name for name in %r if name in sys.modules],
+})
+'''
+
+
+class ModuleStartupTests(actions.TestBase):
+
+    def test_startup_cost_recorded_for_every_manifest_module(self):
+        recorded = set(appengine_config.MODULE_STARTUP_COSTS)
+        repo = manifests.ModulesRepo(appengine_config.BUNDLE_ROOT)
+        for manifest in repo.module_to_manifest.values():
+            main_module = manifest.get_registration().main_module
+            if main_module:
+                self.assertIn(main_module, recorded)
+
+    def test_startup_costs_are_sorted_most_expensive_first(self):
+        totals = [
+            cost.import_sec + cost.register_sec + cost.enable_sec
+            for cost in appengine_config.get_module_startup_costs()]
+        self.assertTrue(totals)
+        self.assertEquals(sorted(totals, reverse=True), totals)
+
+    def test_cold_start_benchmark(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        output = subprocess.check_output(
+            [sys.executable, '-c', _BENCHMARK_SCRIPT % DEFERRED_LIBRARIES],
+            cwd=appengine_config.BUNDLE_ROOT, env=env)
+        result = json.loads(output.strip().splitlines()[-1])
+
+        logging.info('Cold start took %.3fs', result['elapsed_sec'])
+        for name, import_sec, register_sec, enable_sec in result['costs']:
+            logging.info('  %s: %.3fs', name,
+                         import_sec + register_sec + enable_sec)
+        self.assertEquals([], result['loaded'])
@@ -234,3 +234,27 @@ class ProgressPercent(actions.TestBase):
         with Namespace(NAMESPACE):
             self.assertEquals(1.000, self.tracker.get_unit_percent_complete(
                 self.student)[self.unit.unit_id])
+
+    def test_revisiting_completed_lesson_does_not_write_progress(self):
+        self._get_unit_page(self.unit)
+        with Namespace(NAMESPACE):
+            progress = models.StudentPropertyEntity.get(
+                self.student, self.tracker.PROPERTY_KEY)
+            updated_on = progress.updated_on
+
+            tracker = self.course.get_progress_tracker()
+            tracker.put_html_accessed(
+                self.student, self.unit.unit_id, self.lesson_one.lesson_id)
+            progress = models.StudentPropertyEntity.get(
+                self.student, self.tracker.PROPERTY_KEY)
+            self.assertEquals(updated_on, progress.updated_on)
+
+            tracker.put_html_accessed(
+                self.student, self.unit.unit_id, self.lesson_two.lesson_id)
+            progress = models.StudentPropertyEntity.get(
+                self.student, self.tracker.PROPERTY_KEY)
+            self.assertLess(updated_on, progress.updated_on)
+            self.assertEquals(
+                self.tracker.COMPLETED_STATE,
+                tracker.get_lesson_status(
+                    progress, self.unit.unit_id, self.lesson_two.lesson_id))
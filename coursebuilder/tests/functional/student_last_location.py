@@ -19,6 +19,7 @@ from controllers import sites
 from models import config
 from models import courses
 from models import models
+from modules.courses import activity_cron
 from tests.functional import actions
 
 COURSE_NAME = 'test_course'
@@ -152,3 +153,50 @@ class RootCourse(StudentRedirectTestBase):
         response = self.get('/').follow()
         self.assertEquals(302, response.status_int)
         self.assertEquals(saved_path, response.location)
+
+
+class BufferedLastLocation(StudentRedirectTestBase):
+
+    def setUp(self):
+        super(BufferedLastLocation, self).setUp()
+        config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
+
+    def tearDown(self):
+        del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
+        super(BufferedLastLocation, self).tearDown()
+
+    def _get_stored_last_location(self):
+        with common_utils.Namespace(NAMESPACE):
+            user_id = models.Student.all().get().user_id
+            return models.StudentPreferencesDAO.load_or_default_by_user_id(
+                user_id).last_location
+
+    def test_location_is_buffered_until_flushed(self):
+        response = self.get(BASE_URL)
+        response = self.click(response, 'Unit 1 - The Unit')
+        saved_path = response.request.path_qs
+
+        # Redirects see the buffered location before it is stored.
+        self._test_redirects(response.request.url)
+        self.assertIsNone(self._get_stored_last_location())
+
+        activity_cron.FlushStudentActivity._for_testing_only_get()
+        self.assertEquals(saved_path, self._get_stored_last_location())
+
+    def test_unchanged_location_is_not_recorded_again(self):
+        recorded = []
+        record = models.StudentActivityBuffer._record
+
+        def record_and_count(user_id, entry, name, value):
+            recorded.append(name)
+            record(user_id, entry, name, value)
+
+        response = self.get(BASE_URL)
+        unit_page = self.click(response, 'Unit 1 - The Unit')
+        self.swap(models.StudentActivityBuffer, '_record',
+                  staticmethod(record_and_count))
+        self.get(unit_page.request.url)
+        self.get(unit_page.request.url)
+        self.assertEquals([], recorded)
+        self.get(COURSE_URL)
+        self.assertEquals(['last_location'], recorded)
@@ -21,6 +21,7 @@ import copy
 import cStringIO
 import csv
 import datetime
+import gzip
 import logging
 import os
 import re
@@ -62,6 +63,7 @@ import modules.admin.admin
 import modules.admin.config
 from modules.analytics import analytics
 from modules.announcements.announcements import AnnouncementEntity
+from modules.dashboard import question_editor
 from modules import search
 from modules.review import controllers_tests
 from modules.review import stats_tests
@@ -3158,6 +3160,35 @@ class StaticHandlerTest(actions.TestBase):
         assert_response(self.testapp.get(
             '/static/inputex-3.1.0/src/inputex/assets/skins/sam/inputex.css'))
 
+    def test_combo_bundle_is_cached_with_etag_and_gzip(self):
+        url = ('/static/combo/inputex?'
+               'src/inputex/assets/skins/sam/inputex.css&'
+               'src/inputex-list/assets/skins/sam/inputex-list.css')
+        sites.ProcessScopedComboBundleCache.clear_instance()
+
+        response = self.testapp.get(url)
+        assert_equals(response.status_int, 200)
+        assert_equals('text/css', response.content_type)
+        assert_contains('max-age=600', response.headers['Cache-Control'])
+        self.assertTrue(response.body)
+        etag = response.headers['ETag']
+        self.assertEquals(
+            1, sites.ProcessScopedComboBundleCache.get_bundle_count())
+
+        response = self.testapp.get(url, headers={'If-None-Match': etag})
+        assert_equals(response.status_int, 304)
+        assert_equals('', response.body)
+
+        gzipped = self.testapp.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert_equals('gzip', gzipped.headers['Content-Encoding'])
+        self.assertNotEquals(etag, gzipped.headers['ETag'])
+        assert_equals(response.headers['Vary'], 'Accept-Encoding')
+        assert_equals(
+            self.testapp.get(url).body,
+            gzip.GzipFile(fileobj=cStringIO.StringIO(gzipped.body)).read())
+        self.assertEquals(
+            1, sites.ProcessScopedComboBundleCache.get_bundle_count())
+
     def _assert_handler(self, response, name=None):
         assert_equals(response.status_int, 200)
         assert_equals(
@@ -3448,13 +3479,13 @@ class AssessmentTest(actions.TestBase):
             assert course.get_overall_score(student)
 
             # Check assessment answers.
-            answers = transforms.loads(
-                models.StudentAnswersEntity.get_by_key_name(
-                    student.user_id).data)
-            assert pre_answers == answers['Pre']
+            def get_answers(assessment_name):
+                return models.StudentAnswersEntity.get_answers(
+                    student.user_id, assessment_name)
+            assert pre_answers == get_answers('Pre')
 
-            assert [] == answers['Mid']
-            assert [] == answers['Fin']
+            assert [] == get_answers('Mid')
+            assert [] == get_answers('Fin')
 
             # Check that scores are recorded properly.
             student = models.Student.get_enrolled_student_by_user(user)
@@ -4758,6 +4789,37 @@ class LessonComponentsTest(DatastoreBackedCourseTest):
             self.unit.unit_id, self.lesson.lesson_id, use_lxml=False)
         self._assert_components(cpt_list)
 
+    def test_component_manifest(self):
+        """Test that lesson bodies are only parsed when they change."""
+
+        parsed = []
+        get_components_from_html = tags.get_components_from_html
+
+        def parse_and_count(*args, **kwargs):
+            parsed.append(args[0])
+            return get_components_from_html(*args, **kwargs)
+
+        self.swap(tags, 'get_components_from_html', parse_and_count)
+        course = courses.Course(None, app_context=self.app_context)
+        self._assert_components(course.get_components(
+            self.unit.unit_id, self.lesson.lesson_id))
+        self.assertEqual([], parsed)
+
+        lesson = course.find_lesson_by_id(None, self.lesson.lesson_id)
+        lesson.objectives = '<question quid="7" instanceid="Q7"></question>'
+        cpt_list = course.get_components(
+            self.unit.unit_id, self.lesson.lesson_id)
+        self.assertEqual(
+            [{'instanceid': 'Q7', 'quid': '7', 'cpt_name': 'question'}],
+            cpt_list)
+        self.assertEqual([lesson.objectives], parsed)
+
+        # Asking for the other parser parses the lesson body again.
+        del parsed[:]
+        course.get_components(
+            self.unit.unit_id, self.lesson.lesson_id, use_lxml=False)
+        self.assertEqual([lesson.objectives], parsed)
+
     def test_component_progress(self):
         """Test that progress tracking for components is done correctly."""
         unit_id = self.unit.unit_id
@@ -6422,6 +6484,23 @@ var activity = [
 class ImportGiftQuestionsTests(DatastoreBackedCourseTest):
     """Functional tests for importing GIFT-formatted questions."""
 
+    def _put_gift_questions(self, description, questions):
+        payload_dict = {
+            'description': description,
+            'questions': questions}
+        request = {}
+        request['payload'] = transforms.dumps(payload_dict)
+        request[
+            'xsrf_token'] = XsrfTokenManager.create_xsrf_token(
+            'import-gift-questions')
+        return self.testapp.put('/rest/question/gift?%s' % urllib.urlencode(
+            {'request': transforms.dumps(request)}), {})
+
+    def _get_import_status(self):
+        response = self.get('/rest/question/gift')
+        return transforms.loads(
+            transforms.loads(response.body)['payload'])['status']
+
     def test_import_gift_questions(self):
         # get import gift questions
         email = 'gift@google.com'
@@ -6431,19 +6510,55 @@ class ImportGiftQuestionsTests(DatastoreBackedCourseTest):
         assert_contains('GIFT Questions', response.body)
 
         # put import gift questions
-        payload_dict = {
-            'description': 'gift group',
-            'questions':
-                '::title mc::q1? {=c ~w}\n\n ::title: true/false:: q2? {T}'}
-        request = {}
-        request['payload'] = transforms.dumps(payload_dict)
-        request[
-            'xsrf_token'] = XsrfTokenManager.create_xsrf_token(
-            'import-gift-questions')
-        response = self.testapp.put('/rest/question/gift?%s' % urllib.urlencode(
-            {'request': transforms.dumps(request)}), {})
+        response = self._put_gift_questions(
+            'gift group',
+            '::title mc::q1? {=c ~w}\n\n ::title: true/false:: q2? {T}')
         assert_equals(response.status_int, 200)
         assert_contains('gift group', response.body)
+        assert_equals('Import queued.', self._get_import_status())
+
+        self.execute_all_deferred_tasks()
+        with Namespace(self.namespace):
+            questions = models.QuestionDAO.get_all()
+            groups = models.QuestionGroupDAO.get_all()
+        assert_equals(
+            ['title mc', 'title: true/false'],
+            sorted(q.description for q in questions))
+        assert_equals(['gift group'], [g.description for g in groups])
+        assert_equals(
+            sorted(str(q.id) for q in questions),
+            sorted(item['question'] for item in groups[0].items))
+        assert_equals(
+            'Imported 2 questions into group "gift group".',
+            self._get_import_status())
+
+    def test_import_skips_invalid_questions(self):
+        actions.login('gift@google.com', is_admin=True)
+        self.swap(
+            question_editor.ImportGiftQuestionsJob,
+            'BATCH_SIZE', 1)
+        response = self._put_gift_questions(
+            'gift group',
+            '::q1:: q1? {=c ~w}\n\n'
+            '::q2:: q2? {=c =c2 ~w}\n\n'
+            '::q3:: q3? {F}\n\n'
+            '::q1:: q4? {T}\n')
+        assert_equals(response.status_int, 200)
+        self.execute_all_deferred_tasks()
+
+        with Namespace(self.namespace):
+            assert_equals(
+                ['q1', 'q3'],
+                sorted(q.description for q in models.QuestionDAO.get_all()))
+        status = self._get_import_status()
+        assert_contains('Imported 2 questions', status)
+        assert_contains('Skipped 2 questions', status)
+        assert_contains('Line 3: ', status)
+        assert_contains('Line 7: The description must be different', status)
+
+        # A group description may only be used once.
+        response = self._put_gift_questions('gift group', '::q5:: q5? {T}')
+        assert_contains('Non-unique group description.', response.body)
 
 
 class NamespaceTest(actions.TestBase):
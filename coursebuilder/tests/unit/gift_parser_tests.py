@@ -18,6 +18,7 @@
 __author__ = 'Boris Roussev (borislavr@google.com)'
 
 import os
+import time
 import unittest
 from pyparsing import ParseException
 from modules.assessment_tags import gift
@@ -357,3 +358,105 @@ class TestCreateManyGiftQuestion(unittest.TestCase):
             ['multi_choice'] * 4 + ['short_answer'] * 3,
             [x['type'] for x in questions])
 
+
+
+class TestStreamingParser(unittest.TestCase):
+    """Tests for parsing GIFT text one question at a time."""
+
+    def test_split_questions(self):
+        lines = [
+            '// leading comment',
+            '::t1:: q1? {=c',
+            '~w}',
+            '::t2:: q2? {T}',
+            '',
+            '',
+            '::t3:: q3? {',
+            '',
+            '=c ~w',
+            '}']
+        self.assertEqual(
+            [(2, '::t1:: q1? {=c\n~w}'),
+             (4, '::t2:: q2? {T}'),
+             (7, '::t3:: q3? {\n\n=c ~w\n}')],
+            list(gift.split_questions(lines)))
+
+    def test_errors_are_isolated(self):
+        gift_text = """
+::t1:: q1? {=c1 ~w1}
+
+::t2:: q2? {=c1 =c2 ~w1}
+
+::t3:: q3? {F}
+"""
+        results = list(gift.GiftParser.iter_questions(gift_text.splitlines()))
+        self.assertEqual([2, 4, 6], [x[0] for x in results])
+        self.assertEqual('t1', results[0][1]['description'])
+        self.assertIsNone(results[1][1])
+        assert results[1][2].startswith('Line 4: ')
+        self.assertEqual('t3', results[2][1]['description'])
+
+        with self.assertRaises(gift.ParseError):
+            gift.GiftParser.parse_questions(gift_text)
+
+    def test_scanner_matches_grammar(self):
+        curr_dir = os.path.dirname(os.path.realpath(__file__))
+        path = os.path.join(curr_dir, 'gift_examples.txt')
+        lines = open(path, 'rb').read().splitlines()
+        samples = [text for _, text in gift.split_questions(lines)] + [
+            'Q {~%abc ~x}',
+            'Q {~ %50% a ~%50% b}',
+            'Q{\n=a\n~b\n#fb b # more\n~c}',
+            'Q {TRUE # yes }',
+            '::T::\nQ\n{=a ~b}']
+        scanned = 0
+        for text in samples:
+            result = gift.GiftScanner.scan(text)
+            if result:
+                scanned += 1
+                self.assertEqual(
+                    gift.to_dict(gift.GiftParser.question.parseString(
+                        text)[0]),
+                    gift.to_dict(result))
+        self.assertEqual(19, scanned)
+
+
+class GiftParserBenchmark(unittest.TestCase):
+    """Parses a large synthetic question bank, as a performance check."""
+
+    NUM_QUESTIONS = 5000
+
+    def _make_corpus(self):
+        questions = []
+        for i in xrange(self.NUM_QUESTIONS / 5):
+            questions += [
+                '// question %s' % i,
+                '::mc%s:: What is %s plus one? {' % (i, i),
+                '  =%s # right' % (i + 1),
+                '  ~%s # wrong' % i,
+                '  ~%s # wrong' % (i + 2),
+                '}',
+                '',
+                '::ms%s:: Pick the even ones. {~%%50%%%s ~%%50%%%s ~%s}' % (
+                    i, 2 * i, 2 * i + 2, 2 * i + 1),
+                '',
+                '::tf%s:: %s is even. {%s #Look again.}' % (
+                    i, i, 'TRUE' if i % 2 == 0 else 'FALSE'),
+                '',
+                '::sa%s:: Spell %s backwards. {=%s}' % (i, i, str(i)[::-1]),
+                '',
+                '::nu%s:: What is %s times two? {#%s:0.5}' % (i, i, 2 * i),
+                '']
+        return questions
+
+    def test_large_corpus(self):
+        lines = self._make_corpus()
+        start = time.time()
+        results = list(gift.GiftParser.iter_questions(lines))
+        elapsed = time.time() - start
+
+        self.assertEqual(self.NUM_QUESTIONS, len(results))
+        self.assertTrue(all(question for _, question, _ in results))
+        # Parsing the whole corpus as one document with the grammar takes
+        # minutes; one question at a time it should take a few seconds.
+        self.assertLess(elapsed, 30)
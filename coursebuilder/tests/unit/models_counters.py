@@ -0,0 +1,80 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for models/counters.py."""
+
+import unittest
+
+from models import counters
+
+
+class LatencyHistogramTests(unittest.TestCase):
+
+    def setUp(self):
+        super(LatencyHistogramTests, self).setUp()
+        self.histogram = counters.LatencyHistogram(
+            'test-latency-histogram', 'Test histogram.')
+        self.flushed = []
+        self._old_incr = counters.incr_histogram_global_values
+        counters.incr_histogram_global_values = (
+            lambda name, deltas: self.flushed.append((name, deltas)))
+
+    def tearDown(self):
+        counters.incr_histogram_global_values = self._old_incr
+        counters.Registry.remove_histogram(self.histogram)
+        super(LatencyHistogramTests, self).tearDown()
+
+    def test_samples_land_in_log_scale_buckets(self):
+        for millis in [0.5, 1, 3, 3, 100, 10 ** 6]:
+            self.histogram.record(millis, label='a')
+        buckets = self.histogram.get_buckets('a')
+        self.assertEquals(6, self.histogram.value)
+        self.assertEquals(2, buckets[0])  # <= 1ms
+        self.assertEquals(2, buckets[2])  # <= 4ms
+        self.assertEquals(1, buckets[7])  # <= 128ms
+        self.assertEquals(1, buckets[-1])  # overflow
+        self.assertEquals([0] * len(buckets), self.histogram.get_buckets('b'))
+
+    def test_percentiles(self):
+        for _ in xrange(98):
+            self.histogram.record(3)
+        self.histogram.record(50)
+        self.histogram.record(1000)
+        buckets = self.histogram.get_buckets()
+        get_percentile = counters.LatencyHistogram.get_percentile
+        self.assertEquals(4, get_percentile(buckets, 50))
+        self.assertEquals(64, get_percentile(buckets, 99))
+        self.assertEquals(1024, get_percentile(buckets, 100))
+        self.assertIsNone(get_percentile(self.histogram.get_buckets('x'), 50))
+
+    def test_timer_records_under_label(self):
+        with self.histogram.timer('timed'):
+            pass
+        self.assertEquals(['timed'], self.histogram.labels)
+        self.assertEquals(1, sum(self.histogram.get_buckets('timed')))
+
+    def test_flush_sends_only_new_samples(self):
+        self.histogram.record(3, label='a')
+        self.histogram.flush()
+        self.assertEquals([], self.flushed)  # Not yet due.
+
+        self.histogram.flush(force=True)
+        self.histogram.record(3, label='a')
+        self.histogram.flush(force=True)
+        self.histogram.flush(force=True)
+        self.assertEquals(2, len(self.flushed))
+        for name, deltas in self.flushed:
+            self.assertEquals(self.histogram.name, name)
+            self.assertEquals(1, sum(deltas['a']))
+        self.assertEquals(2, sum(self.histogram.get_buckets('a')))